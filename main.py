@@ -1,16 +1,29 @@
 """main.py -- Main entry point for document query pipeline application.
-Handles command line arguments, document loading, and pipeline execution with logging support."""
+Handles command line arguments, document loading, and pipeline execution with logging support.
+
+With --serve, the document store and the pipeline stay loaded in a query server. Later runs hand their requests
+to the server while it is running, which skips loading the models and the index."""
 
 import argparse
+import json
 import logging
 import os
 import sys
+from typing import TYPE_CHECKING, ContextManager, Iterable, List, Optional
 
 from dotenv import load_dotenv
 
-from src.pipeline.document_store import DocumentStoreManager
-from src.pipeline.pipeline import QueryPipeline
-from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.client import DEFAULT_HOST, DEFAULT_PORT, PipelineClient, server_url
+from src.pipeline.options import (CHUNK_STORES, CHUNKERS, DIM_REDUCTIONS, EMBEDDING_BACKENDS, INDEX_TYPES,
+                                  STUB_MODEL_NAME, VECTOR_DTYPES)
+
+if TYPE_CHECKING:
+    from src.pipeline.document_store import DocumentStoreManager
+    from src.pipeline.embedding_cache import CachedEmbeddingRetriever
+    from src.pipeline.pipeline import QueryPipeline
+    from src.pipeline.query_cache import QueryCache
+    from src.pipeline.sharding import CollectionManager
+    from src.pipeline.token_chunker import TokenChunker
 
 
 def main():
@@ -23,63 +36,543 @@ def main():
     # load environment variables
     load_dotenv()
     
-    # verify API key is present
-    if not os.getenv("OPENAI_API_KEY"):
-        raise ValueError("OPENAI_API_KEY not found in environment variables")
-    
     # CLI arguments
     parser = argparse.ArgumentParser(description="Document Query Pipeline")
     parser.add_argument("--doc_dir", help="Directory containing documents")
-    parser.add_argument("--query", required=True, help="Query to run against the documents")
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("--query", help="Query to run against the documents")
+    query_group.add_argument("--queries_file", help="JSONL file with one query object per line")
+    query_group.add_argument("--serve",
+                             action="store_true",
+                             help="Run a query server keeping the document store and the pipeline loaded")
     parser.add_argument("--embedding_model", 
                         default="sentence-transformers/multi-qa-mpnet-base-dot-v1",
                         help="Name of the embedding model to use")
+    parser.add_argument("--embedding_backend",
+                        choices=EMBEDDING_BACKENDS,
+                        default="torch",
+                        help="Inference backend of the embedding model: fp32 PyTorch, or ONNX Runtime in fp32 or "
+                             "with int8 quantized weights (exported to data/onnx_models on first use)")
     parser.add_argument("--llm_model", 
                         default="gpt-4o-mini",
-                        help="Name of the LLM model to use")
+                        help=f"Name of the LLM model to use, '{STUB_MODEL_NAME}' for an offline stand-in")
+    parser.add_argument("--num_workers",
+                        type=int,
+                        default=1,
+                        help="Number of worker processes for document conversion and chunking")
+    parser.add_argument("--batch_size",
+                        type=int,
+                        default=1000,
+                        help="Number of chunks embedded and written to the document store at once")
+    parser.add_argument("--chunker",
+                        choices=CHUNKERS,
+                        default="preprocessor",
+                        help="Split documents into chunks of 500 words (preprocessor) or into chunks that fit the "
+                             "token window of the embedding model, ending at sentence boundaries (token)")
+    parser.add_argument("--chunk_tokens",
+                        type=int,
+                        help="Maximum number of tokens per chunk of the token chunker "
+                             "(default: the window of the embedding model)")
+    parser.add_argument("--chunk_overlap_tokens",
+                        type=int,
+                        default=32,
+                        help="Maximum number of tokens shared by consecutive chunks of the token chunker")
+    parser.add_argument("--sync",
+                        action="store_true",
+                        help="Synchronize the store with --doc_dir: skip unchanged files and delete the chunks of "
+                             "changed and removed files")
+    parser.add_argument("--index_type",
+                        choices=INDEX_TYPES,
+                        default="flat",
+                        help="FAISS index type of a new document store")
+    parser.add_argument("--n_list",
+                        type=int,
+                        default=1024,
+                        help="Number of inverted lists (centroids) of IVF indexes")
+    parser.add_argument("--pq_m",
+                        type=int,
+                        default=64,
+                        help="Number of product quantizer sub-vectors of IVF-PQ indexes")
+    parser.add_argument("--vector_dtype",
+                        choices=VECTOR_DTYPES,
+                        default="fp32",
+                        help="Storage type of the vectors of a new document store; fp16 and int8 are 2x and 4x "
+                             "smaller")
+    parser.add_argument("--reduced_dim",
+                        type=int,
+                        help="Reduce the vectors of a new document store to this dimension before indexing")
+    parser.add_argument("--dim_reduction",
+                        choices=DIM_REDUCTIONS,
+                        default="pca",
+                        help="Projection to --reduced_dim, PCA trained on the first batch or truncation")
+    parser.add_argument("--chunk_store",
+                        choices=CHUNK_STORES,
+                        default="sqlite",
+                        help="Store of the chunks of a new document store; columnar is an append-only, "
+                             "memory-mapped store that is faster to write and to fetch retrieved chunks from")
+    parser.add_argument("--near_duplicate_threshold",
+                        type=float,
+                        help="Drop ingested chunks whose estimated Jaccard similarity to a stored chunk or another "
+                             "chunk of the batch reaches this threshold, e.g. 0.8 (default: keep all chunks)")
+    parser.add_argument("--journal_compaction_ratio",
+                        type=float,
+                        default=0.25,
+                        help="Fold the journal of added vectors into a new saved index once it holds this "
+                             "fraction of the vectors of the saved index")
+    parser.add_argument("--collections",
+                        nargs="+",
+                        help="Names of sharded collections under data/collections to search instead of the single "
+                             "document store; --doc_dir is ingested into the first one (local runs only)")
+    parser.add_argument("--num_shards",
+                        type=int,
+                        help="Number of shards of a new collection (default: 1)")
+    parser.add_argument("--shard_memory_mb",
+                        type=float,
+                        help="Close idle shards once the open shards take more memory than this "
+                             "(default: keep all shards open)")
+    parser.add_argument("--nprobe",
+                        type=int,
+                        help="Number of inverted lists searched per query (IVF indexes)")
+    parser.add_argument("--ef_search",
+                        type=int,
+                        help="Candidate list size searched per query (HNSW indexes)")
+    parser.add_argument("--top_k",
+                        type=int,
+                        default=5,
+                        help="Number of retrieved chunks per query")
+    parser.add_argument("--hybrid",
+                        action="store_true",
+                        help="Fuse dense retrieval with BM25 keyword retrieval (reciprocal rank fusion)")
+    parser.add_argument("--dense_top_k",
+                        type=int,
+                        help="Number of dense candidates fused in --hybrid mode (default: --top_k)")
+    parser.add_argument("--lexical_top_k",
+                        type=int,
+                        help="Number of BM25 candidates fused in --hybrid mode (default: --top_k)")
+    parser.add_argument("--fusion_weights",
+                        type=float,
+                        nargs=2,
+                        default=[1.0, 1.0],
+                        metavar=("DENSE", "LEXICAL"),
+                        help="Weights of the dense and the BM25 ranking in --hybrid mode")
+    parser.add_argument("--stub_latency",
+                        type=float,
+                        default=0.0,
+                        help=f"Simulated response time in seconds of the '{STUB_MODEL_NAME}' model")
+    parser.add_argument("--max_context_tokens",
+                        type=int,
+                        default=2000,
+                        help="Token budget of the retrieved context in the prompt")
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help="Print the answer tokens as they are generated")
+    parser.add_argument("--query_field",
+                        default="query",
+                        help="Field holding the query text in --queries_file objects")
+    parser.add_argument("--output_file",
+                        help="JSONL file the --queries_file results are written to (default: stdout)")
+    parser.add_argument("--metrics_file",
+                        help="File the per-stage metrics are written to at exit, "
+                             "in Prometheus text format if it ends with .prom, else JSON")
+    parser.add_argument("--max_concurrency",
+                        type=int,
+                        default=4,
+                        help="Maximum number of concurrent LLM calls in --queries_file mode")
+    parser.add_argument("--query_batch_wait_ms",
+                        type=float,
+                        help="Coalesce the embedding of concurrent queries (e.g. of --serve) into batches, "
+                             "waiting at most this many milliseconds for queries to batch with")
+    parser.add_argument("--max_query_batch_size",
+                        type=int,
+                        default=32,
+                        help="Maximum number of queries per coalesced embedding batch")
+    parser.add_argument("--host",
+                        default=DEFAULT_HOST,
+                        help="Interface of the query server")
+    parser.add_argument("--port",
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help="Port of the query server")
+    parser.add_argument("--socket",
+                        help="Unix socket of the query server, used instead of --host and --port")
+    parser.add_argument("--ingest_root",
+                        help="Directory under which clients may ingest directories on the query server "
+                             "(default: --doc_dir of the server; without either, ingestion requests are refused)")
+    parser.add_argument("--local",
+                        action="store_true",
+                        help="Run the pipeline in this process even if a query server is running")
     
     args = parser.parse_args()
+    if args.stream and not args.query:
+        parser.error("--stream requires --query and does not support --queries_file or --serve")
+    if args.collections and (args.serve or args.hybrid or args.near_duplicate_threshold is not None):
+        parser.error("--collections does not support --serve, --hybrid or --near_duplicate_threshold")
+    if args.serve and args.doc_dir and args.ingest_root:
+        ingest_root = os.path.realpath(args.ingest_root)
+        if os.path.commonpath([os.path.realpath(args.doc_dir), ingest_root]) != ingest_root:
+            parser.error("--doc_dir of the query server must be inside --ingest_root")
     
-    doc_store_manager = DocumentStoreManager(
-        embedding_model=args.embedding_model
-    )
+    retriever_params = {"top_k": args.top_k}
+    if args.nprobe is not None:
+        retriever_params["nprobe"] = args.nprobe
+    if args.ef_search is not None:
+        retriever_params["ef_search"] = args.ef_search
+    
+    client = PipelineClient(server_url(args.host, args.port, args.socket))
+    if args.serve:
+        run_server(args)
+    elif not args.local and not args.collections and client.is_running():
+        # the store and model options of the server apply
+        logging.info(f"Using query server at {client.url}")
+        run_client(client, args, retriever_params)
+    else:
+        run_local(args, retriever_params)
+
+
+def run_local(args: argparse.Namespace, retriever_params: dict):
+    """
+    Load the document store and the pipeline and answer the queries in this process.
+    
+    :param args: Parsed command line arguments
+    :param retriever_params: Parameters of the retriever
+    """
+    # imported here, so that runs handed to a query server don't load Haystack
+    from src.pipeline.ingestion import ingest_directory
+    from src.pipeline.metrics import METRICS
+    from src.pipeline.query_cache import QueryCache
+    from src.pipeline.server import serialize_event, serialize_result
+    
+    collection_manager = None
+    if args.collections:
+        # ingestion writes to the first collection, queries search all of them
+        collection_manager = open_collection_manager(args)
+        doc_store_manager = collection_manager.collection(args.collections[0], num_shards=args.num_shards)
+    else:
+        doc_store_manager = open_doc_store_manager(args)
     
     if args.doc_dir:
-        # load and preprocess new documents
-        logging.info("Loading documents...")
-        documents = load_documents(args.doc_dir)
-        processed_docs = preprocess_documents(documents)
-        
-        # initialize document store and add documents
-        logging.info("Initializing document store and generating embeddings...")
-        doc_store_manager.add_documents(processed_docs)
+        # stream new documents into the document store
+        logging.info("Loading documents and generating embeddings...")
+        log_ingest_stats(ingest_directory(args.doc_dir, doc_store_manager,
+                                          batch_size=args.batch_size,
+                                          num_workers=args.num_workers,
+                                          sync=args.sync,
+                                          chunker=create_chunker(args)))
     else:
         # check if existing document store has documents
-        if not doc_store_manager.has_documents():
+        if collection_manager is not None:
+            has_documents = any(collection_manager.collection(name).has_documents() for name in args.collections)
+        else:
+            has_documents = doc_store_manager.has_documents()
+        if not has_documents:
             logging.error("No documents found in store. Please provide --doc_dir for initial setup")
             sys.exit(1)
         logging.info("Using existing document store...")
     
     # initialize pipeline
     logging.info("Initializing query pipeline...")
-    pipeline = QueryPipeline(
-        retriever=doc_store_manager.get_retriever(),
-        model_name=args.llm_model
-    )
+    # bulk query files tend to repeat questions
+    pipeline = create_pipeline(args, doc_store_manager, query_cache=QueryCache() if args.queries_file else None,
+                               collection_manager=collection_manager)
     
     # run query
     logging.info("Running query...")
-    result = pipeline.run(args.query)
+    params = {"Retriever": retriever_params}
+    if args.queries_file:
+        records = read_query_records(args)
+        results = pipeline.run_batch([record[args.query_field] for record in records], params=params,
+                                     max_concurrency=args.max_concurrency)
+        write_query_results(args, records, [serialize_result(result) for result in results])
+    elif args.stream:
+        print_stream(serialize_event(event) for event in pipeline.stream(args.query, params=params))
+    else:
+        log_result(serialize_result(pipeline.run(args.query, params=params)))
+    
+    if args.metrics_file:
+        write_metrics_file(args.metrics_file,
+                           METRICS.to_prometheus() if args.metrics_file.endswith(".prom") else METRICS.to_json())
+    if collection_manager is not None:
+        collection_manager.close()
+
+
+def run_server(args: argparse.Namespace):
+    """
+    Load the document store and the pipeline and serve queries until interrupted.
+    
+    :param args: Parsed command line arguments
+    """
+    from src.pipeline.query_cache import QueryCache
+    from src.pipeline.server import QueryService, serve
+    
+    def create_server_pipeline(doc_store_manager: "DocumentStoreManager") -> "QueryPipeline":
+        # repeated queries are answered from the cache until documents are added
+        query_cache = QueryCache()
+        doc_store_manager.add_change_listener(query_cache.invalidate)
+        return create_pipeline(args, doc_store_manager, query_cache=query_cache, store_lock=doc_store_manager.lock)
+    
+    service = QueryService(lambda retriever: open_doc_store_manager(args, retriever=retriever), create_server_pipeline,
+                           chunker=create_chunker(args), ingest_root=args.ingest_root or args.doc_dir)
+    if args.doc_dir:
+        logging.info("Loading documents and generating embeddings...")
+        log_ingest_stats(service.ingest(args.doc_dir, batch_size=args.batch_size, num_workers=args.num_workers,
+                                        sync=args.sync))
+    serve(service, host=args.host, port=args.port, socket_path=args.socket)
+
+
+def run_client(client: PipelineClient, args: argparse.Namespace, retriever_params: dict):
+    """
+    Hand the documents and queries to a running query server.
+    
+    :param client: Client of the query server
+    :param args: Parsed command line arguments
+    :param retriever_params: Parameters of the retriever
+    """
+    if args.doc_dir:
+        logging.info("Ingesting documents on the query server...")
+        log_ingest_stats(client.ingest(os.path.abspath(args.doc_dir), batch_size=args.batch_size,
+                                       num_workers=args.num_workers, sync=args.sync))
+    
+    params = {"Retriever": retriever_params}
+    if args.queries_file:
+        records = read_query_records(args)
+        results = client.query_batch([record[args.query_field] for record in records], params=params,
+                                     max_concurrency=args.max_concurrency)
+        write_query_results(args, records, results)
+    elif args.stream:
+        print_stream(client.stream(args.query, params=params))
+    else:
+        log_result(client.query(args.query, params=params))
+    
+    if args.metrics_file:
+        write_metrics_file(args.metrics_file, client.metrics(prometheus=args.metrics_file.endswith(".prom")))
+
+
+def open_doc_store_manager(args: argparse.Namespace,
+                           retriever: Optional["CachedEmbeddingRetriever"] = None) -> "DocumentStoreManager":
+    """
+    Open the document store configured on the command line.
+    
+    :param args: Parsed command line arguments
+    :param retriever: Retriever whose loaded embedding model is used, None to load the model
+    :return: Document store manager
+    """
+    from src.pipeline.document_store import DocumentStoreManager
+    
+    # verify API key is present
+    if args.llm_model != STUB_MODEL_NAME and not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    
+    return DocumentStoreManager(
+        embedding_model=args.embedding_model,
+        embedding_backend=args.embedding_backend,
+        chunk_store=args.chunk_store,
+        journal_compaction_ratio=args.journal_compaction_ratio,
+        near_duplicate_threshold=args.near_duplicate_threshold,
+        index_type=args.index_type,
+        n_list=args.n_list,
+        pq_m=args.pq_m,
+        vector_dtype=args.vector_dtype,
+        reduced_dim=args.reduced_dim,
+        dim_reduction=args.dim_reduction,
+        mmap_index=args.doc_dir is None,  # query-only runs map the index instead of reading it
+        max_query_batch_size=args.max_query_batch_size,
+        query_batch_wait_ms=args.query_batch_wait_ms,
+        retriever=retriever
+    )
+
+
+def open_collection_manager(args: argparse.Namespace) -> "CollectionManager":
+    """
+    Open the sharded collections configured on the command line.
+    
+    :param args: Parsed command line arguments
+    :return: Collection manager
+    """
+    from src.pipeline.sharding import CollectionManager
+    
+    if args.llm_model != STUB_MODEL_NAME and not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    
+    return CollectionManager(
+        embedding_model=args.embedding_model,
+        memory_budget_bytes=int(args.shard_memory_mb * 2 ** 20) if args.shard_memory_mb is not None else None,
+        embedding_backend=args.embedding_backend,
+        chunk_store=args.chunk_store,
+        journal_compaction_ratio=args.journal_compaction_ratio,
+        index_type=args.index_type,
+        n_list=args.n_list,
+        pq_m=args.pq_m,
+        vector_dtype=args.vector_dtype,
+        reduced_dim=args.reduced_dim,
+        dim_reduction=args.dim_reduction,
+        mmap_index=args.doc_dir is None,
+        max_query_batch_size=args.max_query_batch_size,
+        query_batch_wait_ms=args.query_batch_wait_ms
+    )
+
+
+def create_chunker(args: argparse.Namespace) -> Optional["TokenChunker"]:
+    """
+    Create the chunker configured on the command line.
+    
+    :param args: Parsed command line arguments
+    :return: Token chunker, None for the PreProcessor
+    """
+    if args.chunker != "token":
+        return None
+    from src.pipeline.token_chunker import TokenChunker
+    
+    return TokenChunker(args.embedding_model, max_tokens=args.chunk_tokens, overlap_tokens=args.chunk_overlap_tokens)
+
+
+def create_pipeline(args: argparse.Namespace, doc_store_manager: "DocumentStoreManager",
+                    query_cache: Optional["QueryCache"] = None,
+                    store_lock: Optional[ContextManager] = None,
+                    collection_manager: Optional["CollectionManager"] = None) -> "QueryPipeline":
+    """
+    Build the query pipeline configured on the command line.
+    
+    :param args: Parsed command line arguments
+    :param doc_store_manager: Document store manager to retrieve from, unused with a collection manager
+    :param query_cache: Optional query cache
+    :param store_lock: Optional lock guarding reads of the document store, see QueryPipeline
+    :param collection_manager: Optional manager of the collections in --collections to search instead
+    :return: Query pipeline
+    """
+    from src.pipeline.generators import StubGenerator
+    from src.pipeline.pipeline import QueryPipeline
+    
+    return QueryPipeline(
+        retriever=collection_manager.retriever if collection_manager else doc_store_manager.get_retriever(),
+        model_name=args.llm_model,
+        query_cache=query_cache,
+        generator=StubGenerator(latency_seconds=args.stub_latency) if args.llm_model == STUB_MODEL_NAME else None,
+        max_context_tokens=args.max_context_tokens,
+        bm25_index=doc_store_manager.bm25_index if args.hybrid and not collection_manager else None,
+        dense_top_k=args.dense_top_k,
+        lexical_top_k=args.lexical_top_k,
+        fusion_weights=tuple(args.fusion_weights),
+        store_lock=store_lock,
+        collection_manager=collection_manager,
+        collections=args.collections or ()
+    )
+
+
+def log_ingest_stats(stats: dict):
+    """
+    Log the chunk counts of an ingestion run.
+    
+    :param stats: Dictionary with file and chunk counts of the run
+    """
+    logging.info(f"Indexed chunks -- new: {stats['new']}, skipped: {stats['skipped']}, "
+                 f"re-embedded: {stats['reembedded']}, deleted: {stats.get('deleted', 0)}, "
+                 f"near-duplicates: {stats.get('near_duplicates', 0)} "
+                 f"(~{stats.get('embedding_seconds_saved', 0.0)} s of embedding saved), "
+                 f"failed files: {stats['files_failed']}, unchanged files: {stats.get('files_unchanged', 0)}")
+
+
+def log_result(result: dict):
+    """
+    Log the answer of a query.
+    
+    :param result: Serialized query results, see src.pipeline.server.serialize_result
+    """
+    logging.info(f"Prompt tokens: {result.get('prompt_tokens')}")
+    logging.info(f"Stage timings: {format_timings(result.get('timings', {}))}")
     logging.info("\nQuery Result:")
+    logging.info(result["answer"])
+
+
+def write_metrics_file(metrics_file: str, text: str):
+    """
+    Write the per-stage metrics.
+    
+    :param metrics_file: Path of the metrics file
+    :param text: Metrics in Prometheus text format or JSON
+    """
+    with open(metrics_file, "w") as f:
+        f.write(text)
+    logging.info(f"Metrics written to {metrics_file}")
+
+
+def format_timings(timings: dict) -> str:
+    """
+    Format per-stage timings for logging.
     
-    # handle response more robustly
-    if "answers" in result and result["answers"]:
-        if hasattr(result["answers"][0], "answer"):
-            logging.info(result["answers"][0].answer)
+    :param timings: Seconds spent per stage
+    :return: Comma-separated stage timings in milliseconds
+    """
+    return ", ".join(f"{stage}: {1000 * seconds:.1f}ms" for stage, seconds in timings.items())
+
+
+def print_stream(events: Iterable[dict]):
+    """
+    Print the answer tokens of a streamed query to stdout as they arrive.
+    
+    :param events: Serialized stream events, see src.pipeline.server.serialize_event
+    """
+    for event in events:
+        if event["event"] == "documents":
+            sources = ", ".join(str(source.get("file_path") or "Unknown") for source in event["sources"])
+            logging.info(f"Retrieved sources: {sources}")
+            logging.info("\nQuery Result:")
+        elif event["event"] == "token":
+            sys.stdout.write(event["token"])
+            sys.stdout.flush()
         else:
-            logging.info(result["answers"][0].get("answer", "No answer generated."))
-    else:
-        logging.info(result.get("results", ["No answer generated."])[0])
+            sys.stdout.write("\n")
+            timings = event["result"]["timings"]
+            logging.info(f"Time to first token: {timings['time_to_first_token']:.2f}s, "
+                         f"total: {timings['total']:.2f}s (retrieval: {timings['retrieval']:.2f}s), "
+                         f"prompt tokens: {event['result']['prompt_tokens']}")
+            logging.info(f"Stage timings: {format_timings(timings)}")
+
+
+def read_query_records(args: argparse.Namespace) -> List[dict]:
+    """
+    Read the query objects of the --queries_file.
+    
+    :param args: Parsed command line arguments
+    :return: Query objects, in file order
+    """
+    with open(args.queries_file, "r") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    
+    missing = [i for i, record in enumerate(records, 1) if not record.get(args.query_field)]
+    if missing:
+        raise ValueError(f"Lines {missing} of {args.queries_file} have no '{args.query_field}' field")
+    
+    logging.info(f"Running {len(records)} queries...")
+    return records
+
+
+def write_query_results(args: argparse.Namespace, records: List[dict], results: List[dict]):
+    """
+    Write one JSON result per query object, in input order.
+    
+    Each output object repeats the input object and adds "answer" and "sources", or "error" if the query failed.
+    
+    :param args: Parsed command line arguments
+    :param records: Query objects
+    :param results: Serialized results of the queries, see src.pipeline.server.serialize_result
+    """
+    output = open(args.output_file, "w") if args.output_file else sys.stdout
+    try:
+        for record, result in zip(records, results):
+            if "error" in result:
+                record = {**record, "error": result["error"]}
+            else:
+                record = {**record,
+                          "answer": result["answer"],
+                          "sources": [source["file_path"] for source in result["sources"]],
+                          "prompt_tokens": result["prompt_tokens"]}
+            output.write(json.dumps(record) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    
+    failed = sum("error" in result for result in results)
+    logging.info(f"Answered {len(results) - failed} queries, {failed} failed")
 
 
 if __name__ == "__main__":
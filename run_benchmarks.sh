@@ -0,0 +1,11 @@
+#!/bin/bash
+
+# run the offline benchmarks and compare them with the stored baseline, if any
+# pass e.g. "--sizes 1k 10k" to benchmark a subset of the corpus sizes
+python -m src.pipeline.benchmark run --output data/benchmark_results.json "$@" || exit 1
+
+if [ -f data/benchmark_baseline.json ]; then
+    python -m src.pipeline.benchmark compare data/benchmark_results.json data/benchmark_baseline.json
+else
+    echo "No baseline found; store one with: cp data/benchmark_results.json data/benchmark_baseline.json"
+fi
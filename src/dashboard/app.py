@@ -1,5 +1,9 @@
 """src.dashboard.app.py -- Streamlit dashboard for document query pipeline.
-Provides a web interface for document upload, query input, and result visualization."""
+Provides a web interface for document upload, query input, and result visualization.
+
+The embedding model, document store, pipelines and the ingestion queue are cached resources shared by all browser
+sessions of the process. Uploaded documents are ingested by a background job queue, and queries keep being
+answered from the current index meanwhile."""
 
 import os
 import sys
@@ -11,11 +15,34 @@ sys.path.insert(0, os.path.abspath(Path().parent.parent))
 import shutil
 import streamlit as st
 import tempfile
+import threading
+
+from typing import Optional, Union
 
 from dotenv import load_dotenv
 from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.generators import StubGenerator
+from src.pipeline.ingestion import IngestionJob, IngestionQueue
+from src.pipeline.options import CHUNKERS, STUB_MODEL_NAME
 from src.pipeline.pipeline import QueryPipeline
-from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.query_cache import QueryCache
+from src.pipeline.sharding import CollectionManager, ShardedCollection
+from src.pipeline.token_chunker import TokenChunker
+
+
+# query stages shown in the latency breakdown, in pipeline order
+STAGE_LABELS = {
+    "query_embedding": "Query embedding",
+    "faiss_search": "Vector search",
+    "shard_search": "Shard search",
+    "lexical_search": "Keyword search",
+    "document_fetch": "Document fetch",
+    "prompt_build": "Prompt build",
+    "llm_call": "LLM call",
+}
+
+# serializes the creation of shared resources, so that sessions starting at once open the document store only once
+_resource_lock = threading.Lock()
 
 
 def load_css():
@@ -24,51 +51,180 @@ def load_css():
         st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
 
 
-def initialize_session_state():
-    """Initialize streamlit session state variables."""
-    if 'doc_store_manager' not in st.session_state:
-        st.session_state.doc_store_manager = None
-    if 'pipeline' not in st.session_state:
-        st.session_state.pipeline = None
+@st.cache_resource(show_spinner="Loading document store...")
+def get_doc_store_manager(embedding_model: str) -> DocumentStoreManager:
+    """
+    Open the document store and load the embedding model once per process.
+    
+    :param embedding_model: Name of the embedding model to use
+    :return: Document store manager shared by all sessions
+    """
+    with _resource_lock:
+        return DocumentStoreManager(
+            embedding_model=embedding_model,
+            db_path="data/faiss_document_store.db",
+            index_path="data/faiss_document_store.faiss"
+        )
 
 
-def process_uploaded_documents(uploaded_files: list[st.runtime.uploaded_file_manager.UploadedFile],
-                               embedding_model: str,
-                               llm_model: str):
+@st.cache_resource(show_spinner="Loading collections...")
+def get_collection_manager(embedding_model: str) -> CollectionManager:
     """
-    Process uploaded documents and initialize the pipeline.
+    Open the manager of the named collections once per process; their shards are opened on first use.
+    
+    :param embedding_model: Name of the embedding model to use
+    :return: Collection manager shared by all sessions
+    """
+    with _resource_lock:
+        return CollectionManager(root_dir="data/collections", embedding_model=embedding_model)
+
+
+def get_document_store(embedding_model: str, collection: str) -> Union[DocumentStoreManager, ShardedCollection]:
+    """
+    Get the store documents are added to.
+    
+    :param embedding_model: Name of the embedding model to use
+    :param collection: Name of the collection, empty for the default document store
+    :return: Default document store manager or the collection
+    """
+    if collection:
+        return get_collection_manager(embedding_model).collection(collection)
+    return get_doc_store_manager(embedding_model)
+
+
+@st.cache_resource
+def get_ingestion_queue(embedding_model: str, collection: str = "") -> IngestionQueue:
+    """
+    Create the background ingestion queue of the shared document store or of a collection.
+    
+    There is one queue per store, so jobs with different chunkers never ingest into the store at the same time.
+    
+    :param embedding_model: Name of the embedding model to use
+    :param collection: Name of the collection, empty for the default document store
+    :return: Ingestion queue shared by all sessions
+    """
+    document_store = get_document_store(embedding_model, collection)
+    with _resource_lock:
+        return IngestionQueue(document_store)
+
+
+@st.cache_resource
+def get_pipeline(embedding_model: str, llm_model: str, hybrid: bool, collection: str = "") -> QueryPipeline:
+    """
+    Build a query pipeline over the shared document store or a collection.
+    
+    The pipeline holds the lock of the document store while it searches, so it can be used while documents are
+    ingested, and its query cache is invalidated whenever a batch of documents is indexed. Collections are
+    searched shard by shard, without BM25.
     
-    :param uploaded_files: List of uploaded file objects from Streamlit
     :param embedding_model: Name of the embedding model to use
     :param llm_model: Name of the language model to use
+    :param hybrid: Flag to fuse dense retrieval with BM25 keyword retrieval
+    :param collection: Name of the collection, empty for the default document store
+    :return: Query pipeline shared by all sessions using the same settings
     """
-    with st.spinner("Processing documents..."):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # save uploaded files to temporary directory
-            for uploaded_file in uploaded_files:
-                file_path = Path(temp_dir) / uploaded_file.name
-                with open(file_path, "wb") as f:
-                    shutil.copyfileobj(uploaded_file, f)
-            
-            # process documents
-            documents = load_documents(temp_dir)
-            processed_docs = preprocess_documents(documents)
-            
-            # initialize document store
-            st.session_state.doc_store_manager = DocumentStoreManager(
-                embedding_model=embedding_model,
-                db_path="data/faiss_document_store.db",
-                index_path="data/faiss_document_store.faiss"
+    if collection:
+        collection_manager = get_collection_manager(embedding_model)
+        with _resource_lock:
+            query_cache = QueryCache()
+            collection_manager.collection(collection).add_change_listener(query_cache.invalidate)
+            return QueryPipeline(
+                retriever=collection_manager.retriever,
+                model_name=llm_model,
+                query_cache=query_cache,
+                generator=StubGenerator() if llm_model == STUB_MODEL_NAME else None,
+                collection_manager=collection_manager,
+                collections=[collection]
             )
-            st.session_state.doc_store_manager.add_documents(processed_docs)
-            
-            # initialize pipeline
-            st.session_state.pipeline = QueryPipeline(
-                retriever=st.session_state.doc_store_manager.get_retriever(),
-                model_name=llm_model
-            )
-        
-        st.success("Documents processed successfully!")
+    
+    doc_store_manager = get_doc_store_manager(embedding_model)
+    with _resource_lock:
+        query_cache = QueryCache()
+        doc_store_manager.add_change_listener(query_cache.invalidate)
+        return QueryPipeline(
+            retriever=doc_store_manager.get_retriever(),
+            model_name=llm_model,
+            query_cache=query_cache,
+            generator=StubGenerator() if llm_model == STUB_MODEL_NAME else None,
+            bm25_index=doc_store_manager.bm25_index if hybrid else None,
+            store_lock=doc_store_manager.lock
+        )
+
+
+def latency_breakdown(timings: dict) -> list[dict]:
+    """
+    Build the rows of the per-query latency breakdown table.
+    
+    :param timings: Timings of a streamed query result, in seconds
+    :return: One row per measured stage with its time and share of the total, followed by the total
+    """
+    total = timings["total"]
+    rows = [{"Stage": label, "Time (ms)": round(1000 * timings[stage], 1),
+             "Share": f"{timings[stage] / total:.0%}" if total else "-"}
+            for stage, label in STAGE_LABELS.items() if stage in timings]
+    rows.append({"Stage": "Total", "Time (ms)": round(1000 * total, 1), "Share": "100%"})
+    return rows
+
+
+def submit_uploaded_documents(uploaded_files: list[st.runtime.uploaded_file_manager.UploadedFile],
+                              ingestion_queue: IngestionQueue,
+                              num_workers: int = 1,
+                              chunker: Optional[TokenChunker] = None) -> IngestionJob:
+    """
+    Save uploaded documents to a temporary directory and queue it for ingestion.
+    
+    :param uploaded_files: List of uploaded file objects from Streamlit
+    :param ingestion_queue: Queue ingesting the documents in the background
+    :param num_workers: Number of worker processes for document conversion and chunking
+    :param chunker: Optional chunker used instead of the PreProcessor
+    :return: Queued ingestion job, which deletes the directory once it has finished
+    """
+    temp_dir = tempfile.mkdtemp(prefix="uploaded_documents_")
+    for uploaded_file in uploaded_files:
+        file_path = Path(temp_dir) / uploaded_file.name
+        with open(file_path, "wb") as f:
+            shutil.copyfileobj(uploaded_file, f)
+    return ingestion_queue.submit(temp_dir, remove_when_done=True, num_workers=num_workers, chunker=chunker)
+
+
+def file_status_rows(job: IngestionJob) -> list[dict]:
+    """
+    Build the rows of the per-file status table of an ingestion job.
+    
+    :param job: Ingestion job
+    :return: One row per file with its name, status and error message
+    """
+    return [{"File": Path(file_path).name, "Status": status, "Error": job.file_errors.get(file_path, "")}
+            for file_path, status in list(job.files.items())]
+
+
+@st.fragment(run_every=1.0)
+def show_ingestion_jobs(ingestion_queue: IngestionQueue):
+    """
+    Show the progress of the recent ingestion jobs, refreshed every second.
+    
+    :param ingestion_queue: Queue ingesting the documents in the background
+    """
+    busy = ingestion_queue.is_busy()
+    if st.session_state.get("ingestion_busy") and not busy:
+        # rerun the whole page, e.g. to enable queries after the first documents were indexed
+        st.session_state.ingestion_busy = False
+        st.rerun()
+    st.session_state.ingestion_busy = busy
+    
+    jobs = ingestion_queue.jobs[-5:]
+    if not jobs:
+        return
+    
+    with st.expander("Ingestion Jobs", expanded=busy):
+        for job in reversed(jobs):
+            st.progress(job.progress, text=f"Job {job.id}: {job.status}, {len(job.files)} files")
+            if job.status == "done":
+                st.caption(f"New chunks: {job.stats['new']}, skipped: {job.stats['skipped']}, "
+                           f"re-embedded: {job.stats['reembedded']}, failed files: {job.stats['files_failed']}")
+            elif job.status == "failed":
+                st.error(f"Ingestion failed: {job.error}")
+            st.table(file_status_rows(job))
 
 
 def main():
@@ -80,13 +236,7 @@ def main():
     )
     load_css()
     
-    # API key
     load_dotenv()
-    if not os.getenv("OPENAI_API_KEY"):
-        st.error("OPENAI_API_KEY not found in environment variables")
-        st.stop()
-    
-    initialize_session_state()
     
     st.title("Document Query Pipeline")
     
@@ -103,10 +253,44 @@ def main():
         
         llm_model = st.selectbox(
             "Language Model",
-            ["gpt-4o-mini", "gpt-4", "gpt-3.5-turbo"],
+            ["gpt-4o-mini", "gpt-4", "gpt-3.5-turbo", STUB_MODEL_NAME],
             index=0  # default to gpt-4o-mini
         )
         
+        # API key, not needed by the offline stand-in model
+        if llm_model != STUB_MODEL_NAME and not os.getenv("OPENAI_API_KEY"):
+            st.error("OPENAI_API_KEY not found in environment variables")
+            st.stop()
+        
+        num_workers = st.number_input(
+            "Worker Processes",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=1,
+            help="Number of processes used for document conversion and chunking"
+        )
+        
+        collection = st.text_input(
+            "Collection",
+            value="",
+            help="Name of a separate collection, e.g. per tenant, stored under data/collections; "
+                 "leave empty for the default document store"
+        ).strip()
+        
+        chunker = st.selectbox(
+            "Chunker",
+            CHUNKERS,
+            index=0,
+            help="Split documents into chunks of 500 words, or into chunks that fit the token window of the "
+                 "embedding model and end at sentence boundaries"
+        )
+        
+        hybrid = st.checkbox(
+            "Hybrid Retrieval",
+            value=True,
+            help="Combine semantic search with BM25 keyword search, which finds exact terms such as codes and names"
+        )
+        
         # file uploader
         uploaded_files = st.file_uploader(
             "Upload Documents",
@@ -114,16 +298,26 @@ def main():
             type=['txt', 'pdf', 'docx']
         )
         
+        try:
+            ingestion_queue = get_ingestion_queue(embedding_model, collection)
+        except ValueError as e:
+            # invalid collection name
+            st.error(str(e))
+            st.stop()
         if uploaded_files and st.button("Process Documents"):
-            process_uploaded_documents(uploaded_files, embedding_model, llm_model)
+            job = submit_uploaded_documents(uploaded_files, ingestion_queue, num_workers,
+                                            chunker=TokenChunker(embedding_model) if chunker == "token" else None)
+            st.success(f"Queued {len(job.files)} documents for indexing (job {job.id})")
     
     # main content area
     st.header("Query Documents")
+    show_ingestion_jobs(ingestion_queue)
     
-    # check if pipeline is initialized
-    if st.session_state.pipeline is None:
+    # queries are answered from the current index while new documents are indexed
+    if not get_document_store(embedding_model, collection).has_documents():
         st.warning("Please upload and process documents first.")
         st.stop()
+    pipeline = get_pipeline(embedding_model, llm_model, hybrid, collection)
     
     # query handling
     query = st.text_area("Enter your query:", height=100)
@@ -133,25 +327,44 @@ def main():
             st.error("Please enter a query.")
             st.stop()
         
-        with st.spinner("Processing query..."):
-            result = st.session_state.pipeline.run(query)
-            
-            # display results
-            st.subheader("Response:")
-            
-            if "answers" in result and result["answers"]:
-                if hasattr(result["answers"][0], "answer"):
-                    st.write(result["answers"][0].answer)
-                else:
-                    st.write(result["answers"][0].get("answer", "No answer generated."))
-            
-            # display source documents
+        # display results while they are generated; sources appear as soon as retrieval has finished
+        st.subheader("Response:")
+        answer_placeholder = st.empty()
+        caption_placeholder = st.empty()
+        sources_column, latency_column = st.columns([3, 2])
+        sources_placeholder = sources_column.empty()
+        latency_placeholder = latency_column.empty()
+        
+        events = pipeline.stream(query)
+        with st.spinner("Retrieving documents..."):
+            documents = next(events)["documents"]
+        
+        with sources_placeholder.container():
             with st.expander("Source Documents"):
-                for doc in result["documents"]:
+                for doc in documents:
                     st.markdown(f"**Source:** {doc.meta.get('file_path', 'Unknown')}")
                     st.markdown(f"**Content:** {doc.content[:500]}...")
                     st.markdown("---")
-
+        
+        answer = ""
+        for event in events:
+            if event["event"] == "token":
+                answer += event["token"]
+                answer_placeholder.markdown(answer + "▌")
+            elif event["event"] == "done":
+                result = event["result"]
+                answer_placeholder.markdown(result["answers"][0].get("answer") or "No answer generated.")
+                
+                timings = result["timings"]
+                caption = (f"Time to first token: {timings['time_to_first_token']:.2f}s, "
+                           f"total: {timings['total']:.2f}s, prompt tokens: {result['prompt_tokens']}")
+                if result.get("cache", {}).get("answer"):
+                    caption += " (answer served from cache)"
+                caption_placeholder.caption(caption)
+                
+                with latency_placeholder.container():
+                    with st.expander("Latency Breakdown"):
+                        st.table(latency_breakdown(timings))
 
 if __name__ == "__main__":
     main()
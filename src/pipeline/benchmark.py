@@ -0,0 +1,321 @@
+"""src.pipeline.benchmark.py -- Offline benchmark of ingestion and query latency on synthetic corpora.
+
+Usage:
+    python -m src.pipeline.benchmark run --sizes 1k 10k --output data/benchmark_results.json
+    python -m src.pipeline.benchmark compare data/benchmark_results.json data/benchmark_baseline.json"""
+
+import argparse
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.generators import StubGenerator
+from src.pipeline.options import STUB_MODEL_NAME
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.preprocessing import load_documents, preprocess_documents
+
+
+# small embedding model, so that the benchmark runs on a CPU within minutes
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_SIZES = ["1k", "10k", "100k"]
+
+# words per chunk step of the PreProcessor (split_length 500, split_overlap 50)
+WORDS_PER_CHUNK = 450
+CHUNKS_PER_FILE = 10
+
+# metrics compared against the baseline, with True if higher values are better
+COMPARED_METRICS = {
+    "load_documents.seconds": False,
+    "preprocess_documents.seconds": False,
+    "add_documents.seconds": False,
+    "add_documents.chunks_per_second": True,
+    "query.p50_ms": False,
+    "query.p95_ms": False,
+    "query.p99_ms": False,
+    "query.qps": True,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(size: str) -> int:
+    """
+    Parse a corpus size such as "10k" or "2500".
+    
+    :param size: Number of chunks, optionally with a k suffix
+    :return: Number of chunks
+    """
+    size = size.strip().lower()
+    return int(float(size[:-1]) * 1000) if size.endswith("k") else int(size)
+
+
+def make_vocabulary(num_words: int = 5000, seed: int = 0) -> List[str]:
+    """
+    Create pronounceable synthetic words.
+    
+    :param num_words: Number of words
+    :param seed: Random seed
+    :return: List of distinct words
+    """
+    rng = np.random.default_rng(seed)
+    consonants, vowels = list("bcdfghklmnprstvz"), list("aeiou")
+    words = set()
+    while len(words) < num_words:
+        syllables = rng.integers(1, 4)
+        words.add("".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(syllables)))
+    return sorted(words)
+
+
+def write_corpus(doc_dir: str, num_chunks: int, seed: int = 0) -> int:
+    """
+    Write a synthetic text corpus that the preprocessor splits into about `num_chunks` chunks.
+    
+    Words follow a Zipf distribution over a fixed vocabulary and are grouped into sentences, so that chunking
+    respects sentence boundaries as it does for real text.
+    
+    :param doc_dir: Directory the text files are written to
+    :param num_chunks: Target number of chunks
+    :param seed: Random seed
+    :return: Number of written files
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.asarray(make_vocabulary(seed=seed))
+    Path(doc_dir).mkdir(parents=True, exist_ok=True)
+    
+    num_files = max(1, int(np.ceil(num_chunks / CHUNKS_PER_FILE)))
+    for i in range(num_files):
+        file_chunks = min(CHUNKS_PER_FILE, num_chunks - i * CHUNKS_PER_FILE) or 1
+        num_words = file_chunks * WORDS_PER_CHUNK
+        words = vocabulary[np.minimum(rng.zipf(1.3, num_words), len(vocabulary)) - 1]
+        sentences = [" ".join(words[start:start + 15]).capitalize() + "."
+                     for start in range(0, num_words, 15)]
+        (Path(doc_dir) / f"doc_{i:06d}.txt").write_text(" ".join(sentences))
+    return num_files
+
+
+def make_queries(num_queries: int, seed: int = 1) -> List[str]:
+    """
+    Create synthetic queries over the corpus vocabulary.
+    
+    :param num_queries: Number of queries
+    :param seed: Random seed
+    :return: List of query strings
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary()
+    return [f"What is known about {' '.join(rng.choice(vocabulary, rng.integers(2, 6)))}?"
+            for _ in range(num_queries)]
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize per-query latencies.
+    
+    :param latencies: Latencies in seconds
+    :return: Dict with p50, p95 and p99 in milliseconds and queries per second
+    """
+    latencies_ms = 1000 * np.asarray(latencies)
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+            "qps": round(len(latencies) / float(np.sum(latencies)), 2)}
+
+
+def benchmark_corpus(num_chunks: int, embedding_model: str = DEFAULT_EMBEDDING_MODEL, num_queries: int = 200,
+                     warmup_queries: int = 10, batch_size: int = 1000, top_k: int = 5) -> Dict:
+    """
+    Benchmark ingestion and querying of one synthetic corpus in a temporary directory.
+    
+    :param num_chunks: Target number of chunks of the corpus
+    :param embedding_model: Name or path of the embedding model
+    :param num_queries: Number of timed queries
+    :param warmup_queries: Number of untimed queries run first
+    :param batch_size: Number of chunks passed to add_documents at once
+    :param top_k: Number of retrieved chunks per query
+    :return: Dict of timings per stage
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_dir = str(Path(temp_dir) / "docs")
+        num_files = write_corpus(doc_dir, num_chunks)
+        
+        start = time.perf_counter()
+        documents = load_documents(doc_dir)
+        load_seconds = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        chunks = preprocess_documents(documents)
+        preprocess_seconds = time.perf_counter() - start
+        
+        # the embedding cache is disabled, so that every run embeds all chunks
+        doc_store_manager = DocumentStoreManager(
+            embedding_model=embedding_model,
+            db_path=str(Path(temp_dir) / "benchmark.db"),
+            index_path=str(Path(temp_dir) / "benchmark.faiss"),
+            embedding_cache_size=0
+        )
+        start = time.perf_counter()
+        for batch_start in range(0, len(chunks), batch_size):
+            doc_store_manager.add_documents(chunks[batch_start:batch_start + batch_size])
+        add_seconds = time.perf_counter() - start
+        
+        pipeline = QueryPipeline(retriever=doc_store_manager.get_retriever(), model_name=STUB_MODEL_NAME,
+                                 generator=StubGenerator())
+        params = {"Retriever": {"top_k": top_k}}
+        queries = make_queries(warmup_queries + num_queries)
+        for query in queries[:warmup_queries]:
+            pipeline.run(query, params=params)
+        latencies = []
+        for query in queries[warmup_queries:]:
+            start = time.perf_counter()
+            pipeline.run(query, params=params)
+            latencies.append(time.perf_counter() - start)
+    
+    return {
+        "num_files": num_files,
+        "num_chunks": len(chunks),
+        "load_documents": {"seconds": round(load_seconds, 3),
+                           "files_per_second": round(num_files / load_seconds, 2)},
+        "preprocess_documents": {"seconds": round(preprocess_seconds, 3),
+                                 "chunks_per_second": round(len(chunks) / preprocess_seconds, 2)},
+        "add_documents": {"seconds": round(add_seconds, 3),
+                          "chunks_per_second": round(len(chunks) / add_seconds, 2)},
+        "query": latency_stats(latencies),
+    }
+
+
+def run_benchmarks(sizes: List[str], embedding_model: str = DEFAULT_EMBEDDING_MODEL, num_queries: int = 200,
+                   warmup_queries: int = 10) -> Dict:
+    """
+    Benchmark all corpus sizes.
+    
+    :param sizes: Corpus sizes such as "1k" or "10k"
+    :param embedding_model: Name or path of the embedding model
+    :param num_queries: Number of timed queries per corpus
+    :param warmup_queries: Number of untimed queries per corpus
+    :return: Dict with the environment and the results per corpus size
+    """
+    results = {
+        "environment": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "embedding_model": embedding_model,
+            "num_queries": num_queries,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        logger.info(f"Benchmarking corpus of {size} chunks...")
+        results["results"][size] = benchmark_corpus(parse_size(size), embedding_model=embedding_model,
+                                                    num_queries=num_queries, warmup_queries=warmup_queries)
+    return results
+
+
+def compare_results(results: Dict, baseline: Dict, tolerance: float = 0.1) -> List[Dict]:
+    """
+    Compare benchmark results with a baseline run.
+    
+    :param results: Results of run_benchmarks
+    :param baseline: Baseline results of run_benchmarks
+    :param tolerance: Relative change beyond which a worse value counts as a regression
+    :return: One dict per compared metric with the values, the relative change and a regression flag
+    """
+    comparisons = []
+    for size, metrics in results["results"].items():
+        baseline_metrics = baseline["results"].get(size)
+        if baseline_metrics is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = _get_metric(metrics, metric), _get_metric(baseline_metrics, metric)
+            if current is None or not previous:
+                continue
+            change = (current - previous) / previous
+            comparisons.append({
+                "size": size,
+                "metric": metric,
+                "baseline": previous,
+                "current": current,
+                "change": round(change, 4),
+                "regression": (-change if higher_is_better else change) > tolerance,
+            })
+    return comparisons
+
+
+def _get_metric(metrics: Dict, metric: str) -> Optional[float]:
+    """
+    Look up a dotted metric name such as "query.p95_ms".
+    
+    :param metrics: Results of one corpus size
+    :param metric: Dotted metric name
+    :return: Metric value, or None if missing
+    """
+    value = metrics
+    for key in metric.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _print_comparison(comparisons: List[Dict]) -> Tuple[int, int]:
+    """
+    Print a comparison table.
+    
+    :param comparisons: Result of compare_results
+    :return: Tuple of the number of compared metrics and the number of regressions
+    """
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison["regression"] else ""
+        print(f"{comparison['size']:>6}  {comparison['metric']:<34} {comparison['baseline']:>12} "
+              f"{comparison['current']:>12} {comparison['change']:>+8.1%}  {flag}")
+    regressions = sum(comparison["regression"] for comparison in comparisons)
+    return len(comparisons), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and query latency on synthetic corpora")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Corpus sizes in chunks, e.g. 1k 10k")
+    run_parser.add_argument("--embedding_model", default=DEFAULT_EMBEDDING_MODEL, help="Embedding model")
+    run_parser.add_argument("--num_queries", type=int, default=200, help="Number of timed queries per corpus")
+    run_parser.add_argument("--warmup_queries", type=int, default=10, help="Number of untimed queries per corpus")
+    run_parser.add_argument("--output", help="JSON file the results are written to (default: stdout)")
+    
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions against a baseline")
+    compare_parser.add_argument("results", help="JSON file written by the run command")
+    compare_parser.add_argument("baseline", help="Baseline JSON file written by the run command")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1,
+                                help="Relative change beyond which a worse value is a regression")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    
+    if args.command == "run":
+        results = run_benchmarks(args.sizes, embedding_model=args.embedding_model, num_queries=args.num_queries,
+                                 warmup_queries=args.warmup_queries)
+        if args.output:
+            Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+            Path(args.output).write_text(json.dumps(results, indent=2))
+        else:
+            print(json.dumps(results, indent=2))
+        return
+    
+    results = json.loads(Path(args.results).read_text())
+    baseline = json.loads(Path(args.baseline).read_text())
+    num_compared, regressions = _print_comparison(compare_results(results, baseline, tolerance=args.tolerance))
+    print(f"{regressions} regressions in {num_compared} compared metrics (tolerance {args.tolerance:.0%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""src.pipeline.bm25_index.py -- Compact in-memory BM25 inverted index and reciprocal rank fusion for hybrid retrieval."""
+
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from haystack.schema import Document
+
+
+# words of any script, numbers and codes such as "E-1042", "x86_64" or "3.5.1" are kept as single terms
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:[-_.:/][^\W_]+)*")
+# version of the terms produced by tokenize; saved indexes of other versions are rebuilt
+TOKENIZER_VERSION = 2
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into case-folded terms, so that e.g. "Straße" and "STRASSE" match.
+    
+    :param text: Text to split
+    :return: List of terms
+    """
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+class _Segment:
+    """
+    Immutable block of postings in compressed sparse row layout.
+    
+    The postings of term id t are docs[offsets[t]:offsets[t + 1]] with term frequencies tfs[...]; term ids added
+    after the segment was built have no postings in it.
+    """
+    
+    def __init__(self, offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray):
+        """
+        Initialize a segment from its arrays.
+        
+        :param offsets: Start of the postings of each term id, length vocabulary size + 1
+        :param docs: Document numbers of all postings, grouped by term id
+        :param tfs: Term frequencies of all postings
+        """
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+    
+    @classmethod
+    def build(cls, term_ids: np.ndarray, docs: np.ndarray, tfs: np.ndarray, vocabulary_size: int) -> "_Segment":
+        """
+        Build a segment from unsorted postings.
+        
+        :param term_ids: Term id of each posting
+        :param docs: Document number of each posting
+        :param tfs: Term frequency of each posting
+        :param vocabulary_size: Number of known terms
+        :return: New segment
+        """
+        order = np.lexsort((docs, term_ids))
+        offsets = np.zeros(vocabulary_size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=vocabulary_size), out=offsets[1:])
+        return cls(offsets, docs[order].astype(np.int32), tfs[order].astype(np.int32))
+    
+    @property
+    def size(self) -> int:
+        """Number of postings in the segment."""
+        return len(self.docs)
+    
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the postings of a term.
+        
+        :param term_id: Term id
+        :return: Tuple of document numbers and term frequencies
+        """
+        if term_id + 1 >= len(self.offsets):
+            return self.docs[:0], self.tfs[:0]
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.tfs[start:end]
+    
+    def expand(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Convert the segment back to one row per posting.
+        
+        :return: Tuple of term ids, document numbers and term frequencies
+        """
+        term_ids = np.repeat(np.arange(len(self.offsets) - 1, dtype=np.int32), np.diff(self.offsets))
+        return term_ids, self.docs, self.tfs
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over document chunks.
+    
+    Postings live in numpy arrays rather than Python objects: each batch of added documents becomes a segment in
+    compressed sparse row layout (term offsets, document numbers, term frequencies), and segments of similar size
+    are merged like in a log-structured merge tree, so adding documents costs O(N log N) overall. The index is
+    saved to a single .npz file next to the FAISS index.
+    
+    :param k1: BM25 term frequency saturation
+    :param b: BM25 document length normalization
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty index.
+        
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._vocabulary: Dict[str, int] = {}
+        self._doc_ids: List[str] = []
+        self._doc_numbers: Dict[str, int] = {}
+        self._doc_lengths = np.zeros(0, dtype=np.int32)
+        self._segments: List[_Segment] = []
+        self.tokenizer_version = TOKENIZER_VERSION
+    
+    def __len__(self) -> int:
+        """Number of indexed documents."""
+        return len(self._doc_ids)
+    
+    def __contains__(self, document_id: str) -> bool:
+        """Check whether a document is indexed."""
+        return document_id in self._doc_numbers
+    
+    def add_documents(self, documents: Iterable[Document]):
+        """
+        Index documents; documents whose id is already indexed are ignored.
+        
+        :param documents: Documents to index
+        """
+        with self._lock:
+            term_ids, docs, tfs, lengths = [], [], [], []
+            for doc in documents:
+                if doc.id in self._doc_numbers:
+                    continue
+                number = len(self._doc_ids)
+                self._doc_ids.append(doc.id)
+                self._doc_numbers[doc.id] = number
+                
+                counts = Counter(tokenize(doc.content))
+                lengths.append(sum(counts.values()))
+                for term, count in counts.items():
+                    term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                    docs.append(number)
+                    tfs.append(count)
+            
+            if not lengths:
+                return
+            
+            self._doc_lengths = np.concatenate([self._doc_lengths, np.asarray(lengths, dtype=np.int32)])
+            segment = _Segment.build(np.asarray(term_ids, dtype=np.int32), np.asarray(docs, dtype=np.int32),
+                                     np.asarray(tfs, dtype=np.int32), len(self._vocabulary))
+            self._segments.append(segment)
+            
+            # merge the newest segments while they have similar sizes, keeping the number of segments logarithmic
+            while len(self._segments) > 1 and self._segments[-2].size <= 2 * self._segments[-1].size:
+                newer = self._segments.pop()
+                older = self._segments.pop()
+                self._segments.append(self._merge(older, newer))
+    
+    def remove_documents(self, document_ids: Iterable[str]) -> int:
+        """
+        Remove documents from the index; ids that are not indexed are ignored.
+        
+        The remaining postings are rebuilt into a single segment with renumbered documents, so removing costs
+        O(N) regardless of the number of removed documents; removals should therefore be batched.
+        
+        :param document_ids: Ids of the documents to remove
+        :return: Number of removed documents
+        """
+        with self._lock:
+            removed = {self._doc_numbers[doc_id] for doc_id in document_ids if doc_id in self._doc_numbers}
+            if not removed:
+                return 0
+            
+            keep = np.ones(len(self._doc_ids), dtype=bool)
+            keep[list(removed)] = False
+            # new number of each kept document, in the order the documents were added
+            numbers = np.cumsum(keep, dtype=np.int32) - 1
+            
+            parts = [segment.expand() for segment in self._segments]
+            term_ids, docs, tfs = (np.concatenate([part[i] for part in parts]) for i in range(3))
+            kept_postings = keep[docs]
+            self._segments = [_Segment.build(term_ids[kept_postings], numbers[docs[kept_postings]],
+                                             tfs[kept_postings], len(self._vocabulary))]
+            
+            self._doc_ids = [doc_id for doc_id, kept in zip(self._doc_ids, keep) if kept]
+            self._doc_numbers = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+            self._doc_lengths = self._doc_lengths[keep]
+            return len(removed)
+    
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Score the indexed documents against a query.
+        
+        :param query: Query text
+        :param top_k: Number of documents to return
+        :return: List of document ids and BM25 scores, best first
+        """
+        with self._lock:
+            term_ids = sorted({self._vocabulary[term] for term in tokenize(query) if term in self._vocabulary})
+            if not term_ids or not self._doc_ids:
+                return []
+            
+            num_docs = len(self._doc_ids)
+            average_length = float(self._doc_lengths.mean())
+            matched_docs, contributions = [], []
+            for term_id in term_ids:
+                postings = [segment.postings(term_id) for segment in self._segments]
+                docs = np.concatenate([docs for docs, _ in postings])
+                tfs = np.concatenate([tfs for _, tfs in postings]).astype(np.float32)
+                if len(docs) == 0:
+                    continue
+                
+                idf = np.log(1.0 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = self.k1 * (1.0 - self.b + self.b * self._doc_lengths[docs] / average_length)
+                matched_docs.append(docs)
+                contributions.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+            
+            if not matched_docs:
+                return []
+            
+            # sum the contributions of all query terms per document
+            docs = np.concatenate(matched_docs)
+            contributions = np.concatenate(contributions)
+            order = np.argsort(docs, kind="stable")
+            docs, contributions = docs[order], contributions[order]
+            starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+            unique_docs, scores = docs[starts], np.add.reduceat(contributions, starts)
+            
+            top = np.argsort(-scores, kind="stable")[:top_k]
+            return [(self._doc_ids[unique_docs[i]], float(scores[i])) for i in top]
+    
+    def save(self, path: str):
+        """
+        Atomically write the index to a .npz file.
+        
+        :param path: Path of the index file
+        """
+        with self._lock:
+            arrays = {
+                "params": np.asarray([self.k1, self.b], dtype=np.float64),
+                "vocabulary": np.asarray(sorted(self._vocabulary, key=self._vocabulary.get), dtype=np.str_),
+                "doc_ids": np.asarray(self._doc_ids, dtype=np.str_),
+                "doc_lengths": self._doc_lengths,
+                "num_segments": np.asarray([len(self._segments)]),
+                "tokenizer_version": np.asarray([self.tokenizer_version]),
+            }
+            for i, segment in enumerate(self._segments):
+                arrays.update({f"offsets_{i}": segment.offsets, f"docs_{i}": segment.docs, f"tfs_{i}": segment.tfs})
+            
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, path)
+    
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Load an index written by save.
+        
+        :param path: Path of the index file
+        :return: Loaded index
+        """
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"]
+            index = cls(k1=float(k1), b=float(b))
+            index._vocabulary = {term: i for i, term in enumerate(data["vocabulary"].tolist())}
+            index._doc_ids = data["doc_ids"].tolist()
+            index._doc_numbers = {doc_id: i for i, doc_id in enumerate(index._doc_ids)}
+            index._doc_lengths = data["doc_lengths"]
+            index._segments = [_Segment(data[f"offsets_{i}"], data[f"docs_{i}"], data[f"tfs_{i}"])
+                               for i in range(int(data["num_segments"][0]))]
+            # indexes saved before the version was recorded split words at non-ASCII letters
+            index.tokenizer_version = int(data["tokenizer_version"][0]) if "tokenizer_version" in data else 1
+        return index
+    
+    def _merge(self, older: _Segment, newer: _Segment) -> _Segment:
+        """
+        Merge two segments into one.
+        
+        :param older: Segment built first
+        :param newer: Segment built later
+        :return: Merged segment
+        """
+        parts = [older.expand(), newer.expand()]
+        return _Segment.build(*(np.concatenate([part[i] for part in parts]) for i in range(3)),
+                              vocabulary_size=len(self._vocabulary))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], weights: Optional[Sequence[float]] = None,
+                           rrf_k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of document ids by weighted reciprocal rank fusion.
+    
+    Each document scores sum(weight / (rrf_k + rank)) over the rankings it appears in, with ranks starting at 1.
+    
+    :param rankings: Document ids of each retriever, best first
+    :param weights: Weight of each ranking, defaults to 1 for all
+    :param rrf_k: Rank offset damping the influence of the top ranks
+    :return: List of document ids and fused scores, best first
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, document_id in enumerate(ranking, 1):
+            scores[document_id] = scores.get(document_id, 0.0) + weight / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
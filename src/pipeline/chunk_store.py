@@ -0,0 +1,593 @@
+"""src.pipeline.chunk_store.py -- Append-only, memory-mapped columnar chunk store and a FAISS document store using it.
+
+See src.pipeline.chunk_store_evaluation for its write throughput and hydration latency compared with SQLite."""
+
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Dict, Generator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from haystack.document_stores import BaseDocumentStore, FAISSDocumentStore
+from haystack.schema import Document
+
+from src.pipeline.metrics import METRICS
+from src.pipeline.tombstones import VectorTombstones
+
+
+class _Column:
+    """
+    Variable-length byte column: a data file with the concatenated values and an offsets file with the end offset
+    of each value as uint64.
+    
+    Values are appended to the end of both files; the column is read through memory maps, so that slicing a value
+    does not copy it.
+    
+    :param path: Path prefix of the column files
+    """
+    
+    def __init__(self, path: Path):
+        """
+        Initialize the column, creating empty files if they don't exist.
+        
+        :param path: Path prefix of the column files
+        """
+        self.data_path = path.with_name(path.name + ".data")
+        self.offsets_path = path.with_name(path.name + ".offsets")
+        for file_path in [self.data_path, self.offsets_path]:
+            file_path.touch()
+        self._data = memoryview(b"")
+        self._ends = np.zeros(0, dtype=np.uint64)
+    
+    def truncate(self, count: int):
+        """
+        Cut the column to its first values, dropping values written after them.
+        
+        :param count: Number of values to keep
+        """
+        self._data, self._ends = memoryview(b""), np.zeros(0, dtype=np.uint64)
+        size = int(np.fromfile(self.offsets_path, dtype=np.uint64, count=1, offset=(count - 1) * 8)[0]) \
+            if count > 0 else 0
+        os.truncate(self.offsets_path, count * 8)
+        os.truncate(self.data_path, size)
+        self.remap()
+    
+    def append(self, values: List[bytes]):
+        """
+        Append values to the column files.
+        
+        :param values: Encoded values
+        """
+        start = int(self._ends[-1]) if len(self._ends) else 0
+        ends = start + np.cumsum([len(value) for value in values], dtype=np.uint64)
+        with open(self.data_path, "ab") as f:
+            f.write(b"".join(values))
+        with open(self.offsets_path, "ab") as f:
+            f.write(ends.astype("<u8").tobytes())
+    
+    def remap(self):
+        """Map the current files, e.g. after values were appended."""
+        self._data = self._map(self.data_path)
+        self._ends = np.frombuffer(self._map(self.offsets_path), dtype="<u8")
+    
+    @staticmethod
+    def _map(path: Path) -> memoryview:
+        """
+        Map a file read-only.
+        
+        :param path: Path of the file
+        :return: View of the mapped file, empty for an empty file
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    
+    def get_many(self, rows: np.ndarray) -> List[memoryview]:
+        """
+        Get values without copying them.
+        
+        :param rows: Positions of the values
+        :return: Views of the values in the mapped data file
+        """
+        ends = self._ends[rows]
+        starts = np.where(rows > 0, self._ends[np.maximum(rows - 1, 0)], 0)
+        data = self._data
+        return [data[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+    
+    def sync(self):
+        """Flush the column files to disk."""
+        for file_path in [self.data_path, self.offsets_path]:
+            with open(file_path, "rb+") as f:
+                os.fsync(f.fileno())
+
+
+class ChunkStore:
+    """
+    Append-only columnar store of chunks (id, content and meta data), addressed by row.
+    
+    Each column is a pair of files in `path`, read through memory maps: fetching a chunk by row is two offset
+    lookups and a slice of the mapped file, with no query to plan and no rows to copy before decoding. The row of
+    each id is kept in a dict built when the store is opened.
+    
+    Appended rows are readable at once but become durable only with `commit`, which flushes the columns and then
+    atomically replaces the count file; rows written after the last commit are dropped when the store is opened
+    again. Rows are never updated in place: deleting a chunk appends its row to a file of deleted rows, and the
+    row keeps its position.
+    
+    :param path: Directory of the column files
+    """
+    
+    COLUMNS = ("ids", "content", "meta")
+    
+    def __init__(self, path: str):
+        """
+        Open the store, creating it if it doesn't exist, and drop rows written after the last commit.
+        
+        :param path: Directory of the column files
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._count_path = self.path / "count.json"
+        self._deleted_path = self.path / "deleted.rows"
+        self._columns = {name: _Column(self.path / name) for name in self.COLUMNS}
+        
+        counts = {"count": 0, "deleted": 0}
+        if self._count_path.exists():
+            with open(self._count_path, "r") as f:
+                counts.update(json.load(f))
+        for column in self._columns.values():
+            column.truncate(counts["count"])
+        self._deleted_path.touch()
+        os.truncate(self._deleted_path, counts["deleted"] * 8)
+        self._deleted = np.fromfile(self._deleted_path, dtype="<u8").astype(np.int64)
+        self._num_rows = self._committed = counts["count"]
+        self._committed_deleted = counts["deleted"]
+        
+        ids = self._columns["ids"].get_many(np.arange(self._num_rows))
+        self._rows: Dict[str, int] = {str(document_id, "utf-8"): row for row, document_id in enumerate(ids)}
+        for row in self._deleted.tolist():
+            del self._rows[str(ids[row], "utf-8")]
+    
+    def __len__(self) -> int:
+        """Number of chunks, without deleted ones."""
+        return len(self._rows)
+    
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self._rows
+    
+    @property
+    def num_rows(self) -> int:
+        """Number of rows, including the rows of deleted chunks."""
+        return self._num_rows
+    
+    @property
+    def deleted_rows(self) -> np.ndarray:
+        """Rows of deleted chunks, in the order they were deleted."""
+        return self._deleted
+    
+    def append(self, ids: List[str], contents: List[str], metas: List[dict]):
+        """
+        Append chunks as new rows.
+        
+        :param ids: Unique ids of the chunks, not yet stored
+        :param contents: Texts of the chunks
+        :param metas: Meta data of the chunks, serialized as JSON
+        :raises ValueError: If an id is already stored
+        """
+        if len(set(ids)) != len(ids) or any(document_id in self._rows for document_id in ids):
+            raise ValueError("Chunk ids must be unique and not yet stored")
+        
+        values = {"ids": [document_id.encode("utf-8") for document_id in ids],
+                  "content": [content.encode("utf-8") for content in contents],
+                  "meta": [json.dumps(meta, default=str).encode("utf-8") for meta in metas]}
+        for name, column in self._columns.items():
+            column.append(values[name])
+            column.remap()
+        for row, document_id in enumerate(ids, self._num_rows):
+            self._rows[document_id] = row
+        self._num_rows += len(ids)
+    
+    def delete(self, ids: List[str]) -> List[int]:
+        """
+        Delete chunks; their rows stay in place.
+        
+        :param ids: Ids of the chunks, ids that are not stored are ignored
+        :return: Rows of the deleted chunks
+        """
+        rows = [self._rows.pop(document_id) for document_id in dict.fromkeys(ids) if document_id in self._rows]
+        if rows:
+            with open(self._deleted_path, "ab") as f:
+                f.write(np.asarray(rows, dtype="<u8").tobytes())
+            self._deleted = np.concatenate([self._deleted, np.asarray(rows, dtype=np.int64)])
+        return rows
+    
+    def commit(self):
+        """Make the appended and deleted rows durable."""
+        for column in self._columns.values():
+            column.sync()
+        with open(self._deleted_path, "rb+") as f:
+            os.fsync(f.fileno())
+        tmp_path = self._count_path.with_name(self._count_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"count": self._num_rows, "deleted": len(self._deleted)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._count_path)
+        self._committed, self._committed_deleted = self._num_rows, len(self._deleted)
+    
+    def clear(self):
+        """Drop all rows."""
+        self._rows.clear()
+        self._num_rows = 0
+        self._deleted = np.zeros(0, dtype=np.int64)
+        # commit the empty store first, so that the committed counts never exceed the rows in the files
+        self.commit()
+        for column in self._columns.values():
+            column.truncate(0)
+        os.truncate(self._deleted_path, 0)
+    
+    def get_row(self, document_id: str) -> Optional[int]:
+        """
+        Get the row of a chunk.
+        
+        :param document_id: Id of the chunk
+        :return: Row, None if the id is not stored or deleted
+        """
+        return self._rows.get(document_id)
+    
+    def get_many(self, rows: List[int]) -> List[Tuple[str, str, dict]]:
+        """
+        Read chunks, also deleted ones.
+        
+        :param rows: Rows of the chunks
+        :return: Id, text and meta data of each chunk, in the order of rows
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) and (rows.min() < 0 or rows.max() >= self._num_rows):
+            raise IndexError(f"Rows must be between 0 and {self._num_rows - 1}")
+        ids, contents, metas = (self._columns[name].get_many(rows) for name in self.COLUMNS)
+        return [(str(document_id, "utf-8"), str(content, "utf-8"), json.loads(str(meta, "utf-8")))
+                for document_id, content, meta in zip(ids, contents, metas)]
+
+
+class ColumnarDocumentStore(FAISSDocumentStore):
+    """
+    FAISS document store keeping the chunks in a ChunkStore instead of an SQL database.
+    
+    Row i of the chunk store holds the chunk of FAISS vector id i, so retrieved vector ids are hydrated by direct
+    row lookups, in rank order. Chunks are only appended; rows without a vector yet are the rows past the vectors
+    of the FAISS index, which update_embeddings embeds. Deleted chunks keep their row and their vector, which
+    `tombstones` excludes from searches.
+    
+    `save` commits the chunk store before writing the FAISS index, so that a saved index never references chunks
+    that were not saved; chunks of an interrupted write that reached the chunk store but not the index are dropped
+    (if uncommitted) or re-embedded (if committed) when the store is loaded again.
+    
+    :param chunk_store_path: Directory of the chunk store
+    :param embedding_dim: Dimension of the embeddings
+    :param faiss_index_factory_str: FAISS index factory string of the index
+    :param faiss_index: FAISS index, created from faiss_index_factory_str if None
+    :param return_embedding: Flag to return the stored vectors of retrieved documents
+    :param similarity: "dot_product", "cosine" or "l2"
+    :param index: Name of the index
+    :param duplicate_documents: Handling of documents whose id is stored, "skip" or "fail"
+    :param progress_bar: Flag to show progress bars
+    :param batch_size: Number of documents embedded at once by update_embeddings
+    """
+    
+    def __init__(self,
+                 chunk_store_path: str,
+                 embedding_dim: int = 768,
+                 faiss_index_factory_str: str = "Flat",
+                 faiss_index: Optional[faiss.Index] = None,
+                 return_embedding: bool = False,
+                 similarity: str = "dot_product",
+                 index: str = "document",
+                 duplicate_documents: str = "skip",
+                 progress_bar: bool = True,
+                 batch_size: int = 10_000):
+        """
+        Initialize the store and open its chunk store.
+        
+        :param chunk_store_path: Directory of the chunk store, created if it doesn't exist
+        :param embedding_dim: Dimension of the embeddings
+        :param faiss_index_factory_str: FAISS index factory string of the index
+        :param faiss_index: FAISS index, created from faiss_index_factory_str if None
+        :param return_embedding: Flag to return the stored vectors of retrieved documents
+        :param similarity: "dot_product", "cosine" or "l2"
+        :param index: Name of the index
+        :param duplicate_documents: Handling of documents whose id is stored, "skip" or "fail"
+        :param progress_bar: Flag to show progress bars
+        :param batch_size: Number of documents embedded at once by update_embeddings
+        """
+        if similarity not in ("dot_product", "cosine", "l2"):
+            raise ValueError("similarity must be one of dot_product, cosine and l2")
+        if duplicate_documents not in ("skip", "fail"):
+            raise ValueError("duplicate_documents must be skip or fail, chunks are never overwritten")
+        BaseDocumentStore.__init__(self)
+        
+        self.similarity = similarity
+        self.metric_type = faiss.METRIC_L2 if similarity == "l2" else faiss.METRIC_INNER_PRODUCT
+        self.embedding_dim = embedding_dim
+        self.faiss_index_factory_str = faiss_index_factory_str
+        self.faiss_indexes: Dict[str, faiss.Index] = {
+            index: faiss_index or faiss.index_factory(embedding_dim, faiss_index_factory_str, self.metric_type)
+        }
+        self.return_embedding = return_embedding
+        self.embedding_field = "embedding"
+        self.batch_size = batch_size
+        self.progress_bar = progress_bar
+        self.index = index
+        self.duplicate_documents = duplicate_documents
+        self.chunks = ChunkStore(chunk_store_path)
+        # deleted rows keep their vectors, see VectorTombstones
+        self.tombstones = VectorTombstones(self.chunks.deleted_rows)
+    
+    def write_documents(self, documents: List[Document], index: Optional[str] = None,
+                        batch_size: Optional[int] = None, duplicate_documents: Optional[str] = None,
+                        headers: Optional[Dict[str, str]] = None):
+        """
+        Append documents, and their embeddings to the FAISS index if they have ones.
+        
+        :param documents: Documents, either all with or all without embedding
+        :param index: Name of the index, defaults to self.index
+        :param batch_size: Unused, documents are appended at once
+        :param duplicate_documents: "skip" to ignore documents whose id is stored, "fail" to raise
+        :param headers: Unsupported
+        :raises ValueError: If some but not all documents have an embedding, if embedded documents would follow
+                            chunks without vector, or if a stored id is written with duplicate_documents="fail"
+        """
+        if headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support headers.")
+        index = index or self.index
+        duplicate_documents = duplicate_documents or self.duplicate_documents
+        
+        unique_docs = list({doc.id: doc for doc in documents}.values())
+        new_docs = [doc for doc in unique_docs if doc.id not in self.chunks]
+        if duplicate_documents == "fail" and len(new_docs) < len(documents):
+            raise ValueError("Documents with the same id are already stored")
+        if not new_docs:
+            return
+        
+        with_embedding = [doc.embedding is not None for doc in new_docs]
+        if any(with_embedding):
+            if not all(with_embedding):
+                raise ValueError("Either all or none of the documents must have an embedding")
+            faiss_index = self.faiss_indexes[index]
+            if faiss_index.ntotal != self.chunks.num_rows:
+                raise ValueError("Embedded documents can't be written before the stored chunks without vector are "
+                                 "embedded, call update_embeddings first")
+            vectors = np.ascontiguousarray(np.stack([doc.embedding for doc in new_docs]), dtype=np.float32)
+            if self.similarity == "cosine":
+                self.normalize_embedding(vectors)
+            faiss_index.add(vectors)
+        self.append_documents(new_docs)
+    
+    def append_documents(self, documents: List[Document]):
+        """
+        Append documents to the chunk store only, e.g. after their vectors were added to the FAISS index.
+        
+        :param documents: New documents, in the order of their vector ids
+        """
+        metas = []
+        for doc in documents:
+            meta = dict(doc.meta)
+            # the vector id is the row, so it is not stored
+            meta.pop("vector_id", None)
+            metas.append(meta)
+        with METRICS.stage("chunk_append", items=len(documents)):
+            self.chunks.append([doc.id for doc in documents], [doc.content for doc in documents], metas)
+    
+    def update_embeddings(self, retriever, index: Optional[str] = None, update_existing_embeddings: bool = True,
+                          filters=None, batch_size: Optional[int] = None):
+        """
+        Embed the stored chunks and add their vectors to the FAISS index.
+        
+        :param retriever: Retriever embedding the chunks
+        :param index: Name of the index, defaults to self.index
+        :param update_existing_embeddings: Flag to re-embed all chunks, otherwise only the chunks without vector
+        :param filters: Unsupported
+        :param batch_size: Number of chunks embedded at once, defaults to self.batch_size
+        :raises ValueError: If the FAISS index is not trained
+        """
+        if filters:
+            raise NotImplementedError("ColumnarDocumentStore does not support filters.")
+        index = index or self.index
+        batch_size = batch_size or self.batch_size
+        faiss_index = self.faiss_indexes[index]
+        if not faiss_index.is_trained:
+            raise ValueError(f"FAISS index of type {self.faiss_index_factory_str} must be trained before adding "
+                             "vectors")
+        
+        if update_existing_embeddings:
+            faiss_index.reset()
+        for start in range(faiss_index.ntotal, self.chunks.num_rows, batch_size):
+            rows = np.arange(start, min(start + batch_size, self.chunks.num_rows))
+            # deleted rows get a zero vector that keeps the positions of the following rows
+            live = ~np.isin(rows, self.tombstones.ids)
+            embeddings = np.zeros((len(rows), self.embedding_dim), dtype=np.float32)
+            if live.any():
+                documents = self._get_documents(rows[live].tolist(), index, return_embedding=False)
+                live_embeddings = np.ascontiguousarray(retriever.embed_documents(documents), dtype=np.float32)
+                self._validate_embeddings_shape(embeddings=live_embeddings, num_documents=len(documents),
+                                                embedding_dim=self.embedding_dim)
+                if self.similarity == "cosine":
+                    self.normalize_embedding(live_embeddings)
+                embeddings[live] = live_embeddings
+            faiss_index.add(embeddings)
+    
+    def get_document_count(self, filters=None, index: Optional[str] = None,
+                           only_documents_without_embedding: bool = False,
+                           headers: Optional[Dict[str, str]] = None) -> int:
+        """
+        Count the stored chunks.
+        
+        :param filters: Unsupported
+        :param index: Name of the index, defaults to self.index
+        :param only_documents_without_embedding: Flag to count only the chunks without vector
+        :param headers: Unsupported
+        :return: Number of chunks, without deleted ones
+        """
+        if filters or headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support filters and headers.")
+        if only_documents_without_embedding:
+            vector_count = self.faiss_indexes[index or self.index].ntotal
+            deleted_count = int(np.count_nonzero(self.tombstones.ids >= vector_count))
+            return max(0, self.chunks.num_rows - vector_count - deleted_count)
+        return len(self.chunks)
+    
+    def get_documents_by_id(self, ids: List[str], index: Optional[str] = None, batch_size: Optional[int] = None,
+                            headers: Optional[Dict[str, str]] = None) -> List[Document]:
+        """
+        Fetch chunks by id.
+        
+        :param ids: Ids of the chunks
+        :param index: Name of the index, defaults to self.index
+        :param batch_size: Unused
+        :param headers: Unsupported
+        :return: Stored chunks, in the order of ids; ids that are not stored are skipped
+        """
+        if headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support headers.")
+        rows = [self.chunks.get_row(document_id) for document_id in ids]
+        return self._get_documents([row for row in rows if row is not None], index or self.index)
+    
+    def get_document_by_id(self, id: str, index: Optional[str] = None,
+                           headers: Optional[Dict[str, str]] = None) -> Optional[Document]:
+        """
+        Fetch a chunk by id.
+        
+        :param id: Id of the chunk
+        :param index: Name of the index, defaults to self.index
+        :param headers: Unsupported
+        :return: Stored chunk, None if the id is not stored
+        """
+        documents = self.get_documents_by_id([id], index=index, headers=headers)
+        return documents[0] if documents else None
+    
+    def get_documents_by_vector_ids(self, vector_ids: List[str], index: Optional[str] = None,
+                                    batch_size: Optional[int] = None,
+                                    headers: Optional[Dict[str, str]] = None) -> List[Document]:
+        """
+        Fetch chunks by the ids of their vectors.
+        
+        :param vector_ids: FAISS vector ids
+        :param index: Name of the index, defaults to self.index
+        :param batch_size: Unused
+        :param headers: Unsupported
+        :return: Chunks, in the order of vector_ids; vector ids of deleted chunks are skipped
+        """
+        if headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support headers.")
+        rows = np.asarray([int(vector_id) for vector_id in vector_ids], dtype=np.int64)
+        rows = rows[~np.isin(rows, self.tombstones.ids)]
+        # the embedding is set by query_by_embedding, if requested
+        return self._get_documents(rows.tolist(), index or self.index, return_embedding=False)
+    
+    def get_all_documents(self, index: Optional[str] = None, filters=None, return_embedding: Optional[bool] = None,
+                          batch_size: Optional[int] = None,
+                          headers: Optional[Dict[str, str]] = None) -> List[Document]:
+        """
+        Fetch all chunks.
+        
+        :param index: Name of the index, defaults to self.index
+        :param filters: Unsupported
+        :param return_embedding: Flag to set the stored vectors, defaults to self.return_embedding
+        :param batch_size: Unused
+        :param headers: Unsupported
+        :return: Chunks, in the order they were written
+        """
+        return list(self.get_all_documents_generator(index=index, filters=filters, return_embedding=return_embedding,
+                                                     headers=headers))
+    
+    def get_all_documents_generator(self, index: Optional[str] = None, filters=None,
+                                    return_embedding: Optional[bool] = None, batch_size: Optional[int] = None,
+                                    headers: Optional[Dict[str, str]] = None) -> Generator[Document, None, None]:
+        """
+        Iterate over all chunks.
+        
+        :param index: Name of the index, defaults to self.index
+        :param filters: Unsupported
+        :param return_embedding: Flag to set the stored vectors, defaults to self.return_embedding
+        :param batch_size: Number of chunks read at once, defaults to self.batch_size
+        :param headers: Unsupported
+        :return: Generator of the chunks, in the order they were written
+        """
+        if filters or headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support filters and headers.")
+        batch_size = batch_size or self.batch_size
+        for start in range(0, self.chunks.num_rows, batch_size):
+            rows = np.arange(start, min(start + batch_size, self.chunks.num_rows))
+            rows = rows[~np.isin(rows, self.tombstones.ids)]
+            yield from self._get_documents(rows.tolist(), index or self.index, return_embedding=return_embedding)
+    
+    def delete_documents(self, index: Optional[str] = None, ids: Optional[List[str]] = None, filters=None,
+                         headers: Optional[Dict[str, str]] = None):
+        """
+        Delete chunks, or all chunks and vectors.
+        
+        The vectors of deleted chunks stay in the FAISS index and are added to `tombstones`; like the chunks, the
+        deletion becomes durable with `save`.
+        
+        :param index: Name of the index, defaults to self.index
+        :param ids: Ids of the chunks to delete, None to delete all chunks and vectors
+        :param filters: Unsupported
+        :param headers: Unsupported
+        """
+        if filters or headers:
+            raise NotImplementedError("ColumnarDocumentStore does not support filters and headers.")
+        if ids is not None:
+            self.tombstones.add(self.chunks.delete(ids))
+            return
+        self.faiss_indexes[index or self.index].reset()
+        self.chunks.clear()
+        self.tombstones = VectorTombstones()
+    
+    def delete_all_documents(self, index: Optional[str] = None, filters=None,
+                             headers: Optional[Dict[str, str]] = None):
+        """
+        Delete all chunks and vectors.
+        
+        :param index: Name of the index, defaults to self.index
+        :param filters: Unsupported
+        :param headers: Unsupported
+        """
+        self.delete_documents(index=index, filters=filters, headers=headers)
+    
+    def save(self, index_path, config_path=None):
+        """
+        Commit the chunk store, then save the FAISS index and the configuration of the store.
+        
+        :param index_path: Path of the FAISS index file
+        :param config_path: Path of the configuration file, defaults to index_path with suffix .json
+        """
+        with METRICS.stage("chunk_commit"):
+            self.chunks.commit()
+        super().save(index_path, config_path=config_path)
+    
+    def _get_documents(self, rows, index: str, return_embedding: Optional[bool] = None) -> List[Document]:
+        """
+        Build the documents of rows.
+        
+        :param rows: Rows of the chunks, equal to their vector ids
+        :param index: Name of the index
+        :param return_embedding: Flag to set the stored vectors, defaults to self.return_embedding
+        :return: Documents with meta data field vector_id, if the chunk has a vector
+        """
+        faiss_index = self.faiss_indexes[index]
+        vector_count = faiss_index.ntotal
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+        
+        documents = []
+        for row, (document_id, content, meta) in zip(rows, self.chunks.get_many(rows)):
+            embedding = None
+            if row < vector_count:
+                meta["vector_id"] = str(row)
+                if return_embedding:
+                    embedding = faiss_index.reconstruct(row)
+            documents.append(Document(content=content, id=document_id, meta=meta, embedding=embedding))
+        return documents
@@ -0,0 +1,163 @@
+"""src.pipeline.chunk_store_evaluation.py -- Write throughput and hydration latency of the SQLite and columnar stores.
+
+Usage:
+    python -m src.pipeline.chunk_store_evaluation --num_chunks 100000 --top_k 10 100 1000
+    python -m src.pipeline.chunk_store_evaluation --doc_dir data/documents --work_dir /tmp/chunk_stores"""
+
+import argparse
+import copy
+import json
+import logging
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+from haystack.document_stores import FAISSDocumentStore, SQLDocumentStore
+from haystack.schema import Document
+
+from src.pipeline.chunk_store import ColumnarDocumentStore
+from src.pipeline.document_store import CHUNK_STORES
+from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.retrieval_evaluation import make_keyword_corpus
+
+
+def create_store(chunk_store: str, work_dir: Path, embedding_dim: int) -> FAISSDocumentStore:
+    """
+    Create an empty store with a flat index.
+    
+    :param chunk_store: One of CHUNK_STORES
+    :param work_dir: Directory of the store files
+    :param embedding_dim: Dimension of the vectors
+    :return: Document store
+    """
+    params = {"embedding_dim": embedding_dim, "faiss_index": faiss.IndexFlatIP(embedding_dim),
+              "duplicate_documents": "skip", "progress_bar": False}
+    if chunk_store == "columnar":
+        return ColumnarDocumentStore(chunk_store_path=str(work_dir / "store.chunks"), **params)
+    return FAISSDocumentStore(sql_url=f"sqlite:///{work_dir / 'store.db'}", validate_index_sync=False, **params)
+
+
+def write_chunks(store: FAISSDocumentStore, documents: List[Document], vectors: np.ndarray):
+    """
+    Write a batch of chunks the way DocumentStoreManager does: vectors to FAISS, then the chunks.
+    
+    :param store: Document store
+    :param documents: Chunks
+    :param vectors: Vectors of the chunks
+    """
+    faiss_index = store.faiss_indexes[store.index]
+    rows = []
+    for vector_id, doc in enumerate(documents, faiss_index.ntotal):
+        row = copy.copy(doc)
+        row.meta = {**doc.meta, "vector_id": vector_id}
+        rows.append(row)
+    faiss_index.add(vectors)
+    if isinstance(store, ColumnarDocumentStore):
+        store.append_documents(rows)
+    else:
+        SQLDocumentStore.write_documents(store, rows)
+
+
+def compare_chunk_stores(documents: List[Document],
+                         top_k_values: Optional[List[int]] = None,
+                         num_queries: int = 50,
+                         batch_size: int = 1000,
+                         chunk_stores: Optional[List[str]] = None,
+                         work_dir: Optional[str] = None,
+                         embedding_dim: int = 64) -> List[Dict]:
+    """
+    Measure how fast each chunk store writes chunks and fetches the chunks of retrieved vector ids.
+    
+    Vectors are random, as only the chunk stores are compared: the write throughput includes adding the vectors
+    to a flat index and saving the store, the hydration latency is the time of get_documents_by_vector_ids for
+    top_k random vector ids (what query_by_embedding does after the FAISS search).
+    
+    :param documents: Chunks to write
+    :param top_k_values: Numbers of retrieved chunks to hydrate per query
+    :param num_queries: Number of hydrations per top_k value
+    :param batch_size: Number of chunks written at once
+    :param chunk_stores: Stores to compare, defaults to all CHUNK_STORES
+    :param work_dir: Directory of the store files, a temporary directory if None
+    :param embedding_dim: Dimension of the random vectors
+    :return: One result per store with write throughput, reopen time and hydration latency per top_k
+    """
+    top_k_values = top_k_values or [10, 100, 1000]
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((len(documents), embedding_dim)).astype(np.float32)
+    queries = {top_k: [rng.choice(len(documents), min(top_k, len(documents)), replace=False)
+                       for _ in range(num_queries)] for top_k in top_k_values}
+    
+    results = []
+    root = Path(work_dir or tempfile.mkdtemp(prefix="chunk_stores_"))
+    try:
+        for chunk_store in chunk_stores or CHUNK_STORES:
+            store_dir = root / chunk_store
+            shutil.rmtree(store_dir, ignore_errors=True)
+            store_dir.mkdir(parents=True)
+            
+            store = create_store(chunk_store, store_dir, embedding_dim)
+            start = time.perf_counter()
+            for batch_start in range(0, len(documents), batch_size):
+                batch_end = batch_start + batch_size
+                write_chunks(store, documents[batch_start:batch_end], vectors[batch_start:batch_end])
+            store.save(store_dir / "store.faiss")
+            write_seconds = time.perf_counter() - start
+            
+            # reopening rebuilds the id lookup of the columnar store
+            start = time.perf_counter()
+            store = create_store(chunk_store, store_dir, embedding_dim)
+            store.faiss_indexes[store.index] = faiss.read_index(str(store_dir / "store.faiss"))
+            open_seconds = time.perf_counter() - start
+            
+            result = {"chunk_store": chunk_store, "chunks": len(documents),
+                      "chunks_per_second": len(documents) / write_seconds, "open_seconds": open_seconds}
+            for top_k, samples in queries.items():
+                latencies = []
+                for vector_ids in samples:
+                    start = time.perf_counter()
+                    fetched = store.get_documents_by_vector_ids([str(vector_id) for vector_id in vector_ids])
+                    latencies.append(time.perf_counter() - start)
+                    assert len(fetched) == len(vector_ids), f"{chunk_store} lost chunks"
+                result[f"hydration_ms@{top_k}"] = 1000 * float(np.median(latencies))
+            results.append(result)
+    finally:
+        if work_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    baseline = results[0]
+    for result in results:
+        result["write_speedup"] = result["chunks_per_second"] / baseline["chunks_per_second"]
+        for top_k in top_k_values:
+            result[f"hydration_speedup@{top_k}"] = baseline[f"hydration_ms@{top_k}"] / result[f"hydration_ms@{top_k}"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare write throughput and hydration latency of chunk stores")
+    parser.add_argument("--doc_dir", help="Directory whose chunks are written; synthetic notes if omitted")
+    parser.add_argument("--num_chunks", type=int, default=50_000, help="Number of synthetic chunks")
+    parser.add_argument("--top_k", type=int, nargs="+", default=[10, 100, 1000], help="Retrieved chunks per query")
+    parser.add_argument("--num_queries", type=int, default=50, help="Number of hydrations per top_k")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Number of chunks written at once")
+    parser.add_argument("--chunk_stores", nargs="+", choices=CHUNK_STORES, help="Chunk stores to compare")
+    parser.add_argument("--work_dir", help="Directory of the store files, a temporary directory if omitted")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.doc_dir:
+        documents = preprocess_documents(load_documents(args.doc_dir))
+    else:
+        documents, _ = make_keyword_corpus(args.num_chunks, 0)
+    
+    results = compare_chunk_stores(documents, top_k_values=args.top_k, num_queries=args.num_queries,
+                                   batch_size=args.batch_size, chunk_stores=args.chunk_stores,
+                                   work_dir=args.work_dir)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
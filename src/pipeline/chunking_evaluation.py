@@ -0,0 +1,111 @@
+"""src.pipeline.chunking_evaluation.py -- Chunking speed and truncation rate of the PreProcessor and TokenChunker.
+
+Usage:
+    python -m src.pipeline.chunking_evaluation --num_chunks 5000
+    python -m src.pipeline.chunking_evaluation --doc_dir data/documents --chunk_tokens 256 --overlap_tokens 0"""
+
+import argparse
+import json
+import logging
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from haystack.schema import Document
+
+from src.pipeline.benchmark import DEFAULT_EMBEDDING_MODEL, write_corpus
+from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.options import CHUNKERS
+from src.pipeline.token_chunker import TokenChunker
+
+
+def compare_chunkers(documents: List[Document],
+                     embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                     chunk_tokens: Optional[int] = None,
+                     overlap_tokens: int = 32,
+                     max_seq_len: int = 512,
+                     chunkers: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Measure how fast each chunker splits documents and how many of its chunks the embedding model truncates.
+    
+    A chunk is truncated if it has more tokens of the embedding model, including special tokens, than the window
+    of the model (the smaller of the tokenizer limit and `max_seq_len`); the text beyond the window is not
+    embedded. Both chunkers run once on the first document before they are timed, so loading the tokenizer and
+    the sentence splitter is not measured.
+    
+    :param documents: Documents to split
+    :param embedding_model: Name or path of the embedding model whose tokenizer counts the tokens
+    :param chunk_tokens: Maximum number of tokens per chunk of the TokenChunker, defaults to the window
+    :param overlap_tokens: Maximum number of tokens shared by consecutive chunks of the TokenChunker
+    :param max_seq_len: Maximum sequence length of the retriever
+    :param chunkers: Chunkers to compare, defaults to all CHUNKERS
+    :return: One result per chunker with chunks per second, token counts and truncation rate
+    """
+    token_chunker = TokenChunker(embedding_model, max_tokens=chunk_tokens, overlap_tokens=overlap_tokens,
+                                 max_seq_len=max_seq_len)
+    
+    results = []
+    for name in chunkers or CHUNKERS:
+        chunker = token_chunker if name == "token" else None
+        preprocess_documents(documents[:1], chunker=chunker)
+        start = time.perf_counter()
+        chunks = preprocess_documents(documents, chunker=chunker)
+        seconds = time.perf_counter() - start
+        
+        counts = token_chunker.count_tokens([chunk.content for chunk in chunks])
+        truncated = counts > token_chunker.window
+        results.append({
+            "chunker": name,
+            "chunks": len(chunks),
+            "seconds": seconds,
+            "chunks_per_second": len(chunks) / seconds,
+            "mean_tokens": float(counts.mean()) if len(counts) else 0.0,
+            "max_tokens": int(counts.max()) if len(counts) else 0,
+            "window": token_chunker.window,
+            "truncated_chunks": int(truncated.sum()),
+            "truncation_rate": float(truncated.mean()) if len(counts) else 0.0,
+            # share of the tokens of all chunks that are cut off at embedding time
+            "truncated_token_rate": float(np.maximum(counts - token_chunker.window, 0).sum() / max(1, counts.sum())),
+        })
+    
+    baseline = results[0]
+    for result in results:
+        result["speedup"] = result["chunks_per_second"] / baseline["chunks_per_second"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunking throughput and truncation rate of the chunkers")
+    parser.add_argument("--doc_dir", help="Directory of the documents to split; a synthetic corpus if omitted")
+    parser.add_argument("--num_chunks", type=int, default=5000,
+                        help="Size of the synthetic corpus in PreProcessor chunks")
+    parser.add_argument("--embedding_model", default=DEFAULT_EMBEDDING_MODEL,
+                        help="Embedding model whose tokenizer splits and counts the tokens")
+    parser.add_argument("--chunk_tokens", type=int, help="Maximum number of tokens per chunk of the token chunker")
+    parser.add_argument("--overlap_tokens", type=int, default=32,
+                        help="Maximum number of tokens shared by consecutive chunks of the token chunker")
+    parser.add_argument("--max_seq_len", type=int, default=512, help="Maximum sequence length of the retriever")
+    parser.add_argument("--chunkers", nargs="+", choices=CHUNKERS, help="Chunkers to compare")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.doc_dir:
+        documents = load_documents(args.doc_dir)
+    else:
+        doc_dir = tempfile.mkdtemp(prefix="chunking_")
+        try:
+            write_corpus(doc_dir, args.num_chunks)
+            documents = load_documents(doc_dir)
+        finally:
+            shutil.rmtree(doc_dir, ignore_errors=True)
+    
+    results = compare_chunkers(documents, embedding_model=args.embedding_model, chunk_tokens=args.chunk_tokens,
+                               overlap_tokens=args.overlap_tokens, max_seq_len=args.max_seq_len,
+                               chunkers=args.chunkers)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
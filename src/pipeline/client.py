@@ -0,0 +1,241 @@
+"""src.pipeline.client.py -- Client of the query server (see src.pipeline.server).
+
+Uses the standard library only, so that command line runs can hand their queries to a running server without
+loading Haystack, the embedding model or the index.
+"""
+
+import http.client
+import json
+import socket
+from typing import Iterator, List, Optional
+from urllib.parse import urlsplit
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class ServerError(Exception):
+    """Raised when the server answers a request with an error."""
+    
+    def __init__(self, status: int, message: str):
+        """
+        Initialize the error.
+        
+        :param status: HTTP status code of the response, 0 for errors reported while streaming
+        :param message: Error message of the server
+        """
+        super().__init__(f"Server error {status}: {message}" if status else f"Server error: {message}")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    
+    :param socket_path: Path of the Unix socket
+    :param timeout: Socket timeout in seconds, None to block
+    """
+    
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        """
+        Initialize an unconnected connection.
+        
+        :param socket_path: Path of the Unix socket
+        :param timeout: Socket timeout in seconds, None to block
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+    
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def server_url(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: Optional[str] = None) -> str:
+    """
+    Build the URL of a server.
+    
+    :param host: Host of the server
+    :param port: Port of the server
+    :param socket_path: Path of the Unix socket of the server, replaces host and port
+    :return: URL of the form http://host:port or unix:///path/to/socket
+    """
+    return f"unix://{socket_path}" if socket_path else f"http://{host}:{port}"
+
+
+class PipelineClient:
+    """
+    Sends queries and ingestion requests to a query server.
+    
+    :param url: URL of the server, http://host:port or unix:///path/to/socket, defaults to server_url()
+    :param timeout: Timeout of a request in seconds, None to wait for slow requests such as ingestion
+    """
+    
+    def __init__(self, url: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        Initialize the client; no connection is opened until the first request.
+        
+        :param url: URL of the server, defaults to the default host and port
+        :param timeout: Timeout of a request in seconds, None to wait indefinitely
+        """
+        url = url or server_url()
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "unix"):
+            raise ValueError(f"Unsupported server URL {url}, use http://host:port or unix:///path/to/socket")
+        self.url = url
+        self.timeout = timeout
+        self._parts = parts
+    
+    def is_running(self, timeout: float = 0.5) -> bool:
+        """
+        Check whether the server is up.
+        
+        :param timeout: Seconds to wait for the answer
+        :return: True if the server answered the health check
+        """
+        try:
+            self._request("GET", "/health", timeout=timeout)
+        except (OSError, http.client.HTTPException, ServerError, ValueError):
+            return False
+        return True
+    
+    def health(self) -> dict:
+        """
+        Get the status of the server.
+        
+        :return: Dict with the status, the number of stored chunks, the uptime in seconds and the reload count
+        """
+        return self._request("GET", "/health")
+    
+    def query(self, query: str, params: Optional[dict] = None) -> dict:
+        """
+        Answer a query.
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :return: Dict with the query and its "answer", "sources", "prompt_tokens" and "timings"
+        """
+        return self._request("POST", "/query", {"query": query, "params": params})
+    
+    def stream(self, query: str, params: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Answer a query, yielding the retrieved sources and the answer tokens as they arrive.
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :return: Iterator of events: "documents" with the "sources", "token" per answer token and "done" with the
+                 "result" of query
+        :raises ServerError: If the query fails while streaming
+        """
+        connection = self._connect(self.timeout)
+        try:
+            response = self._send(connection, "POST", "/query", {"query": query, "params": params, "stream": True})
+            for line in response:
+                event = json.loads(line)
+                if event["event"] == "error":
+                    raise ServerError(0, event["error"])
+                yield event
+        finally:
+            connection.close()
+    
+    def query_batch(self, queries: List[str], params: Optional[dict] = None, max_concurrency: int = 4) -> List[dict]:
+        """
+        Answer many queries, see QueryPipeline.run_batch.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :param max_concurrency: Maximum number of concurrent LLM calls
+        :return: Results in the format of query, or with the "error" of a failed query, in the order of the queries
+        """
+        body = {"queries": queries, "params": params, "max_concurrency": max_concurrency}
+        return self._request("POST", "/query_batch", body)["results"]
+    
+    def ingest(self, doc_dir: str, batch_size: int = 1000, num_workers: int = 1, sync: bool = False) -> dict:
+        """
+        Ingest the documents of a directory the server can read.
+        
+        :param doc_dir: Path to the directory containing documents, relative paths are resolved by the server
+        :param batch_size: Number of chunks embedded and written at once
+        :param num_workers: Number of worker processes for document conversion and chunking
+        :param sync: Flag to process only added and changed files and delete the chunks of changed and removed files
+        :return: Dictionary with file and chunk counts of the run
+        """
+        return self._request("POST", "/ingest", {"doc_dir": doc_dir, "batch_size": batch_size,
+                                                 "num_workers": num_workers, "sync": sync})
+    
+    def reload(self) -> dict:
+        """
+        Make the server reopen the document store, e.g. after another process changed it.
+        
+        :return: Status of the server, see health
+        """
+        return self._request("POST", "/reload", {})
+    
+    def metrics(self, prometheus: bool = False) -> str:
+        """
+        Get the per-stage metrics of the server.
+        
+        :param prometheus: Flag to get the Prometheus text format instead of JSON
+        :return: Metrics text
+        """
+        connection = self._connect(self.timeout)
+        try:
+            response = self._send(connection, "GET", "/metrics" if prometheus else "/metrics.json")
+            return response.read().decode("utf-8")
+        finally:
+            connection.close()
+    
+    def _request(self, method: str, path: str, body: Optional[dict] = None, timeout: Optional[float] = None) -> dict:
+        """
+        Send a request and decode the JSON response.
+        
+        :param method: HTTP method
+        :param path: Path of the endpoint
+        :param body: Optional JSON body
+        :param timeout: Timeout in seconds, defaults to the timeout of the client
+        :return: Decoded response
+        """
+        connection = self._connect(timeout if timeout is not None else self.timeout)
+        try:
+            return json.loads(self._send(connection, method, path, body).read())
+        finally:
+            connection.close()
+    
+    def _connect(self, timeout: Optional[float]) -> http.client.HTTPConnection:
+        """
+        Create a connection to the server.
+        
+        :param timeout: Socket timeout in seconds, None to block
+        :return: Unconnected HTTP connection
+        """
+        if self._parts.scheme == "unix":
+            return UnixHTTPConnection(self._parts.path, timeout=timeout)
+        return http.client.HTTPConnection(self._parts.hostname, self._parts.port or DEFAULT_PORT, timeout=timeout)
+    
+    @staticmethod
+    def _send(connection: http.client.HTTPConnection, method: str, path: str,
+              body: Optional[dict] = None) -> http.client.HTTPResponse:
+        """
+        Send a request and check the status of the response.
+        
+        :param connection: Connection to the server
+        :param method: HTTP method
+        :param path: Path of the endpoint
+        :param body: Optional JSON body
+        :return: Response with status 200
+        :raises ServerError: If the server answered with an error status
+        """
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        if response.status != 200:
+            message = response.read().decode("utf-8", errors="replace")
+            try:
+                message = json.loads(message)["error"]
+            except (ValueError, KeyError, TypeError):
+                pass
+            raise ServerError(response.status, message)
+        return response
@@ -0,0 +1,254 @@
+"""src.pipeline.context_builder.py -- Token-budget-aware packing of retrieved chunks into the prompt context."""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from haystack.nodes.base import BaseComponent
+from haystack.schema import Document
+from haystack.utils.openai_utils import _openai_text_completion_tokenization_details, load_openai_tokenizer
+
+from src.pipeline.metrics import METRICS
+from src.pipeline.options import STUB_MODEL_NAME
+
+
+logger = logging.getLogger(__name__)
+
+
+class ApproximateTokenizer:
+    """
+    Tokenizer estimating the tokens of a text without a vocabulary, for models without a loadable tokenizer.
+    
+    Each run of `chars_per_token` characters counts as one token, which is about the average of BPE tokenizers
+    on English text.
+    
+    :param chars_per_token: Number of characters per token
+    """
+    
+    def __init__(self, chars_per_token: int = 4):
+        """
+        Initialize the tokenizer.
+        
+        :param chars_per_token: Number of characters per token
+        """
+        self.chars_per_token = chars_per_token
+    
+    def encode(self, text: str) -> List[str]:
+        """
+        Split a text into pseudo-tokens.
+        
+        :param text: Text to split
+        :return: Runs of at most chars_per_token characters
+        """
+        return [text[start:start + self.chars_per_token] for start in range(0, len(text), self.chars_per_token)]
+    
+    @staticmethod
+    def decode(tokens: List[str]) -> str:
+        """
+        Join pseudo-tokens into text.
+        
+        :param tokens: Pseudo-tokens of encode
+        :return: Text
+        """
+        return "".join(tokens)
+
+
+class ContextBuilder(BaseComponent):
+    """
+    Pipeline node between the retriever and the prompt node that packs the retrieved chunks into a token budget.
+    
+    Chunks are selected by descending score as long as their tokens fit into `max_context_tokens`, counted with the
+    tokenizer of the target model. Text that a chunk shares with an already selected neighbor (the split overlap of
+    the PreProcessor) is not counted twice. Selected chunks of the same file with consecutive split ids are merged
+    into one document with the duplicated overlap removed. The node reports the number of context tokens and of
+    tokens in the rendered prompt.
+    
+    :param model_name: Name of the language model whose tokenizer counts the tokens
+    :param max_context_tokens: Token budget of the packed context, None disables the budget
+    :param prompt_template: Prompt template with {join(documents)} and {query}, used to count the prompt tokens
+    :param max_answer_tokens: Number of tokens reserved for the answer within the context window of the model
+    :param tokenizer: Optional tokenizer with encode and decode methods, e.g. a tiktoken encoding; defaults to the
+                      tokenizer of the model, or an ApproximateTokenizer for the stub model and when the tokenizer
+                      cannot be loaded (tiktoken downloads encodings on first use)
+    """
+    
+    outgoing_edges = 1
+    
+    def __init__(self, model_name: str = "gpt-4o-mini", max_context_tokens: Optional[int] = 2000,
+                 prompt_template: Optional[str] = None, max_answer_tokens: int = 500, tokenizer: Optional[Any] = None):
+        """
+        Initialize the context builder and load the tokenizer of the model.
+        
+        :param model_name: Name of the language model whose tokenizer counts the tokens
+        :param max_context_tokens: Token budget of the packed context, None disables the budget
+        :param prompt_template: Prompt template with {join(documents)} and {query}, used to count the prompt tokens
+        :param max_answer_tokens: Number of tokens reserved for the answer within the context window of the model
+        :param tokenizer: Optional tokenizer with encode and decode methods used instead of the one of the model
+        """
+        super().__init__()
+        tokenizer_name, max_tokens_limit = _openai_text_completion_tokenization_details(model_name=model_name)
+        self.tokenizer = tokenizer or self._load_tokenizer(model_name, tokenizer_name)
+        self.prompt_template = prompt_template or "{join(documents)}\n{query}"
+        
+        # the prompt must leave room for the answer in the context window of the model
+        template_tokens = self.count_tokens(self.prompt_template)
+        window_budget = max(1, max_tokens_limit - max_answer_tokens - template_tokens)
+        self.max_context_tokens = min(max_context_tokens or window_budget, window_budget)
+    
+    @staticmethod
+    def _load_tokenizer(model_name: str, tokenizer_name: str) -> Any:
+        """
+        Load the tokenizer of a model, falling back to an estimate without one.
+        
+        :param model_name: Name of the language model
+        :param tokenizer_name: Name of the tiktoken encoding of the model
+        :return: Tokenizer with encode and decode methods
+        """
+        if model_name == STUB_MODEL_NAME:
+            return ApproximateTokenizer()
+        try:
+            return load_openai_tokenizer(tokenizer_name=tokenizer_name)
+        except Exception as e:
+            logger.warning(f"Tokenizer {tokenizer_name} of {model_name} not available, token counts are estimated: "
+                           f"{type(e).__name__}: {e}")
+            return ApproximateTokenizer()
+    
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens of a text for the target model.
+        
+        :param text: Text to count
+        :return: Number of tokens
+        """
+        return len(self.tokenizer.encode(text))
+    
+    def pack(self, query: str, documents: List[Document]) -> Dict[str, Any]:
+        """
+        Select, merge and deduplicate retrieved chunks under the token budget.
+        
+        :param query: The query string
+        :param documents: Retrieved documents
+        :return: Dictionary with the packed "documents", "context_tokens" and "prompt_tokens"
+        """
+        with METRICS.stage("prompt_build", items=len(documents)):
+            return self._pack(query, documents)
+    
+    def _pack(self, query: str, documents: List[Document]) -> Dict[str, Any]:
+        """
+        Select, merge and deduplicate retrieved chunks, see pack.
+        
+        :param query: The query string
+        :param documents: Retrieved documents
+        :return: Dictionary with the packed "documents", "context_tokens" and "prompt_tokens"
+        """
+        ranked = sorted(documents, key=lambda doc: doc.score if doc.score is not None else 0.0, reverse=True)
+        
+        selected: Dict[str, Document] = {}
+        seen_contents = set()
+        context_tokens = 0
+        for doc in ranked:
+            # identical chunks, e.g. from duplicated files, are included only once
+            if doc.content in seen_contents:
+                continue
+            seen_contents.add(doc.content)
+            cost = self.count_tokens(doc.content) - sum(
+                self.count_tokens(overlap) for overlap in self._shared_texts(doc, selected))
+            if context_tokens + cost <= self.max_context_tokens:
+                selected[doc.id] = doc
+                context_tokens += cost
+            elif not selected:
+                # the best chunk alone exceeds the budget; keep its beginning
+                tokens = self.tokenizer.encode(doc.content)[:self.max_context_tokens]
+                meta = {key: value for key, value in doc.meta.items() if key != "_split_overlap"}
+                truncated = Document(content=self.tokenizer.decode(tokens), meta=meta, score=doc.score)
+                selected[truncated.id] = truncated
+                context_tokens = len(tokens)
+        
+        packed = self._merge_adjacent(list(selected.values()))
+        prompt = self.prompt_template.replace("{join(documents)}", " ".join(doc.content for doc in packed))
+        prompt = prompt.replace("{query}", query)
+        return {"documents": packed, "context_tokens": context_tokens, "prompt_tokens": self.count_tokens(prompt)}
+    
+    def run(self, query: str, documents: List[Document]) -> Tuple[Dict, str]:
+        """
+        Pack the retrieved documents for the prompt node.
+        
+        :param query: The query string
+        :param documents: Retrieved documents
+        :return: Tuple of the packed documents with token counts and the output edge
+        """
+        return self.pack(query, documents), "output_1"
+    
+    def run_batch(self, queries: List[str], documents: List[List[Document]]) -> Tuple[Dict, str]:
+        """
+        Pack the retrieved documents of several queries.
+        
+        :param queries: The query strings
+        :param documents: Retrieved documents per query
+        :return: Tuple of the packed documents and token counts per query, and the output edge
+        """
+        packed = [self.pack(query, docs) for query, docs in zip(queries, documents)]
+        return {key: [result[key] for result in packed] for key in ("documents", "context_tokens",
+                                                                     "prompt_tokens")}, "output_1"
+    
+    @staticmethod
+    def _shared_texts(document: Document, selected: Dict[str, Document]) -> List[str]:
+        """
+        Find the text a chunk shares with already selected chunks through the split overlap.
+        
+        :param document: Candidate chunk
+        :param selected: Selected chunks by id
+        :return: List of overlapping text passages of the candidate
+        """
+        return [document.content[overlap["range"][0]:overlap["range"][1]]
+                for overlap in document.meta.get("_split_overlap") or []
+                if overlap.get("doc_id") in selected]
+    
+    @staticmethod
+    def _merge_adjacent(documents: List[Document]) -> List[Document]:
+        """
+        Merge chunks of the same file with consecutive split ids, dropping the overlap of each following chunk.
+        
+        :param documents: Selected chunks, in descending score order
+        :return: Merged documents, ordered by their best score
+        """
+        groups: Dict[Any, List[Document]] = {}
+        for doc in documents:
+            if doc.meta.get("_split_id") is None:
+                groups[doc.id] = [doc]
+            else:
+                groups.setdefault(doc.meta.get("file_path"), []).append(doc)
+        
+        merged = []
+        for group in groups.values():
+            group.sort(key=lambda doc: doc.meta.get("_split_id") or 0)
+            run = [group[0]]
+            for doc in group[1:]:
+                if doc.meta.get("_split_id") == run[-1].meta.get("_split_id") + 1:
+                    run.append(doc)
+                else:
+                    merged.append(ContextBuilder._merge_run(run))
+                    run = [doc]
+            merged.append(ContextBuilder._merge_run(run))
+        
+        return sorted(merged, key=lambda doc: doc.score if doc.score is not None else 0.0, reverse=True)
+    
+    @staticmethod
+    def _merge_run(run: List[Document]) -> Document:
+        """
+        Concatenate consecutive chunks of a file into one document.
+        
+        :param run: Chunks with consecutive split ids
+        :return: The single chunk, or a merged document with the highest score of the run
+        """
+        if len(run) == 1:
+            return run[0]
+        
+        content = run[0].content
+        for previous, doc in zip(run, run[1:]):
+            overlap_end = next((overlap["range"][1] for overlap in doc.meta.get("_split_overlap") or []
+                                if overlap.get("doc_id") == previous.id), 0)
+            content += doc.content[overlap_end:] if overlap_end else " " + doc.content
+        
+        meta = {key: value for key, value in run[0].meta.items() if key not in ("_split_overlap", "vector_id")}
+        meta["merged_ids"] = [doc.id for doc in run]
+        return Document(content=content, meta=meta, score=max(doc.score or 0.0 for doc in run))
@@ -1,12 +1,257 @@
 """src.pipeline.document_store.py -- Implements DocumentStoreManager class for managing FAISS document store."""
 
+import copy
+import json
+import logging
 import os
+import shutil
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, Collection, Dict, List, Optional
 
-from haystack.document_stores import FAISSDocumentStore
+import faiss
+import numpy as np
+from haystack.document_stores import FAISSDocumentStore, SQLDocumentStore
+from haystack.document_stores.sql import DocumentORM
 from haystack.nodes import EmbeddingRetriever
 from haystack.schema import Document
+from sentence_transformers import SentenceTransformer
+
+from src.pipeline.bm25_index import TOKENIZER_VERSION, BM25Index
+from src.pipeline.chunk_store import ColumnarDocumentStore
+from src.pipeline.embedding_cache import CachedEmbeddingRetriever, EmbeddingCache
+from src.pipeline.journal import VectorJournal
+from src.pipeline.near_duplicates import NearDuplicateIndex
+from src.pipeline.metrics import METRICS
+from src.pipeline.options import CHUNK_STORES, DIM_REDUCTIONS, INDEX_TYPES, VECTOR_DTYPES
+from src.pipeline.tombstones import VectorTombstones
+
+
+# FAISS scalar quantizer type of each of the VECTOR_DTYPES
+QUANTIZER_TYPES = {"fp32": None, "fp16": "QT_fp16", "int8": "QT_8bit"}
+
+# query-time search parameters and their FAISS names
+SEARCH_PARAMS = {"nprobe": "nprobe", "ef_search": "efSearch"}
+
+logger = logging.getLogger(__name__)
+
+
+def build_index_factory(index_type: str, n_list: int = 1024, pq_m: int = 64, hnsw_m: int = 64,
+                        vector_dtype: str = "fp32", reduced_dim: Optional[int] = None,
+                        dim_reduction: str = "pca") -> str:
+    """
+    Build the FAISS index factory string of an index type.
+    
+    Truncation has no factory syntax; it is written as TRUNC<dim>, and the index is built by create_faiss_index.
+    
+    :param index_type: One of INDEX_TYPES
+    :param n_list: Number of inverted lists (centroids) of IVF indexes
+    :param pq_m: Number of product quantizer sub-vectors of IVF-PQ indexes
+    :param hnsw_m: Number of graph links per vector of HNSW indexes
+    :param vector_dtype: Storage type of the vectors, one of VECTOR_DTYPES
+    :param reduced_dim: Dimension the vectors are reduced to before indexing, None to keep the model dimension
+    :param dim_reduction: Projection to the reduced dimension, one of DIM_REDUCTIONS
+    :return: FAISS index factory string
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unknown vector dtype '{vector_dtype}', choose one of {', '.join(VECTOR_DTYPES)}")
+    if index_type == "ivf_pq" and vector_dtype != "fp32":
+        raise ValueError("ivf_pq indexes store product quantizer codes, use vector_dtype fp32")
+    if dim_reduction not in DIM_REDUCTIONS:
+        raise ValueError(f"Unknown dimension reduction '{dim_reduction}', choose one of {', '.join(DIM_REDUCTIONS)}")
+    
+    storage = {"fp32": "Flat", "fp16": "SQfp16", "int8": "SQ8"}[vector_dtype]
+    factories = {
+        "flat": storage,
+        "hnsw": f"HNSW{hnsw_m}" if vector_dtype == "fp32" else f"HNSW{hnsw_m}_{storage}",
+        "ivf_flat": f"IVF{n_list},{storage}",
+        "ivf_pq": f"IVF{n_list},PQ{pq_m}",
+    }
+    if index_type not in factories:
+        raise ValueError(f"Unknown index type '{index_type}', choose one of {', '.join(INDEX_TYPES)}")
+    if reduced_dim:
+        return f"{'PCA' if dim_reduction == 'pca' else 'TRUNC'}{reduced_dim},{factories[index_type]}"
+    return factories[index_type]
+
+
+def create_faiss_index(index_type: str, embedding_dim: int, n_list: int = 1024, pq_m: int = 64,
+                       hnsw_m: int = 64, ef_construction: int = 80, ef_search: int = 20, vector_dtype: str = "fp32",
+                       reduced_dim: Optional[int] = None, dim_reduction: str = "pca") -> faiss.Index:
+    """
+    Create an empty inner product FAISS index.
+    
+    With a reduced dimension, the index is an IndexPreTransform that projects the vectors with a linear map of
+    orthonormal rows: the first `reduced_dim` axes for "truncate", or the top principal axes of the training
+    vectors for "pca" (uncentered, so that projected inner products approximate the original ones). Queries
+    keep the model dimension.
+    
+    :param index_type: One of INDEX_TYPES
+    :param embedding_dim: Dimension of the indexed vectors
+    :param n_list: Number of inverted lists (centroids) of IVF indexes
+    :param pq_m: Number of product quantizer sub-vectors of IVF-PQ indexes
+    :param hnsw_m: Number of graph links per vector of HNSW indexes
+    :param ef_construction: Candidate list size used while building HNSW indexes
+    :param ef_search: Default candidate list size used while searching HNSW indexes
+    :param vector_dtype: Storage type of the vectors, one of VECTOR_DTYPES
+    :param reduced_dim: Dimension the vectors are reduced to before indexing, None to keep the model dimension
+    :param dim_reduction: Projection to the reduced dimension, one of DIM_REDUCTIONS
+    :return: FAISS index, untrained for IVF index types, int8 vectors and PCA (see train_faiss_index)
+    """
+    build_index_factory(index_type, n_list=n_list, pq_m=pq_m, hnsw_m=hnsw_m, vector_dtype=vector_dtype,
+                        reduced_dim=reduced_dim, dim_reduction=dim_reduction)
+    if reduced_dim is not None and not 0 < reduced_dim < embedding_dim:
+        raise ValueError(f"reduced_dim must be between 1 and {embedding_dim - 1}, got {reduced_dim}")
+    index_dim = reduced_dim or embedding_dim
+    
+    if index_type == "hnsw":
+        # created directly like in haystack, the factory does not honor the metric for HNSW in all FAISS versions
+        if vector_dtype == "fp32":
+            index = faiss.IndexHNSWFlat(index_dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            quantizer_type = getattr(faiss.ScalarQuantizer, QUANTIZER_TYPES[vector_dtype])
+            index = faiss.IndexHNSWSQ(index_dim, quantizer_type, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    else:
+        factory = build_index_factory(index_type, n_list=n_list, pq_m=pq_m, vector_dtype=vector_dtype)
+        index = faiss.index_factory(index_dim, factory, faiss.METRIC_INNER_PRODUCT)
+    
+    if not reduced_dim:
+        return index
+    
+    transform = faiss.LinearTransform(embedding_dim, reduced_dim, False)
+    if dim_reduction == "truncate":
+        _set_projection(transform, np.eye(reduced_dim, embedding_dim, dtype=np.float32))
+    return faiss.IndexPreTransform(transform, index)
+
+
+def train_faiss_index(index: faiss.Index, vectors: np.ndarray):
+    """
+    Train an index created by create_faiss_index, including a PCA projection.
+    
+    :param index: Untrained index
+    :param vectors: Training vectors of the model dimension
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        transform = faiss.downcast_VectorTransform(index.chain.at(0))
+        if not transform.is_trained:
+            # principal axes of the uncentered vectors, FAISS' PCAMatrix would center them and break inner products
+            _, _, axes = np.linalg.svd(vectors, full_matrices=False)
+            projection = np.zeros((transform.d_out, transform.d_in), dtype=np.float32)
+            projection[:len(axes)] = axes[:transform.d_out]
+            _set_projection(transform, projection)
+        sub_index = index.index
+        if not sub_index.is_trained:
+            sub_index.train(transform.apply(vectors))
+        index.is_trained = sub_index.is_trained
+    else:
+        index.train(vectors)
+
+
+def _set_projection(transform: faiss.LinearTransform, projection: np.ndarray):
+    """
+    Set the matrix of a linear transform without bias.
+    
+    :param transform: Transform from d_in to d_out dimensions
+    :param projection: Matrix of shape (d_out, d_in) with orthonormal rows
+    """
+    faiss.copy_array_to_vector(np.ascontiguousarray(projection, dtype=np.float32).ravel(), transform.A)
+    transform.is_orthonormal = True
+    transform.is_trained = True
+
+
+def get_index_bytes(index: faiss.Index) -> int:
+    """
+    Get the serialized size of an index, which is about its size in memory.
+    
+    :param index: FAISS index
+    :return: Size in bytes
+    """
+    return int(faiss.serialize_index(index).nbytes)
+
+
+@contextmanager
+def faiss_search_params(document_store: FAISSDocumentStore, **params):
+    """
+    Temporarily set query-time search parameters of the FAISS index of a document store.
+    
+    :param document_store: FAISS document store to search
+    :param params: Search parameters, see SEARCH_PARAMS (e.g. nprobe=16 for IVF, ef_search=64 for HNSW)
+    :raises ValueError: If a parameter is unknown or not supported by the index type
+    """
+    index = document_store.faiss_indexes[document_store.index]
+    parameter_space = faiss.ParameterSpace()
+    
+    previous = {}
+    for name, value in params.items():
+        if name not in SEARCH_PARAMS:
+            raise ValueError(f"Unknown search parameter '{name}', choose one of {', '.join(SEARCH_PARAMS)}")
+        faiss_name = SEARCH_PARAMS[name]
+        try:
+            if faiss_name == "nprobe":
+                previous[faiss_name] = faiss.extract_index_ivf(index).nprobe
+            else:
+                hnsw_index = faiss.downcast_index(index)
+                if isinstance(hnsw_index, faiss.IndexPreTransform):
+                    hnsw_index = faiss.downcast_index(hnsw_index.index)
+                previous[faiss_name] = hnsw_index.hnsw.efSearch
+        except (RuntimeError, AttributeError):
+            raise ValueError(f"Search parameter '{name}' is not supported by index {type(index).__name__}")
+        parameter_space.set_index_parameter(index, faiss_name, value)
+    
+    try:
+        yield
+    finally:
+        for faiss_name, value in previous.items():
+            parameter_space.set_index_parameter(index, faiss_name, value)
+
+
+def query_by_embedding_batch(document_store: FAISSDocumentStore, query_embs: np.ndarray, top_k: int = 10,
+                             scale_score: bool = True) -> List[List[Document]]:
+    """
+    Retrieve the most similar documents of many queries with a single FAISS search.
+    
+    Unlike FAISSDocumentStore.query_by_embedding, all queries are searched at once and the documents of all
+    queries are fetched from the SQL database in one pass. Document embeddings are not returned. Vectors of
+    deleted documents (the `tombstones` of the store, see DocumentStoreManager.delete_documents) are excluded
+    from the search.
+    
+    :param document_store: FAISS document store to search
+    :param query_embs: Query embeddings of shape (num_queries, dim)
+    :param top_k: Number of documents per query
+    :param scale_score: Flag to scale similarity scores to the unit interval
+    :return: List of retrieved documents per query, in rank order
+    """
+    query_embs = np.ascontiguousarray(query_embs, dtype=np.float32).reshape(len(query_embs), -1)
+    if document_store.similarity == "cosine":
+        document_store.normalize_embedding(query_embs)
+    
+    index = document_store.faiss_indexes[document_store.index]
+    tombstones = getattr(document_store, "tombstones", None)
+    params = tombstones.search_params(index) if tombstones is not None else None
+    with METRICS.stage("faiss_search", items=len(query_embs)):
+        score_matrix, vector_id_matrix = index.search(query_embs, top_k, params=params)
+    
+    vector_ids = sorted({str(vector_id) for vector_id in vector_id_matrix.ravel() if vector_id != -1})
+    with METRICS.stage("document_fetch", items=len(vector_ids)):
+        documents = {doc.meta["vector_id"]: doc for doc in document_store.get_documents_by_vector_ids(vector_ids)}
+    
+    results = []
+    for scores, ids in zip(score_matrix, vector_id_matrix):
+        ranked = []
+        for score, vector_id in zip(scores, ids):
+            doc = documents.get(str(vector_id))
+            if doc is None:
+                continue
+            doc = copy.copy(doc)
+            doc.score = document_store.scale_to_unit_interval(score, document_store.similarity) if scale_score \
+                else float(score)
+            ranked.append(doc)
+        results.append(ranked)
+    return results
 
 
 class DocumentStoreManager:
@@ -15,14 +260,69 @@ class DocumentStoreManager:
     
     :param embedding_model: Name or path of the embedding model to use for document embeddings
     :param db_path: Path to the SQLite database file, defaults to data/faiss_document_store.db
+    :param chunk_store: Store of the chunks of new stores, one of CHUNK_STORES; the columnar store is kept in the
+                        directory of the FAISS index path with suffix .chunks
     :param index_path: Path to the FAISS index file, defaults to data/faiss_document_store.faiss
+    :param embedding_cache_dir: Directory of the persistent embedding cache, defaults to data/embedding_cache
+    :param embedding_cache_size: Maximum number of cached embeddings, 0 disables the cache
+    :param embedding_backend: Inference backend of the embedding model, one of options.EMBEDDING_BACKENDS
+    :param onnx_model_dir: Directory of the exported ONNX models, defaults to data/onnx_models
+    :param index_type: FAISS index type of new stores, one of INDEX_TYPES
+    :param n_list: Number of inverted lists (centroids) of IVF indexes
+    :param pq_m: Number of product quantizer sub-vectors of IVF-PQ indexes
+    :param vector_dtype: Storage type of the vectors of new stores, one of VECTOR_DTYPES
+    :param reduced_dim: Dimension the vectors of new stores are reduced to, None to keep the model dimension
+    :param dim_reduction: Projection to reduced_dim, one of DIM_REDUCTIONS
+    :param return_embedding: Flag to fetch the stored vectors of retrieved documents
+    :param train_sample_size: Maximum number of vectors used to train IVF indexes, int8 quantizers and PCA
+    :param mmap_index: Flag to memory-map an existing index read-only instead of reading it into RAM
+    :param enable_bm25: Flag to maintain a BM25 index of the chunks for hybrid retrieval
+    :param max_query_batch_size: Maximum number of concurrent queries embedded in one forward pass
+    :param query_batch_wait_ms: Maximum time in milliseconds a query waits for concurrent queries to be embedded
+                                with, None to embed each call separately
+    :param journal_compaction_ratio: Size of the vector journal, as a fraction of the vectors in the saved index,
+                                     at which the journal is folded into a new saved index
+    :param near_duplicate_threshold: Estimated Jaccard similarity from which ingested chunks are dropped as
+                                     near-duplicates of stored ones, None to keep all chunks
+    :param retriever: Retriever shared with other stores, None to create one from the embedding parameters
+    
+    The vectors of each added batch are appended to a journal next to the index (suffix .journal) instead of
+    saving the whole index; the journal is replayed at load and folded into the saved index by `compact`, which
+    runs in the background once the journal reaches `journal_compaction_ratio` of the index.
+    
+    add_documents may run in a background thread while other threads query the store: it holds `lock` while it
+    reads or modifies the SQL database, the FAISS index and the BM25 index, and readers hold it as well (see the
+    store_lock parameter of QueryPipeline). Embedding and saving run outside the lock.
+    
+    Deleted chunks leave their vectors in the FAISS index, since removing a vector would shift the vector ids of
+    all later chunks; the `tombstones` of the document store exclude them from searches.
     """
-
+    
     def __init__(self, 
                  embedding_model: str = "sentence-transformers/multi-qa-mpnet-base-dot-v1",
                  db_path: Optional[str] = None,
                  index_path: Optional[str] = None,
-                 clean_start: bool = False):
+                 clean_start: bool = False,
+                 chunk_store: str = "sqlite",
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size: int = 200_000,
+                 embedding_backend: str = "torch",
+                 onnx_model_dir: Optional[str] = None,
+                 index_type: str = "flat",
+                 n_list: int = 1024,
+                 pq_m: int = 64,
+                 vector_dtype: str = "fp32",
+                 reduced_dim: Optional[int] = None,
+                 dim_reduction: str = "pca",
+                 return_embedding: bool = False,
+                 train_sample_size: int = 100_000,
+                 mmap_index: bool = False,
+                 enable_bm25: bool = True,
+                 max_query_batch_size: int = 32,
+                 query_batch_wait_ms: Optional[float] = None,
+                 journal_compaction_ratio: float = 0.25,
+                 near_duplicate_threshold: Optional[float] = None,
+                 retriever: Optional[CachedEmbeddingRetriever] = None):
         """
         Initialize the DocumentStoreManager with FAISS document store and embedding retriever.
         
@@ -30,6 +330,38 @@ class DocumentStoreManager:
         :param db_path: Optional path to the SQLite database file
         :param index_path: Optional path to the FAISS index file
         :param clean_start: Flag to control file deletion
+        :param chunk_store: Store of the chunks of new stores, "sqlite" or "columnar" (append-only, memory-mapped,
+                            faster to write and to fetch retrieved chunks from); ignored when an existing index is
+                            loaded
+        :param embedding_cache_dir: Optional directory of the persistent embedding cache
+        :param embedding_cache_size: Maximum number of cached embeddings, 0 disables the cache
+        :param embedding_backend: Inference backend of the embedding model, "torch" for the fp32 PyTorch model,
+                                  "onnx" or "onnx-int8" for ONNX Runtime (exported on first use)
+        :param onnx_model_dir: Optional directory of the exported ONNX models
+        :param index_type: FAISS index type of new stores, ignored when an existing index is loaded
+        :param n_list: Number of inverted lists (centroids) of IVF indexes
+        :param pq_m: Number of product quantizer sub-vectors of IVF-PQ indexes
+        :param vector_dtype: Storage type of the vectors of new stores, "fp32", or "fp16" and "int8" for scalar
+                             quantization (2x and 4x smaller)
+        :param reduced_dim: Dimension the vectors of new stores are reduced to, None to keep the model dimension
+        :param dim_reduction: Projection to reduced_dim, "pca" (trained on the first batch) or "truncate"
+        :param return_embedding: Flag to fetch the stored vectors of retrieved documents; they are approximations
+                                 for compressed indexes
+        :param train_sample_size: Maximum number of vectors used to train IVF indexes, int8 quantizers and PCA
+        :param mmap_index: Flag to memory-map an existing index read-only; processes mapping the same index share
+                           the page cache, and the index is read into RAM only once documents are added
+        :param enable_bm25: Flag to maintain a BM25 index of the chunks, saved next to the FAISS index
+        :param max_query_batch_size: Maximum number of concurrent queries embedded in one forward pass
+        :param query_batch_wait_ms: Maximum time in milliseconds a query waits for concurrent queries to be
+                                    embedded with, None to embed each call separately (see CachedEmbeddingRetriever)
+        :param journal_compaction_ratio: Size of the vector journal, as a fraction of the vectors in the saved
+                                         index, at which the journal is folded into a new saved index; smaller
+                                         values shorten the replay at load, larger ones save the index less often
+        :param near_duplicate_threshold: Estimated Jaccard similarity of the word shingles from which ingested
+                                         chunks are dropped as near-duplicates of stored chunks (see
+                                         ingestion.ingest_directory), None to keep all chunks
+        :param retriever: Retriever to embed with instead of creating one from the embedding parameters, e.g. to
+                          share the model between the shards of a collection; its document store is left unchanged
         """
         # create data directory if it doesn't exist
         data_dir = Path("data")
@@ -38,40 +370,356 @@ class DocumentStoreManager:
         # use provided paths or default to data directory
         self.db_path = db_path or str(data_dir / "faiss_document_store.db")
         self.index_path = index_path or str(data_dir / "faiss_document_store.faiss")
+        self.chunk_store_path = str(Path(self.index_path).with_suffix(".chunks"))
+        self.pending_path = str(Path(self.index_path).with_suffix(".pending.json"))
+        self.bm25_path = str(Path(self.index_path).with_suffix(".bm25.npz"))
+        self.manifest_path = str(Path(self.index_path).with_suffix(".manifest.db"))
+        self.journal_path = str(Path(self.index_path).with_suffix(".journal"))
+        self.near_duplicates_path = str(Path(self.index_path).with_suffix(".minhash.db"))
+        self.journal_compaction_ratio = journal_compaction_ratio
+        self.train_sample_size = train_sample_size
+        self._change_listeners: List[Callable[[], None]] = []
+        # the SQL session of the store is not thread-safe, and FAISS must not be searched while vectors are added
+        self.lock = threading.RLock()
+        # serializes concurrent add_documents, delete_documents and compact calls
+        self._write_lock = threading.Lock()
+        self._compaction_thread: Optional[threading.Thread] = None
+        # inode, modification time and IO flags of the saved index that was read, see _replay_journal
+        self._index_version = None
+        
+        if chunk_store not in CHUNK_STORES:
+            raise ValueError(f"Unknown chunk store '{chunk_store}', choose one of {', '.join(CHUNK_STORES)}")
         
         # Only delete existing files if clean_start is True
         if clean_start:
             self._cleanup_existing_files()
         
+        # the retriever is created first, as the dimension of new indexes is the one of its model
+        self._owns_retriever = retriever is None
+        if retriever is not None:
+            self.retriever = retriever
+            self.embedding_cache = retriever.embedding_cache
+        else:
+            # the embedding cache is shared across stores and survives clean starts
+            self.embedding_cache = None
+            if embedding_cache_size > 0:
+                # backends compute slightly different vectors, so each backend has its own entries
+                cache_model_name = embedding_model
+                if embedding_backend != "torch":
+                    cache_model_name = f"{embedding_model}@{embedding_backend}"
+                self.embedding_cache = EmbeddingCache(
+                    cache_dir=embedding_cache_dir or str(data_dir / "embedding_cache"),
+                    model_name=cache_model_name,
+                    max_entries=embedding_cache_size
+                )
+            
+            self.retriever = CachedEmbeddingRetriever(
+                embedding_model=embedding_model,
+                embedding_cache=self.embedding_cache,
+                embedding_backend=embedding_backend,
+                onnx_model_dir=onnx_model_dir or str(data_dir / "onnx_models"),
+                max_query_batch_size=max_query_batch_size,
+                query_batch_wait_ms=query_batch_wait_ms
+            )
+        self.embedding_dim = self._get_embedding_dim()
+        
         # Initialize document store based on whether index exists
+        self.index_mmapped = False
+        self.journal = VectorJournal(self.journal_path)
         if os.path.exists(self.index_path):
             # If index exists, load it
-            self.document_store = FAISSDocumentStore.load(
-                index_path=self.index_path
-            )
+            self.document_store = self._load_document_store(mmap_index=mmap_index, return_embedding=return_embedding)
+            if self.document_store.embedding_dim != self.embedding_dim:
+                raise ValueError(f"The index {self.index_path} holds vectors of dimension "
+                                 f"{self.document_store.embedding_dim}, but {embedding_model} embeds to dimension "
+                                 f"{self.embedding_dim}")
+            # add the vectors written since the last save of the index
+            self._replay_journal()
         else:
             # If no index exists, create new store
-            self.document_store = FAISSDocumentStore(
-                sql_url=f"sqlite:///{self.db_path}",
-                return_embedding=True,
-                embedding_dim=768
+            compression = {"vector_dtype": vector_dtype, "reduced_dim": reduced_dim, "dim_reduction": dim_reduction}
+            store_params = dict(
+                return_embedding=return_embedding,
+                embedding_dim=self.embedding_dim,
+                faiss_index_factory_str=build_index_factory(index_type, n_list=n_list, pq_m=pq_m, **compression),
+                faiss_index=create_faiss_index(index_type, embedding_dim=self.embedding_dim, n_list=n_list, pq_m=pq_m,
+                                               **compression),
+                duplicate_documents="skip"
             )
+            if chunk_store == "columnar":
+                self.document_store = ColumnarDocumentStore(chunk_store_path=self.chunk_store_path, **store_params)
+            else:
+                self.document_store = FAISSDocumentStore(sql_url=f"sqlite:///{self.db_path}",
+                                                         validate_index_sync=False, **store_params)
+            # vectors journaled before the first save belong to no index
+            self.journal.truncate()
+        if self._owns_retriever:
+            self.retriever.document_store = self.document_store
+        
+        # roll back a batch that reached the SQL database but not the index, and find deleted vectors
+        self._recover_pending_documents()
         
-        self.retriever = EmbeddingRetriever(
-            document_store=self.document_store,
-            embedding_model=embedding_model
-        )
+        self.bm25_index = self._load_bm25_index() if enable_bm25 else None
+        
+        # MinHash signatures of the stored chunks, consulted by ingestion before chunks are embedded
+        self.near_duplicates: Optional[NearDuplicateIndex] = None
+        if near_duplicate_threshold is not None:
+            self.near_duplicates = NearDuplicateIndex(self.near_duplicates_path, threshold=near_duplicate_threshold)
     
-    def add_documents(self, documents: List[Document]):
+    def add_documents(self, documents: List[Document], update_existing_embeddings: bool = False) -> Dict[str, int]:
         """
         Add documents to the document store and generate embeddings.
         
+        Only chunks whose id is not yet present in the store are embedded and appended to the FAISS index,
+        so the cost of a call grows with the number of new chunks rather than with the size of the store.
+        Chunks that were written earlier but never received a vector (e.g. after an interrupted run) are
+        embedded as well.
+        
         :param documents: List of Document objects to add to the store
+        :param update_existing_embeddings: Flag to re-embed the whole store instead of only the new chunks
+        :return: Dictionary with the number of "new", "skipped" and "reembedded" chunks
+        """
+        with self._write_lock:
+            stats = self._add_documents(documents, update_existing_embeddings)
+        
+        # retrieval results may have changed, e.g. for cached queries
+        if stats["new"] or stats["reembedded"]:
+            for listener in self._change_listeners:
+                listener()
+        
+        return stats
+    
+    def _add_documents(self, documents: List[Document], update_existing_embeddings: bool) -> Dict[str, int]:
+        """
+        Add documents to the document store, see add_documents.
+        
+        :param documents: List of Document objects to add to the store
+        :param update_existing_embeddings: Flag to re-embed the whole store instead of only the new chunks
+        :return: Dictionary with the number of "new", "skipped" and "reembedded" chunks
+        """
+        with self.lock:
+            # a memory-mapped index is read-only
+            self._ensure_writable_index()
+            
+            # drop chunks that are duplicated within the batch or already stored (ids are content hashes)
+            unique_docs = list({doc.id: doc for doc in documents}.values())
+            stored_docs = self.document_store.get_documents_by_id([doc.id for doc in unique_docs])
+            existing_ids = {doc.id for doc in stored_docs}
+            new_docs = [doc for doc in unique_docs if doc.id not in existing_ids]
+        
+        stats = {"new": len(new_docs), "skipped": len(documents) - len(new_docs), "reembedded": 0}
+        
+        if update_existing_embeddings:
+            with self.lock:
+                with METRICS.stage("sqlite_write", items=len(new_docs)):
+                    self.document_store.write_documents(new_docs)
+                self._add_to_bm25_index(new_docs)
+                stats["reembedded"] = self.document_store.get_document_count() - len(new_docs)
+                # the journaled vector ids are replaced
+                self.journal.truncate()
+                self.document_store.update_embeddings(self.retriever, update_existing_embeddings=True)
+                if not isinstance(self.document_store, ColumnarDocumentStore):
+                    # the SQL store assigns new vector ids to the remaining chunks only
+                    self.document_store.tombstones = VectorTombstones()
+        else:
+            # embed stored chunks that are missing a vector before appending the new ones
+            with self.lock:
+                missing_count = self.document_store.get_document_count(only_documents_without_embedding=True)
+                if missing_count > 0:
+                    self.document_store.update_embeddings(self.retriever, update_existing_embeddings=False)
+                    stats["reembedded"] = missing_count
+            
+            if new_docs:
+                embeddings = self.retriever.embed_documents(new_docs)
+                for doc, embedding in zip(new_docs, embeddings):
+                    doc.embedding = embedding
+                vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+                if self.document_store.similarity == "cosine":
+                    self.document_store.normalize_embedding(vectors)
+                
+                # record the batch until it is written, so an interrupted write can be rolled back
+                document_ids = [doc.id for doc in new_docs]
+                self._write_pending_ids(document_ids)
+                # only writers change the number of vectors, and they hold the write lock
+                first_vector_id = self.document_store.get_embedding_count()
+                with METRICS.stage("journal_append", items=len(new_docs)):
+                    self.journal.append(first_vector_id, document_ids, vectors)
+                with self.lock:
+                    if not self.document_store.faiss_indexes[self.document_store.index].is_trained:
+                        self._train_index(embeddings)
+                    self._write_documents(new_docs, vectors)
+                    self._add_to_bm25_index(new_docs)
+        
+        if self.near_duplicates is not None and new_docs:
+            self.near_duplicates.add([doc.id for doc in new_docs],
+                                     self.near_duplicates.signatures([doc.content for doc in new_docs]))
+        
+        # persist the batch; saving only reads the indexes, so queries may continue meanwhile
+        if stats["new"] or stats["reembedded"]:
+            if isinstance(self.document_store, ColumnarDocumentStore):
+                with METRICS.stage("chunk_commit"):
+                    self.document_store.chunks.commit()
+            if update_existing_embeddings or stats["reembedded"] or not os.path.exists(self.index_path):
+                # vectors added by update_embeddings are not journaled, and the journal needs a saved index
+                self._compact()
+            elif self.journal.num_vectors > self.journal_compaction_ratio * max(
+                    1, self.document_store.get_embedding_count() - self.journal.num_vectors):
+                self._start_compaction()
+            if self.bm25_index is not None:
+                with METRICS.stage("bm25_save"):
+                    self.bm25_index.save(self.bm25_path)
+        if os.path.exists(self.pending_path):
+            os.remove(self.pending_path)
+        
+        return stats
+    
+    def delete_documents(self, document_ids: List[str]) -> int:
+        """
+        Delete chunks from the store and the BM25 index.
+        
+        The vectors of the chunks stay in the FAISS index and are added to the `tombstones` of the document store,
+        which excludes them from searches. Ids that are not stored are ignored.
+        
+        :param document_ids: Ids of the chunks to delete
+        :return: Number of deleted chunks
+        """
+        with self._write_lock:
+            with self.lock:
+                self._ensure_writable_index()
+                stored_docs = self.document_store.get_documents_by_id(list(set(document_ids)))
+                if not stored_docs:
+                    return 0
+                
+                deleted_ids = [doc.id for doc in stored_docs]
+                with METRICS.stage("chunk_delete", items=len(deleted_ids)):
+                    if isinstance(self.document_store, ColumnarDocumentStore):
+                        self.document_store.delete_documents(ids=deleted_ids)
+                        self.document_store.chunks.commit()
+                    else:
+                        # FAISSDocumentStore.delete_documents would remove the vectors and shift the later ones
+                        vector_ids = [int(doc.meta["vector_id"]) for doc in stored_docs
+                                      if doc.meta.get("vector_id") is not None]
+                        SQLDocumentStore.delete_documents(self.document_store, ids=deleted_ids)
+                        self.document_store.tombstones.add(vector_ids)
+                if self.bm25_index is not None:
+                    self.bm25_index.remove_documents(deleted_ids)
+            if self.near_duplicates is not None:
+                self.near_duplicates.remove(deleted_ids)
+            
+            if self.bm25_index is not None:
+                with METRICS.stage("bm25_save"):
+                    self.bm25_index.save(self.bm25_path)
+        
+        for listener in self._change_listeners:
+            listener()
+        return len(deleted_ids)
+    
+    def _write_documents(self, documents: List[Document], vectors: np.ndarray):
+        """
+        Append the vectors of new documents to the FAISS index and write the documents to the chunk store.
+        
+        Does the same as FAISSDocumentStore.write_documents with embedded documents, in two separately
+        measured stages.
+        
+        :param documents: New documents, in the order of the vectors
+        :param vectors: Float32 vectors of the documents, normalized if the similarity is cosine
+        """
+        faiss_index = self.document_store.faiss_indexes[self.document_store.index]
+        first_vector_id = faiss_index.ntotal
+        with METRICS.stage("faiss_add", items=len(documents)):
+            faiss_index.add(vectors)
+        
+        # the chunks reference the vectors by their position in the FAISS index
+        rows = []
+        for vector_id, doc in enumerate(documents, first_vector_id):
+            doc.meta["vector_id"] = vector_id
+            row = copy.copy(doc)
+            row.embedding = None
+            rows.append(row)
+        if isinstance(self.document_store, ColumnarDocumentStore):
+            # rows are appended in vector id order, so the row of each chunk is its vector id
+            self.document_store.append_documents(rows)
+        else:
+            with METRICS.stage("sqlite_write", items=len(rows)):
+                SQLDocumentStore.write_documents(self.document_store, rows)
+    
+    def compact(self):
+        """
+        Fold the vector journal into a new saved index.
+        
+        Waits for running writes; queries continue meanwhile.
+        """
+        with self._write_lock:
+            if len(self.journal) > 0:
+                self._compact()
+    
+    def _start_compaction(self):
+        """
+        Run compact in a background thread, unless a compaction is already running.
+        """
+        if self._compaction_thread is None or not self._compaction_thread.is_alive():
+            self._compaction_thread = threading.Thread(target=self.compact, name="index-compaction")
+            self._compaction_thread.start()
+    
+    def _compact(self):
+        """
+        Atomically replace the saved index and its configuration, then empty the journal; the caller holds
+        _write_lock.
+        
+        If interrupted before the journal is emptied, the journaled vectors the new index already holds are skipped
+        at load.
+        """
+        config_path = str(Path(self.index_path).with_suffix(".json"))
+        with METRICS.stage("faiss_save", items=self.journal.num_vectors):
+            self.document_store.save(self.index_path + ".tmp", config_path=config_path + ".tmp")
+            for path in [config_path, self.index_path]:
+                with open(path + ".tmp", "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(path + ".tmp", path)
+            directory = os.open(os.path.dirname(os.path.abspath(self.index_path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        self.journal.truncate()
+    
+    def _add_to_bm25_index(self, documents: List[Document]):
+        """
+        Add documents to the BM25 index, if enabled.
+        
+        :param documents: Documents written to the store
+        """
+        if self.bm25_index is not None:
+            with METRICS.stage("bm25_index", items=len(documents)):
+                self.bm25_index.add_documents(documents)
+    
+    def add_change_listener(self, listener: Callable[[], None]):
+        """
+        Register a callback invoked whenever add_documents or delete_documents changes the store.
+        
+        :param listener: Callable without arguments, e.g. QueryCache.invalidate
+        """
+        self._change_listeners.append(listener)
+    
+    def close(self):
         """
-        self.document_store.write_documents(documents)
-        self.document_store.update_embeddings(self.retriever)
-        # save the updated index
-        self.document_store.save(self.index_path)
+        Wait for a running compaction and release the files and connections of the store, and the query batcher
+        of the retriever if the manager created it.
+        
+        The manager must not be used afterwards.
+        """
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        if self._owns_retriever:
+            self.retriever.close()
+        with self._write_lock:
+            self.journal.close()
+            if self.near_duplicates is not None:
+                self.near_duplicates.close()
+            session = getattr(self.document_store, "session", None)
+            if session is not None:
+                session.close()
+                session.bind.dispose()
     
     def get_retriever(self) -> EmbeddingRetriever:
         """
@@ -87,7 +735,251 @@ class DocumentStoreManager:
         
         :return: True if documents exist in store, False otherwise
         """
-        return self.document_store.get_document_count() > 0
+        with self.lock:
+            return self.document_store.get_document_count() > 0
+    
+    def find_near_duplicates(self, documents: List[Document], ignored_ids: Collection[str] = ()) -> Dict[str, str]:
+        """
+        Find the chunks that are near-duplicates of stored chunks or of earlier chunks of the list.
+        
+        Stored chunks are only found if they were added while near-duplicate detection was enabled.
+        
+        :param documents: Chunks about to be added
+        :param ignored_ids: Ids of stored chunks that are not considered, e.g. the chunks a changed file replaces
+        :return: Dict of the id of each near-duplicate to the id of the chunk it duplicates, empty if near-duplicate
+                 detection is disabled
+        """
+        if self.near_duplicates is None or not documents:
+            return {}
+        
+        chunk_ids = [doc.id for doc in documents]
+        with METRICS.stage("near_duplicate_detection", items=len(documents)):
+            signatures = self.near_duplicates.signatures([doc.content for doc in documents])
+            duplicates = self.near_duplicates.find_duplicates(chunk_ids, signatures, ignored_ids)
+            # chunks deleted while near-duplicate detection was disabled kept their signatures
+            stored_ids = set(duplicates.values()) - set(chunk_ids)
+            with self.lock:
+                missing_ids = stored_ids - {doc.id for doc in self.document_store.get_documents_by_id(list(stored_ids))}
+            if missing_ids:
+                self.near_duplicates.remove(list(missing_ids))
+                duplicates = self.near_duplicates.find_duplicates(chunk_ids, signatures, ignored_ids)
+        return {chunk_ids[i]: duplicate_of for i, duplicate_of in duplicates.items()}
+    
+    def _train_index(self, embeddings: np.ndarray):
+        """
+        Train an IVF index, an int8 quantizer or a PCA projection on a random sample of embeddings.
+        
+        :param embeddings: Embeddings to sample the training set from
+        :raises ValueError: If there are fewer embeddings than the index needs for training
+        """
+        index = self.document_store.faiss_indexes[self.document_store.index]
+        factory = self.document_store.faiss_index_factory_str
+        # k-means needs at least one point per centroid, PQ needs 256 points per codebook, and PCA one point per axis
+        min_size = 256 if "PQ" in factory else 1
+        if "IVF" in factory:
+            min_size = max(min_size, faiss.extract_index_ivf(index).nlist)
+        if factory.startswith("PCA"):
+            min_size = max(min_size, faiss.downcast_VectorTransform(index.chain.at(0)).d_out)
+        if len(embeddings) < min_size:
+            raise ValueError(f"Training index {self.document_store.faiss_index_factory_str} requires at least "
+                             f"{min_size} chunks in the first batch, got {len(embeddings)}. Use a smaller n_list "
+                             "or the flat index type.")
+        
+        rng = np.random.default_rng(0)
+        sample_size = min(len(embeddings), self.train_sample_size)
+        sample = np.asarray(embeddings, dtype=np.float32)[rng.choice(len(embeddings), sample_size, replace=False)]
+        if self.document_store.similarity == "cosine":
+            self.document_store.normalize_embedding(sample)
+        train_faiss_index(index, sample)
+    
+    def _load_document_store(self, mmap_index: bool = False, return_embedding: bool = False) -> FAISSDocumentStore:
+        """
+        Load the saved FAISS document store.
+        
+        Equivalent to FAISSDocumentStore.load, but defers the index sync validation to _recover_pending_documents,
+        so that an interrupted batch can be rolled back instead of failing the load.
+        
+        :param mmap_index: Flag to memory-map the index read-only
+        :param return_embedding: Flag to fetch the stored vectors of retrieved documents, replaces the saved setting
+        :return: Loaded FAISSDocumentStore instance, a ColumnarDocumentStore if it was saved by one
+        """
+        with open(Path(self.index_path).with_suffix(".json"), "r") as f:
+            init_params = json.load(f)
+        
+        io_flags = 0
+        if mmap_index:
+            # IVF indexes map their inverted lists, flat and HNSW indexes their vector storage
+            if "IVF" in init_params.get("faiss_index_factory_str", "Flat"):
+                io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            else:
+                io_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            self.index_mmapped = True
+        
+        faiss_index = self._read_index(io_flags)
+        init_params.update(faiss_index=faiss_index, embedding_dim=faiss_index.d, return_embedding=return_embedding)
+        if "chunk_store_path" in init_params:
+            # the chunks stay next to the index, also if the files were moved
+            init_params.update(chunk_store_path=self.chunk_store_path)
+            return ColumnarDocumentStore(**init_params)
+        init_params.update(validate_index_sync=False)
+        return FAISSDocumentStore(**init_params)
+    
+    def _get_embedding_dim(self) -> int:
+        """
+        Get the dimension of the embeddings of the retriever's model.
+        
+        :return: Embedding dimension
+        """
+        sentence_model = getattr(self.retriever.embedding_encoder, "embedding_model", None)
+        if isinstance(sentence_model, SentenceTransformer) and sentence_model.get_sentence_embedding_dimension():
+            return sentence_model.get_sentence_embedding_dimension()
+        # other model formats do not declare their dimension; the probe bypasses the embedding cache
+        return len(EmbeddingRetriever.embed_queries(self.retriever, ["dimension probe"])[0])
+    
+    def _load_bm25_index(self) -> BM25Index:
+        """
+        Load the saved BM25 index, or rebuild it if it is missing, out of sync with the SQL database or built by
+        another version of the tokenizer.
+        
+        :return: BM25 index of all stored chunks
+        """
+        if os.path.exists(self.bm25_path):
+            bm25_index = BM25Index.load(self.bm25_path)
+            if len(bm25_index) == self.document_store.get_document_count() and \
+                    bm25_index.tokenizer_version == TOKENIZER_VERSION:
+                return bm25_index
+        
+        bm25_index = BM25Index()
+        if self.document_store.get_document_count() > 0:
+            logger.info(f"Building BM25 index of {self.document_store.get_document_count()} stored chunks")
+            bm25_index.add_documents(self.document_store.get_all_documents_generator(return_embedding=False))
+            bm25_index.save(self.bm25_path)
+        return bm25_index
+    
+    def _ensure_writable_index(self):
+        """
+        Replace a memory-mapped index with an in-memory copy before it is modified.
+        """
+        if self.index_mmapped:
+            index = self._read_index()
+            self._apply_journal(index, self.journal.read())
+            self.document_store.faiss_indexes[self.document_store.index] = index
+            self.index_mmapped = False
+    
+    def _read_index(self, io_flags: int = 0) -> faiss.Index:
+        """
+        Read the saved index and remember its version.
+        
+        :param io_flags: FAISS IO flags, e.g. to memory-map the index
+        :return: Saved index, without the journaled vectors
+        """
+        stat = os.stat(self.index_path)
+        self._index_version = (stat.st_ino, stat.st_mtime_ns, io_flags)
+        return faiss.read_index(self.index_path, io_flags)
+    
+    def _replay_journal(self):
+        """
+        Add the journaled vectors that the saved index doesn't hold yet.
+        
+        The last journaled batch is dropped if it is still listed in the pending file and did not fully reach the
+        chunk store; _recover_pending_documents then rolls back the chunks it wrote.
+        
+        :raises ValueError: If the journal doesn't continue the saved index
+        """
+        records = self.journal.read()
+        stat = os.stat(self.index_path)
+        if (stat.st_ino, stat.st_mtime_ns) != self._index_version[:2]:
+            # another process compacted the journal into a new index after the index was read
+            self.document_store.faiss_indexes[self.document_store.index] = self._read_index(self._index_version[2])
+            records = self.journal.read()
+        
+        index = self.document_store.faiss_indexes[self.document_store.index]
+        records = [record for record in records if record[1] + len(record[3]) > index.ntotal]
+        if records and os.path.exists(self.pending_path):
+            with open(self.pending_path, "r") as f:
+                pending_ids = json.load(f)
+            if pending_ids == records[-1][2] and \
+                    len(self.document_store.get_documents_by_id(pending_ids)) < len(pending_ids):
+                self.journal.truncate(records[-1][0])
+                records.pop()
+        if not records:
+            return
+        
+        if self.index_mmapped:
+            logger.info(f"Reading the index into memory to add {sum(len(r[3]) for r in records)} journaled vectors")
+            self._ensure_writable_index()
+        else:
+            self._apply_journal(index, records)
+    
+    def _apply_journal(self, index: faiss.Index, records: List[tuple]):
+        """
+        Add journaled vectors to an index.
+        
+        :param index: Index to add the vectors to
+        :param records: Journal records, see VectorJournal.read
+        :raises ValueError: If the records don't continue the index
+        """
+        with METRICS.stage("journal_replay", items=sum(len(record[3]) for record in records)):
+            for _, first_vector_id, _, vectors in records:
+                if first_vector_id + len(vectors) <= index.ntotal:
+                    continue
+                if first_vector_id != index.ntotal:
+                    raise ValueError(f"The journal {self.journal_path} continues at vector id {first_vector_id}, "
+                                     f"but the index {self.index_path} holds {index.ntotal} vectors.")
+                index.add(vectors)
+    
+    def _write_pending_ids(self, document_ids: List[str]):
+        """
+        Persist the ids of a batch that is about to be written.
+        
+        :param document_ids: Ids of the documents in the batch
+        """
+        with open(self.pending_path, "w") as f:
+            json.dump(document_ids, f)
+    
+    def _recover_pending_documents(self):
+        """
+        Remove documents of an interrupted batch from the SQL database, validate the store and set its tombstones.
+        
+        The columnar chunk store needs no rollback: it drops rows that were not committed after their batch,
+        and it keeps the vector ids of its deleted rows itself. For the SQL database, the vectors without a
+        document are the ones of deleted documents.
+        
+        :raises ValueError: If the chunk store references vectors missing from the FAISS index
+        """
+        embedding_count = self.document_store.get_embedding_count()
+        if isinstance(self.document_store, ColumnarDocumentStore):
+            if os.path.exists(self.pending_path):
+                os.remove(self.pending_path)
+            if embedding_count > self.document_store.chunks.num_rows:
+                raise ValueError(f"The FAISS index holds {embedding_count} vectors, but the chunk store only "
+                                 f"{self.document_store.chunks.num_rows} chunks.")
+            return
+        
+        vector_ids = self._get_sql_vector_ids()
+        if os.path.exists(self.pending_path):
+            if len(vector_ids) and vector_ids.max() >= embedding_count:
+                with open(self.pending_path, "r") as f:
+                    pending_ids = json.load(f)
+                # delete from the SQL database only, the vectors never made it into the index or the journal
+                SQLDocumentStore.delete_documents(self.document_store, ids=pending_ids)
+                vector_ids = self._get_sql_vector_ids()
+            os.remove(self.pending_path)
+        
+        if len(vector_ids) and vector_ids.max() >= embedding_count:
+            raise ValueError(f"The SQL database references vector id {vector_ids.max()}, but FAISS only holds "
+                             f"{embedding_count} embeddings.")
+        self.document_store.tombstones = VectorTombstones(np.setdiff1d(np.arange(embedding_count), vector_ids))
+    
+    def _get_sql_vector_ids(self) -> np.ndarray:
+        """
+        Get the vector ids of the documents in the SQL database.
+        
+        :return: Sorted vector ids
+        """
+        query = self.document_store.session.query(DocumentORM.vector_id).filter(
+            DocumentORM.index == self.document_store.index, DocumentORM.vector_id.isnot(None))
+        return np.sort(np.fromiter((int(vector_id) for vector_id, in query), dtype=np.int64))
     
     def _cleanup_existing_files(self):
         """
@@ -102,3 +994,9 @@ class DocumentStoreManager:
             os.remove(self.db_path)
         if os.path.exists(self.index_path):
             os.remove(self.index_path)
+        if os.path.exists(self.chunk_store_path):
+            shutil.rmtree(self.chunk_store_path)
+        for file_path in [self.pending_path, self.bm25_path, self.manifest_path, self.journal_path,
+                          self.near_duplicates_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -0,0 +1,131 @@
+"""src.pipeline.embedding_backend_evaluation.py -- Throughput and recall@k of embedding backends versus the fp32 model.
+
+Usage:
+    python -m src.pipeline.embedding_backend_evaluation --num_passages 1000 --num_queries 100
+    python -m src.pipeline.embedding_backend_evaluation --doc_dir data/documents --k 10 --backends onnx-int8"""
+
+import argparse
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.pipeline.document_store import create_faiss_index
+from src.pipeline.embedding_backends import DEFAULT_CACHE_DIR, load_embedding_model
+from src.pipeline.index_evaluation import recall_at_k
+from src.pipeline.options import EMBEDDING_BACKENDS
+from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.retrieval_evaluation import make_keyword_corpus
+
+
+def compare_embedding_backends(embedding_model: str,
+                               passages: List[str],
+                               queries: List[str],
+                               k: int = 5,
+                               backends: Optional[List[str]] = None,
+                               cache_dir: Optional[str] = None,
+                               batch_size: int = 32) -> List[Dict]:
+    """
+    Measure the embedding throughput and the retrieval agreement of backends with the fp32 torch baseline.
+    
+    Each backend embeds the passages and queries, and its top-k passages per query (exact inner product search)
+    are compared with the top-k passages of the baseline: recall@k is the mean fraction of the baseline results
+    the backend retrieves as well.
+    
+    :param embedding_model: Name or path of the embedding model
+    :param passages: Texts to embed and search
+    :param queries: Queries to embed and search with
+    :param k: Number of passages per query
+    :param backends: Backends to compare with the baseline, defaults to all EMBEDDING_BACKENDS
+    :param cache_dir: Directory of the exported models, defaults to DEFAULT_CACHE_DIR
+    :param batch_size: Number of texts embedded at once
+    :return: One result dict per backend, starting with the baseline
+    """
+    backends = ["torch"] + [backend for backend in backends or EMBEDDING_BACKENDS if backend != "torch"]
+    k = min(k, len(passages))
+    
+    results, baseline = [], None
+    for backend in backends:
+        start = time.perf_counter()
+        sentence_model = load_embedding_model(embedding_model, backend=backend, cache_dir=cache_dir)
+        load_seconds = time.perf_counter() - start
+        
+        # warm up, so that one-time initialization is not counted as embedding time
+        sentence_model.encode(passages[:batch_size], batch_size=batch_size, show_progress_bar=False)
+        start = time.perf_counter()
+        passage_embeddings = sentence_model.encode(passages, batch_size=batch_size, show_progress_bar=False)
+        passage_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        query_embeddings = np.stack([sentence_model.encode([query], show_progress_bar=False)[0] for query in queries])
+        query_ms = 1000 * (time.perf_counter() - start) / len(queries)
+        
+        index = create_faiss_index("flat", embedding_dim=passage_embeddings.shape[1])
+        index.add(np.ascontiguousarray(passage_embeddings, dtype=np.float32))
+        _, retrieved = index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
+        
+        passages_per_second = len(passages) / passage_seconds
+        if baseline is None:
+            baseline = {"passages_per_second": passages_per_second, "query_ms": query_ms,
+                        "passage_embeddings": passage_embeddings, "retrieved": retrieved}
+        
+        results.append({
+            "backend": backend,
+            "load_seconds": round(load_seconds, 3),
+            "passages_per_second": round(passages_per_second, 2),
+            "query_ms": round(query_ms, 3),
+            "speedup": round(passages_per_second / baseline["passages_per_second"], 3),
+            "query_speedup": round(baseline["query_ms"] / query_ms, 3),
+            f"recall@{k}": round(recall_at_k(baseline["retrieved"], retrieved), 4),
+            "mean_cosine": round(mean_cosine(baseline["passage_embeddings"], passage_embeddings), 6),
+        })
+    
+    return results
+
+
+def mean_cosine(expected: np.ndarray, actual: np.ndarray) -> float:
+    """
+    Compute the mean cosine similarity of corresponding rows.
+    
+    :param expected: Array of shape (num_vectors, dim)
+    :param actual: Array of the same shape
+    :return: Mean cosine similarity in [-1, 1]
+    """
+    dot = np.sum(expected * actual, axis=1)
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    return float(np.mean(dot / np.maximum(norms, 1e-12)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare throughput and recall@k of embedding backends")
+    parser.add_argument("--embedding_model", default="sentence-transformers/multi-qa-mpnet-base-dot-v1",
+                        help="Name or path of the embedding model")
+    parser.add_argument("--backends", nargs="+", choices=EMBEDDING_BACKENDS, help="Backends to compare")
+    parser.add_argument("--doc_dir", help="Directory whose chunks are embedded; synthetic notes if omitted")
+    parser.add_argument("--num_passages", type=int, default=1000, help="Maximum number of passages")
+    parser.add_argument("--num_queries", type=int, default=100, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of passages per query")
+    parser.add_argument("--batch_size", type=int, default=32, help="Number of texts embedded at once")
+    parser.add_argument("--cache_dir", default=DEFAULT_CACHE_DIR, help="Directory of the exported models")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.doc_dir:
+        passages = [doc.content for doc in preprocess_documents(load_documents(args.doc_dir))][:args.num_passages]
+        # queries are the opening words of sampled chunks
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(passages), min(args.num_queries, len(passages)), replace=False)
+        queries = [" ".join(passages[i].split()[:20]) for i in sample]
+    else:
+        documents, query_pairs = make_keyword_corpus(args.num_passages, args.num_queries)
+        passages = [doc.content for doc in documents]
+        queries = [query for query, _ in query_pairs]
+    
+    results = compare_embedding_backends(args.embedding_model, passages, queries, k=args.k, backends=args.backends,
+                                         cache_dir=args.cache_dir, batch_size=args.batch_size)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
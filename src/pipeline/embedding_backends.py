@@ -0,0 +1,184 @@
+"""src.pipeline.embedding_backends.py -- ONNX Runtime and int8 quantized CPU inference backends of the embedding model.
+
+See src.pipeline.embedding_backend_evaluation for their throughput and recall@k compared with the fp32 model."""
+
+import hashlib
+import inspect
+import logging
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import torch
+from sentence_transformers import SentenceTransformer
+
+from src.pipeline.options import EMBEDDING_BACKENDS
+
+try:
+    import onnxruntime
+except ImportError:  # optional, only needed by the onnx backends
+    onnxruntime = None
+
+
+DEFAULT_CACHE_DIR = "data/onnx_models"
+
+logger = logging.getLogger(__name__)
+
+
+class OnnxTransformerModel(torch.nn.Module):
+    """
+    Runs the exported transformer of a sentence-transformers model in ONNX Runtime.
+    
+    Replaces the Hugging Face model (`auto_model`) of the sentence-transformers Transformer module, so that
+    tokenization, pooling and normalization of the model stay unchanged.
+    
+    :param model_path: Path of the ONNX model
+    :param config: Hugging Face configuration of the exported model
+    :param num_threads: Number of threads per inference call, None for the ONNX Runtime default
+    """
+    
+    def __init__(self, model_path: str, config, num_threads: Optional[int] = None):
+        """
+        Load the ONNX model into an inference session.
+        
+        :param model_path: Path of the ONNX model
+        :param config: Hugging Face configuration of the exported model, read by the Transformer module
+        :param num_threads: Number of threads per inference call, None for the ONNX Runtime default
+        """
+        super().__init__()
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.config = config
+    
+    def forward(self, return_dict: bool = False, **inputs) -> Tuple[torch.Tensor]:
+        """
+        Compute the token embeddings of a tokenized batch.
+        
+        :param return_dict: Ignored, outputs are always returned as a tuple
+        :param inputs: Tokenizer outputs such as input_ids and attention_mask
+        :return: Tuple with the token embeddings, shape (batch, sequence, hidden_size)
+        """
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        token_embeddings = self.session.run(None, feed)[0]
+        return (torch.from_numpy(token_embeddings),)
+
+
+class _TransformerExport(torch.nn.Module):
+    """Maps the positional inputs of torch.onnx.export to the keyword inputs of a Hugging Face model."""
+    
+    def __init__(self, model: torch.nn.Module, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+    
+    def forward(self, *inputs):
+        return self.model(**dict(zip(self.input_names, inputs)), return_dict=False)[0]
+
+
+def get_export_dir(sentence_model: SentenceTransformer, model_name: str, cache_dir: Optional[str] = None) -> Path:
+    """
+    Get the directory of the exported ONNX models of an embedding model.
+    
+    :param sentence_model: Loaded embedding model
+    :param model_name: Name or path the model was loaded from
+    :param cache_dir: Directory of the exported models, defaults to DEFAULT_CACHE_DIR
+    :return: Directory named after a hash of the model name and configuration
+    """
+    # the configuration tells apart different models saved under the same local path
+    config = sentence_model[0].auto_model.config.to_json_string()
+    digest = hashlib.blake2b(f"{model_name}\0{config}".encode("utf-8"), digest_size=8).hexdigest()
+    return Path(cache_dir or DEFAULT_CACHE_DIR) / digest
+
+
+def export_onnx_model(sentence_model: SentenceTransformer, model_name: str, cache_dir: Optional[str] = None,
+                      quantize: bool = False) -> Path:
+    """
+    Export the transformer of an embedding model to ONNX, or reuse an earlier export.
+    
+    :param sentence_model: Loaded embedding model
+    :param model_name: Name or path the model was loaded from
+    :param cache_dir: Directory of the exported models, defaults to DEFAULT_CACHE_DIR
+    :param quantize: Flag to get the model with int8 quantized weights
+    :return: Path of the ONNX model
+    """
+    export_dir = get_export_dir(sentence_model, model_name, cache_dir)
+    fp32_path = export_dir / "model.onnx"
+    int8_path = export_dir / "model.int8.onnx"
+    path = int8_path if quantize else fp32_path
+    if path.exists():
+        return path
+    
+    export_dir.mkdir(parents=True, exist_ok=True)
+    if not fp32_path.exists():
+        logger.info(f"Exporting {model_name} to {fp32_path}")
+        transformer = sentence_model[0]
+        model = transformer.auto_model.eval()
+        sample = transformer.tokenize(["Sample text of the export.", "A second sample."])
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]}
+        # the dynamo exporter, the default of newer torch versions, needs the onnxscript package
+        options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+        
+        # write to a temporary file, so that an interrupted export is not mistaken for a finished one
+        tmp_path = fp32_path.with_name(fp32_path.name + ".tmp")
+        with torch.no_grad():
+            torch.onnx.export(_TransformerExport(model, input_names), tuple(sample[name] for name in input_names),
+                              str(tmp_path), input_names=input_names, output_names=["token_embeddings"],
+                              dynamic_axes=dynamic_axes, opset_version=17, **options)
+        os.replace(tmp_path, fp32_path)
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        logger.info(f"Quantizing {fp32_path} to {int8_path}")
+        tmp_path = int8_path.with_name(int8_path.name + ".tmp")
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        os.replace(tmp_path, int8_path)
+    
+    return path
+
+
+def apply_embedding_backend(sentence_model: SentenceTransformer, backend: str, model_name: str,
+                            cache_dir: Optional[str] = None, num_threads: Optional[int] = None):
+    """
+    Switch a loaded embedding model to an inference backend.
+    
+    :param sentence_model: Loaded embedding model, modified in place
+    :param backend: One of EMBEDDING_BACKENDS
+    :param model_name: Name or path the model was loaded from, identifies its exports
+    :param cache_dir: Directory of the exported models, defaults to DEFAULT_CACHE_DIR
+    :param num_threads: Number of threads per inference call of the onnx backends
+    :raises ValueError: If the backend is unknown
+    :raises ImportError: If an onnx backend is chosen without onnxruntime installed
+    """
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', choose one of {', '.join(EMBEDDING_BACKENDS)}")
+    if backend == "torch":
+        return
+    if onnxruntime is None:
+        raise ImportError(f"The {backend} embedding backend needs ONNX Runtime: pip install onnxruntime onnx")
+    
+    transformer = sentence_model[0]
+    path = export_onnx_model(sentence_model, model_name, cache_dir=cache_dir, quantize=backend == "onnx-int8")
+    transformer.auto_model = OnnxTransformerModel(str(path), transformer.auto_model.config, num_threads=num_threads)
+
+
+def load_embedding_model(model_name: str, backend: str = "torch", cache_dir: Optional[str] = None,
+                         max_seq_len: int = 512) -> SentenceTransformer:
+    """
+    Load an embedding model on the CPU with an inference backend.
+    
+    :param model_name: Name or path of the embedding model
+    :param backend: One of EMBEDDING_BACKENDS
+    :param cache_dir: Directory of the exported models, defaults to DEFAULT_CACHE_DIR
+    :param max_seq_len: Longest length of each text sequence
+    :return: Embedding model
+    """
+    sentence_model = SentenceTransformer(model_name, device="cpu")
+    sentence_model.max_seq_length = max_seq_len
+    apply_embedding_backend(sentence_model, backend, model_name, cache_dir=cache_dir)
+    return sentence_model
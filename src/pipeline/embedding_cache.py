@@ -0,0 +1,448 @@
+"""src.pipeline.embedding_cache.py -- Persistent, content-addressed embedding cache and a retriever that consults it."""
+
+import copy
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from filelock import FileLock
+from haystack.document_stores import BaseDocumentStore
+from haystack.nodes import EmbeddingRetriever
+from haystack.schema import Document
+from sentence_transformers import SentenceTransformer
+
+from src.pipeline.embedding_backends import apply_embedding_backend
+from src.pipeline.metrics import METRICS
+from src.pipeline.micro_batching import MicroBatcher
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embedding vectors keyed by (embedding model name, normalized text hash).
+    
+    Vectors are stored in a memory-mapped float32 array next to a compact index of 16-byte keys and
+    last-use ticks. The cache grows on demand up to `max_entries`; beyond that, the least recently used
+    entries are overwritten.
+    
+    Several caches (e.g. of a CLI run and a query server) may share a directory. Writers hold a file lock on the
+    cache files and first pick up the slots written or evicted by other caches; lookups check the stored key of
+    a slot, so a slot reused by another cache is a miss, never the vector of another text.
+    
+    :param cache_dir: Directory holding the cache files
+    :param model_name: Name of the embedding model the cached vectors belong to
+    :param max_entries: Maximum number of cached vectors
+    """
+    
+    KEY_SIZE = 16
+    MIN_CAPACITY = 1024
+    
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int = 200_000):
+        """
+        Initialize the cache and load existing cache files for the given model, if any.
+        
+        :param cache_dir: Directory holding the cache files
+        :param model_name: Name of the embedding model the cached vectors belong to
+        :param max_entries: Maximum number of cached vectors
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self.max_entries = max_entries
+        
+        # one set of files per model, so vectors of different dimensions never share an array
+        prefix = hashlib.blake2b(model_name.encode("utf-8"), digest_size=8).hexdigest()
+        self._vectors_path = self.cache_dir / f"{prefix}.vectors.npy"
+        self._keys_path = self.cache_dir / f"{prefix}.keys.npy"
+        self._ticks_path = self.cache_dir / f"{prefix}.ticks.npy"
+        
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(str(self.cache_dir / f"{prefix}.lock"))
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._ticks: Optional[np.memmap] = None
+        self._slots: Dict[bytes, int] = {}
+        self._tick = 0
+        # inode and size of the keys file the arrays are mapped from, None if not mapped
+        self._identity = None
+        
+        self.hits = 0
+        self.misses = 0
+        
+        with self._file_lock:
+            self._refresh()
+    
+    def __len__(self) -> int:
+        return len(self._slots)
+    
+    def make_key(self, text: str, kind: str = "passage") -> bytes:
+        """
+        Build the content-addressed key of a text.
+        
+        :param text: Text that is embedded
+        :param kind: Kind of embedding ("passage" or "query"), as models may encode both differently
+        :return: 16-byte key
+        """
+        normalized = " ".join(text.split())
+        payload = f"{self.model_name}\0{kind}\0{normalized}".encode("utf-8")
+        return hashlib.blake2b(payload, digest_size=self.KEY_SIZE).digest()
+    
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached vectors.
+        
+        :param keys: Keys created by `make_key`
+        :return: One vector per key, None for keys that are not cached
+        """
+        with self._lock:
+            if self._file_identity() != self._identity:
+                # another cache grew or cleared the files
+                with self._file_lock:
+                    self._refresh()
+            vectors = []
+            for key in keys:
+                slot = self._slots.get(key)
+                vector = np.array(self._vectors[slot]) if slot is not None else None
+                # writers store the key of a slot before its vector, so a matching key after the copy means the
+                # vector is that of the key
+                if slot is not None and self._keys[slot].tobytes() != key:
+                    # the slot was reused by another cache sharing the directory
+                    del self._slots[key]
+                    slot = None
+                if slot is None:
+                    self.misses += 1
+                    vectors.append(None)
+                    continue
+                self.hits += 1
+                self._tick += 1
+                self._ticks[slot] = self._tick
+                vectors.append(vector)
+            return vectors
+    
+    def put_many(self, keys: List[bytes], embeddings: np.ndarray):
+        """
+        Store vectors in the cache, evicting the least recently used entries if the cache is full.
+        
+        :param keys: Keys created by `make_key`
+        :param embeddings: Array of shape (len(keys), embedding_dim)
+        """
+        if len(keys) == 0:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        
+        with self._lock, self._file_lock:
+            self._refresh()
+            if self._ticks is not None and len(self._ticks) and int(np.max(self._ticks)) > self._tick:
+                # another cache wrote to the files since, its entries and evictions are in the arrays only
+                self._load()
+            
+            # de-duplicate within the batch, the last vector of a key wins
+            batch = {key: i for i, key in enumerate(keys)}
+            if len(batch) > self.max_entries:
+                batch = dict(list(batch.items())[-self.max_entries:])
+            
+            if self._vectors is None:
+                self._allocate(embedding_dim=embeddings.shape[1], capacity=min(self.MIN_CAPACITY, self.max_entries))
+            elif embeddings.shape[1] != self._vectors.shape[1]:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match cache dimension "
+                                 f"{self._vectors.shape[1]}")
+            
+            new_keys = [key for key in batch if key not in self._slots]
+            protected = [self._slots[key] for key in batch if key in self._slots]
+            free_slots = self._reserve_slots(len(new_keys), protected=protected)
+            for key, slot in zip(new_keys, free_slots):
+                self._slots[key] = slot
+                self._keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            
+            for key, i in batch.items():
+                slot = self._slots[key]
+                self._tick += 1
+                self._vectors[slot] = embeddings[i]
+                self._ticks[slot] = self._tick
+            
+            self._flush()
+    
+    def clear(self):
+        """Remove all cached vectors of this model from disk."""
+        with self._lock, self._file_lock:
+            self._vectors = self._keys = self._ticks = None
+            self._slots = {}
+            self._tick = 0
+            self._identity = None
+            for path in [self._vectors_path, self._keys_path, self._ticks_path]:
+                if path.exists():
+                    os.remove(path)
+    
+    def _file_identity(self) -> Optional[tuple]:
+        """
+        Identify the current keys file, which changes when a cache grows or clears the files.
+        
+        :return: Inode and size of the keys file, None if there are no cache files
+        """
+        try:
+            stat = os.stat(self._keys_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+    
+    def _refresh(self):
+        """Map the current cache files if another cache replaced or removed them; requires the file lock."""
+        identity = self._file_identity()
+        if identity == self._identity:
+            return
+        if identity is not None and self._vectors_path.exists() and self._ticks_path.exists():
+            self._load()
+        else:
+            self._vectors = self._keys = self._ticks = None
+            self._slots = {}
+            self._identity = None
+    
+    def _load(self):
+        """Open existing cache files and rebuild the key-to-slot mapping."""
+        self._identity = self._file_identity()
+        self._vectors = np.load(self._vectors_path, mmap_mode="r+")
+        self._keys = np.load(self._keys_path, mmap_mode="r+")
+        self._ticks = np.load(self._ticks_path, mmap_mode="r+")
+        
+        # ticks start at 1, so a zero tick marks an unused slot
+        used = np.flatnonzero(np.asarray(self._ticks) > 0)
+        self._slots = {self._keys[slot].tobytes(): int(slot) for slot in used}
+        self._tick = max(self._tick, int(np.max(self._ticks)) if len(self._ticks) else 0)
+    
+    def _allocate(self, embedding_dim: int, capacity: int):
+        """
+        Create (or grow) the memory-mapped arrays, copying over existing entries.
+        
+        :param embedding_dim: Dimension of the cached vectors
+        :param capacity: Number of slots of the new arrays
+        """
+        tmp_paths = {}
+        for name, path, dtype, shape in [
+            ("_vectors", self._vectors_path, np.float32, (capacity, embedding_dim)),
+            ("_keys", self._keys_path, np.uint8, (capacity, self.KEY_SIZE)),
+            ("_ticks", self._ticks_path, np.int64, (capacity,)),
+        ]:
+            tmp_path = path.with_name(path.name + ".tmp")
+            array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            old = getattr(self, name)
+            if old is not None:
+                array[:len(old)] = old
+            array.flush()
+            del array, old
+            tmp_paths[tmp_path] = path
+        
+        # release all mappings before swapping the files (required on Windows)
+        self._vectors = self._keys = self._ticks = None
+        for tmp_path, path in tmp_paths.items():
+            os.replace(tmp_path, path)
+        self._load()
+    
+    def _reserve_slots(self, count: int, protected: List[int]) -> List[int]:
+        """
+        Find slots for new entries, growing the arrays or evicting least recently used entries.
+        
+        :param count: Number of slots needed
+        :param protected: Slots that must not be evicted
+        :return: List of slot indices
+        """
+        if count == 0:
+            return []
+        
+        capacity = len(self._ticks)
+        required = len(self._slots) + count
+        if required > capacity and capacity < self.max_entries:
+            new_capacity = min(self.max_entries, max(required, 2 * capacity))
+            self._allocate(embedding_dim=self._vectors.shape[1], capacity=new_capacity)
+            capacity = new_capacity
+        
+        free = np.flatnonzero(np.asarray(self._ticks) == 0)[:count].tolist()
+        missing = count - len(free)
+        if missing > 0:
+            ticks = np.array(self._ticks)
+            ticks[protected + free] = np.iinfo(np.int64).max
+            evicted = np.argpartition(ticks, missing - 1)[:missing]
+            evicted_slots = set(int(slot) for slot in evicted)
+            self._slots = {key: slot for key, slot in self._slots.items() if slot not in evicted_slots}
+            free.extend(int(slot) for slot in evicted)
+        return free
+    
+    def _flush(self):
+        """Write pending changes of the memory-mapped arrays to disk."""
+        for array in (self._vectors, self._keys, self._ticks):
+            array.flush()
+
+
+class CachedEmbeddingRetriever(EmbeddingRetriever):
+    """
+    EmbeddingRetriever that looks up document and query embeddings in an EmbeddingCache before running the model.
+    
+    With `query_batch_wait_ms` set, the model calls of concurrent embed_queries calls (e.g. of a query server) are
+    coalesced by a MicroBatcher into batched forward passes of up to `max_query_batch_size` queries. Each batched
+    pass is recorded as stage "query_batch", whose items_per_call is the achieved batch size.
+    
+    With an `embedding_backend` other than "torch", the sentence-transformers model runs in ONNX Runtime (see
+    src.pipeline.embedding_backends); its embeddings differ slightly from the fp32 model, so the embedding cache
+    should be separate per backend.
+    
+    :param embedding_cache: Cache to consult; if None, the retriever behaves like a plain EmbeddingRetriever
+    :param embedding_backend: Inference backend of the model, one of options.EMBEDDING_BACKENDS
+    :param onnx_model_dir: Directory of the exported ONNX models, defaults to embedding_backends.DEFAULT_CACHE_DIR
+    :param max_query_batch_size: Maximum number of queries embedded in one coalesced forward pass
+    :param query_batch_wait_ms: Maximum time in milliseconds a query waits for concurrent queries to batch with,
+                                None to embed the queries of each call separately
+    """
+    
+    def __init__(self,
+                 embedding_model: str,
+                 document_store: Optional[BaseDocumentStore] = None,
+                 use_gpu: bool = True,
+                 batch_size: int = 32,
+                 max_seq_len: int = 512,
+                 top_k: int = 10,
+                 progress_bar: bool = True,
+                 scale_score: bool = True,
+                 embed_meta_fields: Optional[List[str]] = None,
+                 embedding_cache: Optional[EmbeddingCache] = None,
+                 embedding_backend: str = "torch",
+                 onnx_model_dir: Optional[str] = None,
+                 max_query_batch_size: int = 32,
+                 query_batch_wait_ms: Optional[float] = None):
+        """
+        Initialize the retriever.
+        
+        Haystack derives pipeline configurations from the signature of a node, so the supported EmbeddingRetriever
+        parameters are listed explicitly.
+        
+        :param embedding_model: Name or path of the embedding model to use
+        :param document_store: Document store the retriever searches
+        :param use_gpu: Whether to use all available GPUs or the CPU
+        :param batch_size: Number of documents to embed at once
+        :param max_seq_len: Longest length of each document sequence
+        :param top_k: Number of documents to return per query
+        :param progress_bar: Whether to show a progress bar while embedding
+        :param scale_score: Whether to scale the similarity score to the unit interval
+        :param embed_meta_fields: Meta fields embedded together with the document content
+        :param embedding_cache: Cache to consult
+        :param embedding_backend: Inference backend of the model ("torch", "onnx" or "onnx-int8")
+        :param onnx_model_dir: Directory of the exported ONNX models
+        :param max_query_batch_size: Maximum number of queries embedded in one coalesced forward pass
+        :param query_batch_wait_ms: Maximum time in milliseconds a query waits for concurrent queries, None to
+                                    disable coalescing
+        """
+        super().__init__(
+            embedding_model=embedding_model,
+            document_store=document_store,
+            use_gpu=use_gpu,
+            batch_size=batch_size,
+            max_seq_len=max_seq_len,
+            top_k=top_k,
+            progress_bar=progress_bar,
+            scale_score=scale_score,
+            embed_meta_fields=embed_meta_fields
+        )
+        self.embedding_cache = embedding_cache
+        self.embedding_backend = embedding_backend
+        if embedding_backend != "torch":
+            sentence_model = getattr(self.embedding_encoder, "embedding_model", None)
+            if not isinstance(sentence_model, SentenceTransformer):
+                raise ValueError(f"Embedding backend {embedding_backend} supports sentence-transformers models only")
+            apply_embedding_backend(sentence_model, embedding_backend, embedding_model, cache_dir=onnx_model_dir)
+        
+        self.query_batcher = None
+        if query_batch_wait_ms is not None:
+            self.query_batcher = MicroBatcher(lambda queries: EmbeddingRetriever.embed_queries(self, queries),
+                                              max_batch_size=max_query_batch_size, max_wait_ms=query_batch_wait_ms,
+                                              stage="query_batch")
+        # whether close() stops the query batcher, see share
+        self._owns_query_batcher = True
+    
+    def share(self) -> "CachedEmbeddingRetriever":
+        """
+        Create a retriever for another document store that uses the loaded model, the embedding cache and the
+        query batcher of this one.
+        
+        The returned retriever takes over the query batcher: closing it stops the batcher, closing this retriever
+        no longer does.
+        
+        :return: Retriever without a document store
+        """
+        shared = copy.copy(self)
+        shared.document_store = None
+        self._owns_query_batcher = False
+        return shared
+    
+    def close(self):
+        """Stop the query batcher, unless it was handed to a shared retriever."""
+        if self.query_batcher is not None and self._owns_query_batcher:
+            self.query_batcher.close()
+            self._owns_query_batcher = False
+    
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Create embeddings for a list of queries, reusing cached vectors.
+        
+        :param queries: List of queries to embed
+        :return: Embeddings, one per input query, shape: (queries, embedding_dim)
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        embed_fn = self.query_batcher.submit if self.query_batcher is not None else super().embed_queries
+        if self.embedding_cache is None:
+            return self._run_model("query_embedding", embed_fn, queries)
+        
+        keys = [self.embedding_cache.make_key(query, kind="query") for query in queries]
+        return self._embed_with_cache(keys, queries, embed_fn, "query_embedding")
+    
+    def embed_documents(self, documents: List[Document]) -> np.ndarray:
+        """
+        Create embeddings for a list of documents, reusing cached vectors.
+        
+        :param documents: List of documents to embed
+        :return: Embeddings, one per input document, shape: (docs, embedding_dim)
+        """
+        if self.embedding_cache is None:
+            return self._run_model("embedding", super().embed_documents, documents)
+        
+        # key on the text that is actually embedded, i.e. including embedded meta fields
+        texts = [doc.content for doc in self._preprocess_documents(documents)]
+        keys = [self.embedding_cache.make_key(text, kind="passage") for text in texts]
+        return self._embed_with_cache(keys, documents, super().embed_documents, "embedding")
+    
+    def _embed_with_cache(self, keys: List[bytes], items: list, embed_fn, stage: str) -> np.ndarray:
+        """
+        Combine cached vectors with freshly computed ones for the cache misses.
+        
+        :param keys: Cache keys, one per item
+        :param items: Queries or documents to embed
+        :param embed_fn: Function computing embeddings for a list of items
+        :param stage: Name of the metrics stage measuring the model calls
+        :return: Embeddings, one per item
+        """
+        cached = self.embedding_cache.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        
+        if missing:
+            computed = self._run_model(stage, embed_fn, [items[i] for i in missing])
+            self.embedding_cache.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                cached[i] = vector
+        
+        return np.stack(cached).astype(np.float32)
+    
+    @staticmethod
+    def _run_model(stage: str, embed_fn, items: list) -> np.ndarray:
+        """
+        Run the embedding model on a batch, recording its time and batch size in the metrics registry.
+        
+        :param stage: Name of the metrics stage, "embedding" for documents or "query_embedding"
+        :param embed_fn: Function computing embeddings for a list of items
+        :param items: Queries or documents to embed
+        :return: Embeddings, one per item
+        """
+        with METRICS.stage(stage, items=len(items)):
+            return embed_fn(items)
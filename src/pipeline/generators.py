@@ -0,0 +1,222 @@
+"""src.pipeline.generators.py -- Pluggable answer generators for QueryPipeline, including a local stand-in LLM."""
+
+import asyncio
+import hashlib
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterator, List
+
+from haystack.nodes import PromptNode
+from haystack.nodes.prompt.invocation_layer.handlers import TokenStreamingHandler
+from haystack.schema import Document
+
+
+class Generator(ABC):
+    """
+    Generates the answer to a query from the retrieved documents.
+    
+    Subclasses implement generate; agenerate runs it in a worker thread unless a subclass provides native async
+    generation, and stream yields the whole answer at once unless a subclass provides token streaming.
+    """
+    
+    @abstractmethod
+    def generate(self, query: str, documents: List[Document]) -> str:
+        """
+        Generate an answer.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text
+        """
+    
+    async def agenerate(self, query: str, documents: List[Document]) -> str:
+        """
+        Generate an answer without blocking the event loop.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text
+        """
+        return await asyncio.to_thread(self.generate, query, documents)
+    
+    def stream(self, query: str, documents: List[Document]) -> Iterator[str]:
+        """
+        Generate an answer as a stream of text fragments.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Iterator of answer fragments, which concatenate to the answer text
+        """
+        yield self.generate(query, documents)
+
+
+class PromptNodeGenerator(Generator):
+    """
+    Generator backed by a Haystack PromptNode, e.g. an OpenAI model.
+    
+    :param prompt_node: Prompt node rendering the prompt template and calling the LLM
+    """
+    
+    def __init__(self, prompt_node: PromptNode):
+        """
+        Initialize the generator.
+        
+        :param prompt_node: Prompt node rendering the prompt template and calling the LLM
+        """
+        self.prompt_node = prompt_node
+    
+    def generate(self, query: str, documents: List[Document]) -> str:
+        """
+        Generate an answer with the prompt node.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text
+        """
+        output, _ = self.prompt_node.run(query=query, documents=documents)
+        return (output.get("results") or ["No answer generated."])[0]
+    
+    def stream(self, query: str, documents: List[Document]) -> Iterator[str]:
+        """
+        Generate an answer with the prompt node, yielding tokens as the model sends them.
+        
+        The prompt node runs in a background thread whose stream handler forwards each token through a queue.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Iterator of answer tokens
+        """
+        tokens: queue.Queue = queue.Queue()
+        done = object()
+        errors = []
+        
+        def run():
+            try:
+                self.prompt_node.run(query=query, documents=documents,
+                                     generation_kwargs={"stream_handler": _QueueStreamingHandler(tokens)})
+            except Exception as e:
+                errors.append(e)
+            finally:
+                tokens.put(done)
+        
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        while (token := tokens.get()) is not done:
+            yield token
+        thread.join()
+        if errors:
+            raise errors[0]
+
+
+class StubGenerator(Generator):
+    """
+    Deterministic local stand-in for an LLM, for offline tests and throughput measurements without an API key.
+    
+    The answer is derived from the query and the retrieved documents only, so identical inputs always produce
+    identical answers. Each call waits for `latency_seconds` before the first token and `token_interval_seconds`
+    per token to simulate the response time of a remote model; agenerate waits asynchronously, so concurrent
+    calls overlap like requests to a real API.
+    
+    :param latency_seconds: Simulated time to the first token per call
+    :param token_interval_seconds: Simulated time per generated token
+    """
+    
+    def __init__(self, latency_seconds: float = 0.0, token_interval_seconds: float = 0.0):
+        """
+        Initialize the generator.
+        
+        :param latency_seconds: Simulated time to the first token per call
+        :param token_interval_seconds: Simulated time per generated token
+        """
+        if latency_seconds < 0 or token_interval_seconds < 0:
+            raise ValueError("latency_seconds and token_interval_seconds must not be negative")
+        self.latency_seconds = latency_seconds
+        self.token_interval_seconds = token_interval_seconds
+    
+    def generate(self, query: str, documents: List[Document]) -> str:
+        """
+        Generate a deterministic answer after the simulated latency.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text
+        """
+        answer = self._answer(query, documents)
+        time.sleep(self.latency_seconds + self.token_interval_seconds * len(self._tokenize(answer)))
+        return answer
+    
+    async def agenerate(self, query: str, documents: List[Document]) -> str:
+        """
+        Generate a deterministic answer after the simulated latency, without blocking the event loop.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text
+        """
+        answer = self._answer(query, documents)
+        await asyncio.sleep(self.latency_seconds + self.token_interval_seconds * len(self._tokenize(answer)))
+        return answer
+    
+    def stream(self, query: str, documents: List[Document]) -> Iterator[str]:
+        """
+        Generate a deterministic answer word by word, at the simulated latencies.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Iterator of answer tokens
+        """
+        time.sleep(self.latency_seconds)
+        for token in self._tokenize(self._answer(query, documents)):
+            time.sleep(self.token_interval_seconds)
+            yield token
+    
+    @staticmethod
+    def _answer(query: str, documents: List[Document]) -> str:
+        """
+        Build the answer text.
+        
+        :param query: The query string
+        :param documents: Retrieved documents used as context
+        :return: Answer text quoting the best document
+        """
+        if not documents:
+            return "This question cannot be answered based on the given context."
+        
+        digest = hashlib.blake2b(query.encode("utf-8"), digest_size=4).hexdigest()
+        excerpt = " ".join(documents[0].content.split()[:30])
+        return f"[stub {digest}] Based on {len(documents)} documents: {excerpt}"
+    
+    @staticmethod
+    def _tokenize(answer: str) -> List[str]:
+        """
+        Split an answer into word tokens that concatenate to the answer.
+        
+        :param answer: Answer text
+        :return: List of tokens, each but the first with its leading space
+        """
+        words = answer.split(" ")
+        return words[:1] + [f" {word}" for word in words[1:]]
+
+
+class _QueueStreamingHandler(TokenStreamingHandler):
+    """Stream handler of PromptNodeGenerator that forwards received tokens to a queue."""
+    
+    def __init__(self, tokens: queue.Queue):
+        """
+        Initialize the handler.
+        
+        :param tokens: Queue receiving the tokens
+        """
+        self.tokens = tokens
+    
+    def __call__(self, token_received: str, **kwargs) -> str:
+        """
+        Forward a received token.
+        
+        :param token_received: Token received from the model
+        :return: The unchanged token
+        """
+        self.tokens.put(token_received)
+        return token_received
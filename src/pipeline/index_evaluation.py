@@ -0,0 +1,224 @@
+"""src.pipeline.index_evaluation.py -- Recall@k versus latency evaluation of approximate FAISS index types.
+
+Also evaluates the recall@k cost and the size of compressed vector storage (fp16/int8 scalar quantization and
+PCA or truncation to a lower dimension).
+
+Usage:
+    python -m src.pipeline.index_evaluation --index_path data/faiss_document_store.faiss --k 5
+    python -m src.pipeline.index_evaluation --num_vectors 100000 --dim 768
+    python -m src.pipeline.index_evaluation --compression --reduced_dims 384 192"""
+
+import argparse
+import json
+import time
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from src.pipeline.document_store import (DIM_REDUCTIONS, INDEX_TYPES, SEARCH_PARAMS, VECTOR_DTYPES,
+                                         create_faiss_index, get_index_bytes, train_faiss_index)
+
+
+# search parameter values swept per index type
+DEFAULT_SWEEPS = {
+    "flat": {},
+    "hnsw": {"ef_search": [16, 32, 64, 128, 256]},
+    "ivf_flat": {"nprobe": [1, 4, 16, 64]},
+    "ivf_pq": {"nprobe": [1, 4, 16, 64]},
+}
+
+
+def load_vectors(index_path: str) -> np.ndarray:
+    """
+    Load the vectors stored in a saved FAISS index.
+    
+    :param index_path: Path to the FAISS index file
+    :return: Array of shape (num_vectors, dim)
+    """
+    index = faiss.read_index(index_path)
+    if index.ntotal == 0:
+        raise ValueError(f"Index {index_path} is empty")
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        # inverted list indexes need a direct map to reconstruct vectors
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def recall_at_k(ground_truth: np.ndarray, retrieved: np.ndarray) -> float:
+    """
+    Compute the mean fraction of the exact top-k neighbors that were retrieved.
+    
+    :param ground_truth: Exact neighbor ids of shape (num_queries, k)
+    :param retrieved: Approximate neighbor ids of shape (num_queries, k)
+    :return: Recall@k in [0, 1]
+    """
+    hits = [len(set(truth) & set(found)) for truth, found in zip(ground_truth, retrieved)]
+    return float(np.sum(hits)) / ground_truth.size
+
+
+def evaluate_index_types(vectors: np.ndarray,
+                         queries: np.ndarray,
+                         k: int = 5,
+                         index_types: Optional[List[str]] = None,
+                         n_list: Optional[int] = None,
+                         pq_m: int = 64) -> List[Dict]:
+    """
+    Build each index type over the vectors and measure recall@k and latency against the flat baseline.
+    
+    :param vectors: Vectors to index, shape (num_vectors, dim)
+    :param queries: Query vectors, shape (num_queries, dim)
+    :param k: Number of neighbors per query
+    :param index_types: Index types to evaluate, defaults to all INDEX_TYPES
+    :param n_list: Number of inverted lists of IVF indexes, defaults to 4 * sqrt(num_vectors)
+    :param pq_m: Number of product quantizer sub-vectors of IVF-PQ indexes
+    :return: One result dict per index type and search parameter setting
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    index_types = index_types or list(INDEX_TYPES)
+    n_list = n_list or max(1, int(4 * np.sqrt(len(vectors))))
+    dim = vectors.shape[1]
+    
+    baseline = create_faiss_index("flat", embedding_dim=dim)
+    baseline.add(vectors)
+    _, ground_truth = baseline.search(queries, k)
+    
+    results = []
+    for index_type in index_types:
+        index = create_faiss_index(index_type, embedding_dim=dim, n_list=n_list, pq_m=pq_m)
+        
+        start = time.perf_counter()
+        if not index.is_trained:
+            index.train(vectors)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        
+        sweep = DEFAULT_SWEEPS[index_type]
+        settings = [{name: value} for name, values in sweep.items() for value in values] or [{}]
+        parameter_space = faiss.ParameterSpace()
+        for setting in settings:
+            for name, value in setting.items():
+                parameter_space.set_index_parameter(index, SEARCH_PARAMS[name], value)
+            
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query[np.newaxis], k)
+            latency_ms = 1000 * (time.perf_counter() - start) / len(queries)
+            _, retrieved = index.search(queries, k)
+            
+            results.append({
+                "index_type": index_type,
+                "search_params": setting,
+                f"recall@{k}": round(recall_at_k(ground_truth, retrieved), 4),
+                "latency_ms": round(latency_ms, 4),
+                "build_seconds": round(build_seconds, 3),
+            })
+    
+    return results
+
+
+def evaluate_compression(vectors: np.ndarray,
+                         queries: np.ndarray,
+                         k: int = 5,
+                         vector_dtypes: Optional[List[str]] = None,
+                         reduced_dims: Optional[List[int]] = None,
+                         dim_reductions: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Build flat indexes with compressed vectors and measure their size, recall@k and latency.
+    
+    Recall@k is measured against the exact search over the uncompressed fp32 vectors. Each vector dtype is
+    combined with the full dimension and with each reduced dimension and reduction.
+    
+    :param vectors: Vectors to index, shape (num_vectors, dim)
+    :param queries: Query vectors, shape (num_queries, dim)
+    :param k: Number of neighbors per query
+    :param vector_dtypes: Storage types to evaluate, defaults to all VECTOR_DTYPES
+    :param reduced_dims: Reduced dimensions to evaluate, defaults to a half and a quarter of the dimension
+    :param dim_reductions: Projections to evaluate, defaults to all DIM_REDUCTIONS
+    :return: One result dict per setting
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dim = vectors.shape[1]
+    vector_dtypes = vector_dtypes or list(VECTOR_DTYPES)
+    reduced_dims = reduced_dims or [dim // 2, dim // 4]
+    dim_reductions = dim_reductions or list(DIM_REDUCTIONS)
+    
+    baseline = create_faiss_index("flat", embedding_dim=dim)
+    baseline.add(vectors)
+    _, ground_truth = baseline.search(queries, k)
+    baseline_bytes = get_index_bytes(baseline)
+    
+    settings = [{"reduced_dim": None, "dim_reduction": None}]
+    settings += [{"reduced_dim": reduced_dim, "dim_reduction": dim_reduction}
+                 for reduced_dim in reduced_dims for dim_reduction in dim_reductions]
+    
+    results = []
+    for vector_dtype in vector_dtypes:
+        for setting in settings:
+            index = create_faiss_index("flat", embedding_dim=dim, vector_dtype=vector_dtype,
+                                       reduced_dim=setting["reduced_dim"],
+                                       dim_reduction=setting["dim_reduction"] or "pca")
+            if not index.is_trained:
+                train_faiss_index(index, vectors)
+            index.add(vectors)
+            
+            start = time.perf_counter()
+            for query in queries:
+                index.search(query[np.newaxis], k)
+            latency_ms = 1000 * (time.perf_counter() - start) / len(queries)
+            _, retrieved = index.search(queries, k)
+            
+            index_bytes = get_index_bytes(index)
+            results.append({
+                "vector_dtype": vector_dtype,
+                **setting,
+                f"recall@{k}": round(recall_at_k(ground_truth, retrieved), 4),
+                "bytes_per_vector": round(index_bytes / len(vectors), 1),
+                "compression": round(baseline_bytes / index_bytes, 2),
+                "latency_ms": round(latency_ms, 4),
+            })
+    
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate recall@k versus latency of FAISS index types")
+    parser.add_argument("--index_path", help="Saved FAISS index whose vectors are evaluated; synthetic if omitted")
+    parser.add_argument("--num_vectors", type=int, default=20_000, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--num_queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=5, help="Number of neighbors per query")
+    parser.add_argument("--index_types", nargs="+", choices=INDEX_TYPES, help="Index types to evaluate")
+    parser.add_argument("--n_list", type=int, help="Number of inverted lists of IVF indexes")
+    parser.add_argument("--pq_m", type=int, default=64, help="Number of sub-vectors of IVF-PQ indexes")
+    parser.add_argument("--compression", action="store_true",
+                        help="Evaluate compressed vector storage of flat indexes instead of the index types")
+    parser.add_argument("--vector_dtypes", nargs="+", choices=list(VECTOR_DTYPES), help="Storage types to evaluate")
+    parser.add_argument("--reduced_dims", nargs="+", type=int, help="Reduced dimensions to evaluate")
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    if args.index_path:
+        vectors = load_vectors(args.index_path)
+    else:
+        vectors = rng.standard_normal((args.num_vectors, args.dim)).astype(np.float32)
+    
+    # queries are perturbed stored vectors, so that they resemble the indexed distribution
+    sample = vectors[rng.choice(len(vectors), min(args.num_queries, len(vectors)), replace=False)]
+    queries = sample + 0.1 * np.std(vectors) * rng.standard_normal(sample.shape).astype(np.float32)
+    
+    if args.compression:
+        results = evaluate_compression(vectors, queries, k=args.k, vector_dtypes=args.vector_dtypes,
+                                       reduced_dims=args.reduced_dims)
+    else:
+        results = evaluate_index_types(vectors, queries, k=args.k, index_types=args.index_types,
+                                       n_list=args.n_list, pq_m=args.pq_m)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""src.pipeline.ingestion.py -- Streaming, resumable ingestion of document directories into the document store."""
+
+import itertools
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from haystack.schema import Document
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.manifest import IngestionManifest, hash_file
+from src.pipeline.metrics import METRICS
+from src.pipeline.preprocessing import discover_files, iter_file_chunks
+from src.pipeline.token_chunker import TokenChunker
+
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_directory(doc_dir: str,
+                     doc_store_manager: DocumentStoreManager,
+                     batch_size: int = 1000,
+                     num_workers: int = 1,
+                     checkpoint_path: Optional[str] = None,
+                     progress_callback: Optional[Callable[[str, str, Optional[str]], None]] = None,
+                     sync: bool = False,
+                     manifest_path: Optional[str] = None,
+                     chunker: Optional[TokenChunker] = None) -> Dict[str, int]:
+    """
+    Stream the documents of a directory into the document store in bounded batches.
+    
+    Files are converted and chunked lazily; chunks are embedded and written once `batch_size` of them have
+    accumulated, so memory usage is bounded by the batch size rather than by the size of the corpus. After every
+    written batch, its completed files are appended to a checkpoint file, and a rerun after a crash skips them.
+    The checkpoint is removed once the directory has been ingested completely.
+    
+    If the document store manager has near-duplicate detection enabled, chunks that are near-duplicates of stored
+    chunks or of other chunks of the batch are dropped before they are embedded. Their files reference the chunk
+    they duplicate in the manifest instead, so it is kept as long as one of the files contains it. The model time
+    saved is estimated from the average embedding time per chunk of the process.
+    
+    Every ingested file is also recorded in an IngestionManifest with its size, modification time, content hash
+    and chunk ids. With `sync`, the directory is synchronized with the manifest instead: files whose size and
+    modification time are unchanged are skipped without being opened, changed files are chunked again and their
+    stale chunks deleted, and the chunks of files removed from the directory are deleted. The manifest is updated
+    after every written batch, so an interrupted sync resumes where it stopped and needs no checkpoint.
+    
+    :param doc_dir: Path to the directory containing documents
+    :param doc_store_manager: Document store manager to add the chunks to
+    :param batch_size: Number of chunks embedded and written at once
+    :param num_workers: Number of worker processes for document conversion and chunking
+    :param checkpoint_path: Path of the checkpoint file, defaults to the index path with suffix .checkpoint.json
+    :param progress_callback: Optional callable invoked with the file path, its new status ("chunked", "indexed" or
+                              "failed") and the error message of failed files, e.g. to report per-file progress
+    :param sync: Flag to process only added and changed files and delete the chunks of changed and removed files
+    :param manifest_path: Path of the manifest, defaults to the manifest of the document store manager
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor;
+                    with `sync`, unchanged files keep the chunks of the chunker they were ingested with
+    :return: Dictionary with file and chunk counts of the run, and the estimated embedding seconds saved by
+             dropping near-duplicates
+    """
+    if batch_size <= 0:
+        raise ValueError("batch_size must be positive")
+    
+    checkpoint_path = checkpoint_path or str(Path(doc_store_manager.index_path).with_suffix(".checkpoint.json"))
+    completed_files = set() if sync else _load_checkpoint(checkpoint_path, doc_dir)
+    # a checkpoint of an interrupted run over the directory is continued, any other one is replaced
+    append_checkpoint = bool(completed_files)
+    stats = {"files": 0, "files_resumed": len(completed_files), "files_failed": 0, "files_unchanged": 0,
+             "files_removed": 0, "new": 0, "skipped": 0, "reembedded": 0, "deleted": 0, "near_duplicates": 0,
+             "embedding_seconds_saved": 0.0}
+    
+    with IngestionManifest(manifest_path or doc_store_manager.manifest_path) as manifest:
+        discovered = [path for path in discover_files(doc_dir) if str(path) not in completed_files]
+        file_paths, file_states = _compare_with_manifest(discovered, manifest, sync, stats, progress_callback)
+        
+        batch: List[Document] = []
+        batch_files: List[str] = []
+        batch_chunk_ids: Dict[str, List[str]] = {}
+        failed_files = set()
+        
+        def flush():
+            """Embed and write the current batch, then advance the manifest and the checkpoint."""
+            nonlocal append_checkpoint
+            if doc_store_manager.near_duplicates is not None and batch:
+                # the chunks a changed file had before may not stand in for its new chunks
+                replaced_ids = {chunk_id for file_path in batch_chunk_ids
+                                for chunk_id in manifest.get_chunk_ids(file_states[file_path][0])}
+                duplicate_of = doc_store_manager.find_near_duplicates(batch, ignored_ids=replaced_ids)
+                stats["near_duplicates"] += len(duplicate_of)
+                batch[:] = [doc for doc in batch if doc.id not in duplicate_of]
+                for file_path, chunk_ids in batch_chunk_ids.items():
+                    batch_chunk_ids[file_path] = list(dict.fromkeys(duplicate_of.get(chunk_id, chunk_id)
+                                                                    for chunk_id in chunk_ids))
+            if batch:
+                batch_stats = doc_store_manager.add_documents(batch)
+                for key, value in batch_stats.items():
+                    stats[key] += value
+            
+            entries = [(*file_states[file_path], chunk_ids) for file_path, chunk_ids in batch_chunk_ids.items()]
+            if sync:
+                # delete before recording the new state: if interrupted in between, the next sync repeats both
+                stale_ids = manifest.stale_chunk_ids({entry[0]: entry[-1] for entry in entries})
+                if stale_ids:
+                    stats["deleted"] += doc_store_manager.delete_documents(sorted(stale_ids))
+            else:
+                # without sync, the chunks of recorded files are not tracked, so their entries must stay outdated
+                entries = [entry for entry in entries if manifest.get(entry[0]) is None]
+            manifest.put(entries)
+            
+            completed_files.update(batch_files)
+            if not sync:
+                _save_checkpoint(checkpoint_path, doc_dir, batch_files, append=append_checkpoint)
+                append_checkpoint = True
+            if progress_callback is not None:
+                for file_path in batch_files:
+                    if file_path not in failed_files:
+                        progress_callback(file_path, "indexed", None)
+            logger.info(f"Ingested {len(completed_files)} files ({stats['new']} new chunks)")
+            batch.clear()
+            batch_files.clear()
+            batch_chunk_ids.clear()
+        
+        for file_path, chunks, error, content_hash in iter_file_chunks(file_paths, num_workers=num_workers,
+                                                                       chunker=chunker, hash_files=True):
+            if error is not None:
+                # the entry of a file that failed to load stays unchanged, keeping its chunks
+                logger.warning(f"Skipped file {file_path}: {error}")
+                stats["files_failed"] += 1
+                failed_files.add(str(file_path))
+            else:
+                stats["files"] += 1
+                resolved, size, mtime, _ = file_states[str(file_path)]
+                file_states[str(file_path)] = (resolved, size, mtime, content_hash)
+                batch.extend(chunks)
+                batch_chunk_ids[str(file_path)] = list(dict.fromkeys(chunk.id for chunk in chunks))
+            batch_files.append(str(file_path))
+            if progress_callback is not None:
+                progress_callback(str(file_path), "failed" if error is not None else "chunked", error)
+            
+            if len(batch) >= batch_size:
+                flush()
+        
+        if batch or batch_files:
+            flush()
+        
+        if sync:
+            on_disk = {str(path.resolve()) for path in discovered}
+            removed = [path for path in manifest.paths_under(str(Path(doc_dir).resolve())) if path not in on_disk]
+            if removed:
+                stale_ids = manifest.stale_chunk_ids({path: [] for path in removed})
+                if stale_ids:
+                    stats["deleted"] += doc_store_manager.delete_documents(sorted(stale_ids))
+                manifest.remove(removed)
+                stats["files_removed"] = len(removed)
+                logger.info(f"Removed {len(removed)} deleted files ({len(stale_ids)} stale chunks)")
+    
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    
+    if stats["near_duplicates"]:
+        embedding = METRICS.snapshot().get("embedding", {})
+        if embedding.get("items"):
+            seconds_per_chunk = embedding["wall_seconds"] / embedding["items"]
+            stats["embedding_seconds_saved"] = round(stats["near_duplicates"] * seconds_per_chunk, 3)
+        logger.info(f"Dropped {stats['near_duplicates']} near-duplicate chunks, saving about "
+                    f"{stats['embedding_seconds_saved']} s of embedding")
+    
+    return stats
+
+
+def _compare_with_manifest(file_paths: List[Path],
+                           manifest: IngestionManifest,
+                           sync: bool,
+                           stats: Dict[str, int],
+                           progress_callback: Optional[Callable[[str, str, Optional[str]], None]] = None
+                           ) -> Tuple[List[Path], Dict[str, Tuple[str, int, int, str]]]:
+    """
+    Select the files to ingest and record their state before they are read.
+    
+    The size and modification time are taken before chunking, so a file modified while it is ingested differs
+    from its entry at the next sync. Only files whose size or modification time changed since their entry are
+    hashed here, to tell touched from modified files; the other files are hashed by the processes converting
+    them (see iter_file_chunks).
+    
+    :param file_paths: Paths of the discovered files
+    :param manifest: Manifest of the ingested files
+    :param sync: Flag to skip files that are unchanged since they were recorded
+    :param stats: Statistics of the run, counts the unchanged files
+    :param progress_callback: Optional callable reporting unchanged files as "indexed"
+    :return: Tuple of the paths to ingest and the resolved path, size, modification time and hash (None if not
+             hashed yet) of each
+    """
+    selected, file_states = [], {}
+    touched = []
+    for path in file_paths:
+        resolved = str(path.resolve())
+        stat = path.stat()
+        entry = manifest.get(resolved)
+        if sync and entry is not None:
+            if (entry[0], entry[1]) == (stat.st_size, stat.st_mtime_ns):
+                content_hash = None
+            else:
+                content_hash = hash_file(resolved)
+                if content_hash == entry[2]:
+                    # touched but not modified: only the recorded modification time changes
+                    touched.append((resolved, stat.st_size, stat.st_mtime_ns, content_hash, None))
+                    content_hash = None
+            if content_hash is None:
+                stats["files_unchanged"] += 1
+                if progress_callback is not None:
+                    progress_callback(str(path), "indexed", None)
+                continue
+        else:
+            content_hash = None
+        selected.append(path)
+        file_states[str(path)] = (resolved, stat.st_size, stat.st_mtime_ns, content_hash)
+    
+    manifest.put(touched)
+    if sync:
+        logger.info(f"Syncing {len(selected)} added or changed files, {stats['files_unchanged']} are unchanged")
+    return selected, file_states
+
+
+class IngestionJob:
+    """
+    Status of a directory ingested by an IngestionQueue.
+    
+    `status` moves from "queued" over "running" to "done" or "failed". `files` maps each file path to its status:
+    "queued", "chunked" (converted and split, waiting for its batch to be embedded), "indexed" or "failed".
+    
+    :param job_id: Sequential id of the job
+    :param doc_dir: Path to the directory containing documents
+    :param num_workers: Number of worker processes for document conversion and chunking
+    :param remove_when_done: Flag to delete the directory once the job has finished, e.g. for uploaded files
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor
+    """
+    
+    def __init__(self, job_id: int, doc_dir: str, num_workers: int = 1, remove_when_done: bool = False,
+                 chunker: Optional[TokenChunker] = None):
+        """
+        Initialize a queued job, listing the files of the directory.
+        
+        :param job_id: Sequential id of the job
+        :param doc_dir: Path to the directory containing documents
+        :param num_workers: Number of worker processes for document conversion and chunking
+        :param remove_when_done: Flag to delete the directory once the job has finished
+        :param chunker: Optional chunker used instead of the PreProcessor
+        """
+        self.id = job_id
+        self.doc_dir = doc_dir
+        self.num_workers = num_workers
+        self.remove_when_done = remove_when_done
+        self.chunker = chunker
+        self.status = "queued"
+        self.files: Dict[str, str] = {str(path): "queued" for path in discover_files(doc_dir)}
+        self.file_errors: Dict[str, str] = {}
+        self.stats: Optional[Dict[str, int]] = None
+        self.error: Optional[str] = None
+        self.submitted = time.time()
+        self.finished: Optional[float] = None
+    
+    @property
+    def progress(self) -> float:
+        """Fraction of the files that are indexed or failed."""
+        if not self.files:
+            return 1.0 if self.status in ("done", "failed") else 0.0
+        finished = sum(status in ("indexed", "failed") for status in list(self.files.values()))
+        return finished / len(self.files)
+    
+    def update_file(self, file_path: str, status: str, error: Optional[str] = None):
+        """
+        Record the new status of a file; used as progress_callback of ingest_directory.
+        
+        :param file_path: Path of the file
+        :param status: New status of the file
+        :param error: Error message of a failed file
+        """
+        self.files[file_path] = status
+        if error is not None:
+            self.file_errors[file_path] = error
+
+
+class IngestionQueue:
+    """
+    Ingests directories one after another in a background thread.
+    
+    Jobs are ingested with ingest_directory, so other threads keep querying the document store meanwhile (see
+    DocumentStoreManager.lock) and see the chunks of each written batch. Submitting returns at once; poll the
+    IngestionJob for its progress.
+    
+    Use a single queue per document store: jobs of one queue never run at the same time, while jobs of two
+    queues would share the checkpoint and the manifest of the store.
+    
+    :param doc_store_manager: Document store manager to add the chunks to
+    :param batch_size: Number of chunks embedded and written at once
+    :param num_workers: Number of worker processes for document conversion and chunking
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor,
+                    the default of the submitted jobs
+    """
+    
+    def __init__(self, doc_store_manager: DocumentStoreManager, batch_size: int = 1000, num_workers: int = 1,
+                 chunker: Optional[TokenChunker] = None):
+        """
+        Initialize the queue and start its worker thread.
+        
+        :param doc_store_manager: Document store manager to add the chunks to
+        :param batch_size: Number of chunks embedded and written at once
+        :param num_workers: Number of worker processes for document conversion and chunking
+        :param chunker: Optional chunker used instead of the PreProcessor
+        """
+        self.doc_store_manager = doc_store_manager
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.chunker = chunker
+        self.jobs: List[IngestionJob] = []
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[IngestionJob]" = queue.Queue()
+        threading.Thread(target=self._run, name="ingestion", daemon=True).start()
+    
+    def submit(self, doc_dir: str, remove_when_done: bool = False, num_workers: Optional[int] = None,
+               chunker: Optional[TokenChunker] = None) -> IngestionJob:
+        """
+        Queue a directory for ingestion.
+        
+        :param doc_dir: Path to the directory containing documents
+        :param remove_when_done: Flag to delete the directory once the job has finished
+        :param num_workers: Number of worker processes of this job, defaults to the number of the queue
+        :param chunker: Chunker of this job, defaults to the chunker of the queue
+        :return: Queued job
+        """
+        with self._lock:
+            job = IngestionJob(next(self._job_ids), doc_dir, num_workers=num_workers or self.num_workers,
+                               remove_when_done=remove_when_done, chunker=chunker or self.chunker)
+            self.jobs.append(job)
+        self._queue.put(job)
+        return job
+    
+    def is_busy(self) -> bool:
+        """
+        Check whether jobs are queued or running.
+        
+        :return: True if any job has not finished
+        """
+        return any(job.status in ("queued", "running") for job in self.jobs)
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until all submitted jobs have finished.
+        
+        :param timeout: Maximum number of seconds to wait, None to wait indefinitely
+        :return: True if all jobs have finished
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self.is_busy():
+            if deadline is not None and time.perf_counter() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def _run(self):
+        """Ingest the queued jobs in submission order."""
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            try:
+                job.stats = ingest_directory(job.doc_dir, self.doc_store_manager, batch_size=self.batch_size,
+                                             num_workers=job.num_workers, progress_callback=job.update_file,
+                                             chunker=job.chunker)
+                job.status = "done"
+            except Exception as e:
+                logger.exception(f"Ingestion of {job.doc_dir} failed")
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+            finally:
+                job.finished = time.time()
+                if job.remove_when_done:
+                    shutil.rmtree(job.doc_dir, ignore_errors=True)
+
+
+def _load_checkpoint(checkpoint_path: str, doc_dir: str) -> set:
+    """
+    Load the files completed by an interrupted run over the same directory.
+    
+    The checkpoint holds one JSON object per line: the first names the directory, and each one lists completed
+    files under "completed_files". A line cut off by a crash while it was appended is ignored.
+    
+    :param checkpoint_path: Path of the checkpoint file
+    :param doc_dir: Path to the directory containing documents
+    :return: Set of completed file paths
+    """
+    if not os.path.exists(checkpoint_path):
+        return set()
+    
+    records = []
+    with open(checkpoint_path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    
+    checkpoint_dir = records[0].get("doc_dir") if records else None
+    if checkpoint_dir != str(Path(doc_dir).resolve()):
+        logger.info(f"Ignoring checkpoint {checkpoint_path} of directory {checkpoint_dir}")
+        return set()
+    
+    completed_files = {file_path for record in records for file_path in record.get("completed_files", [])}
+    logger.info(f"Resuming ingestion, skipping {len(completed_files)} completed files")
+    return completed_files
+
+
+def _save_checkpoint(checkpoint_path: str, doc_dir: str, completed_files: List[str], append: bool):
+    """
+    Record the files completed by a batch in the checkpoint file.
+    
+    Each batch appends one line, so the cost of a checkpoint does not grow with the number of completed files.
+    
+    :param checkpoint_path: Path of the checkpoint file
+    :param doc_dir: Path to the directory containing documents
+    :param completed_files: File paths completed by the batch
+    :param append: Flag to append to the checkpoint of this run, else a new checkpoint is written atomically
+    """
+    record = json.dumps({"completed_files": completed_files}) + "\n"
+    if append:
+        with open(checkpoint_path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # a line cut off by a crash is terminated, so that it does not swallow the record
+                    record = "\n" + record
+            f.write(record.encode("utf-8"))
+        return
+    
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps({"doc_dir": str(Path(doc_dir).resolve())}) + "\n" + record)
+    os.replace(tmp_path, checkpoint_path)
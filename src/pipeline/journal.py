@@ -0,0 +1,116 @@
+"""src.pipeline.journal.py -- Append-only journal of the vectors added to a FAISS index since it was last saved."""
+
+import json
+import os
+import struct
+import zlib
+from typing import List, Tuple
+
+import numpy as np
+
+
+# magic, first vector id, number of vectors, dimension, length of the encoded document ids
+_HEADER = struct.Struct("<4sQQII")
+_MAGIC = b"VJR1"
+_CHECKSUM = struct.Struct("<I")
+
+
+class VectorJournal:
+    """
+    Append-only file of the vector batches added to a FAISS index after its last full save.
+    
+    Each record holds the vector id of its first vector, the document ids and the vectors of one batch, followed by a
+    CRC32 checksum; records are fsync'd when appended. At load, the records the saved index doesn't contain yet are
+    added to it again, so a batch costs a write proportional to its size instead of a rewrite of the whole index. A
+    record cut short by a crash fails its checksum and is dropped together with everything after it.
+    
+    :param path: Path of the journal file, created if missing
+    """
+    
+    def __init__(self, path: str):
+        """
+        Open the journal.
+        
+        :param path: Path of the journal file, created if missing
+        """
+        self.path = path
+        self._file = open(path, "ab")
+        # file offset and number of vectors of each record that was read or appended
+        self._records: List[Tuple[int, int]] = []
+    
+    def __len__(self) -> int:
+        """Number of records that were read or appended."""
+        return len(self._records)
+    
+    @property
+    def num_vectors(self) -> int:
+        """Number of vectors in the records that were read or appended."""
+        return sum(count for _, count in self._records)
+    
+    @property
+    def size(self) -> int:
+        """Size of the journal file in bytes."""
+        return self._file.tell()
+    
+    def append(self, first_vector_id: int, document_ids: List[str], vectors: np.ndarray):
+        """
+        Durably append the vectors of a batch.
+        
+        :param first_vector_id: Vector id of the first vector in the index
+        :param document_ids: Ids of the documents of the vectors
+        :param vectors: Vectors as added to the index, of shape (num_vectors, dim)
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        encoded_ids = json.dumps(document_ids).encode("utf-8")
+        record = (_HEADER.pack(_MAGIC, first_vector_id, len(vectors), vectors.shape[1], len(encoded_ids))
+                  + encoded_ids + vectors.tobytes())
+        offset = self.size
+        self._file.write(record + _CHECKSUM.pack(zlib.crc32(record)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._records.append((offset, len(vectors)))
+    
+    def read(self) -> List[Tuple[int, int, List[str], np.ndarray]]:
+        """
+        Read all intact records and drop a torn or corrupt tail.
+        
+        :return: Tuples of file offset, first vector id, document ids and vectors of each record
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+        
+        records = []
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            magic, first_vector_id, count, dim, ids_length = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + ids_length + 4 * count * dim
+            if magic != _MAGIC or end + _CHECKSUM.size > len(data) or \
+                    _CHECKSUM.unpack_from(data, end)[0] != zlib.crc32(data[offset:end]):
+                break
+            ids_start = offset + _HEADER.size
+            document_ids = json.loads(data[ids_start:ids_start + ids_length].decode("utf-8"))
+            vectors = np.frombuffer(data, dtype="<f4", count=count * dim, offset=ids_start + ids_length)
+            records.append((offset, first_vector_id, document_ids, vectors.reshape(count, dim)))
+            offset = end + _CHECKSUM.size
+        
+        self._records = [(record[0], len(record[3])) for record in records]
+        if offset < len(data):
+            self.truncate(offset)
+        return records
+    
+    def truncate(self, offset: int = 0):
+        """
+        Durably drop all records from a file offset on.
+        
+        :param offset: Offset of the first dropped record, 0 to empty the journal
+        """
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        os.fsync(self._file.fileno())
+        self._records = [record for record in self._records if record[0] < offset]
+    
+    def close(self):
+        """
+        Close the journal file.
+        """
+        self._file.close()
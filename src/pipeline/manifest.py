@@ -0,0 +1,149 @@
+"""src.pipeline.manifest.py -- Persisted record of the ingested files and their chunks, for incremental re-syncs."""
+
+import hashlib
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# files are hashed in blocks, so large files are never read into memory at once
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(path: str) -> str:
+    """
+    Hash the content of a file.
+    
+    :param path: Path of the file
+    :return: Hex digest of the BLAKE2b hash of the content
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    SQLite table of the ingested files with their size, modification time, content hash and chunk ids.
+    
+    A re-sync compares the size and modification time of each file with its entry and skips unchanged files
+    without opening them; the content hash catches files that were touched but not modified. The chunk ids tell
+    which chunks of a changed or removed file are stale. Chunk ids are content hashes, so files with identical
+    passages share chunks, and a chunk is only stale once no file references it anymore.
+    
+    :param path: Path of the SQLite database, created if missing
+    """
+    
+    def __init__(self, path: str):
+        """
+        Open the manifest.
+        
+        :param path: Path of the SQLite database, created if missing
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS files "
+                                     "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS file_chunks (path TEXT, chunk_id TEXT, "
+                                     "PRIMARY KEY (path, chunk_id)) WITHOUT ROWID")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS file_chunks_chunk_id ON file_chunks (chunk_id)")
+    
+    def __enter__(self) -> "IngestionManifest":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __len__(self) -> int:
+        """Number of recorded files."""
+        return self._connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._connection.close()
+    
+    def get(self, path: str) -> Optional[Tuple[int, int, str]]:
+        """
+        Get the recorded state of a file.
+        
+        :param path: Resolved path of the file
+        :return: Tuple of size, modification time in nanoseconds and content hash, None if not recorded
+        """
+        return self._connection.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?", (path,)).fetchone()
+    
+    def get_chunk_ids(self, path: str) -> List[str]:
+        """
+        Get the chunk ids recorded for a file.
+        
+        :param path: Resolved path of the file
+        :return: Chunk ids
+        """
+        return [chunk_id for chunk_id, in
+                self._connection.execute("SELECT chunk_id FROM file_chunks WHERE path = ?", (path,))]
+    
+    def paths_under(self, directory: str) -> List[str]:
+        """
+        List the recorded files in a directory and its subdirectories.
+        
+        :param directory: Resolved path of the directory
+        :return: Sorted file paths
+        """
+        prefix = directory.rstrip(os.sep) + os.sep
+        # all paths starting with the prefix sort between it and the prefix with its last character incremented
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._connection.execute("SELECT path FROM files WHERE path >= ? AND path < ? ORDER BY path",
+                                        (prefix, upper))
+        return [path for path, in rows]
+    
+    def stale_chunk_ids(self, new_chunk_ids: Dict[str, Iterable[str]]) -> Set[str]:
+        """
+        Find the chunks that are no longer referenced once the given files have been updated.
+        
+        :param new_chunk_ids: New chunk ids of each updated file, empty for removed files
+        :return: Ids of the chunks recorded for the updated files that neither they nor any other file reference
+        """
+        paths = list(new_chunk_ids)
+        referenced = set().union(*new_chunk_ids.values())
+        stale = set()
+        for start in range(0, len(paths), 500):
+            batch = paths[start:start + 500]
+            placeholders = ", ".join("?" * len(batch))
+            # old chunks of the updated files, unless another file references them
+            rows = self._connection.execute(
+                f"SELECT DISTINCT old.chunk_id FROM file_chunks old WHERE old.path IN ({placeholders}) AND NOT EXISTS "
+                f"(SELECT 1 FROM file_chunks other WHERE other.chunk_id = old.chunk_id "
+                f"AND other.path NOT IN ({placeholders}))", batch + batch)
+            stale.update(chunk_id for chunk_id, in rows if chunk_id not in referenced)
+        return stale
+    
+    def put(self, entries: Iterable[Tuple[str, int, int, str, Optional[Iterable[str]]]]):
+        """
+        Record the state of files in one transaction.
+        
+        :param entries: Tuples of resolved path, size, modification time in nanoseconds, content hash and chunk
+                        ids; chunk ids of None keep the recorded ones, e.g. for files touched but not modified
+        """
+        with self._connection:
+            for path, size, mtime_ns, content_hash, chunk_ids in entries:
+                self._connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                                         (path, size, mtime_ns, content_hash))
+                if chunk_ids is not None:
+                    self._connection.execute("DELETE FROM file_chunks WHERE path = ?", (path,))
+                    self._connection.executemany("INSERT OR IGNORE INTO file_chunks VALUES (?, ?)",
+                                                 ((path, chunk_id) for chunk_id in chunk_ids))
+    
+    def remove(self, paths: Iterable[str]):
+        """
+        Remove files and their chunk ids in one transaction.
+        
+        :param paths: Resolved paths of the files
+        """
+        with self._connection:
+            for path in paths:
+                self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                self._connection.execute("DELETE FROM file_chunks WHERE path = ?", (path,))
@@ -0,0 +1,278 @@
+"""src.pipeline.metrics.py -- Per-stage wall time, CPU time and memory instrumentation with JSON and Prometheus export."""
+
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# upper bounds of the Prometheus latency histogram buckets in seconds
+HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# per-query stage timings of the current thread or asyncio task, see collect_timings
+_active_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("active_timings", default=None)
+
+
+def peak_rss_bytes() -> int:
+    """
+    Get the peak resident set size of the current process.
+    
+    :return: High-water mark of the resident memory in bytes, 0 if unavailable
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Measurement:
+    """
+    Context manager measuring the wall time, CPU time and peak memory of a block.
+    
+    CPU time is process-wide, so it includes other threads running concurrently with the block (e.g. the
+    intra-op threads of the embedding model). Peak memory is the process high-water mark at the end of the block.
+    Measurements taken in worker processes can be sent back and recorded with MetricsRegistry.record.
+    
+    :param items: Number of items processed in the block; may be set inside the block once known
+    """
+    
+    def __init__(self, items: int = 0):
+        """
+        Initialize an empty measurement.
+        
+        :param items: Number of items processed in the block
+        """
+        self.items = items
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_bytes = 0
+    
+    def __enter__(self) -> "Measurement":
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        self.peak_rss_bytes = peak_rss_bytes()
+    
+    def as_dict(self) -> Dict[str, float]:
+        """
+        Convert the measurement to keyword arguments of MetricsRegistry.record.
+        
+        :return: Dict with wall_seconds, cpu_seconds, peak_rss_bytes and items
+        """
+        return {"wall_seconds": self.wall_seconds, "cpu_seconds": self.cpu_seconds,
+                "peak_rss_bytes": self.peak_rss_bytes, "items": self.items}
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of per-stage measurements.
+    
+    Each stage accumulates the number of calls, wall and CPU time, processed items (e.g. the chunks of an
+    embedding batch) and the peak memory, and keeps the most recent wall times for percentiles. The registry
+    is exported as JSON (snapshot, to_json) or in the Prometheus text format (to_prometheus, serve).
+    
+    :param max_samples: Number of recent wall times kept per stage for percentiles
+    :param prefix: Prefix of the Prometheus metric names
+    """
+    
+    def __init__(self, max_samples: int = 2048, prefix: str = "pipeline"):
+        """
+        Initialize an empty registry.
+        
+        :param max_samples: Number of recent wall times kept per stage for percentiles
+        :param prefix: Prefix of the Prometheus metric names
+        """
+        self.max_samples = max_samples
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict] = {}
+    
+    @contextmanager
+    def stage(self, name: str, items: int = 0) -> Iterator[Measurement]:
+        """
+        Measure a block as one call of a stage.
+        
+        The wall time is also added to the per-query timings of the enclosing collect_timings block, if any.
+        
+        :param name: Stage name, e.g. "embedding"
+        :param items: Number of items processed by the call, or set measurement.items inside the block
+        :return: Context manager yielding the running measurement
+        """
+        measurement = Measurement(items)
+        try:
+            with measurement:
+                yield measurement
+        finally:
+            self.record(name, **measurement.as_dict())
+    
+    def record(self, name: str, wall_seconds: float, cpu_seconds: float = 0.0, peak_rss_bytes: int = 0,
+               items: int = 0):
+        """
+        Record one call of a stage.
+        
+        :param name: Stage name
+        :param wall_seconds: Wall time of the call
+        :param cpu_seconds: CPU time of the call
+        :param peak_rss_bytes: Peak resident memory of the process during the call
+        :param items: Number of items processed by the call
+        """
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {
+                    "count": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "items": 0, "peak_rss_bytes": 0,
+                    "buckets": [0] * len(HISTOGRAM_BUCKETS), "samples": deque(maxlen=self.max_samples),
+                }
+            stage["count"] += 1
+            stage["wall_seconds"] += wall_seconds
+            stage["cpu_seconds"] += cpu_seconds
+            stage["items"] += items
+            stage["peak_rss_bytes"] = max(stage["peak_rss_bytes"], peak_rss_bytes)
+            stage["samples"].append(wall_seconds)
+            for i, bound in enumerate(HISTOGRAM_BUCKETS):
+                if wall_seconds <= bound:
+                    stage["buckets"][i] += 1
+        
+        timings = _active_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + wall_seconds
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Summarize all stages.
+        
+        :return: Dict of stage name to call count, wall time totals and percentiles in seconds, CPU time,
+                 items, items per call and per second, and peak memory in bytes
+        """
+        with self._lock:
+            summary = {}
+            for name, stage in sorted(self._stages.items()):
+                p50, p95, p99 = np.percentile(np.asarray(stage["samples"]), [50, 95, 99])
+                summary[name] = {
+                    "count": stage["count"],
+                    "wall_seconds": round(stage["wall_seconds"], 6),
+                    "wall_p50_seconds": round(float(p50), 6),
+                    "wall_p95_seconds": round(float(p95), 6),
+                    "wall_p99_seconds": round(float(p99), 6),
+                    "cpu_seconds": round(stage["cpu_seconds"], 6),
+                    "items": stage["items"],
+                    "items_per_call": round(stage["items"] / stage["count"], 2),
+                    "items_per_second": round(stage["items"] / stage["wall_seconds"], 2)
+                    if stage["wall_seconds"] > 0 else 0.0,
+                    "peak_rss_bytes": stage["peak_rss_bytes"],
+                }
+            return summary
+    
+    def to_json(self) -> str:
+        """
+        Export the registry as JSON.
+        
+        :return: JSON object of snapshot
+        """
+        return json.dumps(self.snapshot(), indent=2)
+    
+    def to_prometheus(self) -> str:
+        """
+        Export the registry in the Prometheus text exposition format.
+        
+        :return: Metrics text, one histogram of wall time and counters of CPU time, calls and items per stage
+        """
+        prefix = self.prefix
+        lines = [
+            f"# HELP {prefix}_stage_wall_seconds Wall time of pipeline stage calls.",
+            f"# TYPE {prefix}_stage_wall_seconds histogram",
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for name, stage in stages:
+                for bound, count in zip(HISTOGRAM_BUCKETS, np.cumsum(stage["buckets"])):
+                    lines.append(f'{prefix}_stage_wall_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+                lines.append(f'{prefix}_stage_wall_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+                lines.append(f'{prefix}_stage_wall_seconds_sum{{stage="{name}"}} {stage["wall_seconds"]}')
+                lines.append(f'{prefix}_stage_wall_seconds_count{{stage="{name}"}} {stage["count"]}')
+            
+            for metric, key, kind, description in [
+                ("stage_cpu_seconds_total", "cpu_seconds", "counter", "Process CPU time during pipeline stage calls."),
+                ("stage_items_total", "items", "counter", "Items processed by pipeline stages."),
+                ("stage_peak_rss_bytes", "peak_rss_bytes", "gauge", "Peak resident memory seen by pipeline stages."),
+            ]:
+                lines.append(f"# HELP {prefix}_{metric} {description}")
+                lines.append(f"# TYPE {prefix}_{metric} {kind}")
+                for name, stage in stages:
+                    lines.append(f'{prefix}_{metric}{{stage="{name}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+    
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve the registry over HTTP in a background thread: /metrics in Prometheus format, /metrics.json as JSON.
+        
+        :param port: Port to listen on, 0 picks a free port
+        :param host: Interface to listen on
+        :return: Running server; call shutdown() to stop it
+        """
+        registry = self
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = registry.to_json(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    
+    def reset(self):
+        """Drop all recorded measurements."""
+        with self._lock:
+            self._stages.clear()
+
+
+@contextmanager
+def collect_timings(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """
+    Collect the wall time of every stage recorded in the current thread or asyncio task, e.g. for one query.
+    
+    :param timings: Dict to add to, e.g. the timings of a preceding step; a new dict by default
+    :return: Context manager yielding the dict of stage name to accumulated seconds
+    """
+    timings = {} if timings is None else timings
+    token = _active_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _active_timings.reset(token)
+
+
+# process-wide registry shared by all pipeline components
+METRICS = MetricsRegistry()
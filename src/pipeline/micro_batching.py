@@ -0,0 +1,160 @@
+"""src.pipeline.micro_batching.py -- Coalescing of concurrent calls into batched calls, e.g. of the query encoder."""
+
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from src.pipeline.metrics import METRICS
+
+
+class _Request:
+    """Items of one caller and the slot for their result."""
+    
+    def __init__(self, items: list):
+        self.items = items
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent calls of a batch function into fewer, larger calls.
+    
+    Callers submit lists of items and block until their rows are computed. A background thread takes the first
+    waiting request, collects further requests for up to `max_wait_ms` or until `max_batch_size` items are
+    gathered, runs the batch function once on all of them and hands each caller its rows. A single request larger
+    than `max_batch_size` is run as one batch; requests are never split.
+    
+    Each call of the batch function is recorded as stage `stage` in metrics.METRICS with the number of items, so
+    items_per_call of the stage is the achieved batch size.
+    
+    :param batch_fn: Function mapping a list of items to an array with one row per item
+    :param max_batch_size: Maximum number of items per call of batch_fn
+    :param max_wait_ms: Maximum time in milliseconds the first request of a batch waits for more requests
+    :param stage: Name of the metrics stage of the batch function calls
+    """
+    
+    def __init__(self, batch_fn: Callable[[list], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 stage: str = "micro_batch"):
+        """
+        Initialize the batcher and start its background thread.
+        
+        :param batch_fn: Function mapping a list of items to an array with one row per item
+        :param max_batch_size: Maximum number of items per call of batch_fn
+        :param max_wait_ms: Maximum time in milliseconds the first request of a batch waits for more requests
+        :param stage: Name of the metrics stage of the batch function calls
+        """
+        if max_batch_size <= 0 or max_wait_ms < 0:
+            raise ValueError("max_batch_size must be positive and max_wait_ms must not be negative")
+        
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.stage = stage
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        # guards _closed, so that no request is queued behind the sentinel of close()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"{stage}-batcher", daemon=True)
+        self._thread.start()
+    
+    def submit(self, items: list) -> np.ndarray:
+        """
+        Compute the rows of items as part of a batch.
+        
+        :param items: Items of the caller
+        :return: Rows of the batch function for the items, in order
+        :raises Exception: The exception raised by the batch function for the batch of the items
+        """
+        request = _Request(list(items))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+    
+    def close(self):
+        """Stop the background thread after the submitted requests have been processed and reject new requests."""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        """Process requests until closed, then fail the requests left in the queue."""
+        try:
+            self._process_requests()
+        finally:
+            self._fail_pending()
+    
+    def _process_requests(self):
+        """Collect requests into batches and process them until the sentinel of close() is taken."""
+        carried: Optional[_Request] = None
+        while True:
+            first = carried if carried is not None else self._queue.get()
+            carried = None
+            if first is None:
+                return
+            
+            batch = [first]
+            size = len(first.items)
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            closing = False
+            while size < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                if size + len(request.items) > self.max_batch_size:
+                    # the request opens the next batch
+                    carried = request
+                    break
+                batch.append(request)
+                size += len(request.items)
+            
+            self._process(batch)
+            if closing:
+                return
+    
+    def _fail_pending(self):
+        """Fail the requests that are still queued, so that their callers do not wait forever."""
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request.error = RuntimeError("MicroBatcher is closed")
+                request.done.set()
+    
+    def _process(self, batch: List[_Request]):
+        """
+        Run the batch function on the items of a batch and hand each request its rows.
+        
+        :param batch: Requests of the batch
+        """
+        items = [item for request in batch for item in request.items]
+        try:
+            with METRICS.stage(self.stage, items=len(items)):
+                rows = self.batch_fn(items)
+            start = 0
+            for request in batch:
+                request.result = rows[start:start + len(request.items)]
+                start += len(request.items)
+        except BaseException as e:
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
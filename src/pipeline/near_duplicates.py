@@ -0,0 +1,290 @@
+"""src.pipeline.near_duplicates.py -- MinHash LSH index of the ingested chunks for near-duplicate removal."""
+
+import logging
+import re
+import sqlite3
+import threading
+import zlib
+from typing import Collection, Dict, List, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# signature of a text without words; such texts are neither indexed nor reported as duplicates
+_EMPTY = np.iinfo(np.uint32).max
+# multiplier combining the word hashes of a shingle
+_SHINGLE_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Choose the banding of MinHash signatures for a similarity threshold.
+    
+    Two signatures are candidates if all rows of at least one band are equal, which happens with probability
+    1 - (1 - s^rows)^bands for texts of Jaccard similarity s. The banding minimizes the sum of the probability of
+    missing pairs above the threshold and of finding pairs below it.
+    
+    :param threshold: Jaccard similarity from which texts are near-duplicates
+    :param num_perm: Number of hash functions of a signature
+    :return: Tuple of the number of bands and of rows per band
+    """
+    similarities = np.linspace(0.0, 1.0, 1001)
+    below = similarities < threshold
+    best, best_error = (num_perm, 1), np.inf
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        probability = 1.0 - (1.0 - similarities ** rows) ** bands
+        error = probability[below].mean() * threshold + (1.0 - probability[~below]).mean() * (1.0 - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash LSH index of chunk texts.
+    
+    A text is reduced to the set of its word shingles (`shingle_size` consecutive lower-cased words), and its
+    signature holds the minimum of `num_perm` hash functions over the shingles, so the fraction of equal
+    signature entries estimates the Jaccard similarity of two texts. Signatures are split into bands stored in an
+    SQLite table (see lsh_bands), so candidates are found by equal bands instead of comparing with every indexed
+    chunk; candidates are confirmed with the full signature. Since the index is persistent, chunks are also
+    recognized as near-duplicates of chunks ingested by earlier runs.
+    
+    Changing the threshold re-bands the stored signatures; changing `num_perm` or `shingle_size` clears the index.
+    
+    :param path: Path of the SQLite database, created if missing
+    :param threshold: Estimated Jaccard similarity from which a chunk is a near-duplicate of another
+    :param num_perm: Number of hash functions of a signature
+    :param shingle_size: Number of words per shingle
+    """
+    
+    def __init__(self, path: str, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 3):
+        """
+        Open the index.
+        
+        :param path: Path of the SQLite database, created if missing
+        :param threshold: Estimated Jaccard similarity from which a chunk is a near-duplicate of another
+        :param num_perm: Number of hash functions of a signature
+        :param shingle_size: Number of words per shingle
+        """
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold must be in (0, 1]")
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        
+        # odd multipliers and offsets of the multiply-shift hash functions; fixed, as signatures are persisted
+        rng = np.random.default_rng(0)
+        self._multipliers = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._offsets = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        
+        # ingestion and deletions may run in different threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS signatures "
+                                     "(chunk_id TEXT PRIMARY KEY, signature BLOB) WITHOUT ROWID")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, key BLOB, chunk_id TEXT, "
+                                     "PRIMARY KEY (band, key, chunk_id)) WITHOUT ROWID")
+        self._check_config()
+    
+    def __enter__(self) -> "NearDuplicateIndex":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def __len__(self) -> int:
+        """Number of indexed chunks."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+    
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._connection.close()
+    
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        Compute the MinHash signatures of texts.
+        
+        :param texts: Texts, e.g. the contents of chunks
+        :return: Signatures, shape: (texts, num_perm), dtype uint32
+        """
+        signatures = np.full((len(texts), self.num_perm), _EMPTY, dtype=np.uint32)
+        for i, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            if not words:
+                continue
+            hashes = np.fromiter((zlib.crc32(word.encode("utf-8")) for word in words), dtype=np.uint64,
+                                 count=len(words))
+            # texts shorter than a shingle form a single shingle
+            size = min(self.shingle_size, len(hashes))
+            shingles = hashes[:len(hashes) - size + 1].copy()
+            for offset in range(1, size):
+                shingles = shingles * _SHINGLE_MULTIPLIER + hashes[offset:len(hashes) - size + 1 + offset]
+            shingles = np.unique(shingles)
+            # multiply-shift hashing: the high 32 bits of a * x + b modulo 2^64
+            hashed = (self._multipliers[:, None] * shingles[None, :] + self._offsets[:, None]) >> np.uint64(32)
+            signatures[i] = hashed.min(axis=1)
+        return signatures
+    
+    def find_duplicates(self, chunk_ids: List[str], signatures: np.ndarray,
+                        ignored_ids: Collection[str] = ()) -> Dict[int, str]:
+        """
+        Find the chunks of a batch that are near-duplicates of indexed chunks or of earlier chunks of the batch.
+        
+        Chunks with the id of an indexed chunk are exact duplicates and not reported.
+        
+        :param chunk_ids: Ids of the chunks of the batch
+        :param signatures: Signatures of the chunks, see signatures
+        :param ignored_ids: Ids of indexed chunks that no chunk is reported as a near-duplicate of, e.g. the chunks
+                            a changed file replaces
+        :return: Dict of the position of each near-duplicate in the batch to the id of the most similar chunk
+        """
+        keys = [self._band_keys(signature) for signature in signatures]
+        candidates = self._lookup(keys)
+        candidate_ids = {chunk_id for ids in candidates for chunk_id in ids}
+        with self._lock:
+            stored = self._get_signatures(candidate_ids)
+        
+        duplicates = {}
+        kept_buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        for i, (chunk_id, signature) in enumerate(zip(chunk_ids, signatures)):
+            if signature[0] == _EMPTY or chunk_id in stored:
+                # exact duplicates are skipped by DocumentStoreManager.add_documents
+                continue
+            batch_candidates = {j for band, key in enumerate(keys[i]) for j in kept_buckets.get((band, key), [])}
+            best_id, best_similarity = None, self.threshold
+            for other_id in candidates[i]:
+                if other_id in stored and other_id not in ignored_ids:
+                    similarity = np.mean(stored[other_id] == signature)
+                    if similarity >= best_similarity:
+                        best_id, best_similarity = other_id, similarity
+            for j in sorted(batch_candidates):
+                if chunk_ids[j] != chunk_id:
+                    similarity = np.mean(signatures[j] == signature)
+                    if similarity >= best_similarity:
+                        best_id, best_similarity = chunk_ids[j], similarity
+            
+            if best_id is not None:
+                duplicates[i] = best_id
+            else:
+                for band, key in enumerate(keys[i]):
+                    kept_buckets.setdefault((band, key), []).append(i)
+        return duplicates
+    
+    def add(self, chunk_ids: List[str], signatures: np.ndarray):
+        """
+        Index the signatures of chunks in one transaction; ids that are already indexed are ignored.
+        
+        :param chunk_ids: Ids of the chunks
+        :param signatures: Signatures of the chunks, see signatures
+        """
+        rows = [(chunk_id, signature) for chunk_id, signature in zip(chunk_ids, signatures) if signature[0] != _EMPTY]
+        with self._lock, self._connection:
+            self._insert(rows)
+    
+    def remove(self, chunk_ids: List[str]):
+        """
+        Remove chunks from the index in one transaction, e.g. after they were deleted from the document store.
+        
+        :param chunk_ids: Ids of the chunks, ids that are not indexed are ignored
+        """
+        with self._lock:
+            signatures = self._get_signatures(chunk_ids)
+        with self._lock, self._connection:
+            for chunk_id, signature in signatures.items():
+                self._connection.executemany("DELETE FROM bands WHERE band = ? AND key = ? AND chunk_id = ?",
+                                             ((band, key, chunk_id)
+                                              for band, key in enumerate(self._band_keys(signature))))
+                self._connection.execute("DELETE FROM signatures WHERE chunk_id = ?", (chunk_id,))
+    
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        """
+        Split a signature into the keys of its bands.
+        
+        :param signature: Signature of a chunk
+        :return: One key per band
+        """
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+    
+    def _lookup(self, keys: List[List[bytes]]) -> List[set]:
+        """
+        Find the indexed chunks sharing a band with each chunk of a batch.
+        
+        :param keys: Band keys of each chunk
+        :return: Set of candidate chunk ids per chunk
+        """
+        candidates = [set() for _ in keys]
+        with self._lock:
+            for band in range(self.bands):
+                positions: Dict[bytes, List[int]] = {}
+                for i, chunk_keys in enumerate(keys):
+                    positions.setdefault(chunk_keys[band], []).append(i)
+                band_keys = list(positions)
+                for start in range(0, len(band_keys), 500):
+                    batch = band_keys[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT key, chunk_id FROM bands WHERE band = ? AND key IN ({', '.join('?' * len(batch))})",
+                        [band] + batch)
+                    for key, chunk_id in rows:
+                        for i in positions[key]:
+                            candidates[i].add(chunk_id)
+        return candidates
+    
+    def _get_signatures(self, chunk_ids) -> Dict[str, np.ndarray]:
+        """
+        Read the stored signatures of chunks; the caller holds _lock.
+        
+        :param chunk_ids: Ids of the chunks
+        :return: Dict of chunk id to signature, for the indexed chunks
+        """
+        chunk_ids = list(chunk_ids)
+        signatures = {}
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            rows = self._connection.execute(
+                f"SELECT chunk_id, signature FROM signatures WHERE chunk_id IN ({', '.join('?' * len(batch))})", batch)
+            signatures.update((chunk_id, np.frombuffer(blob, dtype=np.uint32)) for chunk_id, blob in rows)
+        return signatures
+    
+    def _insert(self, rows: List[Tuple[str, np.ndarray]]):
+        """
+        Insert signatures and their bands; the caller holds _lock and a transaction.
+        
+        :param rows: Tuples of chunk id and signature
+        """
+        self._connection.executemany("INSERT OR IGNORE INTO signatures VALUES (?, ?)",
+                                     ((chunk_id, signature.tobytes()) for chunk_id, signature in rows))
+        self._connection.executemany("INSERT OR IGNORE INTO bands VALUES (?, ?, ?)",
+                                     ((band, key, chunk_id) for chunk_id, signature in rows
+                                      for band, key in enumerate(self._band_keys(signature))))
+    
+    def _check_config(self):
+        """
+        Re-band or clear the stored signatures if they were indexed with other settings.
+        """
+        config = {"num_perm": str(self.num_perm), "shingle_size": str(self.shingle_size),
+                  "bands": f"{self.bands}x{self.rows}"}
+        stored = dict(self._connection.execute("SELECT key, value FROM meta"))
+        if stored == config:
+            return
+        
+        with self._connection:
+            if stored and (stored["num_perm"], stored["shingle_size"]) != (config["num_perm"], config["shingle_size"]):
+                logger.warning(f"Clearing the near-duplicate index {self.path}, its signatures were computed with "
+                               f"other settings")
+                self._connection.execute("DELETE FROM signatures")
+            self._connection.execute("DELETE FROM bands")
+            rows = [(chunk_id, np.frombuffer(blob, dtype=np.uint32))
+                    for chunk_id, blob in self._connection.execute("SELECT chunk_id, signature FROM signatures")]
+            self._insert(rows)
+            self._connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", config.items())
@@ -0,0 +1,27 @@
+"""src.pipeline.options.py -- Choices of the pipeline options, importable without loading Haystack or PyTorch.
+
+main.py builds its command line from these, so that runs handed to a query server do not import the modules that
+implement the options."""
+
+
+# FAISS index types of the document store
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+# scalar quantization of the stored vectors; ivf_pq indexes always store PQ codes
+VECTOR_DTYPES = ("fp32", "fp16", "int8")
+
+# projections of the vectors to a lower dimension before indexing
+DIM_REDUCTIONS = ("pca", "truncate")
+
+# stores of the chunk texts and meta data: an SQLite database, or an append-only memory-mapped ChunkStore
+CHUNK_STORES = ("sqlite", "columnar")
+
+# "torch" runs the fp32 PyTorch model; "onnx" runs the same model exported to ONNX, "onnx-int8" additionally
+# quantizes its weights to int8 (dynamic quantization, activations are quantized per batch at run time)
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# chunkers of preprocessing, the Haystack PreProcessor splitting by words and the TokenChunker
+CHUNKERS = ("preprocessor", "token")
+
+# model name selecting the StubGenerator in main.py and the dashboard
+STUB_MODEL_NAME = "local-stub"
@@ -1,20 +1,77 @@
 """src.pipeline.pipeline.py -- Query pipeline implementation for document retrieval and LLM processing."""
 
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import ContextManager, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 from haystack.nodes import EmbeddingRetriever, PromptNode
 from haystack.pipelines import Pipeline
+from haystack.schema import Document
+
+from src.pipeline.bm25_index import BM25Index, reciprocal_rank_fusion
+from src.pipeline.context_builder import ContextBuilder
+from src.pipeline.document_store import SEARCH_PARAMS, faiss_search_params, query_by_embedding_batch
+from src.pipeline.generators import Generator, PromptNodeGenerator
+from src.pipeline.metrics import METRICS, collect_timings
+from src.pipeline.query_cache import QueryCache
+from src.pipeline.sharding import CollectionManager
 
 
 class QueryPipeline:
-    def __init__(self, retriever: EmbeddingRetriever, model_name: str = "gpt-4o-mini"):
+    def __init__(self, retriever: EmbeddingRetriever, model_name: str = "gpt-4o-mini",
+                 query_cache: Optional[QueryCache] = None, generator: Optional[Generator] = None,
+                 max_context_tokens: Optional[int] = 2000, bm25_index: Optional[BM25Index] = None,
+                 dense_top_k: Optional[int] = None, lexical_top_k: Optional[int] = None,
+                 fusion_weights: Tuple[float, float] = (1.0, 1.0), rrf_k: int = 60,
+                 store_lock: Optional[ContextManager] = None,
+                 collection_manager: Optional[CollectionManager] = None, collections: Sequence[str] = ()):
         """
         Initialize the QueryPipeline with retriever and prompt node.
 
         :param retriever: The retriever component for document retrieval
         :param model_name: Name of the language model to use
+        :param query_cache: Optional cache of query embeddings, retrieval results and answers; register its
+                            invalidate method with DocumentStoreManager.add_change_listener
+        :param generator: Optional answer generator replacing the prompt node, e.g. a StubGenerator
+        :param max_context_tokens: Token budget of the retrieved context in the prompt, None for the context
+                                   window of the model
+        :param bm25_index: Optional BM25 index of the stored chunks (DocumentStoreManager.bm25_index); enables
+                           hybrid retrieval fusing dense and lexical rankings by reciprocal rank fusion
+        :param dense_top_k: Number of dense candidates fused in hybrid retrieval, defaults to the final top_k
+        :param lexical_top_k: Number of BM25 candidates fused in hybrid retrieval, defaults to the final top_k
+        :param fusion_weights: Weights of the dense and the lexical ranking in the fusion
+        :param rrf_k: Rank offset of reciprocal rank fusion
+        :param store_lock: Optional lock held while the document store and the BM25 index are read, e.g.
+                           DocumentStoreManager.lock when documents are added while the pipeline serves queries
+        :param collection_manager: Optional manager of sharded collections; queries search the shards of
+                                   `collections` in parallel instead of the document store of the retriever, which
+                                   should be CollectionManager.retriever
+        :param collections: Names of the collections searched with a collection manager
+        :raises ValueError: If a collection manager is combined with a BM25 index or given no collections
         """
+        if collection_manager is not None and bm25_index is not None:
+            raise ValueError("Hybrid retrieval is not supported across collections, pass no bm25_index")
+        if collection_manager is not None and not collections:
+            raise ValueError("Pass the collections to search with the collection manager")
         self.retriever = retriever
+        self.model_name = model_name
+        self.query_cache = query_cache
+        self.bm25_index = bm25_index
+        self.dense_top_k = dense_top_k
+        self.lexical_top_k = lexical_top_k
+        self.fusion_weights = tuple(fusion_weights)
+        self.rrf_k = rrf_k
+        self.store_lock = store_lock
+        self.collection_manager = collection_manager
+        self.collections = list(collections)
+        # FAISS search parameters are set on the shared index, so concurrent searches using them are serialized
+        self._search_lock = threading.Lock()
         
         PROMPT_TEMPLATE = """
         You are a helpful assistant. You need to provide answers to a QUESTION exclusively based on provided CONTEXT.
@@ -35,6 +92,20 @@ class QueryPipeline:
         respond with "This question cannot be answered based on the given context."
         """
         
+        # packs the retrieved chunks into the token budget of the prompt
+        self.context_builder = ContextBuilder(
+            model_name=model_name,
+            max_context_tokens=max_context_tokens,
+            prompt_template=PROMPT_TEMPLATE,
+            max_answer_tokens=500
+        )
+        
+        if generator is not None:
+            self.generator = generator
+            self.prompt_node = None
+            self.pipeline = None
+            return
+        
         self.prompt_node = PromptNode(
             model_name_or_path=model_name,
             api_key=os.environ.get("OPENAI_API_KEY"),
@@ -48,23 +119,493 @@ class QueryPipeline:
         # set up pipeline
         self.pipeline = Pipeline()
         self.pipeline.add_node(component=self.retriever, name="Retriever", inputs=["Query"])
-        self.pipeline.add_node(component=self.prompt_node, name="PromptNode", inputs=["Retriever"])
+        self.pipeline.add_node(component=self.context_builder, name="ContextBuilder", inputs=["Retriever"])
+        self.pipeline.add_node(component=self.prompt_node, name="PromptNode", inputs=["ContextBuilder"])
+        self.generator = PromptNodeGenerator(self.prompt_node)
     
     def run(self, query: str, params: dict = None):
         """
         Run the pipeline with a query.
 
         :param query: The query string to process
-        :param params: Optional parameters for the pipeline components
-        :return: The pipeline results
+        :param params: Optional parameters for the pipeline components; the "Retriever" parameters may include
+                       FAISS search parameters such as "nprobe" (IVF indexes) and "ef_search" (HNSW indexes)
+        :return: The pipeline results, with the seconds spent per stage (e.g. "query_embedding", "faiss_search",
+                 "prompt_build", "llm_call") under "timings"; all stages are also recorded in metrics.METRICS
         """
-        params = {"Retriever": {"top_k": 5}} if params is None else params       
+        # FAISS search parameters are applied to the index instead of being passed to the retriever
+        retriever_params, search_params = self._split_params(params)
+        params = {**(params or {}), "Retriever": retriever_params}
+        
+        if (self.query_cache is not None or self.pipeline is None or self.bm25_index is not None
+                or self.store_lock is not None or self.collection_manager is not None):
+            return self._run_steps(query, params, search_params)
         
-        result = self.pipeline.run(query=query, params=params)
+        with collect_timings() as timings:
+            with faiss_search_params(self.retriever.document_store, **search_params):
+                result = self.pipeline.run(query=query, params=params)
+        result.setdefault("timings", timings)
         
         # ensure we have a consistent response format
         if "answers" not in result:
             result["answers"] = [{"answer": result.get("results", ["No answer generated."])[0]}]
         
         return result
-    
\ No newline at end of file
+    
+    def run_batch(self, queries: List[str], params: dict = None, batch_size: int = 64,
+                  max_concurrency: int = 4) -> List[dict]:
+        """
+        Run the pipeline with many queries.
+        
+        Queries are embedded in batches of `batch_size` and each batch is retrieved with a single FAISS search.
+        Answers are generated by up to `max_concurrency` concurrent LLM calls. A failing query does not abort
+        the batch; its result contains the error message under "error" instead of answers.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components, see run
+        :param batch_size: Number of queries embedded and searched at once
+        :param max_concurrency: Maximum number of concurrent LLM calls
+        :return: The pipeline results, in the order of the queries
+        """
+        if batch_size <= 0 or max_concurrency <= 0:
+            raise ValueError("batch_size and max_concurrency must be positive")
+        
+        retriever_params, search_params = self._split_params(params)
+        
+        results: List[Optional[dict]] = [None] * len(queries)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            futures = {}
+            for start in range(0, len(queries), batch_size):
+                batch = queries[start:start + batch_size]
+                try:
+                    retrieved = self._retrieve(batch, retriever_params, search_params)
+                except Exception as e:
+                    for position in range(start, start + len(batch)):
+                        results[position] = {"query": queries[position], "error": f"{type(e).__name__}: {e}"}
+                    continue
+                for position, (query, retrieval) in enumerate(zip(batch, retrieved), start):
+                    futures[executor.submit(self._generate, query, *retrieval)] = position
+            
+            for future, position in futures.items():
+                try:
+                    results[position] = future.result()
+                except Exception as e:
+                    results[position] = {"query": queries[position], "error": f"{type(e).__name__}: {e}"}
+        
+        return results
+    
+    def retrieve(self, queries: List[str], params: dict = None) -> List[List[Document]]:
+        """
+        Retrieve the documents of many queries without generating answers.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components, see run
+        :return: Retrieved documents per query, best first
+        """
+        retriever_params, search_params = self._split_params(params)
+        return [documents for _, documents, _, _ in self._retrieve(queries, retriever_params, search_params)]
+    
+    def stream(self, query: str, params: dict = None) -> Iterator[dict]:
+        """
+        Run the pipeline with a query, yielding the retrieved documents and the answer tokens as they arrive.
+        
+        The iterator yields events in order: {"event": "documents", "documents": [...]} once retrieval has
+        finished, {"event": "token", "token": "..."} per answer token, and finally {"event": "done", "result": ...}
+        with the pipeline results. The results carry "timings" in seconds: "retrieval", "time_to_first_token"
+        (from the start of the query), "generation" and "total", next to the time of each stage (see run).
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see run
+        :return: Iterator of event dictionaries
+        """
+        start = time.perf_counter()
+        retriever_params, search_params = self._split_params(params)
+        embedding, documents, query_cached, timings = self._retrieve([query], retriever_params, search_params)[0]
+        with collect_timings(timings):
+            context = self.context_builder.pack(query, documents)
+        retrieved = time.perf_counter()
+        yield {"event": "documents", "documents": context["documents"]}
+        
+        first_token = None
+        answer, generation = self._get_cached_answer(embedding, documents)
+        answer_cached = answer is not None
+        tokens = [answer] if answer_cached else self.generator.stream(query, context["documents"])
+        
+        fragments = []
+        for token in tokens:
+            if first_token is None:
+                first_token = time.perf_counter()
+            fragments.append(token)
+            yield {"event": "token", "token": token}
+        answer = "".join(fragments)
+        end = time.perf_counter()
+        
+        if not answer_cached:
+            # the stream is consumed by the caller, so the call is recorded from its start and end only
+            METRICS.record("llm_call", wall_seconds=end - retrieved)
+            timings["llm_call"] = end - retrieved
+            self._cache_answer(embedding, documents, answer, generation)
+        
+        result = self._build_result(query, context, answer, query_cached, answer_cached, timings)
+        result["timings"] = {
+            **timings,
+            "retrieval": retrieved - start,
+            "time_to_first_token": (first_token or end) - start,
+            "generation": end - retrieved,
+            "total": end - start,
+        }
+        yield {"event": "done", "result": result}
+    
+    @staticmethod
+    def _split_params(params: Optional[dict]) -> Tuple[dict, dict]:
+        """
+        Separate the retriever parameters from the FAISS search parameters.
+        
+        :param params: Optional parameters for the pipeline components, see run
+        :return: Tuple of retriever parameters and FAISS search parameters
+        """
+        params = {"Retriever": {"top_k": 5}} if params is None else params
+        retriever_params = dict(params.get("Retriever", {}))
+        search_params = {key: retriever_params.pop(key) for key in SEARCH_PARAMS if key in retriever_params}
+        return retriever_params, search_params
+    
+    def _run_steps(self, query: str, params: dict, search_params: dict) -> dict:
+        """
+        Run retrieval and answer generation step by step, consulting the query cache (if any) before each step.
+        
+        :param query: The query string to process
+        :param params: Parameters for the pipeline components, without FAISS search parameters
+        :param search_params: FAISS search parameters applied to the index
+        :return: The pipeline results, with the cache outcome of each step under "cache" if a cache is used
+        """
+        retrieval = self._retrieve([query], params.get("Retriever", {}), search_params)[0]
+        return self._generate(query, *retrieval)
+    
+    def _retrieve(self, queries: List[str], retriever_params: dict,
+                  search_params: dict) -> List[Tuple[np.ndarray, List[Document], bool, Dict[str, float]]]:
+        """
+        Embed and retrieve a batch of queries, serving repeated queries from the query cache.
+        
+        With a BM25 index, the dense and the lexical candidates of each query are fused by reciprocal rank fusion
+        and the fused score replaces the similarity score. Queries with filters are retrieved dense only, since
+        the BM25 index does not store metadata.
+        
+        :param queries: The query strings to process
+        :param retriever_params: Parameters of the retriever, without FAISS search parameters
+        :param search_params: FAISS search parameters applied to the index
+        :return: Tuple of query embedding, retrieved documents, query cache hit flag and the stage timings of the
+                 batch per query
+        """
+        with collect_timings() as timings:
+            retrieved = self._retrieve_batch(queries, retriever_params, search_params)
+        return [(*retrieval, dict(timings)) for retrieval in retrieved]
+    
+    def _retrieve_batch(self, queries: List[str], retriever_params: dict,
+                        search_params: dict) -> List[Tuple[np.ndarray, List[Document], bool]]:
+        """
+        Embed and retrieve a batch of queries, see _retrieve.
+        
+        :param queries: The query strings to process
+        :param retriever_params: Parameters of the retriever, without FAISS search parameters
+        :param search_params: FAISS search parameters applied to the index
+        :return: Tuple of query embedding, retrieved documents and query cache hit flag per query
+        """
+        top_k = retriever_params.get("top_k", self.retriever.top_k)
+        filters = retriever_params.get("filters")
+        hybrid = self.bm25_index is not None and not filters
+        fusion = (self.dense_top_k, self.lexical_top_k, self.fusion_weights, self.rrf_k) if hybrid else None
+        keys = [(query, top_k, repr(filters), tuple(sorted(search_params.items())), fusion, tuple(self.collections))
+                for query in queries]
+        
+        retrieved: List[Optional[Tuple[np.ndarray, List[Document], bool]]] = [None] * len(queries)
+        # results of a search that overlaps with a change of the store are not cached, see QueryCache.generation
+        generation = self.query_cache.generation if self.query_cache is not None else None
+        if self.query_cache is not None:
+            for position, key in enumerate(keys):
+                cached = self.query_cache.get_query(key)
+                if cached is not None:
+                    embedding, document_ids, scores = cached
+                    retrieved[position] = (embedding, self._get_documents(document_ids, scores), True)
+        
+        missing = [position for position, retrieval in enumerate(retrieved) if retrieval is None]
+        if missing:
+            embeddings = self.retriever.embed_queries([queries[position] for position in missing])
+            dense_top_k = max(top_k, self.dense_top_k or top_k) if hybrid else top_k
+            if self.collection_manager is not None:
+                # shards are locked and configured one by one
+                document_lists = self.collection_manager.search(self.collections, embeddings, top_k=dense_top_k,
+                                                                scale_score=self.retriever.scale_score,
+                                                                **search_params)
+            else:
+                with self._hold_store_lock(), self._search_lock if search_params else nullcontext():
+                    with faiss_search_params(self.retriever.document_store, **search_params):
+                        document_lists = query_by_embedding_batch(self.retriever.document_store, embeddings,
+                                                                  top_k=dense_top_k,
+                                                                  scale_score=self.retriever.scale_score)
+            if hybrid:
+                document_lists = [self._fuse(queries[position], documents, top_k)
+                                  for position, documents in zip(missing, document_lists)]
+            for position, embedding, documents in zip(missing, embeddings, document_lists):
+                retrieved[position] = (embedding, documents, False)
+                if self.query_cache is not None:
+                    self.query_cache.put_query(keys[position], embedding, [doc.id for doc in documents],
+                                               [doc.score for doc in documents], generation=generation)
+        
+        return retrieved
+    
+    def _fuse(self, query: str, dense_documents: List[Document], top_k: int) -> List[Document]:
+        """
+        Fuse the dense candidates of a query with its BM25 candidates.
+        
+        :param query: The query string
+        :param dense_documents: Documents of the dense search, best first
+        :param top_k: Number of documents to return
+        :return: Top documents of the fused ranking, with the fused score
+        """
+        with self._hold_store_lock(), METRICS.stage("lexical_search"):
+            lexical = self.bm25_index.search(query, top_k=self.lexical_top_k or top_k)
+        fused = reciprocal_rank_fusion([[doc.id for doc in dense_documents], [doc_id for doc_id, _ in lexical]],
+                                       weights=self.fusion_weights, rrf_k=self.rrf_k)[:top_k]
+        
+        # documents found only by BM25 are fetched from the document store
+        documents = {doc.id: doc for doc in dense_documents}
+        lexical_only = [doc_id for doc_id, _ in fused if doc_id not in documents]
+        if lexical_only:
+            with self._hold_store_lock(), METRICS.stage("document_fetch", items=len(lexical_only)):
+                fetched = self.retriever.document_store.get_documents_by_id(lexical_only)
+            documents.update({doc.id: doc for doc in fetched})
+        
+        ranked = []
+        for document_id, score in fused:
+            if document_id in documents:
+                documents[document_id].score = score
+                ranked.append(documents[document_id])
+        return ranked
+    
+    def _hold_store_lock(self) -> ContextManager:
+        """
+        Get the context manager guarding reads of the document store.
+        
+        :return: The store lock, or a no-op context manager without one
+        """
+        return self.store_lock if self.store_lock is not None else nullcontext()
+    
+    def _generate(self, query: str, embedding: np.ndarray, documents: List[Document], query_cached: bool,
+                  timings: Dict[str, float]) -> dict:
+        """
+        Generate the answer of a retrieved query, serving similar queries from the answer cache.
+        
+        :param query: The query string to process
+        :param embedding: Query embedding
+        :param documents: Retrieved documents
+        :param query_cached: Flag whether the retrieval was served from the query cache
+        :param timings: Stage timings of the retrieval
+        :return: The pipeline results
+        """
+        with collect_timings(dict(timings)) as timings:
+            context = self.context_builder.pack(query, documents)
+            answer, generation = self._get_cached_answer(embedding, documents)
+            answer_cached = answer is not None
+            if not answer_cached:
+                with METRICS.stage("llm_call"):
+                    answer = self.generator.generate(query, context["documents"])
+                self._cache_answer(embedding, documents, answer, generation)
+        return self._build_result(query, context, answer, query_cached, answer_cached, timings)
+    
+    def _get_cached_answer(self, embedding: np.ndarray,
+                           documents: List[Document]) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Look up the answer of a similar query with the same retrieved documents.
+        
+        :param embedding: Query embedding
+        :param documents: Retrieved documents
+        :return: Tuple of the cached answer text, None without a cache or on a miss, and the generation of the
+                 cache at the lookup, see QueryCache.generation
+        """
+        if self.query_cache is None:
+            return None, None
+        generation = self.query_cache.generation
+        output = self.query_cache.get_answer(embedding, [doc.id for doc in documents], self.model_name)
+        return (output["results"][0] if output is not None else None), generation
+    
+    def _cache_answer(self, embedding: np.ndarray, documents: List[Document], answer: str,
+                      generation: Optional[int]):
+        """
+        Store a generated answer in the answer cache, if any.
+        
+        :param embedding: Query embedding
+        :param documents: Retrieved documents
+        :param answer: Generated answer text
+        :param generation: Generation of the cache at the lookup of the answer
+        """
+        if self.query_cache is not None:
+            self.query_cache.put_answer(embedding, [doc.id for doc in documents], self.model_name,
+                                        {"results": [answer]}, generation=generation)
+    
+    def _build_result(self, query: str, context: dict, answer: str, query_cached: bool, answer_cached: bool,
+                      timings: Dict[str, float]) -> dict:
+        """
+        Assemble the pipeline results in the format of the Haystack pipeline.
+        
+        :param query: The query string
+        :param context: Packed context of the ContextBuilder
+        :param answer: Answer text
+        :param query_cached: Flag whether the retrieval was served from the query cache
+        :param answer_cached: Flag whether the answer was served from the answer cache
+        :param timings: Seconds spent per stage
+        :return: The pipeline results
+        """
+        result = {"query": query, **context, "results": [answer], "answers": [{"answer": answer}],
+                  "timings": timings}
+        if self.query_cache is not None:
+            result["cache"] = {"query": query_cached, "answer": answer_cached}
+        return result
+    
+    def _get_documents(self, document_ids: List[str], scores: List[float]) -> List[Document]:
+        """
+        Fetch cached retrieval results from the document store in rank order.
+        
+        :param document_ids: Ids of the retrieved documents, in rank order
+        :param scores: Scores of the retrieved documents
+        :return: List of retrieved documents with their scores
+        """
+        if self.collection_manager is not None:
+            documents: Dict[str, Document] = {
+                doc.id: doc for doc in self.collection_manager.get_documents_by_id(self.collections, document_ids)
+            }
+        else:
+            with self._hold_store_lock(), METRICS.stage("document_fetch", items=len(document_ids)):
+                documents = {doc.id: doc for doc in self.retriever.document_store.get_documents_by_id(document_ids)}
+        ranked = []
+        for document_id, score in zip(document_ids, scores):
+            if document_id in documents:
+                documents[document_id].score = score
+                ranked.append(documents[document_id])
+        return ranked
+
+
+class AsyncQueryPipeline(QueryPipeline):
+    """
+    Asyncio variant of QueryPipeline that keeps many queries in flight in a single process.
+    
+    Query embedding and FAISS search run in a thread pool and the answer generator is awaited, so the event loop
+    keeps serving other queries while a request waits on the LLM. Accepts the arguments of QueryPipeline and
+    `max_workers`, the number of retrieval threads.
+    """
+    
+    def __init__(self, retriever: EmbeddingRetriever, model_name: str = "gpt-4o-mini",
+                 query_cache: Optional[QueryCache] = None, generator: Optional[Generator] = None,
+                 max_context_tokens: Optional[int] = 2000, bm25_index: Optional[BM25Index] = None,
+                 dense_top_k: Optional[int] = None, lexical_top_k: Optional[int] = None,
+                 fusion_weights: Tuple[float, float] = (1.0, 1.0), rrf_k: int = 60,
+                 store_lock: Optional[ContextManager] = None,
+                 collection_manager: Optional[CollectionManager] = None, collections: Sequence[str] = (),
+                 max_workers: int = 4):
+        """
+        Initialize the pipeline and its retrieval thread pool.
+        
+        :param retriever: The retriever component for document retrieval
+        :param model_name: Name of the language model to use
+        :param query_cache: Optional cache of query embeddings, retrieval results and answers
+        :param generator: Optional answer generator replacing the prompt node, e.g. a StubGenerator
+        :param max_context_tokens: Token budget of the retrieved context in the prompt
+        :param bm25_index: Optional BM25 index of the stored chunks, enables hybrid retrieval
+        :param dense_top_k: Number of dense candidates fused in hybrid retrieval
+        :param lexical_top_k: Number of BM25 candidates fused in hybrid retrieval
+        :param fusion_weights: Weights of the dense and the lexical ranking in the fusion
+        :param rrf_k: Rank offset of reciprocal rank fusion
+        :param store_lock: Optional lock held while the document store and the BM25 index are read
+        :param collection_manager: Optional manager of sharded collections searched instead of the document store
+        :param collections: Names of the collections searched with a collection manager
+        :param max_workers: Number of threads running query embedding and search
+        """
+        super().__init__(retriever, model_name=model_name, query_cache=query_cache, generator=generator,
+                         max_context_tokens=max_context_tokens, bm25_index=bm25_index, dense_top_k=dense_top_k,
+                         lexical_top_k=lexical_top_k, fusion_weights=fusion_weights, rrf_k=rrf_k,
+                         store_lock=store_lock, collection_manager=collection_manager, collections=collections)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+    
+    async def arun(self, query: str, params: dict = None) -> dict:
+        """
+        Run the pipeline with a query.
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :return: The pipeline results
+        """
+        retrieval = (await self._aretrieve([query], params))[0]
+        return await self._agenerate(query, *retrieval)
+    
+    async def arun_batch(self, queries: List[str], params: dict = None, batch_size: int = 64,
+                         max_concurrency: int = 16) -> List[dict]:
+        """
+        Run the pipeline with many queries, see QueryPipeline.run_batch.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :param batch_size: Number of queries embedded and searched at once
+        :param max_concurrency: Maximum number of concurrent generator calls
+        :return: The pipeline results, in the order of the queries
+        """
+        if batch_size <= 0 or max_concurrency <= 0:
+            raise ValueError("batch_size and max_concurrency must be positive")
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run_query(query: str, retrieval: tuple) -> dict:
+            try:
+                async with semaphore:
+                    return await self._agenerate(query, *retrieval)
+            except Exception as e:
+                return {"query": query, "error": f"{type(e).__name__}: {e}"}
+        
+        async def run_queries(batch: List[str]) -> List[dict]:
+            try:
+                retrieved = await self._aretrieve(batch, params)
+            except Exception as e:
+                return [{"query": query, "error": f"{type(e).__name__}: {e}"} for query in batch]
+            return list(await asyncio.gather(*[run_query(query, retrieval)
+                                               for query, retrieval in zip(batch, retrieved)]))
+        
+        batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+        results = await asyncio.gather(*[run_queries(batch) for batch in batches])
+        return [result for batch_results in results for result in batch_results]
+    
+    def close(self):
+        """Shut down the retrieval thread pool."""
+        self._executor.shutdown(wait=False)
+    
+    async def _aretrieve(self, queries: List[str],
+                         params: Optional[dict]) -> List[Tuple[np.ndarray, List[Document], bool, Dict[str, float]]]:
+        """
+        Embed and retrieve a batch of queries in the thread pool.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components
+        :return: Tuple of query embedding, retrieved documents, query cache hit flag and stage timings per query
+        """
+        retriever_params, search_params = self._split_params(params)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._retrieve, queries, retriever_params, search_params)
+    
+    async def _agenerate(self, query: str, embedding: np.ndarray, documents: List[Document],
+                         query_cached: bool, timings: Dict[str, float]) -> dict:
+        """
+        Await the answer of a retrieved query, serving similar queries from the answer cache.
+        
+        :param query: The query string to process
+        :param embedding: Query embedding
+        :param documents: Retrieved documents
+        :param query_cached: Flag whether the retrieval was served from the query cache
+        :param timings: Stage timings of the retrieval
+        :return: The pipeline results
+        """
+        with collect_timings(dict(timings)) as timings:
+            context = self.context_builder.pack(query, documents)
+            answer, generation = self._get_cached_answer(embedding, documents)
+            answer_cached = answer is not None
+            if not answer_cached:
+                with METRICS.stage("llm_call"):
+                    answer = await self.generator.agenerate(query, context["documents"])
+                self._cache_answer(embedding, documents, answer, generation)
+        return self._build_result(query, context, answer, query_cached, answer_cached, timings)
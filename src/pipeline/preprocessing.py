@@ -1,11 +1,26 @@
 """src.pipeline.preprocessing.py -- Document loading and preprocessing utilities."""
 
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from haystack.nodes import PreProcessor
 from haystack.schema import Document
 from haystack.utils import convert_files_to_docs
 
+from src.pipeline.manifest import hash_file
+from src.pipeline.metrics import METRICS, Measurement
+from src.pipeline.token_chunker import TokenChunker
+
+
+# the suffixes haystack.utils.convert_files_to_docs has converters for; it keeps them in a local list (allowed_suffixes)
+# and skips other files with a warning, so this copy must follow it when Haystack is upgraded
+SUPPORTED_SUFFIXES = (".pdf", ".txt", ".docx")
+
+logger = logging.getLogger(__name__)
+
 
 def load_documents(doc_dir: str) -> List[Document]:
     """
@@ -15,7 +30,9 @@ def load_documents(doc_dir: str) -> List[Document]:
     :return: List of Document objects
     """
     doc_dir = Path(doc_dir)
-    documents = convert_files_to_docs(dir_path=doc_dir)
+    with METRICS.stage("conversion") as measurement:
+        documents = convert_files_to_docs(dir_path=doc_dir)
+        measurement.items = len(documents)
     
     # Ensure file paths are stored in metadata
     for doc in documents:
@@ -25,14 +42,109 @@ def load_documents(doc_dir: str) -> List[Document]:
     return documents
 
 
-def preprocess_documents(documents: List[Document]) -> List[Document]:
+def preprocess_documents(documents: List[Document], chunker: Optional[TokenChunker] = None) -> List[Document]:
     """
     Preprocess documents into chunks.
     
     :param documents: List of documents to process
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor
     :return: List of processed Document objects
     """
-    preprocessor = PreProcessor(
+    if chunker is not None:
+        # the chunker tokenizes the documents in batches
+        with METRICS.stage("chunking") as measurement:
+            processed_docs = chunker.process(documents)
+            measurement.items = len(processed_docs)
+        return processed_docs
+    
+    processed_docs = []
+    for doc in documents:
+        with METRICS.stage("chunking") as measurement:
+            chunks = _preprocess_document(doc)
+            measurement.items = len(chunks)
+        processed_docs.extend(chunks)
+    
+    return processed_docs
+
+
+def load_and_preprocess_documents(doc_dir: str, num_workers: int = 1,
+                                  chunker: Optional[TokenChunker] = None) -> List[Document]:
+    """
+    Load documents from a directory and split them into chunks.
+    
+    Collects the chunks of iter_file_chunks, the streaming implementation used by ingestion, into a list. Chunks
+    are returned in sorted file path order, and files that fail to convert are logged and skipped, regardless of
+    the number of workers.
+    
+    :param doc_dir: Path to the directory containing documents
+    :param num_workers: Number of worker processes, 1 loads and chunks the documents serially
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor
+    :return: List of processed Document objects
+    """
+    processed_docs = []
+    for file_path, chunks, error, _ in iter_file_chunks(discover_files(doc_dir), num_workers=num_workers,
+                                                        chunker=chunker):
+        if error is not None:
+            logger.warning(f"Skipped file {file_path}: {error}")
+            continue
+        processed_docs.extend(chunks)
+    return processed_docs
+
+
+def iter_file_chunks(file_paths: Iterable[Path], num_workers: int = 1, max_pending: int = None,
+                     chunker: Optional[TokenChunker] = None,
+                     hash_files: bool = False) -> Iterator[Tuple[Path, List[Document], str, Optional[str]]]:
+    """
+    Lazily convert and chunk files one at a time, in input order.
+    
+    Only a bounded number of files is in flight at any time, so a slow consumer throttles conversion instead of
+    letting converted chunks pile up in memory.
+    
+    :param file_paths: Paths of the files to process
+    :param num_workers: Number of worker processes, 1 processes the files in the calling process
+    :param max_pending: Maximum number of files submitted to the pool ahead of the consumer, defaults to 2 per worker
+    :param chunker: Optional chunker splitting by the tokens of the embedding model instead of the PreProcessor;
+                    worker processes load its tokenizer once
+    :param hash_files: Flag to hash the content of each file (see manifest.hash_file) before it is converted, in
+                       the process converting it
+    :return: Iterator of tuples of file path, chunks, error message (None on success) and content hash (None
+             without hash_files or on failure)
+    """
+    if num_workers <= 1:
+        for file_path in file_paths:
+            yield _record_file_measurements(*_load_and_preprocess_file(file_path, chunker, hash_files))
+        return
+    
+    max_pending = max_pending or 2 * num_workers
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(executor.submit(_load_and_preprocess_file, file_path, chunker, hash_files))
+            if len(pending) >= max_pending:
+                yield _record_file_measurements(*pending.popleft().result())
+        while pending:
+            yield _record_file_measurements(*pending.popleft().result())
+
+
+def discover_files(doc_dir: str) -> List[Path]:
+    """
+    List the supported files in a directory and its subdirectories.
+    
+    :param doc_dir: Path to the directory containing documents
+    :return: Sorted list of file paths
+    """
+    return sorted(path for path in Path(doc_dir).glob("**/*")
+                  if path.is_file() and path.suffix.lower() in SUPPORTED_SUFFIXES)
+
+
+@lru_cache(maxsize=1)
+def _get_preprocessor() -> PreProcessor:
+    """
+    Create the preprocessor once per process.
+    
+    :return: Configured PreProcessor instance
+    """
+    return PreProcessor(
         clean_empty_lines=True,
         clean_whitespace=True,
         clean_header_footer=True,
@@ -40,9 +152,65 @@ def preprocess_documents(documents: List[Document]) -> List[Document]:
         split_length=500,
         split_overlap=50
     )
+
+
+def _preprocess_document(document: Document, chunker: Optional[TokenChunker] = None) -> List[Document]:
+    """
+    Split a single document into chunks.
     
-    processed_docs = []
-    for doc in documents:
-        processed_docs.extend(preprocessor.process([doc]))
+    :param document: Document to process
+    :param chunker: Optional chunker used instead of the PreProcessor
+    :return: List of chunks
+    """
+    return (chunker or _get_preprocessor()).process([document])
+
+
+def _load_and_preprocess_file(file_path: Path, chunker: Optional[TokenChunker] = None, hash_content: bool = False
+                              ) -> Tuple[Path, List[Document], str, Dict[str, Dict[str, float]], Optional[str]]:
+    """
+    Convert a single file and split it into chunks; executed in worker processes.
     
-    return processed_docs
+    :param file_path: Path of the file to process
+    :param chunker: Optional chunker used instead of the PreProcessor
+    :param hash_content: Flag to hash the content of the file before converting it
+    :return: Tuple of file path, chunks, error message (None on success), the measurements of the "conversion"
+             and "chunking" stages and the content hash (None if not requested or on failure)
+    """
+    measurements = {}
+    try:
+        # hashed before converting, so a file modified meanwhile differs from its hash at the next sync
+        content_hash = hash_file(str(file_path)) if hash_content else None
+        with Measurement(items=1) as conversion:
+            documents = convert_files_to_docs(file_paths=[file_path])
+        measurements["conversion"] = conversion.as_dict()
+        
+        with Measurement() as chunking:
+            chunks = []
+            for doc in documents:
+                if not doc.meta.get("file_path"):
+                    doc.meta["file_path"] = str(doc.meta.get("name", ""))
+                chunks.extend(_preprocess_document(doc, chunker))
+            chunking.items = len(chunks)
+        measurements["chunking"] = chunking.as_dict()
+        return file_path, chunks, None, measurements, content_hash
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}", measurements, None
+
+
+def _record_file_measurements(file_path: Path, chunks: List[Document], error: str,
+                              measurements: Dict[str, Dict[str, float]],
+                              content_hash: Optional[str]) -> Tuple[Path, List[Document], str, Optional[str]]:
+    """
+    Record the stage measurements of a processed file in the metrics registry of this process.
+    
+    :param file_path: Path of the processed file
+    :param chunks: Chunks of the file
+    :param error: Error message, None on success
+    :param measurements: Measurements per stage
+    :param content_hash: Content hash of the file, or None
+    :return: Tuple of file path, chunks, error message and content hash
+    """
+    for stage, measurement in measurements.items():
+        METRICS.record(stage, **measurement)
+    return file_path, chunks, error, content_hash
+
@@ -0,0 +1,212 @@
+"""src.pipeline.query_cache.py -- Two-level query cache: exact query lookups and semantically matched answers."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class QueryCache:
+    """
+    In-memory cache for QueryPipeline.
+    
+    The query level maps the exact query text (and retrieval parameters) to the query embedding and the retrieved
+    document ids and scores, which skips embedding and vector search for repeated queries. The answer level stores
+    LLM answers and returns one for a new query whose embedding lies within `similarity_threshold` (cosine) of a
+    cached query that retrieved the same documents. Both levels evict least recently used entries beyond
+    `max_entries` and drop entries older than `ttl_seconds`.
+    
+    `invalidate` increments `generation`. Callers read it before the lookup that missed and pass it to `put_query`
+    or `put_answer`, which drop results computed across an invalidation, e.g. by a search that started before
+    documents were added.
+    
+    :param max_entries: Maximum number of entries per cache level
+    :param ttl_seconds: Time to live of cache entries in seconds, None for no expiry
+    :param similarity_threshold: Minimum cosine similarity between query embeddings for an answer hit
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: Optional[float] = 3600,
+                 similarity_threshold: float = 0.95):
+        """
+        Initialize an empty cache.
+        
+        :param max_entries: Maximum number of entries per cache level
+        :param ttl_seconds: Time to live of cache entries in seconds, None for no expiry
+        :param similarity_threshold: Minimum cosine similarity between query embeddings for an answer hit
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        
+        self._lock = threading.Lock()
+        self._queries: OrderedDict = OrderedDict()
+        self._answers: OrderedDict = OrderedDict()
+        self._next_answer_id = 0
+        self.generation = 0
+        self.stats = {"query_hits": 0, "query_misses": 0, "answer_hits": 0, "answer_misses": 0, "invalidations": 0,
+                      "stale_puts": 0}
+    
+    def get_query(self, key: Tuple) -> Optional[Tuple[np.ndarray, List[str], List[float]]]:
+        """
+        Look up the embedding and retrieval results of a query.
+        
+        :param key: Query text and retrieval parameters, see QueryPipeline
+        :return: Tuple of query embedding, document ids and scores, or None on a miss
+        """
+        with self._lock:
+            entry = self._get_fresh(self._queries, key)
+            self.stats["query_hits" if entry else "query_misses"] += 1
+            return entry["value"] if entry else None
+    
+    def put_query(self, key: Tuple, embedding: np.ndarray, document_ids: List[str], scores: List[float],
+                  generation: Optional[int] = None):
+        """
+        Store the embedding and retrieval results of a query.
+        
+        :param key: Query text and retrieval parameters, see QueryPipeline
+        :param embedding: Query embedding
+        :param document_ids: Ids of the retrieved documents, in rank order
+        :param scores: Scores of the retrieved documents
+        :param generation: Generation read before the lookup, the results are dropped if the cache was invalidated
+                           since; None to store them regardless
+        """
+        with self._lock:
+            if self._is_stale(generation):
+                return
+            self._put(self._queries, key, {"value": (embedding, list(document_ids), list(scores))})
+    
+    def get_answer(self, embedding: np.ndarray, document_ids: List[str], model_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer of a similar query with the same retrieved context.
+        
+        :param embedding: Query embedding
+        :param document_ids: Ids of the retrieved documents, in rank order
+        :param model_name: Name of the LLM generating the answers
+        :return: Cached answer output, or None on a miss
+        """
+        normalized = self._normalize(embedding)
+        context = (model_name, tuple(document_ids))
+        
+        with self._lock:
+            self._expire(self._answers)
+            candidates = [(answer_id, entry) for answer_id, entry in self._answers.items()
+                          if entry["context"] == context]
+            if candidates:
+                similarities = np.stack([entry["embedding"] for _, entry in candidates]) @ normalized
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    answer_id, entry = candidates[best]
+                    self._answers.move_to_end(answer_id)
+                    self.stats["answer_hits"] += 1
+                    return dict(entry["output"])
+            self.stats["answer_misses"] += 1
+            return None
+    
+    def put_answer(self, embedding: np.ndarray, document_ids: List[str], model_name: str, output: Dict[str, Any],
+                   generation: Optional[int] = None):
+        """
+        Store the answer generated for a query and its retrieved context.
+        
+        :param embedding: Query embedding
+        :param document_ids: Ids of the retrieved documents, in rank order
+        :param model_name: Name of the LLM generating the answers
+        :param output: Answer output of the prompt node
+        :param generation: Generation read before the lookup, the answer is dropped if the cache was invalidated
+                           since; None to store it regardless
+        """
+        with self._lock:
+            if self._is_stale(generation):
+                return
+            self._next_answer_id += 1
+            self._put(self._answers, self._next_answer_id, {
+                "embedding": self._normalize(embedding),
+                "context": (model_name, tuple(document_ids)),
+                "output": dict(output),
+            })
+    
+    def invalidate(self):
+        """Drop all cached entries, e.g. after documents were added to the store."""
+        with self._lock:
+            self._queries.clear()
+            self._answers.clear()
+            self.generation += 1
+            self.stats["invalidations"] += 1
+    
+    def _is_stale(self, generation: Optional[int]) -> bool:
+        """
+        Check whether the cache was invalidated since a generation was read.
+        
+        :param generation: Generation read before a lookup, or None
+        :return: True if results computed since the generation must not be stored
+        """
+        if generation is None or generation == self.generation:
+            return False
+        self.stats["stale_puts"] += 1
+        return True
+    
+    def _put(self, entries: OrderedDict, key, entry: Dict):
+        """
+        Insert an entry and evict the least recently used entries beyond the size limit.
+        
+        :param entries: Cache level to insert into
+        :param key: Key of the entry
+        :param entry: Entry to insert
+        """
+        entry["created"] = time.monotonic()
+        entries[key] = entry
+        entries.move_to_end(key)
+        self._expire(entries)
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+    
+    def _get_fresh(self, entries: OrderedDict, key) -> Optional[Dict]:
+        """
+        Get an unexpired entry and mark it as recently used.
+        
+        :param entries: Cache level to search
+        :param key: Key of the entry
+        :return: Entry, or None if missing or expired
+        """
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry):
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return entry
+    
+    def _expire(self, entries: OrderedDict):
+        """
+        Drop expired entries of a cache level.
+        
+        :param entries: Cache level to clean up
+        """
+        for key in [key for key, entry in entries.items() if self._is_expired(entry)]:
+            del entries[key]
+    
+    def _is_expired(self, entry: Dict) -> bool:
+        """
+        Check whether an entry exceeded the time to live.
+        
+        :param entry: Cache entry
+        :return: True if the entry expired
+        """
+        return self.ttl_seconds is not None and time.monotonic() - entry["created"] > self.ttl_seconds
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        """
+        Scale an embedding to unit length for cosine similarity.
+        
+        :param embedding: Embedding vector
+        :return: Normalized float32 vector
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
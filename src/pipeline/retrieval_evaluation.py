@@ -0,0 +1,130 @@
+"""src.pipeline.retrieval_evaluation.py -- Hit rate@k of dense versus hybrid (dense + BM25) retrieval.
+
+Usage:
+    python -m src.pipeline.retrieval_evaluation --num_documents 2000 --num_queries 200
+    python -m src.pipeline.retrieval_evaluation --embedding_model sentence-transformers/all-MiniLM-L6-v2"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from haystack.schema import Document
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.generators import StubGenerator
+from src.pipeline.pipeline import QueryPipeline
+
+
+COMPONENTS = ["pump", "valve", "sensor", "controller", "bearing", "gasket", "actuator", "filter"]
+PROPERTIES = ["operating temperature", "maximum pressure", "torque rating", "service interval", "supply voltage"]
+
+
+def make_keyword_corpus(num_documents: int, num_queries: int,
+                        seed: int = 0) -> Tuple[List[Document], List[Tuple[str, str]]]:
+    """
+    Build a synthetic corpus of near-identical maintenance notes that differ mainly in their part numbers.
+    
+    Such keyword-heavy text (part numbers, error codes, identifiers) is where dense embeddings blur distinct
+    documents together and exact term matching helps.
+    
+    :param num_documents: Number of documents
+    :param num_queries: Number of queries, each targeting one document
+    :param seed: Random seed
+    :return: Tuple of the documents and a list of (query, id of the relevant document)
+    """
+    rng = np.random.default_rng(seed)
+    documents, facts = [], []
+    for i in range(num_documents):
+        part = f"{''.join(rng.choice(list('ABCDEFGHKLMNPRSTXZ'), 2))}-{rng.integers(1000, 10000)}"
+        component = COMPONENTS[i % len(COMPONENTS)]
+        prop = PROPERTIES[rng.integers(len(PROPERTIES))]
+        value = f"{rng.integers(10, 500)} units"
+        content = (f"Maintenance note for the {component} assembly with part number {part}. "
+                   f"The {prop} of this {component} is {value}. Inspect the {component} for wear and replace "
+                   f"worn seals according to the service manual before returning the unit to operation.")
+        documents.append(Document(content=content, meta={"file_path": f"notes/{i}.txt"}))
+        facts.append((part, component, prop))
+    
+    queries = []
+    for i in rng.choice(num_documents, min(num_queries, num_documents), replace=False):
+        part, component, prop = facts[i]
+        queries.append((f"What is the {prop} of the {component} {part}?", documents[i].id))
+    return documents, queries
+
+
+def hit_rate_at_k(pipeline: QueryPipeline, queries: List[Tuple[str, str]], k: int) -> float:
+    """
+    Compute the fraction of queries whose relevant document is among the top k retrieved documents.
+    
+    :param pipeline: Query pipeline to retrieve with
+    :param queries: List of (query, id of the relevant document)
+    :param k: Number of retrieved documents
+    :return: Hit rate@k in [0, 1]
+    """
+    retrieved = pipeline.retrieve([query for query, _ in queries], params={"Retriever": {"top_k": k}})
+    hits = [relevant_id in {doc.id for doc in documents} for (_, relevant_id), documents in zip(queries, retrieved)]
+    return float(np.mean(hits))
+
+
+def evaluate_hybrid_retrieval(doc_store_manager: DocumentStoreManager,
+                              queries: List[Tuple[str, str]],
+                              top_ks: List[int],
+                              target_hit_rate: float = 0.9,
+                              lexical_top_k: Optional[int] = None,
+                              fusion_weights: Tuple[float, float] = (1.0, 1.0)) -> Dict:
+    """
+    Measure hit rate@k of dense and hybrid retrieval and the smallest top_k reaching a target hit rate.
+    
+    :param doc_store_manager: Document store manager holding the indexed corpus
+    :param queries: List of (query, id of the relevant document)
+    :param top_ks: Values of top_k to evaluate
+    :param target_hit_rate: Hit rate the retrieved context should reach
+    :param lexical_top_k: Number of BM25 candidates fused in hybrid retrieval, defaults to top_k
+    :param fusion_weights: Weights of the dense and the lexical ranking
+    :return: Dict with the hit rates per mode and top_k, and the smallest sufficient top_k per mode
+    """
+    pipelines = {
+        "dense": QueryPipeline(doc_store_manager.get_retriever(), generator=StubGenerator()),
+        "hybrid": QueryPipeline(doc_store_manager.get_retriever(), generator=StubGenerator(),
+                                bm25_index=doc_store_manager.bm25_index, lexical_top_k=lexical_top_k,
+                                fusion_weights=fusion_weights),
+    }
+    
+    results = {"target_hit_rate": target_hit_rate, "hit_rate": {}, "min_top_k": {}}
+    for mode, pipeline in pipelines.items():
+        hit_rates = {k: round(hit_rate_at_k(pipeline, queries, k), 4) for k in sorted(top_ks)}
+        results["hit_rate"][mode] = hit_rates
+        results["min_top_k"][mode] = next((k for k, rate in hit_rates.items() if rate >= target_hit_rate), None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate hit rate@k of dense versus hybrid retrieval")
+    parser.add_argument("--embedding_model", default="sentence-transformers/multi-qa-mpnet-base-dot-v1",
+                        help="Embedding model of the dense retriever")
+    parser.add_argument("--num_documents", type=int, default=2000, help="Number of synthetic documents")
+    parser.add_argument("--num_queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--top_ks", type=int, nargs="+", default=[1, 2, 3, 5, 10, 20], help="Values of top_k")
+    parser.add_argument("--target_hit_rate", type=float, default=0.9, help="Hit rate the context should reach")
+    parser.add_argument("--lexical_top_k", type=int, help="Number of BM25 candidates fused in hybrid retrieval")
+    args = parser.parse_args()
+    
+    documents, queries = make_keyword_corpus(args.num_documents, args.num_queries)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        doc_store_manager = DocumentStoreManager(
+            embedding_model=args.embedding_model,
+            db_path=str(Path(temp_dir) / "evaluation.db"),
+            index_path=str(Path(temp_dir) / "evaluation.faiss"),
+            embedding_cache_size=0
+        )
+        doc_store_manager.add_documents(documents)
+        results = evaluate_hybrid_retrieval(doc_store_manager, queries, args.top_ks,
+                                            target_hit_rate=args.target_hit_rate, lexical_top_k=args.lexical_top_k)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+"""src.pipeline.server.py -- Long-running query server keeping the document store and the query pipeline loaded.
+
+The server speaks JSON over HTTP, on a TCP port or a Unix socket, and handles every request in its own thread:
+
+    GET  /health         status and number of stored chunks
+    GET  /metrics        per-stage metrics in Prometheus format, /metrics.json as JSON
+    POST /query          {"query": ..., "params": {...}, "stream": false}; streamed as one JSON event per line
+    POST /query_batch    {"queries": [...], "params": {...}, "max_concurrency": 4}
+    POST /ingest         {"doc_dir": ..., "batch_size": 1000, "num_workers": 1, "sync": false}
+    POST /reload         reopen the document store, e.g. after another process changed it
+
+Requests are not authenticated. /ingest only accepts directories under the ingest root of the service, but any
+client that reaches the server can query the store, ingest and reload; keep it on a loopback interface or a Unix
+socket, or put it behind an authenticating proxy.
+
+Usage:
+    python main.py --serve [--doc_dir DIR] [--port 8765 | --socket /tmp/pipeline.sock]
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Callable, Dict, Iterator, List, Optional, Union
+
+from haystack.schema import Document
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.embedding_cache import CachedEmbeddingRetriever
+from src.pipeline.ingestion import ingest_directory
+from src.pipeline.metrics import METRICS
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.token_chunker import TokenChunker
+
+
+logger = logging.getLogger(__name__)
+
+
+class BadRequest(ValueError):
+    """Raised for malformed requests, answered with status 400."""
+
+
+def serialize_document(doc: Document) -> dict:
+    """
+    Convert a retrieved document to JSON.
+    
+    :param doc: Retrieved document
+    :return: Dict with the id, file path, score and content of the document
+    """
+    return {"id": doc.id, "file_path": doc.meta.get("file_path"), "content": doc.content,
+            "score": float(doc.score) if doc.score is not None else None}
+
+
+def serialize_result(result: dict) -> dict:
+    """
+    Convert pipeline results to JSON.
+    
+    :param result: Results of QueryPipeline.run or one result of QueryPipeline.run_batch
+    :return: Dict with the query and its "answer", "sources", "prompt_tokens", "timings" and "cache" outcome,
+             or its "error" if the query failed
+    """
+    if "error" in result:
+        return {"query": result["query"], "error": result["error"]}
+    
+    answers = result.get("answers") or [{"answer": result.get("results", ["No answer generated."])[0]}]
+    answer = answers[0].answer if hasattr(answers[0], "answer") else answers[0].get("answer", "No answer generated.")
+    serialized = {"query": result.get("query"), "answer": answer,
+                  "sources": [serialize_document(doc) for doc in result.get("documents", [])],
+                  "prompt_tokens": result.get("prompt_tokens"), "timings": result.get("timings", {})}
+    if "cache" in result:
+        serialized["cache"] = result["cache"]
+    return serialized
+
+
+def serialize_event(event: dict) -> dict:
+    """
+    Convert an event of QueryPipeline.stream to JSON.
+    
+    :param event: Stream event
+    :return: The event, with the retrieved documents under "sources" and serialized results
+    """
+    if event["event"] == "documents":
+        return {"event": "documents", "sources": [serialize_document(doc) for doc in event["documents"]]}
+    if event["event"] == "done":
+        return {"event": "done", "result": serialize_result(event["result"])}
+    return event
+
+
+class _ServiceState:
+    """
+    Document store manager and pipeline of a QueryService, with the number of requests using them.
+    
+    :param doc_store_manager: Document store manager
+    :param pipeline: Query pipeline of the document store manager
+    :param shared_retriever: Flag that the retriever was shared by the service, which then closes it
+    """
+    
+    def __init__(self, doc_store_manager: DocumentStoreManager, pipeline: QueryPipeline, shared_retriever: bool):
+        self.doc_store_manager = doc_store_manager
+        self.pipeline = pipeline
+        self.shared_retriever = shared_retriever
+        self.active = 0
+        self.retired = False
+    
+    def close(self):
+        """Release the document store and, if the service shared it, the retriever."""
+        self.doc_store_manager.close()
+        if self.shared_retriever:
+            self.doc_store_manager.retriever.close()
+
+
+class QueryService:
+    """
+    Keeps a document store and a query pipeline loaded between requests.
+    
+    Queries run concurrently with each other and with ingestion, since the pipeline holds the lock of the
+    document store only while it searches and fetches documents (see DocumentStoreManager.lock). Ingestion
+    requests and reloads are serialized. A reload opens the document store again with the loaded embedding
+    model (see CachedEmbeddingRetriever.share) and swaps the store and the pipeline at once; queries that are
+    running finish on the previous ones, which are closed after the last of them.
+    
+    :param create_doc_store_manager: Callable opening the document store, given the retriever to embed with or
+                                     None to load the embedding model
+    :param create_pipeline: Callable building the query pipeline of a document store manager, which should pass
+                            DocumentStoreManager.lock as store_lock
+    :param chunker: Optional chunker of ingested documents used instead of the PreProcessor
+    :param ingest_root: Directory containing all directories that may be ingested, None to refuse ingestion
+    """
+    
+    def __init__(self,
+                 create_doc_store_manager: Callable[[Optional[CachedEmbeddingRetriever]], DocumentStoreManager],
+                 create_pipeline: Callable[[DocumentStoreManager], QueryPipeline],
+                 chunker: Optional[TokenChunker] = None,
+                 ingest_root: Optional[str] = None):
+        """
+        Open the document store and build the pipeline.
+        
+        :param create_doc_store_manager: Callable opening the document store with a retriever, or None
+        :param create_pipeline: Callable building the query pipeline of a document store manager
+        :param chunker: Optional chunker of ingested documents used instead of the PreProcessor
+        :param ingest_root: Directory containing all directories that may be ingested, None to refuse ingestion
+        """
+        self._create_doc_store_manager = create_doc_store_manager
+        self._create_pipeline = create_pipeline
+        self.chunker = chunker
+        self.ingest_root = os.path.realpath(ingest_root) if ingest_root is not None else None
+        self._update_lock = threading.Lock()
+        # guards the swap of the state and the request counts of the states
+        self._state_lock = threading.Lock()
+        self.started = time.time()
+        self.reloads = 0
+        self._state = self._open()
+    
+    @property
+    def doc_store_manager(self) -> DocumentStoreManager:
+        """Document store manager serving the queries."""
+        return self._state.doc_store_manager
+    
+    @property
+    def pipeline(self) -> QueryPipeline:
+        """Query pipeline serving the queries."""
+        return self._state.pipeline
+    
+    def health(self) -> dict:
+        """
+        Report the status of the service.
+        
+        :return: Dict with the status, the number of stored chunks, the uptime in seconds and the reload count
+        """
+        with self._use() as state, state.doc_store_manager.lock:
+            documents = state.doc_store_manager.document_store.get_document_count()
+        return {"status": "ok", "documents": documents, "uptime_seconds": round(time.time() - self.started, 3),
+                "reloads": self.reloads}
+    
+    def query(self, query: str, params: Optional[dict] = None) -> dict:
+        """
+        Answer a query.
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :return: Serialized results, see serialize_result
+        """
+        with self._use() as state:
+            return serialize_result(state.pipeline.run(query, params=params))
+    
+    def stream(self, query: str, params: Optional[dict] = None) -> Iterator[dict]:
+        """
+        Answer a query, yielding the retrieved documents and the answer tokens as they arrive.
+        
+        :param query: The query string to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :return: Iterator of serialized events, see QueryPipeline.stream
+        """
+        with self._use() as state:
+            for event in state.pipeline.stream(query, params=params):
+                yield serialize_event(event)
+    
+    def query_batch(self, queries: List[str], params: Optional[dict] = None, max_concurrency: int = 4) -> List[dict]:
+        """
+        Answer many queries, see QueryPipeline.run_batch.
+        
+        :param queries: The query strings to process
+        :param params: Optional parameters for the pipeline components, see QueryPipeline.run
+        :param max_concurrency: Maximum number of concurrent LLM calls
+        :return: Serialized results, in the order of the queries
+        """
+        with self._use() as state:
+            results = state.pipeline.run_batch(queries, params=params, max_concurrency=max_concurrency)
+        return [serialize_result(result) for result in results]
+    
+    def ingest(self, doc_dir: str, batch_size: int = 1000, num_workers: int = 1, sync: bool = False) -> Dict[str, int]:
+        """
+        Stream the documents of a directory into the document store, see ingestion.ingest_directory.
+        
+        The directory must lie under the ingest root once symbolic links are resolved, and the number of worker
+        processes is capped at the number of CPUs.
+        
+        :param doc_dir: Path to the directory containing documents
+        :param batch_size: Number of chunks embedded and written at once
+        :param num_workers: Number of worker processes for document conversion and chunking
+        :param sync: Flag to process only added and changed files and delete the chunks of changed and removed files
+        :return: Dictionary with file and chunk counts of the run
+        :raises BadRequest: If ingestion is disabled, the directory is outside the ingest root or not found
+        """
+        if self.ingest_root is None:
+            raise BadRequest("Ingestion is disabled, the server has no ingest root")
+        path = os.path.realpath(doc_dir)
+        if os.path.commonpath([path, self.ingest_root]) != self.ingest_root:
+            raise BadRequest(f"Directory {doc_dir} is outside the ingest root")
+        if not os.path.isdir(path):
+            raise BadRequest(f"Directory {doc_dir} not found")
+        if batch_size <= 0:
+            raise BadRequest("Field 'batch_size' must be positive")
+        num_workers = max(1, min(num_workers, os.cpu_count() or 1))
+        with self._update_lock, self._use() as state:
+            return ingest_directory(path, state.doc_store_manager, batch_size=batch_size, num_workers=num_workers,
+                                    sync=sync, chunker=self.chunker)
+    
+    def reload(self) -> dict:
+        """
+        Open the document store again and replace the store and the pipeline once both are ready.
+        
+        :return: Status of the service, see health
+        """
+        with self._update_lock:
+            state = self._open(self.doc_store_manager.retriever.share())
+            self._swap(state)
+            self.reloads += 1
+        logger.info("Reloaded document store and pipeline")
+        return self.health()
+    
+    def close(self):
+        """Close the document store once the running requests are done; the service must not be used afterwards."""
+        with self._update_lock:
+            self._swap(None)
+    
+    @contextmanager
+    def _use(self) -> Iterator[_ServiceState]:
+        """
+        Use the current document store and pipeline, which stay open until the request is done.
+        
+        :return: Context manager yielding the state of the service
+        """
+        with self._state_lock:
+            state = self._state
+            if state is None:
+                raise RuntimeError("QueryService is closed")
+            state.active += 1
+        try:
+            yield state
+        finally:
+            with self._state_lock:
+                state.active -= 1
+                release = state.retired and state.active == 0
+            if release:
+                state.close()
+    
+    def _swap(self, state: Optional[_ServiceState]):
+        """
+        Replace the current state and close it once no request uses it.
+        
+        :param state: New state, None to close the service
+        """
+        with self._state_lock:
+            previous, self._state = self._state, state
+            previous.retired = True
+            release = previous.active == 0
+        if release:
+            previous.close()
+    
+    def _open(self, retriever: Optional[CachedEmbeddingRetriever] = None) -> _ServiceState:
+        """
+        Open the document store and build its pipeline.
+        
+        :param retriever: Retriever shared with the previous document store, None to load the embedding model
+        :return: State with the document store manager and the query pipeline
+        """
+        doc_store_manager = self._create_doc_store_manager(retriever)
+        if retriever is not None and doc_store_manager.retriever is retriever:
+            # a shared retriever is not bound to the store by the manager
+            retriever.document_store = doc_store_manager.document_store
+        return _ServiceState(doc_store_manager, self._create_pipeline(doc_store_manager),
+                             shared_retriever=retriever is not None)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Maps the HTTP endpoints to the QueryService of the server."""
+    
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(self.server.service.health())
+        elif self.path == "/metrics":
+            self._send(METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        elif self.path == "/metrics.json":
+            self._send(METRICS.to_json().encode("utf-8"), "application/json")
+        else:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+    
+    def do_POST(self):
+        routes = {"/query": self._query, "/query_batch": self._query_batch, "/ingest": self._ingest,
+                  "/reload": self._reload}
+        route = routes.get(self.path)
+        if route is None:
+            self._send_json({"error": f"Unknown path {self.path}"}, status=404)
+            return
+        
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                raise BadRequest(f"Invalid JSON: {e}")
+            if not isinstance(request, dict):
+                raise BadRequest("Request body must be a JSON object")
+            route(request)
+        except BadRequest as e:
+            self._send_json({"error": str(e)}, status=400)
+        except Exception as e:
+            logger.exception(f"Request {self.path} failed")
+            self._send_json({"error": f"{type(e).__name__}: {e}"}, status=500)
+    
+    def _query(self, request: dict):
+        service = self.server.service
+        query = _get_field(request, "query", str, required=True)
+        params = _get_field(request, "params", dict)
+        if not request.get("stream"):
+            self._send_json(service.query(query, params))
+            return
+        
+        # retrieval errors are still answered with a status code, later errors end the stream with an error event
+        events = service.stream(query, params)
+        first_event = next(events)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        self.close_connection = True
+        self._write_event(first_event)
+        try:
+            for event in events:
+                self._write_event(event)
+        except Exception as e:
+            logger.exception("Streaming query failed")
+            self._write_event({"event": "error", "error": f"{type(e).__name__}: {e}"})
+    
+    def _query_batch(self, request: dict):
+        queries = _get_field(request, "queries", list, required=True)
+        if not all(isinstance(query, str) for query in queries):
+            raise BadRequest("Field 'queries' must be a list of strings")
+        results = self.server.service.query_batch(queries, _get_field(request, "params", dict),
+                                                  max_concurrency=_get_field(request, "max_concurrency", int, 4))
+        self._send_json({"results": results})
+    
+    def _ingest(self, request: dict):
+        stats = self.server.service.ingest(_get_field(request, "doc_dir", str, required=True),
+                                           batch_size=_get_field(request, "batch_size", int, 1000),
+                                           num_workers=_get_field(request, "num_workers", int, 1),
+                                           sync=_get_field(request, "sync", bool, False))
+        self._send_json(stats)
+    
+    def _reload(self, request: dict):
+        self._send_json(self.server.service.reload())
+    
+    def _write_event(self, event: dict):
+        self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+        self.wfile.flush()
+    
+    def _send_json(self, body: dict, status: int = 200):
+        self._send(json.dumps(body).encode("utf-8"), "application/json", status=status)
+    
+    def _send(self, payload: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format: str, *args):
+        # the client address of Unix sockets is empty, so the default format does not apply
+        logger.debug(f"{self.command} {self.path}: " + format % args)
+
+
+def _get_field(request: dict, name: str, kind: type, default=None, required: bool = False):
+    """
+    Get a field of a request.
+    
+    :param request: Decoded request body
+    :param name: Field name
+    :param kind: Expected type of the field
+    :param default: Value of a missing field
+    :param required: Flag to reject requests without the field
+    :return: Value of the field
+    :raises BadRequest: If a required field is missing or a field has the wrong type
+    """
+    value = request.get(name, default)
+    if value is None and required:
+        raise BadRequest(f"Field '{name}' is required")
+    if value is not None and (not isinstance(value, kind) or (isinstance(value, bool) and kind is not bool)):
+        raise BadRequest(f"Field '{name}' must be of type {kind.__name__}")
+    return value
+
+
+def is_loopback(host: str) -> bool:
+    """
+    Check whether a host is a loopback interface, reachable from this machine only.
+    
+    :param host: Host name or IP address
+    :return: True for localhost and loopback addresses
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _TCPServer(ThreadingHTTPServer):
+    # server_close waits for the running requests
+    daemon_threads = False
+
+
+class _UnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = False
+
+
+def create_server(service: QueryService, host: str = "127.0.0.1", port: int = 8765,
+                  socket_path: Optional[str] = None) -> Union[_TCPServer, _UnixServer]:
+    """
+    Create a server answering requests with a query service.
+    
+    :param service: Query service answering the requests
+    :param host: Interface to listen on
+    :param port: Port to listen on, 0 picks a free port
+    :param socket_path: Path of a Unix socket to listen on instead of host and port
+    :return: Server; call serve_forever() to handle requests and shutdown() to stop
+    :raises OSError: If another server is listening on the socket
+    """
+    if socket_path is None and not is_loopback(host):
+        logger.warning(f"Query server listens on {host} without authentication; any client reaching it can query, "
+                       f"ingest under the ingest root and reload")
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            # a socket file left behind by a server that did not shut down is replaced
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                if probe.connect_ex(socket_path) == 0:
+                    raise OSError(f"Another server is listening on {socket_path}")
+            os.remove(socket_path)
+        server = _UnixServer(socket_path, _RequestHandler)
+    else:
+        server = _TCPServer((host, port), _RequestHandler)
+    server.service = service
+    return server
+
+
+def serve(service: QueryService, host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None):
+    """
+    Answer requests until interrupted or terminated (SIGTERM), then let the running requests finish.
+    
+    :param service: Query service answering the requests
+    :param host: Interface to listen on
+    :param port: Port to listen on
+    :param socket_path: Path of a Unix socket to listen on instead of host and port
+    """
+    server = create_server(service, host=host, port=port, socket_path=socket_path)
+    if threading.current_thread() is threading.main_thread():
+        # shutdown() waits for serve_forever to return, so it cannot run in the signal handler itself
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    logger.info(f"Query server listening on {socket_path or f'{host}:{server.server_address[1]}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Shutting down query server...")
+        server.server_close()
+        service.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,530 @@
+"""src.pipeline.sharding.py -- Named collections of sharded document stores with parallel scatter-gather search."""
+
+import heapq
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from haystack.schema import Document
+
+from src.pipeline.document_store import DocumentStoreManager, faiss_search_params, query_by_embedding_batch
+from src.pipeline.embedding_cache import CachedEmbeddingRetriever, EmbeddingCache
+from src.pipeline.metrics import METRICS
+
+
+logger = logging.getLogger(__name__)
+
+# collection names are directory names
+_COLLECTION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+def shard_paths(root_dir: str, collection: str, shard: int) -> Tuple[str, str]:
+    """
+    Get the file paths of a shard of a collection.
+    
+    :param root_dir: Directory of the collections
+    :param collection: Name of the collection, letters, digits, "_", "." and "-"
+    :param shard: Number of the shard
+    :return: Tuple of the SQLite database path and the FAISS index path, see DocumentStoreManager
+    :raises ValueError: If the collection name is not a valid directory name
+    """
+    if not _COLLECTION_NAME.match(collection):
+        raise ValueError(f"Invalid collection name '{collection}', use letters, digits, '_', '.' and '-'")
+    shard_dir = Path(root_dir) / collection / f"shard_{shard}"
+    return str(shard_dir / "document_store.db"), str(shard_dir / "document_store.faiss")
+
+
+def shard_of(document_id: str, num_shards: int) -> int:
+    """
+    Get the shard a chunk is stored in.
+    
+    Chunk ids are content hashes, so a chunk is always routed to the same shard and duplicates are recognized by
+    that shard alone.
+    
+    :param document_id: Id of the chunk
+    :param num_shards: Number of shards of the collection
+    :return: Number of the shard
+    """
+    return zlib.crc32(document_id.encode("utf-8")) % num_shards
+
+
+class ShardedCollection:
+    """
+    Named collection of chunks split over `num_shards` document stores by chunk id.
+    
+    Shards are opened lazily by the CollectionManager and may be closed again while idle. The collection supports
+    the part of the DocumentStoreManager interface used by ingestion.ingest_directory (add_documents,
+    delete_documents, find_near_duplicates, index_path and manifest_path), so a directory can be ingested into
+    it directly; the manifest and the ingestion checkpoint are kept per collection.
+    
+    :param manager: Manager opening the shards
+    :param name: Name of the collection
+    :param num_shards: Number of shards
+    """
+    
+    # near-duplicate detection is configured per document store, collections do not support it
+    near_duplicates = None
+    
+    def __init__(self, manager: "CollectionManager", name: str, num_shards: int):
+        """
+        Initialize the collection; shards are opened on first use.
+        
+        :param manager: Manager opening the shards
+        :param name: Name of the collection
+        :param num_shards: Number of shards
+        """
+        self.manager = manager
+        self.name = name
+        self.num_shards = num_shards
+        self.path = Path(manager.root_dir) / name
+        self.index_path = str(self.path / "collection")
+        self.manifest_path = str(self.path / "manifest.db")
+        self._change_listeners: List[Callable[[], None]] = []
+    
+    def add_documents(self, documents: List[Document], update_existing_embeddings: bool = False) -> Dict[str, int]:
+        """
+        Add chunks to their shards, see DocumentStoreManager.add_documents.
+        
+        :param documents: Chunks to add
+        :param update_existing_embeddings: Flag to re-embed the whole collection instead of only the new chunks
+        :return: Dictionary with the number of "new", "skipped" and "reembedded" chunks over all shards
+        """
+        by_shard: Dict[int, List[Document]] = {}
+        for doc in documents:
+            by_shard.setdefault(shard_of(doc.id, self.num_shards), []).append(doc)
+        shards = range(self.num_shards) if update_existing_embeddings else sorted(by_shard)
+        
+        stats = {"new": 0, "skipped": 0, "reembedded": 0}
+        for shard in shards:
+            with self.manager.use_shard(self.name, shard) as store:
+                for key, value in store.add_documents(by_shard.get(shard, []), update_existing_embeddings).items():
+                    stats[key] += value
+        if stats["new"] or stats["reembedded"]:
+            for listener in self._change_listeners:
+                listener()
+        return stats
+    
+    def delete_documents(self, document_ids: List[str]) -> int:
+        """
+        Delete chunks from their shards, see DocumentStoreManager.delete_documents.
+        
+        :param document_ids: Ids of the chunks to delete
+        :return: Number of deleted chunks
+        """
+        by_shard: Dict[int, List[str]] = {}
+        for document_id in document_ids:
+            by_shard.setdefault(shard_of(document_id, self.num_shards), []).append(document_id)
+        deleted = 0
+        for shard, shard_ids in sorted(by_shard.items()):
+            with self.manager.use_shard(self.name, shard) as store:
+                deleted += store.delete_documents(shard_ids)
+        if deleted:
+            for listener in self._change_listeners:
+                listener()
+        return deleted
+    
+    def find_near_duplicates(self, documents: List[Document], ignored_ids=()) -> Dict[str, str]:
+        """
+        Collections do not detect near-duplicates, see DocumentStoreManager.find_near_duplicates.
+        
+        :param documents: Chunks about to be added
+        :param ignored_ids: Ignored
+        :return: Empty dict
+        """
+        return {}
+    
+    def get_documents_by_id(self, document_ids: List[str]) -> List[Document]:
+        """
+        Fetch chunks from their shards.
+        
+        :param document_ids: Ids of the chunks
+        :return: Stored chunks with their collection and shard in the meta fields "collection" and "shard", in
+                 no particular order
+        """
+        by_shard: Dict[int, List[str]] = {}
+        for document_id in document_ids:
+            by_shard.setdefault(shard_of(document_id, self.num_shards), []).append(document_id)
+        documents = []
+        for shard, shard_ids in sorted(by_shard.items()):
+            with self.manager.use_shard(self.name, shard) as store, store.lock:
+                shard_documents = store.document_store.get_documents_by_id(shard_ids)
+            for doc in shard_documents:
+                doc.meta = {**doc.meta, "collection": self.name, "shard": shard}
+            documents.extend(shard_documents)
+        return documents
+    
+    def get_document_count(self) -> int:
+        """
+        Count the chunks of all shards.
+        
+        :return: Number of stored chunks
+        """
+        count = 0
+        for shard in range(self.num_shards):
+            with self.manager.use_shard(self.name, shard) as store, store.lock:
+                count += store.document_store.get_document_count()
+        return count
+    
+    def has_documents(self) -> bool:
+        """
+        Check if any shard contains documents.
+        
+        :return: True if documents exist in the collection
+        """
+        return self.get_document_count() > 0
+    
+    def add_change_listener(self, listener: Callable[[], None]):
+        """
+        Register a callable invoked after chunks were added to or deleted from the collection.
+        
+        :param listener: Callable without arguments, e.g. QueryCache.invalidate
+        """
+        self._change_listeners.append(listener)
+
+
+class CollectionManager:
+    """
+    Opens the shards of named collections on demand and searches them in parallel.
+    
+    Each collection lives in its own directory under `root_dir` (e.g. one per tenant) and is split into a fixed
+    number of shards, each a DocumentStoreManager with its own SQLite database or chunk store and FAISS index.
+    All shards share one embedding model and embedding cache. Shards are opened on first use and kept open in
+    least recently used order; once the estimated memory of the open shards exceeds `memory_budget_bytes`, the
+    least recently used shards that are not in use are closed. Shards are opened outside the lock of the manager,
+    so opening a shard (reading its index and replaying its journal) blocks neither searches of open shards nor
+    the opening of other shards.
+    
+    A search embeds the queries once, searches all shards of the selected collections in a thread pool (FAISS
+    releases the GIL while searching, so shards are searched on separate cores) and merges the top-k of each
+    shard by score.
+    
+    :param root_dir: Directory of the collections
+    :param embedding_model: Name or path of the embedding model of all collections
+    :param memory_budget_bytes: Memory budget of the open shards, estimated from their index files; None for no
+                                limit
+    :param max_workers: Number of threads searching shards in parallel, defaults to the number of CPUs
+    :param embedding_cache_dir: Directory of the persistent embedding cache, defaults to data/embedding_cache
+    :param embedding_cache_size: Maximum number of cached embeddings, 0 disables the cache
+    :param store_params: Further DocumentStoreManager parameters of the shards, e.g. index_type or chunk_store
+    """
+    
+    def __init__(self,
+                 root_dir: str = "data/collections",
+                 embedding_model: str = "sentence-transformers/multi-qa-mpnet-base-dot-v1",
+                 memory_budget_bytes: Optional[int] = None,
+                 max_workers: Optional[int] = None,
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size: int = 200_000,
+                 **store_params):
+        """
+        Initialize the manager and load the embedding model.
+        
+        :param root_dir: Directory of the collections
+        :param embedding_model: Name or path of the embedding model of all collections
+        :param memory_budget_bytes: Memory budget of the open shards, None for no limit
+        :param max_workers: Number of threads searching shards in parallel, defaults to the number of CPUs
+        :param embedding_cache_dir: Directory of the persistent embedding cache, defaults to data/embedding_cache
+        :param embedding_cache_size: Maximum number of cached embeddings, 0 disables the cache
+        :param store_params: Further DocumentStoreManager parameters of the shards
+        """
+        self.root_dir = root_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.store_params = store_params
+        Path(root_dir).mkdir(parents=True, exist_ok=True)
+        
+        # all shards embed with one model and cache, the parameters of their own retrievers are not used
+        embedding_backend = store_params.pop("embedding_backend", "torch")
+        embedding_cache = None
+        if embedding_cache_size > 0:
+            cache_model_name = embedding_model
+            if embedding_backend != "torch":
+                cache_model_name = f"{embedding_model}@{embedding_backend}"
+            embedding_cache = EmbeddingCache(
+                cache_dir=embedding_cache_dir or str(Path("data") / "embedding_cache"),
+                model_name=cache_model_name,
+                max_entries=embedding_cache_size
+            )
+        self.retriever = CachedEmbeddingRetriever(
+            embedding_model=embedding_model,
+            embedding_cache=embedding_cache,
+            embedding_backend=embedding_backend,
+            onnx_model_dir=store_params.pop("onnx_model_dir", None) or str(Path("data") / "onnx_models"),
+            max_query_batch_size=store_params.pop("max_query_batch_size", 32),
+            query_batch_wait_ms=store_params.pop("query_batch_wait_ms", None)
+        )
+        self.embedding_model = embedding_model
+        
+        self._lock = threading.Lock()
+        self._collections: Dict[str, ShardedCollection] = {}
+        # open shards in least recently used order, with the number of their current users
+        self._shards: "OrderedDict[Tuple[str, int], DocumentStoreManager]" = OrderedDict()
+        self._users: Dict[Tuple[str, int], int] = {}
+        # shards being opened, resolved with their document store manager
+        self._opening: Dict[Tuple[str, int], Future] = {}
+        self._last_used: Dict[Tuple[str, int], float] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                                            thread_name_prefix="shard-search")
+    
+    def list_collections(self) -> List[str]:
+        """
+        List the collections under the root directory.
+        
+        :return: Sorted collection names
+        """
+        return sorted(path.parent.name for path in Path(self.root_dir).glob("*/collection.json"))
+    
+    def collection(self, name: str, num_shards: Optional[int] = None, create: bool = True) -> ShardedCollection:
+        """
+        Get a collection, creating it if it doesn't exist.
+        
+        :param name: Name of the collection, letters, digits, "_", "." and "-"
+        :param num_shards: Number of shards of a new collection (default: 1); for existing collections, None or
+                           their number of shards
+        :param create: Flag to create a missing collection
+        :return: Collection
+        :raises ValueError: If the name is invalid, the collection has a different number of shards or does not
+                            exist and create is False
+        """
+        with self._lock:
+            if name not in self._collections:
+                # validates the name
+                shard_paths(self.root_dir, name, 0)
+                config_path = Path(self.root_dir) / name / "collection.json"
+                if config_path.exists():
+                    with open(config_path, "r") as f:
+                        stored_shards = json.load(f)["num_shards"]
+                elif not create:
+                    raise ValueError(f"Collection '{name}' does not exist")
+                else:
+                    stored_shards = num_shards or 1
+                    config_path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(config_path, "w") as f:
+                        json.dump({"num_shards": stored_shards}, f)
+                self._collections[name] = ShardedCollection(self, name, stored_shards)
+            collection = self._collections[name]
+        if num_shards is not None and num_shards != collection.num_shards:
+            raise ValueError(f"Collection '{name}' has {collection.num_shards} shards, not {num_shards}")
+        return collection
+    
+    @contextmanager
+    def use_shard(self, collection: str, shard: int) -> Iterator[DocumentStoreManager]:
+        """
+        Open a shard if necessary and keep it open while it is used.
+        
+        :param collection: Name of the collection
+        :param shard: Number of the shard
+        :return: Context manager yielding the document store manager of the shard
+        """
+        key = (collection, shard)
+        with self._lock:
+            # a shard with users is not closed, also while it is being opened
+            self._users[key] = self._users.get(key, 0) + 1
+            store = self._shards.get(key)
+            opening = opener = None
+            if store is None:
+                opening = self._opening.get(key)
+                if opening is None:
+                    opening = opener = self._opening[key] = Future()
+        try:
+            if opener is not None:
+                store = self._open_shard(key, opener)
+            elif store is None:
+                store = opening.result()
+            with self._lock:
+                self._shards.move_to_end(key)
+                self._last_used[key] = time.monotonic()
+                self._evict()
+            yield store
+        finally:
+            with self._lock:
+                self._users[key] -= 1
+                if key in self._shards:
+                    self._last_used[key] = time.monotonic()
+                    self._evict()
+    
+    def search(self, collections: Sequence[str], query_embs: np.ndarray, top_k: int = 10,
+               scale_score: bool = True, **search_params) -> List[List[Document]]:
+        """
+        Search all shards of collections in parallel and merge their results by score.
+        
+        Each shard returns its top_k chunks per query, so the merged top_k equals the top_k of one index over all
+        shards. Retrieved chunks carry their collection and shard in the meta fields "collection" and "shard".
+        
+        :param collections: Names of the collections to search
+        :param query_embs: Query embeddings of shape (num_queries, dim)
+        :param top_k: Number of documents per query
+        :param scale_score: Flag to scale similarity scores to the unit interval
+        :param search_params: FAISS search parameters applied to each shard, see document_store.SEARCH_PARAMS
+        :return: List of retrieved documents per query, best first
+        :raises ValueError: If a collection does not exist
+        """
+        shards = [(name, shard) for name in collections
+                  for shard in range(self.collection(name, create=False).num_shards)]
+        with METRICS.stage("shard_search", items=len(shards)):
+            futures = [self._executor.submit(self._search_shard, name, shard, query_embs, top_k, scale_score,
+                                             search_params) for name, shard in shards]
+            shard_results = [future.result() for future in futures]
+        
+        merged = []
+        for position in range(len(query_embs)):
+            candidates = [doc for results in shard_results for doc in results[position]]
+            merged.append(heapq.nlargest(top_k, candidates, key=lambda doc: doc.score))
+        return merged
+    
+    def retrieve(self, queries: List[str], collections: Sequence[str], top_k: int = 10,
+                 **search_params) -> List[List[Document]]:
+        """
+        Embed queries and search collections, see search.
+        
+        :param queries: The query strings
+        :param collections: Names of the collections to search
+        :param top_k: Number of documents per query
+        :param search_params: FAISS search parameters applied to each shard
+        :return: List of retrieved documents per query, best first
+        """
+        query_embs = self.retriever.embed_queries(queries)
+        return self.search(collections, query_embs, top_k=top_k, scale_score=self.retriever.scale_score,
+                           **search_params)
+    
+    def get_documents_by_id(self, collections: Sequence[str], document_ids: List[str]) -> List[Document]:
+        """
+        Fetch chunks from the shards of collections.
+        
+        :param collections: Names of the collections storing the chunks
+        :param document_ids: Ids of the chunks
+        :return: Stored chunks, see ShardedCollection.get_documents_by_id
+        :raises ValueError: If a collection does not exist
+        """
+        with METRICS.stage("document_fetch", items=len(document_ids)):
+            return [doc for name in collections
+                    for doc in self.collection(name, create=False).get_documents_by_id(document_ids)]
+    
+    def open_shards(self) -> List[Tuple[str, int]]:
+        """
+        List the open shards.
+        
+        :return: Collection name and shard number of each open shard, least recently used first
+        """
+        with self._lock:
+            return list(self._shards)
+    
+    def evict_idle(self, max_idle_seconds: float = 0.0) -> int:
+        """
+        Close the shards that have not been used for a while, regardless of the memory budget.
+        
+        :param max_idle_seconds: Minimum time since the last use of a closed shard
+        :return: Number of closed shards
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = [key for key in self._shards
+                    if not self._users.get(key) and now - self._last_used[key] >= max_idle_seconds]
+            for key in idle:
+                self._close_shard(key)
+        return len(idle)
+    
+    def close(self):
+        """
+        Close all shards and stop the search threads and the query batcher of the retriever.
+        """
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for key in list(self._shards):
+                self._close_shard(key)
+        self.retriever.close()
+    
+    def _open_shard(self, key: Tuple[str, int], opening: Future) -> DocumentStoreManager:
+        """
+        Open a shard reserved in _opening, without holding _lock, and resolve the future other users wait on.
+        
+        :param key: Collection name and shard number
+        :param opening: Future of the shard in _opening
+        :return: Document store manager of the shard
+        """
+        try:
+            with METRICS.stage("shard_open"):
+                db_path, index_path = shard_paths(self.root_dir, *key)
+                Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+                store = DocumentStoreManager(embedding_model=self.embedding_model, db_path=db_path,
+                                             index_path=index_path, retriever=self.retriever, **self.store_params)
+        except BaseException as e:
+            with self._lock:
+                del self._opening[key]
+            opening.set_exception(e)
+            raise
+        with self._lock:
+            self._shards[key] = store
+            del self._opening[key]
+        opening.set_result(store)
+        return store
+    
+    def _search_shard(self, collection: str, shard: int, query_embs: np.ndarray, top_k: int, scale_score: bool,
+                      search_params: dict) -> List[List[Document]]:
+        """
+        Search one shard.
+        
+        :param collection: Name of the collection
+        :param shard: Number of the shard
+        :param query_embs: Query embeddings
+        :param top_k: Number of documents per query
+        :param scale_score: Flag to scale similarity scores to the unit interval
+        :param search_params: FAISS search parameters
+        :return: List of retrieved documents per query
+        """
+        with self.use_shard(collection, shard) as store, store.lock:
+            if store.document_store.get_embedding_count() == 0:
+                return [[] for _ in query_embs]
+            with faiss_search_params(store.document_store, **search_params):
+                results = query_by_embedding_batch(store.document_store, query_embs, top_k=top_k,
+                                                   scale_score=scale_score)
+        for documents in results:
+            for doc in documents:
+                doc.meta = {**doc.meta, "collection": collection, "shard": shard}
+        return results
+    
+    def _evict(self):
+        """
+        Close least recently used shards without users while the open shards exceed the memory budget; the caller
+        holds _lock.
+        """
+        if self.memory_budget_bytes is None:
+            return
+        total = sum(self._shard_bytes(store) for store in self._shards.values())
+        for key in list(self._shards):
+            if total <= self.memory_budget_bytes:
+                break
+            if not self._users.get(key):
+                total -= self._shard_bytes(self._shards[key])
+                self._close_shard(key)
+    
+    def _close_shard(self, key: Tuple[str, int]):
+        """
+        Close an open shard; the caller holds _lock.
+        
+        :param key: Collection name and shard number
+        """
+        logger.info(f"Closing shard {key[1]} of collection {key[0]}")
+        self._shards.pop(key).close()
+        self._users.pop(key, None)
+        self._last_used.pop(key, None)
+    
+    @staticmethod
+    def _shard_bytes(store: DocumentStoreManager) -> int:
+        """
+        Estimate the memory of an open shard from the size of its index, journal and BM25 files.
+        
+        :param store: Document store manager of the shard
+        :return: Estimated size in bytes
+        """
+        return sum(os.path.getsize(path) for path in [store.index_path, store.journal_path, store.bm25_path]
+                   if os.path.exists(path))
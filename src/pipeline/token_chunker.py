@@ -0,0 +1,236 @@
+"""src.pipeline.token_chunker.py -- Document chunking by the tokens of the embedding model."""
+
+import re
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from haystack.schema import Document
+from transformers import AutoTokenizer, PreTrainedTokenizerFast
+
+
+# ends of sentences and paragraphs; a chunk preferably ends where the match ends
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+|\n\s*\n|\f")
+_LINE_WHITESPACE = re.compile(r"[ \t]*\n[ \t]*")
+_EMPTY_LINES = re.compile(r"\n{3,}")
+
+
+@lru_cache(maxsize=4)
+def _load_tokenizer(tokenizer_name: str) -> PreTrainedTokenizerFast:
+    """
+    Load a tokenizer once per process.
+    
+    :param tokenizer_name: Name or path of the embedding model or its tokenizer
+    :return: Tokenizer
+    """
+    return AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+
+
+class TokenChunker:
+    """
+    Splits documents into chunks of at most `max_tokens` tokens of the embedding model, preferably at the end of a
+    sentence or paragraph.
+    
+    Word-based splitting (PreProcessor with split_by="word") does not know how many tokens a chunk becomes, so
+    chunks with long or rare words exceed the window of the embedding model and are truncated when embedded. This
+    chunker tokenizes the documents in batches with the fast (Rust) tokenizer of the model and splits by the
+    character offsets of the tokens: chunk boundaries are found by binary search over token offsets and each chunk
+    is a single slice of the document text, without joining words again. A sentence longer than a chunk is cut at
+    a word boundary. Consecutive chunks share up to `overlap_tokens` tokens, starting at a sentence or word
+    boundary, and carry the "_split_id" and "_split_overlap" meta fields of the PreProcessor, so the
+    ContextBuilder merges them the same way. Whitespace and empty lines are cleaned as by the PreProcessor;
+    repeated page headers and footers are not removed.
+    
+    Chunkers are pickled with the name of the tokenizer only, so they can be passed to worker processes, which
+    load the tokenizer once.
+    
+    :param tokenizer_name: Name or path of the embedding model, whose fast tokenizer is used
+    :param max_tokens: Maximum number of tokens per chunk, defaults to the embedding window less the special tokens
+    :param overlap_tokens: Maximum number of tokens shared by consecutive chunks
+    :param max_seq_len: Maximum sequence length of the retriever, see CachedEmbeddingRetriever
+    :param batch_size: Number of documents tokenized at once
+    """
+    
+    def __init__(self, tokenizer_name: str, max_tokens: Optional[int] = None, overlap_tokens: int = 32,
+                 max_seq_len: int = 512, batch_size: int = 64):
+        """
+        Load the tokenizer and validate the chunk size.
+        
+        :param tokenizer_name: Name or path of the embedding model, whose fast tokenizer is used
+        :param max_tokens: Maximum number of tokens per chunk, defaults to the embedding window less the special
+                           tokens
+        :param overlap_tokens: Maximum number of tokens shared by consecutive chunks
+        :param max_seq_len: Maximum sequence length of the retriever
+        :param batch_size: Number of documents tokenized at once
+        :raises ValueError: If the tokenizer has no fast implementation or the chunk size does not fit the window
+        """
+        self.tokenizer_name = tokenizer_name
+        self.max_seq_len = max_seq_len
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+        if not self.tokenizer.is_fast:
+            raise ValueError(f"{tokenizer_name} has no fast tokenizer, which is needed for token offsets")
+        
+        # the model embeds at most the window, including special tokens such as [CLS] and [SEP]
+        self.window = min(self.tokenizer.model_max_length, max_seq_len)
+        self.max_tokens = max_tokens or self.window - self.tokenizer.num_special_tokens_to_add()
+        if self.max_tokens + self.tokenizer.num_special_tokens_to_add() > self.window:
+            raise ValueError(f"Chunks of {self.max_tokens} tokens exceed the window of {self.window} tokens of "
+                             f"{tokenizer_name}")
+        if not 0 <= overlap_tokens < self.max_tokens:
+            raise ValueError(f"overlap_tokens must be between 0 and {self.max_tokens - 1}")
+    
+    @property
+    def tokenizer(self) -> PreTrainedTokenizerFast:
+        """Tokenizer of the embedding model."""
+        return _load_tokenizer(self.tokenizer_name)
+    
+    def process(self, documents: List[Document]) -> List[Document]:
+        """
+        Split documents into chunks, like PreProcessor.process.
+        
+        :param documents: Documents to split; documents that are not text are returned unchanged
+        :return: Chunks in document order
+        """
+        chunks = []
+        for start in range(0, len(documents), self.batch_size):
+            batch = documents[start:start + self.batch_size]
+            texts = [clean_text(doc.content) if doc.content_type == "text" else None for doc in batch]
+            offsets = iter(self._token_offsets([text for text in texts if text]))
+            for doc, text in zip(batch, texts):
+                if text is None:
+                    chunks.append(doc)
+                elif text:
+                    chunks.extend(self._split(doc, text, next(offsets)))
+        return chunks
+    
+    def count_tokens(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Count the tokens the embedding model sees of texts, including special tokens and before truncation.
+        
+        :param texts: Texts, e.g. the contents of chunks
+        :return: Number of tokens per text
+        """
+        counts = []
+        for start in range(0, len(texts), self.batch_size):
+            encoding = self.tokenizer(list(texts[start:start + self.batch_size]), add_special_tokens=True,
+                                      return_attention_mask=False, return_token_type_ids=False, verbose=False)
+            counts.extend(len(input_ids) for input_ids in encoding["input_ids"])
+        return np.asarray(counts, dtype=np.int64)
+    
+    def _token_offsets(self, texts: List[str]) -> List[np.ndarray]:
+        """
+        Tokenize texts in one call of the fast tokenizer, without special tokens.
+        
+        :param texts: Non-empty texts
+        :return: Array of shape (num_tokens, 2) with the start and end character of each token, per text
+        """
+        if not texts:
+            return []
+        encoding = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True,
+                                  return_attention_mask=False, return_token_type_ids=False, verbose=False)
+        return [np.asarray(offsets, dtype=np.int64).reshape(-1, 2) for offsets in encoding["offset_mapping"]]
+    
+    def _split(self, document: Document, text: str, offsets: np.ndarray) -> List[Document]:
+        """
+        Split the cleaned text of a document by the character offsets of its tokens.
+        
+        :param document: Document the chunks inherit their meta fields from
+        :param text: Cleaned text of the document
+        :param offsets: Start and end character of each token of the text
+        :return: Chunks of the document
+        """
+        spans = self._token_spans(text, offsets)
+        if not spans:
+            return []
+        char_spans = [(int(offsets[start, 0]), int(offsets[end - 1, 1])) for start, end in spans]
+        chunks = [Document(content=text[start:end], meta={**document.meta, "_split_id": split_id},
+                           id_hash_keys=document.id_hash_keys)
+                  for split_id, (start, end) in enumerate(char_spans)]
+        
+        if self.overlap_tokens:
+            for chunk in chunks:
+                chunk.meta["_split_overlap"] = []
+            for split_id in range(len(chunks) - 1):
+                (start, end), next_start = char_spans[split_id], char_spans[split_id + 1][0]
+                if next_start < end:
+                    chunks[split_id].meta["_split_overlap"].append(
+                        {"doc_id": chunks[split_id + 1].id, "range": (next_start - start, end - start)})
+                    chunks[split_id + 1].meta["_split_overlap"].insert(
+                        0, {"doc_id": chunks[split_id].id, "range": (0, end - next_start)})
+        return chunks
+    
+    def _token_spans(self, text: str, offsets: np.ndarray) -> List[Tuple[int, int]]:
+        """
+        Choose the token ranges of the chunks of a text.
+        
+        :param text: Cleaned text
+        :param offsets: Start and end character of each token of the text
+        :return: Start and end token (exclusive) of each chunk
+        """
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            return []
+        starts, ends = offsets[:, 0], offsets[:, 1]
+        # first tokens of sentences, and first tokens of words (preceded by whitespace)
+        sentence_starts = np.unique(np.searchsorted(starts, [match.end() for match in _SENTENCE_END.finditer(text)]))
+        word_starts = np.flatnonzero(starts[1:] > ends[:-1]) + 1
+        
+        spans = []
+        start = end = 0
+        while end < num_tokens:
+            limit = start + self.max_tokens
+            if limit >= num_tokens:
+                next_end = num_tokens
+            else:
+                # each chunk ends after the end of the previous one
+                next_end = _last_bound(sentence_starts, end, limit) or _last_bound(word_starts, end, limit)
+                if next_end is None and start < end:
+                    # no boundary after the overlap, start the chunk without it
+                    start = end
+                    continue
+                next_end = next_end or limit
+            spans.append((start, next_end))
+            end = next_end
+            
+            start = end
+            if self.overlap_tokens and end < num_tokens:
+                low = max(end - self.overlap_tokens, spans[-1][0] + 1)
+                start = _first_bound(sentence_starts, low, end) or _first_bound(word_starts, low, end) or end
+        return spans
+
+
+def clean_text(text: str) -> str:
+    """
+    Strip the whitespace around lines and collapse runs of empty lines, like the PreProcessor.
+    
+    :param text: Text of a document
+    :return: Cleaned text
+    """
+    return _EMPTY_LINES.sub("\n\n", _LINE_WHITESPACE.sub("\n", text)).strip()
+
+
+def _last_bound(bounds: np.ndarray, low: int, high: int) -> Optional[int]:
+    """
+    Find the last boundary in the interval (low, high].
+    
+    :param bounds: Sorted token indices
+    :param low: Exclusive lower end
+    :param high: Inclusive upper end
+    :return: Token index, None if the interval holds no boundary
+    """
+    position = np.searchsorted(bounds, high, side="right") - 1
+    return int(bounds[position]) if position >= 0 and bounds[position] > low else None
+
+
+def _first_bound(bounds: np.ndarray, low: int, high: int) -> Optional[int]:
+    """
+    Find the first boundary in the interval [low, high).
+    
+    :param bounds: Sorted token indices
+    :param low: Inclusive lower end
+    :param high: Exclusive upper end
+    :return: Token index, None if the interval holds no boundary
+    """
+    position = np.searchsorted(bounds, low, side="left")
+    return int(bounds[position]) if position < len(bounds) and bounds[position] < high else None
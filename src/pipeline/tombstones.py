@@ -0,0 +1,67 @@
+"""src.pipeline.tombstones.py -- Vector ids of deleted chunks, excluded from FAISS searches."""
+
+from typing import Iterable, Optional
+
+import faiss
+import numpy as np
+
+
+class VectorTombstones:
+    """
+    Set of FAISS vector ids whose chunks were deleted.
+    
+    FAISS indexes address their vectors by position, and the chunk stores reference vectors by these ids; removing
+    a vector from the index would shift the ids of all later vectors. Vectors of deleted chunks therefore stay in
+    the index and are excluded from searches by an ID selector, so that a search still returns top_k live chunks.
+    
+    :param vector_ids: Vector ids of deleted chunks
+    """
+    
+    def __init__(self, vector_ids: Iterable[int] = ()):
+        """
+        Initialize the set.
+        
+        :param vector_ids: Vector ids of deleted chunks
+        """
+        self.ids = np.unique(np.fromiter(vector_ids, dtype=np.int64))
+        self._batch_selector: Optional[faiss.IDSelectorBatch] = None
+        self._selector: Optional[faiss.IDSelectorNot] = None
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def add(self, vector_ids: Iterable[int]):
+        """
+        Add vector ids of deleted chunks.
+        
+        :param vector_ids: Vector ids
+        """
+        self.ids = np.union1d(self.ids, np.fromiter(vector_ids, dtype=np.int64))
+        self._selector = None
+    
+    def search_params(self, index: faiss.Index) -> Optional[faiss.SearchParameters]:
+        """
+        Build search parameters that exclude the deleted vectors.
+        
+        The parameters replace those set on the index, so the current nprobe of IVF indexes and efSearch of HNSW
+        indexes are copied into them.
+        
+        :param index: FAISS index to search
+        :return: Search parameters, None if no vector is deleted
+        """
+        if len(self.ids) == 0:
+            return None
+        if self._selector is None:
+            # IDSelectorNot doesn't own the selector it negates, so both are kept
+            self._batch_selector = faiss.IDSelectorBatch(self.ids)
+            self._selector = faiss.IDSelectorNot(self._batch_selector)
+        
+        base_index = faiss.downcast_index(index)
+        if isinstance(base_index, faiss.IndexPreTransform):
+            base_index = faiss.downcast_index(base_index.index)
+        if isinstance(base_index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=self._selector, efSearch=base_index.hnsw.efSearch)
+        try:
+            return faiss.SearchParametersIVF(sel=self._selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+        except RuntimeError:
+            return faiss.SearchParameters(sel=self._selector)
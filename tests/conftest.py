@@ -51,7 +51,8 @@ def doc_store(tmp_path) -> DocumentStoreManager:
     store = DocumentStoreManager(
         db_path=db_path,
         index_path=index_path,
-        clean_start=True
+        clean_start=True,
+        embedding_cache_dir=str(tmp_path / "embedding_cache")
     )
     
     yield store
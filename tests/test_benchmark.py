@@ -0,0 +1,40 @@
+"""src.tests.test_benchmark.py -- Test benchmark corpus generation and baseline comparison."""
+
+from pathlib import Path
+
+from src.pipeline.benchmark import compare_results, latency_stats, parse_size, write_corpus
+from src.pipeline.preprocessing import load_documents, preprocess_documents
+
+
+def test_write_corpus(tmp_path: Path) -> None:
+    """
+    Test that the synthetic corpus is split into about the requested number of chunks.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    assert parse_size("10k") == 10_000 and parse_size("2500") == 2500, "size not parsed"
+    
+    num_files = write_corpus(str(tmp_path), num_chunks=25)
+    chunks = preprocess_documents(load_documents(str(tmp_path)))
+    
+    assert num_files == 3, "unexpected number of files"
+    assert 25 <= len(chunks) <= 35, f"unexpected number of chunks: {len(chunks)}"
+
+
+def test_compare_results() -> None:
+    """
+    Test that worse values beyond the tolerance are flagged, respecting the direction of each metric.
+    """
+    baseline = {"results": {"1k": {"add_documents": {"seconds": 10.0, "chunks_per_second": 100.0},
+                                   "query": latency_stats([0.01, 0.01, 0.02])}}}
+    results = {"results": {"1k": {"add_documents": {"seconds": 10.5, "chunks_per_second": 80.0},
+                                  "query": latency_stats([0.005, 0.005, 0.01])},
+                           "10k": {"add_documents": {"seconds": 1.0}}}}
+    
+    comparisons = {comparison["metric"]: comparison for comparison in compare_results(results, baseline, 0.1)}
+    
+    assert not comparisons["add_documents.seconds"]["regression"], "change within tolerance flagged"
+    assert comparisons["add_documents.chunks_per_second"]["regression"], "throughput drop not flagged"
+    assert not comparisons["query.p95_ms"]["regression"], "latency improvement flagged"
+    assert not comparisons["query.qps"]["regression"], "throughput gain flagged"
+    assert all(comparison["size"] == "1k" for comparison in comparisons.values()), "size without baseline compared"
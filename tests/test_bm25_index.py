@@ -0,0 +1,146 @@
+"""src.tests.test_bm25_index.py -- Test BM25 index, rank fusion and hybrid retrieval functionality."""
+
+from haystack.schema import Document
+
+from src.pipeline.bm25_index import TOKENIZER_VERSION, BM25Index, reciprocal_rank_fusion, tokenize
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.generators import StubGenerator
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.retrieval_evaluation import make_keyword_corpus
+
+
+def test_bm25_search() -> None:
+    """
+    Test that codes are kept as single terms and that exact matches rank first.
+    """
+    assert tokenize("Error E-1042 on x86_64!") == ["error", "e-1042", "on", "x86_64"], "unexpected terms"
+    
+    docs = [
+        Document(content="The pump failed with error E-1042 during startup."),
+        Document(content="The pump failed with error E-2077 during startup."),
+        Document(content="Valve maintenance schedule."),
+    ]
+    index = BM25Index()
+    index.add_documents(docs)
+    
+    results = index.search("error E-2077", top_k=3)
+    assert [doc_id for doc_id, _ in results[:1]] == [docs[1].id], "exact code not ranked first"
+    assert docs[2].id not in [doc_id for doc_id, _ in results], "unrelated document matched"
+    assert index.search("unknown terms") == [], "unknown terms matched"
+
+
+def test_bm25_non_ascii() -> None:
+    """
+    Test that words with non-ASCII letters are kept as single terms and found by their case-folded forms.
+    """
+    assert tokenize("Größe der Müller-Café, Straße 7") == ["grösse", "der", "müller-café", "strasse", "7"], \
+        "non-ASCII words split"
+    
+    docs = [
+        Document(content="Die Größe der Dichtung prüft Müller in der Hauptstraße."),
+        Document(content="Le café de la gare ferme à midi."),
+        Document(content="The mill checks the seal size."),
+    ]
+    index = BM25Index()
+    index.add_documents(docs)
+    assert [doc_id for doc_id, _ in index.search("Müller", top_k=3)] == [docs[0].id], "umlaut term not matched"
+    assert [doc_id for doc_id, _ in index.search("HAUPTSTRASSE", top_k=3)] == [docs[0].id], "ß not case-folded"
+    assert [doc_id for doc_id, _ in index.search("café", top_k=3)] == [docs[1].id], "accented term not matched"
+
+
+def test_bm25_segments(tmp_path) -> None:
+    """
+    Test that incremental batches are merged into few segments and survive a save and load roundtrip.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    docs = [Document(content=f"document number {i} mentions term{i % 7}") for i in range(64)]
+    incremental = BM25Index()
+    for doc in docs:
+        incremental.add_documents([doc, doc])
+    bulk = BM25Index()
+    bulk.add_documents(docs)
+    
+    assert len(incremental) == 64, "duplicate documents indexed"
+    assert len(incremental._segments) <= 7, "segments not merged"
+    assert incremental.search("term3 number", top_k=10) == bulk.search("term3 number", top_k=10), \
+        "incremental and bulk index differ"
+    
+    path = str(tmp_path / "index.bm25.npz")
+    incremental.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("term3 number", top_k=10) == bulk.search("term3 number", top_k=10), "loaded index differs"
+    
+    loaded.add_documents([Document(content="new document with term3")])
+    assert len(loaded) == 65, "document not added after loading"
+
+
+def test_bm25_remove_documents() -> None:
+    """
+    Test that removed documents are no longer found and that the remaining ones score as if never removed.
+    """
+    docs = [Document(content=f"document number {i} mentions term{i % 7}") for i in range(64)]
+    index = BM25Index()
+    for start in range(0, 64, 8):
+        index.add_documents(docs[start:start + 8])
+    removed = [doc.id for doc in docs[::3]]
+    
+    assert index.remove_documents(removed + ["unknown"]) == len(removed), "wrong number of documents removed"
+    remaining = BM25Index()
+    remaining.add_documents(doc for doc in docs if doc.id not in removed)
+    assert len(index) == len(remaining) and docs[0].id not in index, "documents not removed"
+    assert index.search("term3 number", top_k=64) == remaining.search("term3 number", top_k=64), \
+        "scores differ from an index without the removed documents"
+    
+    index.add_documents([docs[0]])
+    assert index.search("number 0", top_k=1)[0][0] == docs[0].id, "removed document not added again"
+
+
+def test_reciprocal_rank_fusion() -> None:
+    """
+    Test that documents ranked well by both rankings win and that weights shift the fused order.
+    """
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d", "a"]])
+    assert [doc_id for doc_id, _ in fused][:1] == ["b"], "document ranked well by both not first"
+    
+    weighted = reciprocal_rank_fusion([["a"], ["d"]], weights=[1.0, 2.0])
+    assert [doc_id for doc_id, _ in weighted] == ["d", "a"], "weights ignored"
+
+
+def test_hybrid_pipeline(tmp_path) -> None:
+    """
+    Test that hybrid retrieval finds documents by part number and that the BM25 index persists with the store.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    docs, queries = make_keyword_corpus(num_documents=200, num_queries=20)
+    db_path = str(tmp_path / "store.db")
+    index_path = str(tmp_path / "store.faiss")
+    store = DocumentStoreManager(db_path=db_path, index_path=index_path, clean_start=True,
+                                 embedding_cache_dir=str(tmp_path / "embedding_cache"))
+    store.add_documents(docs)
+    
+    pipeline = QueryPipeline(store.get_retriever(), generator=StubGenerator(), bm25_index=store.bm25_index)
+    retrieved = pipeline.retrieve([query for query, _ in queries], params={"Retriever": {"top_k": 3}})
+    hits = [relevant_id in [doc.id for doc in documents] for (_, relevant_id), documents in zip(queries, retrieved)]
+    assert all(hits), "hybrid retrieval missed part numbers"
+    
+    result = pipeline.run(queries[0][0], params={"Retriever": {"top_k": 3}})
+    assert result["answers"][0]["answer"].startswith("[stub"), "stub answer missing"
+    
+    assert (tmp_path / "store.bm25.npz").exists(), "BM25 index not saved"
+    reopened = DocumentStoreManager(db_path=db_path, index_path=index_path,
+                                    embedding_cache_dir=str(tmp_path / "embedding_cache"))
+    assert len(reopened.bm25_index) == 200, "BM25 index not loaded"
+    assert reopened.bm25_index.search(queries[0][0], top_k=1) == store.bm25_index.search(queries[0][0], top_k=1), \
+        "loaded BM25 index differs"
+    
+    # indexes of an older tokenizer are rebuilt
+    reopened.bm25_index.tokenizer_version = 1
+    reopened.bm25_index.save(str(tmp_path / "store.bm25.npz"))
+    rebuilt = DocumentStoreManager(db_path=db_path, index_path=index_path,
+                                   embedding_cache_dir=str(tmp_path / "embedding_cache"))
+    assert rebuilt.bm25_index.tokenizer_version == TOKENIZER_VERSION and len(rebuilt.bm25_index) == 200, \
+        "BM25 index of an older tokenizer not rebuilt"
+    assert BM25Index.load(str(tmp_path / "store.bm25.npz")).tokenizer_version == TOKENIZER_VERSION, \
+        "rebuilt BM25 index not saved"
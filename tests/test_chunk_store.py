@@ -0,0 +1,104 @@
+"""src.tests.test_chunk_store.py -- Test the columnar chunk store and the document store using it."""
+
+from pathlib import Path
+from typing import List
+
+import pytest
+from haystack.schema import Document
+
+from src.pipeline.chunk_store import ChunkStore, ColumnarDocumentStore
+from src.pipeline.chunk_store_evaluation import compare_chunk_stores
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.retrieval_evaluation import make_keyword_corpus
+
+
+def test_chunk_store(tmp_path: Path) -> None:
+    """
+    Test that chunks are read by row, and that only committed rows survive reopening the store.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    store = ChunkStore(str(tmp_path / "chunks"))
+    store.append(["a", "b"], ["Erste Zeile", "second ✓"], [{"page": 1}, {}])
+    store.commit()
+    store.append(["c"], ["uncommitted"], [{"page": 3}])
+    assert store.get_many([2, 0]) == [("c", "uncommitted", {"page": 3}), ("a", "Erste Zeile", {"page": 1})], \
+        "chunks not read by row"
+    with pytest.raises(ValueError):
+        store.append(["a"], ["duplicate"], [{}])
+    
+    reopened = ChunkStore(str(tmp_path / "chunks"))
+    assert len(reopened) == 2 and "c" not in reopened, "uncommitted row not dropped"
+    reopened.append(["d"], ["after reopening"], [{}])
+    assert reopened.get_row("d") == 2 and reopened.get_many([1, 2])[1][1] == "after reopening", "append failed"
+    
+    assert reopened.delete(["b", "x"]) == [1], "chunk not deleted"
+    reopened.commit()
+    reopened = ChunkStore(str(tmp_path / "chunks"))
+    assert len(reopened) == 2 and reopened.num_rows == 3 and reopened.get_row("b") is None, "deletion not persisted"
+    assert reopened.get_row("d") == 2, "rows moved by deletion"
+    
+    reopened.clear()
+    assert len(ChunkStore(str(tmp_path / "chunks"))) == 0, "store not cleared"
+
+
+def test_columnar_document_store(tmp_path: Path, test_docs: List[Document]) -> None:
+    """
+    Test that the columnar store retrieves like the SQLite store and survives reloads and interrupted writes.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param test_docs: Documents to add
+    """
+    documents, _ = make_keyword_corpus(20, 0)
+    stores = {}
+    for chunk_store in ["sqlite", "columnar"]:
+        stores[chunk_store] = DocumentStoreManager(db_path=str(tmp_path / f"{chunk_store}.db"),
+                                                   index_path=str(tmp_path / f"{chunk_store}.faiss"),
+                                                   embedding_cache_dir=str(tmp_path / "embedding_cache"),
+                                                   chunk_store=chunk_store)
+        assert stores[chunk_store].add_documents(documents)["new"] == 20, "documents not added"
+    
+    store = stores["columnar"]
+    assert isinstance(store.document_store, ColumnarDocumentStore), "columnar store not used"
+    assert not (tmp_path / "columnar.db").exists(), "SQLite database created"
+    results = {name: [(doc.id, round(doc.score, 5)) for doc in manager.retriever.retrieve("pump seals", top_k=5)]
+               for name, manager in stores.items()}
+    assert results["columnar"] == results["sqlite"], "retrieval results differ"
+    assert store.document_store.get_documents_by_id([documents[3].id])[0].content == documents[3].content, \
+        "document not found by id"
+    
+    # simulate a crash after writing a batch but before saving the index
+    for doc in test_docs:
+        doc.embedding = store.retriever.embed_documents([doc])[0]
+    store.document_store.write_documents(test_docs)
+    assert store.document_store.get_document_count() == 22, "documents not written"
+    
+    reloaded = DocumentStoreManager(db_path=store.db_path, index_path=store.index_path, embedding_cache_size=0)
+    assert isinstance(reloaded.document_store, ColumnarDocumentStore), "columnar store not reloaded"
+    assert reloaded.document_store.get_document_count() == 20, "unsaved chunks not dropped"
+    assert reloaded.document_store.get_embedding_count() == 20, "embedding count mismatch"
+    assert reloaded.add_documents(test_docs)["new"] == 2, "dropped chunks not added again"
+    
+    # chunks committed without vectors are embedded by the next write
+    reloaded.document_store.append_documents(make_keyword_corpus(21, 0)[0][20:])
+    reloaded.document_store.chunks.commit()
+    reloaded = DocumentStoreManager(db_path=store.db_path, index_path=store.index_path, embedding_cache_size=0)
+    assert reloaded.add_documents([])["reembedded"] == 1, "chunk without vector not embedded"
+    assert reloaded.document_store.get_embedding_count() == 23, "embedding count mismatch"
+    assert len(reloaded.bm25_index) == 23, "BM25 index out of sync"
+
+
+def test_compare_chunk_stores(tmp_path: Path) -> None:
+    """
+    Test that the evaluation reports write throughput and hydration latency of both stores.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    documents, _ = make_keyword_corpus(300, 0)
+    results = compare_chunk_stores(documents, top_k_values=[5, 50], num_queries=3, batch_size=100,
+                                   work_dir=str(tmp_path), embedding_dim=8)
+    
+    assert [result["chunk_store"] for result in results] == ["sqlite", "columnar"], "stores missing"
+    assert results[0]["write_speedup"] == 1.0, "baseline not compared to itself"
+    assert all(result["chunks_per_second"] > 0 and result["hydration_ms@50"] > 0 for result in results), \
+        "measurements missing"
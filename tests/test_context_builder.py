@@ -0,0 +1,75 @@
+"""src.tests.test_context_builder.py -- Test context packing functionality."""
+
+from haystack.schema import Document
+from typing import List
+
+from src.pipeline import context_builder
+from src.pipeline.context_builder import ApproximateTokenizer, ContextBuilder
+from src.pipeline.options import STUB_MODEL_NAME
+from src.pipeline.preprocessing import preprocess_documents
+
+
+def make_chunks() -> List[Document]:
+    """
+    Split a long document into overlapping chunks with descending scores.
+    
+    :return: List of chunks
+    """
+    text = " ".join(f"word{i}." if i % 20 == 19 else f"word{i}" for i in range(1200))
+    chunks = preprocess_documents([Document(content=text, meta={"file_path": "long.txt"})])
+    for rank, chunk in enumerate(chunks):
+        chunk.score = 1.0 - rank / 10
+    return chunks
+
+
+def test_merge_adjacent_chunks() -> None:
+    """
+    Test that consecutive chunks of a file are merged without the duplicated overlap.
+    """
+    chunks = make_chunks()
+    builder = ContextBuilder(max_context_tokens=None)
+    context = builder.pack("query", chunks + [Document(content=chunks[0].content, score=0.0)])
+    
+    assert len(chunks) > 1, "test document not split"
+    assert len(context["documents"]) == 1, "adjacent chunks not merged"
+    words = context["documents"][0].content.split()
+    assert len(words) == len(set(words)) == 1200, "overlap not removed"
+    assert context["context_tokens"] == builder.count_tokens(context["documents"][0].content), \
+        "context tokens mismatch"
+    assert context["prompt_tokens"] > context["context_tokens"], "prompt tokens missing query"
+
+
+def test_token_budget() -> None:
+    """
+    Test that chunks are packed by score under the token budget.
+    """
+    chunks = make_chunks()
+    budget = ContextBuilder().count_tokens(chunks[0].content) + 10
+    context = ContextBuilder(max_context_tokens=budget).pack("query", chunks)
+    
+    assert context["context_tokens"] <= budget, "token budget exceeded"
+    assert [doc.id for doc in context["documents"]] == [chunks[0].id], "best chunk not selected"
+    
+    truncated = ContextBuilder(max_context_tokens=50).pack("query", chunks)
+    assert truncated["context_tokens"] == 50, "oversized best chunk not truncated to the budget"
+    assert chunks[0].content.startswith(truncated["documents"][0].content), "truncated chunk mismatch"
+
+
+def test_tokenizer_fallback(monkeypatch) -> None:
+    """
+    Test that the stub model and models whose tokenizer cannot be loaded count tokens without tiktoken.
+    
+    :param monkeypatch: Pytest fixture to make loading the tokenizer fail
+    """
+    def fail_to_load(tokenizer_name: str):
+        raise ConnectionError(f"cannot download {tokenizer_name}")
+    
+    monkeypatch.setattr(context_builder, "load_openai_tokenizer", fail_to_load)
+    assert isinstance(ContextBuilder(model_name=STUB_MODEL_NAME).tokenizer, ApproximateTokenizer), "stub not estimated"
+    builder = ContextBuilder(max_context_tokens=5)
+    assert builder.count_tokens("a" * 10) == 3, "unavailable tokenizer not estimated"
+    packed = builder.pack("query", [Document(content="b" * 40, score=1.0)])
+    assert packed["documents"][0].content == "b" * 20, "chunk not truncated to the estimated budget"
+    
+    tokenizer = ApproximateTokenizer(chars_per_token=1)
+    assert ContextBuilder(tokenizer=tokenizer).count_tokens("abc") == 3, "injected tokenizer not used"
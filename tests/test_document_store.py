@@ -1,9 +1,12 @@
 """src.tests.test_document_store.py -- Test document store functionality."""
 
+import faiss
+import pytest
+
 from haystack.schema import Document
 from typing import List
 
-from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.document_store import DocumentStoreManager, faiss_search_params, query_by_embedding_batch
 
 
 
@@ -38,3 +41,205 @@ def test_get_retriever(doc_store: DocumentStoreManager) -> None:
     retriever = doc_store.get_retriever()
     assert retriever is not None, "retriever missing"
     assert retriever == doc_store.retriever, "retriever mismatch"
+
+
+def test_add_documents_incremental(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that only new chunks are embedded when adding documents to a populated store.
+
+    :param doc_store: Document store instance
+    :param test_docs: Documents to add
+    """
+    stats = doc_store.add_documents(test_docs[:1])
+    assert stats == {"new": 1, "skipped": 0, "reembedded": 0}, "initial stats mismatch"
+    
+    stats = doc_store.add_documents(test_docs)
+    assert stats == {"new": 1, "skipped": 1, "reembedded": 0}, "incremental stats mismatch"
+    assert doc_store.document_store.get_document_count() == len(test_docs), "document count mismatch"
+    assert doc_store.document_store.get_embedding_count() == len(test_docs), "embedding count mismatch"
+
+
+def test_recover_interrupted_batch(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that a batch written to the SQL database but not to the saved index is rolled back on load.
+
+    :param doc_store: Document store instance
+    :param test_docs: Documents to add
+    """
+    doc_store.add_documents(test_docs[:1])
+    
+    # simulate a crash after writing the second batch but before saving the index
+    interrupted_docs = test_docs[1:]
+    for doc in interrupted_docs:
+        doc.embedding = doc_store.retriever.embed_documents([doc])[0]
+    doc_store._write_pending_ids([doc.id for doc in interrupted_docs])
+    doc_store.document_store.write_documents(interrupted_docs)
+    
+    reloaded = DocumentStoreManager(
+        embedding_model=doc_store.retriever.embedding_model,
+        db_path=doc_store.db_path,
+        index_path=doc_store.index_path,
+        embedding_cache_size=0
+    )
+    assert reloaded.document_store.get_document_count() == 1, "interrupted batch not rolled back"
+    assert reloaded.document_store.get_embedding_count() == 1, "embedding count mismatch"
+
+
+@pytest.mark.parametrize("chunk_store", ["sqlite", "columnar"])
+def test_vector_journal(tmp_path, chunk_store: str) -> None:
+    """
+    Test that batches are journaled instead of rewriting the index, replayed on load and compacted.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param chunk_store: Chunk store of the document store
+    """
+    params = dict(db_path=str(tmp_path / "journal.db"), index_path=str(tmp_path / "journal.faiss"),
+                  embedding_cache_size=0, chunk_store=chunk_store, journal_compaction_ratio=10.0)
+    docs = [Document(content=f"Pump {i} of station {i % 4} needs new seals.") for i in range(12)]
+    store = DocumentStoreManager(**params)
+    store.add_documents(docs[:4])
+    index_stat = (tmp_path / "journal.faiss").stat()
+    assert len(store.journal) == 0, "first batch not saved to the index"
+    
+    store.add_documents(docs[4:8])
+    assert (tmp_path / "journal.faiss").stat().st_mtime_ns == index_stat.st_mtime_ns, "index rewritten"
+    assert store.journal.num_vectors == 4, "batch not journaled"
+    
+    # simulate a crash after journaling a batch but before writing its chunks
+    interrupted_docs = docs[8:]
+    store._write_pending_ids([doc.id for doc in interrupted_docs])
+    store.journal.append(8, [doc.id for doc in interrupted_docs], store.retriever.embed_documents(interrupted_docs))
+    
+    reloaded = DocumentStoreManager(**params)
+    assert reloaded.document_store.get_embedding_count() == 8, "journal not replayed"
+    assert reloaded.document_store.get_document_count() == 8 and reloaded.journal.num_vectors == 4, \
+        "interrupted batch not dropped from the journal"
+    assert [doc.id for doc in reloaded.retriever.retrieve(docs[6].content, top_k=1)] == [docs[6].id], \
+        "journaled vector not searchable"
+    
+    reloaded.add_documents(interrupted_docs)
+    reloaded.compact()
+    assert len(reloaded.journal) == 0 and (tmp_path / "journal.journal").stat().st_size == 0, "journal not emptied"
+    assert (tmp_path / "journal.faiss").stat().st_size > index_stat.st_size, "journal not folded into the index"
+    assert DocumentStoreManager(**params).document_store.get_embedding_count() == 12, "compacted index incomplete"
+
+
+@pytest.mark.parametrize("chunk_store", ["sqlite", "columnar"])
+def test_delete_documents(tmp_path, chunk_store: str) -> None:
+    """
+    Test that deleted chunks are excluded from searches, also after reloading and adding documents.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param chunk_store: Chunk store of the document store
+    """
+    params = dict(db_path=str(tmp_path / "delete.db"), index_path=str(tmp_path / "delete.faiss"),
+                  embedding_cache_size=0, index_type="hnsw", chunk_store=chunk_store)
+    store = DocumentStoreManager(**params)
+    docs = [Document(content=f"Pump {i} of station {i % 4} needs new seals.") for i in range(20)]
+    store.add_documents(docs)
+    deleted_ids = {doc.id for doc in docs[:12]}
+    
+    assert store.delete_documents(list(deleted_ids) + ["unknown"]) == 12, "wrong number of chunks deleted"
+    assert store.document_store.get_document_count() == 8, "chunks not deleted"
+    assert store.document_store.get_embedding_count() == 20, "vectors of deleted chunks removed"
+    assert not deleted_ids & {doc_id for doc_id, _ in store.bm25_index.search("pump seals", top_k=20)}, \
+        "deleted chunks still in the BM25 index"
+    
+    query = store.retriever.embed_queries([docs[3].content])
+    results = query_by_embedding_batch(store.document_store, query, top_k=5)[0]
+    assert len(results) == 5 and not deleted_ids & {doc.id for doc in results}, "deleted chunks retrieved"
+    
+    reloaded = DocumentStoreManager(**params)
+    assert len(reloaded.document_store.tombstones) == 12, "deleted vectors not found after reload"
+    reloaded.add_documents(docs[:2])
+    results = query_by_embedding_batch(reloaded.document_store, query, top_k=20)[0]
+    assert {doc.id for doc in results} == {doc.id for doc in docs[2:] if doc.id not in deleted_ids} | \
+        {docs[0].id, docs[1].id}, "retrieved chunks differ from the live chunks"
+
+
+def test_ivf_index_training(tmp_path, test_docs: List[Document]) -> None:
+    """
+    Test that an IVF index is trained automatically and accepts query-time search parameters.
+
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param test_docs: Documents to add
+    """
+    store = DocumentStoreManager(
+        db_path=str(tmp_path / "ivf_document_store.db"),
+        index_path=str(tmp_path / "ivf_document_store.faiss"),
+        embedding_cache_size=0,
+        index_type="ivf_flat",
+        n_list=1
+    )
+    store.add_documents(test_docs)
+    index = store.document_store.faiss_indexes[store.document_store.index]
+    assert index.is_trained, "index not trained"
+    assert store.document_store.get_embedding_count() == len(test_docs), "embedding count mismatch"
+    
+    with faiss_search_params(store.document_store, nprobe=4):
+        assert faiss.extract_index_ivf(index).nprobe == 4, "nprobe not applied"
+    assert faiss.extract_index_ivf(index).nprobe == 1, "nprobe not restored"
+
+
+def test_search_params_unsupported(doc_store: DocumentStoreManager) -> None:
+    """
+    Test that search parameters of other index types are rejected.
+
+    :param doc_store: Document store instance
+    """
+    with pytest.raises(ValueError):
+        with faiss_search_params(doc_store.document_store, nprobe=4):
+            pass
+
+
+def test_mmap_index(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test searching a memory-mapped index and adding documents to it.
+
+    :param doc_store: Document store instance
+    :param test_docs: Documents to add
+    """
+    doc_store.add_documents(test_docs[:1])
+    
+    mapped = DocumentStoreManager(
+        embedding_model=doc_store.retriever.embedding_model,
+        db_path=doc_store.db_path,
+        index_path=doc_store.index_path,
+        embedding_cache_size=0,
+        mmap_index=True
+    )
+    assert mapped.index_mmapped, "index not memory-mapped"
+    assert mapped.retriever.retrieve("test", top_k=1), "no documents retrieved"
+    
+    mapped.add_documents(test_docs)
+    assert not mapped.index_mmapped, "index not loaded into memory before adding documents"
+    assert mapped.document_store.get_embedding_count() == len(test_docs), "embedding count mismatch"
+
+
+def test_compressed_index(tmp_path) -> None:
+    """
+    Test a store with PCA-reduced int8 vectors: training, retrieval without embeddings, search params and reload.
+
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    params = dict(db_path=str(tmp_path / "compressed.db"), index_path=str(tmp_path / "compressed.faiss"),
+                  embedding_cache_size=0, index_type="hnsw", vector_dtype="int8", reduced_dim=16)
+    store = DocumentStoreManager(**params)
+    model = store.retriever.embedding_encoder.embedding_model
+    assert store.embedding_dim == model.get_sentence_embedding_dimension(), "dimension not taken from the model"
+    
+    docs = [Document(content=f"Valve {i} of circuit {i % 5} is inspected every {i + 2} weeks.",
+                     meta={"file_path": f"notes/{i}.txt"}) for i in range(40)]
+    store.add_documents(docs)
+    index = store.document_store.faiss_indexes[store.document_store.index]
+    assert isinstance(index, faiss.IndexPreTransform) and index.is_trained, "projection not trained"
+    
+    with faiss_search_params(store.document_store, ef_search=64):
+        results = store.retriever.retrieve(docs[7].content, top_k=3)
+    assert docs[7].id in [doc.id for doc in results], "compressed index lost the exact match"
+    assert all(doc.embedding is None for doc in results), "embeddings returned without being requested"
+    
+    reloaded = DocumentStoreManager(**params, mmap_index=True, return_embedding=True)
+    results = reloaded.retriever.retrieve(docs[7].content, top_k=3)
+    assert docs[7].id in [doc.id for doc in results], "reloaded index lost the exact match"
+    assert results[0].embedding.shape == (store.embedding_dim,), "requested embeddings not returned"
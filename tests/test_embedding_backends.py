@@ -0,0 +1,81 @@
+"""src.tests.test_embedding_backends.py -- Test the ONNX Runtime embedding backends and their evaluation."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.embedding_backend_evaluation import compare_embedding_backends
+from src.pipeline.embedding_backends import load_embedding_model
+
+pytest.importorskip("onnxruntime")
+
+
+def test_onnx_backends(doc_store: DocumentStoreManager, tmp_path: Path) -> None:
+    """
+    Test that the ONNX backends reproduce the fp32 embeddings and that exported models are reused.
+    
+    :param doc_store: Document store with the fp32 torch backend
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    model_name = doc_store.retriever.embedding_model
+    texts = ["The pump needs maintenance every month.", "Replace the worn seals of the valve."]
+    expected = load_embedding_model(model_name).encode(texts)
+    
+    onnx_model_dir = tmp_path / "onnx_models"
+    fp32_model = load_embedding_model(model_name, backend="onnx", cache_dir=str(onnx_model_dir))
+    assert np.allclose(fp32_model.encode(texts), expected, atol=1e-4), "onnx embeddings differ"
+    
+    int8_model = load_embedding_model(model_name, backend="onnx-int8", cache_dir=str(onnx_model_dir))
+    cosine = np.sum(int8_model.encode(texts) * expected, axis=1) / np.linalg.norm(expected, axis=1) ** 2
+    assert np.all(cosine > 0.9), "int8 embeddings too far from fp32"
+    
+    exported = sorted(onnx_model_dir.glob("*/*.onnx"))
+    assert [path.name for path in exported] == ["model.int8.onnx", "model.onnx"], "exports not cached"
+    mtimes = [path.stat().st_mtime_ns for path in exported]
+    load_embedding_model(model_name, backend="onnx-int8", cache_dir=str(onnx_model_dir))
+    assert [path.stat().st_mtime_ns for path in exported] == mtimes, "cached export not reused"
+    
+    with pytest.raises(ValueError):
+        load_embedding_model(model_name, backend="tensorrt")
+
+
+def test_document_store_backend(tmp_path: Path) -> None:
+    """
+    Test that a store with the onnx backend embeds like the fp32 store and keeps separate cache entries.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    stores = {}
+    for backend in ["torch", "onnx"]:
+        stores[backend] = DocumentStoreManager(db_path=str(tmp_path / f"{backend}.db"),
+                                               index_path=str(tmp_path / f"{backend}.faiss"),
+                                               embedding_cache_dir=str(tmp_path / "embedding_cache"),
+                                               embedding_backend=backend,
+                                               onnx_model_dir=str(tmp_path / "onnx_models"))
+    
+    query = "pump maintenance"
+    expected = stores["torch"].retriever.embed_queries([query])
+    assert np.allclose(stores["onnx"].retriever.embed_queries([query]), expected, atol=1e-4), \
+        "onnx query embedding differs"
+    assert stores["onnx"].embedding_cache.hits == 0, "fp32 cache entry served to the onnx backend"
+
+
+def test_compare_embedding_backends(doc_store: DocumentStoreManager, tmp_path: Path) -> None:
+    """
+    Test that the evaluation reports throughput and recall@k of each backend against the fp32 baseline.
+    
+    :param doc_store: Document store whose embedding model is evaluated
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    passages = [f"Valve number {i} belongs to circuit {i % 7} of the cooling system." for i in range(40)]
+    queries = ["Which circuit does valve 12 belong to?", "cooling system circuit 3"]
+    results = compare_embedding_backends(doc_store.retriever.embedding_model, passages, queries, k=3,
+                                         backends=["onnx", "onnx-int8"], cache_dir=str(tmp_path / "onnx_models"),
+                                         batch_size=8)
+    
+    assert [result["backend"] for result in results] == ["torch", "onnx", "onnx-int8"], "backends missing"
+    assert results[0]["recall@3"] == 1.0 and results[0]["speedup"] == 1.0, "baseline not compared to itself"
+    assert results[1]["mean_cosine"] > 0.999, "onnx embeddings differ"
+    assert all(result["passages_per_second"] > 0 for result in results), "throughput missing"
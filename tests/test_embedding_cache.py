@@ -0,0 +1,84 @@
+"""src.tests.test_embedding_cache.py -- Test embedding cache functionality."""
+
+import numpy as np
+
+from haystack.schema import Document
+from pathlib import Path
+from typing import List
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.embedding_cache import EmbeddingCache
+
+
+def test_cache_roundtrip(tmp_path: Path) -> None:
+    """
+    Test storing, normalizing and reloading cached vectors.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    cache = EmbeddingCache(str(tmp_path), model_name="test-model")
+    keys = [cache.make_key("first  text"), cache.make_key("second text")]
+    cache.put_many(keys, np.ones((2, 4)))
+    
+    assert cache.make_key(" first text ") == keys[0], "text normalization mismatch"
+    assert cache.make_key("first text", kind="query") != keys[0], "query and passage keys collide"
+    
+    reloaded = EmbeddingCache(str(tmp_path), model_name="test-model")
+    assert len(reloaded) == 2, "cache entries not persisted"
+    assert np.allclose(reloaded.get_many(keys[:1])[0], 1.0), "cached vector mismatch"
+    assert len(EmbeddingCache(str(tmp_path), model_name="other-model")) == 0, "models share cache entries"
+
+
+def test_cache_eviction(tmp_path: Path) -> None:
+    """
+    Test that the least recently used entries are evicted when the cache is full.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    cache = EmbeddingCache(str(tmp_path), model_name="test-model", max_entries=2)
+    keys = [cache.make_key(f"text {i}") for i in range(3)]
+    cache.put_many(keys[:2], np.zeros((2, 4)))
+    cache.get_many(keys[:1])  # mark first entry as recently used
+    cache.put_many(keys[2:], np.zeros((1, 4)))
+    
+    cached = cache.get_many(keys)
+    assert len(cache) == 2, "cache size exceeds limit"
+    assert cached[0] is not None and cached[2] is not None, "recently used entries evicted"
+    assert cached[1] is None, "least recently used entry not evicted"
+
+
+def test_shared_cache_dir(tmp_path: Path) -> None:
+    """
+    Test that caches sharing a directory never return the vector of another text.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    a = EmbeddingCache(str(tmp_path), model_name="test-model", max_entries=2)
+    b = EmbeddingCache(str(tmp_path), model_name="test-model", max_entries=2)
+    keys = [a.make_key(f"text {i}") for i in range(4)]
+    a.put_many(keys[:2], np.zeros((2, 4)))
+    b.put_many(keys[2:], np.ones((2, 4)))
+    
+    assert a.get_many(keys[:2]) == [None, None], "slot reused by another cache returned as a hit"
+    
+    grown = EmbeddingCache(str(tmp_path), model_name="test-model")
+    grown.put_many([grown.make_key(f"more {i}") for i in range(EmbeddingCache.MIN_CAPACITY + 1)],
+                   np.full((EmbeddingCache.MIN_CAPACITY + 1, 4), 2.0))
+    b.put_many(keys[:1], np.zeros((1, 4)))
+    assert np.allclose(EmbeddingCache(str(tmp_path), model_name="test-model").get_many(keys[:1])[0], 0.0), \
+        "write to the files replaced by a growing cache lost"
+
+
+def test_add_documents_populates_cache(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that embeddings computed during document addition are cached.
+    
+    :param doc_store: Document store instance
+    :param test_docs: Documents to add
+    """
+    doc_store.add_documents(test_docs)
+    assert len(doc_store.embedding_cache) == len(test_docs), "embeddings not cached"
+    
+    embeddings = doc_store.retriever.embed_documents(test_docs)
+    assert embeddings.shape[0] == len(test_docs), "embedding count mismatch"
+    assert doc_store.embedding_cache.hits == len(test_docs), "cache not consulted"
@@ -0,0 +1,62 @@
+"""src.tests.test_generators.py -- Test answer generator functionality."""
+
+import asyncio
+import time
+
+import pytest
+
+from haystack.schema import Document
+from typing import List
+
+from src.pipeline.generators import PromptNodeGenerator, StubGenerator
+
+
+def test_stub_generator_deterministic(test_docs: List[Document]) -> None:
+    """
+    Test that the stub generator answers identical inputs identically and quotes the best document.
+    
+    :param test_docs: Test documents
+    """
+    generator = StubGenerator()
+    answer = generator.generate("test query", test_docs)
+    
+    assert answer == generator.generate("test query", test_docs), "answer not deterministic"
+    assert answer != generator.generate("other query", test_docs), "answer independent of query"
+    assert test_docs[0].content in answer, "best document not quoted"
+    assert "cannot be answered" in generator.generate("test query", []), "empty context not handled"
+
+
+def test_stub_generator_latency(test_docs: List[Document]) -> None:
+    """
+    Test that concurrent async calls overlap their simulated latency.
+    
+    :param test_docs: Test documents
+    """
+    generator = StubGenerator(latency_seconds=0.2)
+    
+    async def generate_all():
+        return await asyncio.gather(*[generator.agenerate(f"query {i}", test_docs) for i in range(10)])
+    
+    start = time.perf_counter()
+    answers = asyncio.run(generate_all())
+    assert len(answers) == 10, "answers missing"
+    assert time.perf_counter() - start < 1.0, "async calls did not overlap"
+    
+    with pytest.raises(ValueError):
+        StubGenerator(latency_seconds=-1)
+
+
+def test_prompt_node_generator_stream(test_docs: List[Document]) -> None:
+    """
+    Test that tokens passed to the stream handler of the prompt node are yielded in order.
+    
+    :param test_docs: Test documents
+    """
+    class StreamingPromptNode:
+        def run(self, query, documents, generation_kwargs):
+            for token in ["Test", " answer"]:
+                generation_kwargs["stream_handler"](token)
+            return {"results": ["Test answer"]}, "output_1"
+    
+    assert list(PromptNodeGenerator(StreamingPromptNode()).stream("test query", test_docs)) == ["Test", " answer"], \
+        "streamed tokens mismatch"
@@ -0,0 +1,41 @@
+"""src.tests.test_index_evaluation.py -- Test index evaluation functionality."""
+
+import numpy as np
+
+from src.pipeline.index_evaluation import evaluate_compression, evaluate_index_types, recall_at_k
+
+
+def test_recall_at_k() -> None:
+    """
+    Test recall computation against exact neighbors.
+    """
+    ground_truth = np.array([[0, 1], [2, 3]])
+    retrieved = np.array([[1, 0], [2, 5]])
+    assert recall_at_k(ground_truth, retrieved) == 0.75, "recall mismatch"
+
+
+def test_evaluate_index_types() -> None:
+    """
+    Test that the flat index reaches full recall and approximate indexes are reported.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 16)).astype(np.float32)
+    results = evaluate_index_types(vectors, vectors[:10], k=3, index_types=["flat", "ivf_flat"], n_list=8)
+    
+    flat_results = [result for result in results if result["index_type"] == "flat"]
+    assert flat_results[0]["recall@3"] == 1.0, "flat index recall mismatch"
+    assert any(result["index_type"] == "ivf_flat" for result in results), "ivf results missing"
+
+
+def test_evaluate_compression() -> None:
+    """
+    Test that compressed storage is reported with its size reduction and that PCA keeps low-rank vectors.
+    """
+    rng = np.random.default_rng(0)
+    vectors = (rng.standard_normal((2000, 8)) @ rng.standard_normal((8, 64))).astype(np.float32)
+    results = evaluate_compression(vectors, vectors[:20], k=3, reduced_dims=[8], dim_reductions=["pca"])
+    
+    by_setting = {(result["vector_dtype"], result["reduced_dim"]): result for result in results}
+    assert by_setting[("fp32", None)]["recall@3"] == 1.0, "uncompressed recall mismatch"
+    assert by_setting[("int8", None)]["compression"] > 3.5, "int8 vectors not 4x smaller"
+    assert by_setting[("fp32", 8)]["recall@3"] > 0.95, "pca lost the rank-8 structure"
@@ -0,0 +1,178 @@
+"""src.tests.test_ingestion.py -- Test streaming ingestion functionality."""
+
+import json
+import os
+
+from pathlib import Path
+
+import pytest
+
+from src.pipeline import ingestion
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.ingestion import IngestionQueue, ingest_directory
+from src.pipeline.manifest import IngestionManifest, hash_file
+from src.pipeline.token_chunker import TokenChunker
+
+
+def test_ingest_directory(doc_store: DocumentStoreManager, test_dir: Path, tmp_path: Path) -> None:
+    """
+    Test ingesting a directory in batches.
+
+    :param doc_store: Document store instance
+    :param test_dir: Directory containing test documents
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    checkpoint_path = tmp_path / "checkpoint.json"
+    stats = ingest_directory(str(test_dir), doc_store, batch_size=1, checkpoint_path=str(checkpoint_path))
+    
+    assert stats["files"] == 2, "file count mismatch"
+    assert stats["new"] == 2, "chunk count mismatch"
+    assert doc_store.document_store.get_document_count() == 2, "document count mismatch"
+    assert not checkpoint_path.exists(), "checkpoint not removed after completion"
+
+
+def test_ingest_directory_resume(doc_store: DocumentStoreManager, test_dir: Path, tmp_path: Path) -> None:
+    """
+    Test that files recorded in a checkpoint are skipped.
+
+    :param doc_store: Document store instance
+    :param test_dir: Directory containing test documents
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    checkpoint_path = tmp_path / "checkpoint.json"
+    checkpoint_path.write_text(json.dumps({
+        "doc_dir": str(test_dir.resolve()),
+        "completed_files": [str(test_dir / "test1.txt")]
+    }))
+    
+    stats = ingest_directory(str(test_dir), doc_store, checkpoint_path=str(checkpoint_path))
+    assert stats["files_resumed"] == 1, "resumed file count mismatch"
+    assert stats["files"] == 1, "file count mismatch"
+    assert doc_store.document_store.get_document_count() == 1, "document count mismatch"
+
+
+def test_ingest_directory_checkpoint(doc_store: DocumentStoreManager, test_dir: Path, tmp_path: Path) -> None:
+    """
+    Test that every batch appends its files to the checkpoint and that a line cut off by a crash is ignored.
+    
+    :param doc_store: Document store instance
+    :param test_dir: Directory containing test documents
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    (test_dir / "test3.txt").write_text("This is a third test document.")
+    checkpoint_path = tmp_path / "checkpoint.json"
+    
+    def crash_after_two(file_path: str, status: str, error):
+        if status == "indexed" and file_path.endswith("test2.txt"):
+            raise KeyboardInterrupt
+    
+    with pytest.raises(KeyboardInterrupt):
+        ingest_directory(str(test_dir), doc_store, batch_size=1, checkpoint_path=str(checkpoint_path),
+                         progress_callback=crash_after_two)
+    lines = checkpoint_path.read_text().splitlines()
+    assert json.loads(lines[0]) == {"doc_dir": str(test_dir.resolve())}, "checkpoint header missing"
+    assert [json.loads(line)["completed_files"] for line in lines[1:]] == \
+        [[str(test_dir / "test1.txt")], [str(test_dir / "test2.txt")]], "batches not appended"
+    
+    with open(checkpoint_path, "a") as f:
+        f.write('{"completed_files": ["' + str(test_dir))
+    stats = ingest_directory(str(test_dir), doc_store, batch_size=1, checkpoint_path=str(checkpoint_path))
+    assert stats["files_resumed"] == 2 and stats["files"] == 1, "completed files not skipped"
+    assert doc_store.document_store.get_document_count() == 3, "document count mismatch"
+
+
+def test_ingestion_queue(doc_store: DocumentStoreManager, test_dir: Path) -> None:
+    """
+    Test that queued directories are ingested in the background with per-file status.
+    
+    :param doc_store: Document store instance
+    :param test_dir: Directory containing test documents
+    """
+    (test_dir / "broken.docx").write_bytes(b"not a docx file")
+    ingestion_queue = IngestionQueue(doc_store, batch_size=1)
+    chunker = TokenChunker(doc_store.retriever.embedding_model)
+    job = ingestion_queue.submit(str(test_dir), remove_when_done=True, chunker=chunker)
+    
+    assert ingestion_queue.wait(timeout=60), "job did not finish"
+    assert job.status == "done" and job.progress == 1.0, "job not completed"
+    assert job.chunker is chunker and ingestion_queue.chunker is None, "chunker not passed with the job"
+    assert job.stats["new"] == 2 and job.stats["files_failed"] == 1, "unexpected job statistics"
+    assert job.files[str(test_dir / "test1.txt")] == "indexed", "file status not updated"
+    assert job.files[str(test_dir / "broken.docx")] == "failed", "failed file not reported"
+    assert str(test_dir / "broken.docx") in job.file_errors, "error of failed file missing"
+    assert not test_dir.exists(), "directory not removed"
+    assert doc_store.document_store.get_document_count() == 2, "documents not written"
+
+
+def test_ingest_directory_sync(doc_store: DocumentStoreManager, test_dir: Path, monkeypatch) -> None:
+    """
+    Test that a sync skips unchanged files and deletes the chunks of changed and removed files.
+    
+    :param doc_store: Document store instance
+    :param test_dir: Directory containing test documents
+    :param monkeypatch: Pytest fixture to record the hashed files
+    """
+    (test_dir / "copy.txt").write_text("This is a test document.")
+    (test_dir / "notes.txt").write_text("Pump seals are replaced every six months.")
+    hashed_files = []
+    monkeypatch.setattr(ingestion, "hash_file", lambda path: hashed_files.append(path) or hash_file(path))
+    stats = ingest_directory(str(test_dir), doc_store)
+    assert stats["new"] == 3 and stats["skipped"] == 1, "unexpected chunk counts"
+    assert not hashed_files, "new files hashed before their conversion"
+    with IngestionManifest(doc_store.manifest_path) as manifest:
+        assert manifest.get(str((test_dir / "notes.txt").resolve()))[2] == hash_file(str(test_dir / "notes.txt")), \
+            "content hash not recorded"
+    
+    stats = ingest_directory(str(test_dir), doc_store, sync=True)
+    assert stats["files_unchanged"] == 4 and stats["files"] == 0 and stats["deleted"] == 0, "unchanged files synced"
+    assert not hashed_files, "unchanged files read"
+    
+    (test_dir / "notes.txt").write_text("Pump seals are replaced every three months.")
+    (test_dir / "test1.txt").unlink()
+    # touched but not modified
+    os.utime(test_dir / "test2.txt", ns=(10 ** 18, 10 ** 18))
+    stats = ingest_directory(str(test_dir), doc_store, sync=True)
+    assert stats["files"] == 1 and stats["files_unchanged"] == 2 and stats["files_removed"] == 1, \
+        "unexpected file counts"
+    assert sorted(Path(path).name for path in hashed_files) == ["notes.txt", "test2.txt"], "wrong files hashed"
+    assert stats["new"] == 1 and stats["deleted"] == 1, "stale chunk of the changed file not replaced"
+    
+    contents = sorted(doc.content for doc in doc_store.document_store.get_all_documents())
+    assert contents == ["Pump seals are replaced every three months.", "This is a test document.",
+                        "This is another test document."], "chunk shared with copy.txt deleted or stale chunk kept"
+    results = doc_store.retriever.retrieve("How often are pump seals replaced?", top_k=3)
+    assert "six months" not in " ".join(doc.content for doc in results), "stale chunk retrieved"
+
+
+def test_ingest_near_duplicates(tmp_path: Path) -> None:
+    """
+    Test that near-duplicate chunks are dropped before embedding, also across runs, and kept by a sync.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    doc_store = DocumentStoreManager(db_path=str(tmp_path / "dedup.db"), index_path=str(tmp_path / "dedup.faiss"),
+                                     embedding_cache_size=0, near_duplicate_threshold=0.8)
+    doc_dir = tmp_path / "docs"
+    doc_dir.mkdir()
+    report = " ".join(f"Pump {i} of station {i % 7} was inspected in week {i} and needs new seals." for i in range(10))
+    (doc_dir / "report_v1.txt").write_text(report)
+    (doc_dir / "report_v2.txt").write_text(report.replace("week 4 ", "week 5 "))
+    (doc_dir / "other.txt").write_text("Valve 3 of circuit 2 leaks oil.")
+    stats = ingest_directory(str(doc_dir), doc_store)
+    assert stats["new"] == 2 and stats["near_duplicates"] == 1, "near-duplicate chunk not dropped"
+    assert stats["embedding_seconds_saved"] > 0, "saved embedding time not estimated"
+    
+    (doc_dir / "report_v3.txt").write_text(report + " Checked again.")
+    stats = ingest_directory(str(doc_dir), doc_store, sync=True)
+    assert stats["new"] == 0 and stats["near_duplicates"] == 1, "near-duplicate of a stored chunk not dropped"
+    
+    # the stored chunk stays while another file contains a near-duplicate of it
+    (doc_dir / "report_v1.txt").unlink()
+    stats = ingest_directory(str(doc_dir), doc_store, sync=True)
+    assert stats["deleted"] == 0 and doc_store.document_store.get_document_count() == 2, "shared chunk deleted"
+    
+    # a changed file is not matched with its replaced chunk
+    (doc_dir / "other.txt").write_text("Valve 3 of circuit 2 leaks oil again.")
+    stats = ingest_directory(str(doc_dir), doc_store, sync=True)
+    assert stats["new"] == 1 and stats["deleted"] == 1, "changed chunk dropped as a near-duplicate of its old version"
+
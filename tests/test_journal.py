@@ -0,0 +1,39 @@
+"""src.tests.test_journal.py -- Test the append-only vector journal."""
+
+from pathlib import Path
+
+import numpy as np
+
+from src.pipeline.journal import VectorJournal
+
+
+def test_vector_journal(tmp_path: Path) -> None:
+    """
+    Test that records are read back after reopening, and that a torn record is dropped with everything after it.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    path = str(tmp_path / "index.journal")
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    journal = VectorJournal(path)
+    journal.append(0, ["a", "b"], vectors[:2])
+    journal.append(2, ["c", "d"], vectors[2:])
+    assert len(journal) == 2 and journal.num_vectors == 4, "records not counted"
+    intact_size = journal.size
+    journal.append(4, ["e"], vectors[:1])
+    journal.close()
+    
+    # simulate a crash in the middle of writing the last record
+    with open(path, "r+b") as f:
+        f.truncate(intact_size + 10)
+    reopened = VectorJournal(path)
+    records = reopened.read()
+    assert [(first, ids) for _, first, ids, _ in records] == [(0, ["a", "b"]), (2, ["c", "d"])], "records not read"
+    assert np.array_equal(np.concatenate([record[3] for record in records]), vectors), "vectors changed"
+    assert reopened.size == intact_size, "torn record not truncated"
+    
+    reopened.truncate(records[1][0])
+    reopened.append(2, ["f"], vectors[3:])
+    assert [ids for _, _, ids, _ in VectorJournal(path).read()] == [["a", "b"], ["f"]], "append after truncate failed"
+    reopened.truncate()
+    assert VectorJournal(path).read() == [] and reopened.num_vectors == 0, "journal not emptied"
@@ -0,0 +1,86 @@
+"""src.tests.test_metrics.py -- Test per-stage metrics registry and pipeline instrumentation."""
+
+import json
+import urllib.request
+from pathlib import Path
+
+from haystack.schema import Document
+from typing import List
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.generators import StubGenerator
+from src.pipeline.metrics import METRICS, MetricsRegistry, collect_timings
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.preprocessing import discover_files, iter_file_chunks
+
+
+def test_metrics_registry() -> None:
+    """
+    Test stage aggregation, per-query timing collection and both export formats.
+    """
+    registry = MetricsRegistry()
+    with collect_timings() as timings:
+        for batch_size in (8, 24):
+            with registry.stage("embedding", items=batch_size):
+                pass
+        with registry.stage("llm_call") as measurement:
+            measurement.items = 1
+    registry.record("faiss_add", wall_seconds=2.0, cpu_seconds=1.5, items=100)
+    
+    snapshot = registry.snapshot()
+    assert snapshot["embedding"]["count"] == 2 and snapshot["embedding"]["items_per_call"] == 16, \
+        "batch sizes not aggregated"
+    assert snapshot["faiss_add"]["items_per_second"] == 50, "throughput mismatch"
+    assert set(timings) == {"embedding", "llm_call"}, "per-query timings not collected"
+    assert json.loads(registry.to_json())["llm_call"]["items"] == 1, "JSON export mismatch"
+    
+    text = registry.to_prometheus()
+    assert 'pipeline_stage_wall_seconds_bucket{stage="faiss_add",le="2.5"} 1' in text, "histogram bucket missing"
+    assert 'pipeline_stage_wall_seconds_bucket{stage="faiss_add",le="1.0"} 0' in text, "histogram not cumulative"
+    assert 'pipeline_stage_items_total{stage="embedding"} 32' in text, "items counter missing"
+    
+    server = registry.serve(port=0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode("utf-8") == registry.to_prometheus(), "served metrics differ"
+    finally:
+        server.shutdown()
+
+
+def test_pipeline_instrumentation(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that ingestion and query stages are recorded and that results carry per-query stage timings.
+    
+    :param doc_store: Document store instance
+    :param test_docs: Test documents
+    """
+    METRICS.reset()
+    doc_store.add_documents(test_docs)
+    pipeline = QueryPipeline(retriever=doc_store.get_retriever(), generator=StubGenerator())
+    result = pipeline.run("test query", params={"Retriever": {"top_k": 1}})
+    
+    snapshot = METRICS.snapshot()
+    for stage in ["embedding", "faiss_add", "sqlite_write", "faiss_save", "faiss_search", "document_fetch"]:
+        assert stage in snapshot, f"stage {stage} not recorded"
+    assert snapshot["sqlite_write"]["items"] == 2, "written documents not counted"
+    assert {"faiss_search", "prompt_build", "llm_call"} <= set(result["timings"]), "per-query timings missing"
+    
+    # the separately measured FAISS and SQL writes keep vectors and rows in step
+    assert len(doc_store.document_store.get_all_documents()) == 2, "documents not written"
+    assert doc_store.document_store.get_embedding_count() == 2, "vectors not written"
+
+
+def test_file_measurements(test_dir: Path) -> None:
+    """
+    Test that conversion and chunking measured in worker processes are recorded in the calling process.
+    
+    :param test_dir: Test directory with files
+    """
+    METRICS.reset()
+    results = list(iter_file_chunks(discover_files(str(test_dir)), num_workers=2))
+    
+    snapshot = METRICS.snapshot()
+    assert all(len(result) == 4 for result in results), "measurements leaked into the results"
+    assert snapshot["conversion"]["count"] == 2, "conversion of worker processes not recorded"
+    assert snapshot["chunking"]["items"] == 2, "chunks of worker processes not counted"
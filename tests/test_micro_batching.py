@@ -0,0 +1,106 @@
+"""src.tests.test_micro_batching.py -- Test coalescing of concurrent calls into batches."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.metrics import METRICS
+from src.pipeline.micro_batching import MicroBatcher, _Request
+
+
+def test_micro_batcher() -> None:
+    """
+    Test that concurrent requests are batched up to the maximum size and that each caller gets its own rows.
+    """
+    calls = []
+    
+    def batch_fn(items: list) -> np.ndarray:
+        calls.append(len(items))
+        return np.asarray(items, dtype=np.float32)[:, None] * 2
+    
+    METRICS.reset()
+    batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_ms=200, stage="test_batch")
+    start = threading.Barrier(8)
+    
+    def submit(i: int) -> np.ndarray:
+        start.wait()
+        return batcher.submit([i])
+    
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(submit, range(8)))
+    batcher.close()
+    
+    assert [float(result[0, 0]) for result in results] == [2.0 * i for i in range(8)], "rows handed to wrong callers"
+    assert max(calls) <= 4 and len(calls) < 8, f"requests not batched: {calls}"
+    assert METRICS.snapshot()["test_batch"]["items"] == 8, "batch sizes not recorded"
+
+
+def test_micro_batcher_errors() -> None:
+    """
+    Test that an error of the batch function is raised to the callers and that oversized requests are not split.
+    """
+    def batch_fn(items: list) -> np.ndarray:
+        if "bad" in items:
+            raise ValueError("bad item")
+        return np.zeros((len(items), 1))
+    
+    batcher = MicroBatcher(batch_fn, max_batch_size=2, max_wait_ms=0)
+    with pytest.raises(ValueError):
+        batcher.submit(["bad"])
+    assert batcher.submit(["a", "b", "c"]).shape == (3, 1), "oversized request not processed"
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(["a"])
+
+
+def test_micro_batcher_close_race() -> None:
+    """
+    Test that requests submitted while the batcher closes are rejected instead of waiting forever.
+    """
+    release = threading.Event()
+    
+    def batch_fn(items: list) -> np.ndarray:
+        release.wait()
+        return np.zeros((len(items), 1))
+    
+    batcher = MicroBatcher(batch_fn, max_batch_size=1, max_wait_ms=0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        in_flight = executor.submit(batcher.submit, ["a"])
+        closing = executor.submit(batcher.close)
+        while not batcher._closed:
+            time.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            batcher.submit(["b"])
+        # a request that got behind the sentinel of close() anyway
+        leftover = _Request(["c"])
+        batcher._queue.put(leftover)
+        release.set()
+        assert in_flight.result(timeout=10).shape == (1, 1), "request submitted before close not processed"
+        closing.result(timeout=10)
+    
+    assert leftover.done.is_set() and isinstance(leftover.error, RuntimeError), "leftover request not failed"
+
+
+def test_coalesced_query_embeddings(tmp_path) -> None:
+    """
+    Test that coalesced query embeddings equal the embeddings of separate calls.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    store = DocumentStoreManager(db_path=str(tmp_path / "store.db"), index_path=str(tmp_path / "store.faiss"),
+                                 embedding_cache_size=0, query_batch_wait_ms=50)
+    queries = [f"question {i} about the pump" for i in range(6)]
+    expected = store.retriever.embed_queries(queries)
+    
+    METRICS.reset()
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        embeddings = list(executor.map(lambda query: store.retriever.embed_queries([query])[0], queries))
+    
+    assert np.allclose(np.stack(embeddings), expected, atol=1e-5), "coalesced embeddings differ"
+    snapshot = METRICS.snapshot()
+    assert snapshot["query_embedding"]["count"] == 6, "per-query embedding calls not recorded"
+    assert snapshot["query_batch"]["count"] < 6, "concurrent queries not coalesced"
@@ -0,0 +1,32 @@
+"""src.tests.test_near_duplicates.py -- Test the MinHash LSH near-duplicate index."""
+
+from pathlib import Path
+
+from src.pipeline.near_duplicates import NearDuplicateIndex, lsh_bands
+
+
+def test_near_duplicate_index(tmp_path: Path) -> None:
+    """
+    Test that near-duplicates are found within a batch and across reopening, and that removed chunks are not.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    words = [f"word{i}" for i in range(120)]
+    original = " ".join(words)
+    edited = " ".join(words[:60] + ["changed"] + words[61:])
+    other = " ".join(reversed(words))
+    path = str(tmp_path / "index.minhash.db")
+    
+    index = NearDuplicateIndex(path, threshold=0.8)
+    signatures = index.signatures([original, edited, other, "", ""])
+    assert index.find_duplicates(["a", "b", "c", "d", "e"], signatures) == {1: "a"}, "batch duplicates not found"
+    index.add(["a", "c", "d"], signatures[[0, 2, 3]])
+    assert len(index) == 2, "chunk without words indexed"
+    index.close()
+    
+    reopened = NearDuplicateIndex(path, threshold=0.7)
+    assert (reopened.bands, reopened.rows) == lsh_bands(0.7, 128), "index not re-banded for the new threshold"
+    assert reopened.find_duplicates(["b", "a"], signatures[[1, 0]]) == {0: "a"}, "stored duplicate not found"
+    assert reopened.find_duplicates(["b"], signatures[[1]], ignored_ids={"a"}) == {}, "ignored chunk matched"
+    reopened.remove(["a", "unknown"])
+    assert len(reopened) == 1 and reopened.find_duplicates(["b"], signatures[[1]]) == {}, "removed chunk matched"
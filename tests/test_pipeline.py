@@ -1,11 +1,14 @@
 """src.tests.test_pipeline.py -- Test pipeline functionality."""
 
+import asyncio
+
 import pytest
 
 from haystack.schema import Document
 from typing import List
 
-from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.generators import StubGenerator
+from src.pipeline.pipeline import AsyncQueryPipeline, QueryPipeline
 from src.pipeline.document_store import DocumentStoreManager
 
 
@@ -42,3 +45,97 @@ def test_pipeline_run(doc_store: DocumentStoreManager, test_docs: List[Document]
     result = pipeline.run("test query")
     assert "answers" in result, "answers missing"
     assert result["answers"][0]["answer"] == "Test answer", "answer mismatch"
+
+
+def test_pipeline_run_batch(doc_store: DocumentStoreManager, test_docs: List[Document], monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test batch execution with result ordering and per-query errors.
+
+    :param doc_store: Document store instance
+    :param test_docs: Test documents
+    :param monkeypatch: Pytest monkeypatch fixture
+    """
+    # mock the PromptNode response, failing for one query
+    def mock_run(query, documents):
+        if query == "bad query":
+            raise RuntimeError("LLM failure")
+        return {"results": [f"Answer to {query}"]}, "output_1"
+    
+    doc_store.add_documents(test_docs)
+    pipeline = QueryPipeline(retriever=doc_store.get_retriever())
+    monkeypatch.setattr(pipeline.prompt_node, "run", mock_run)
+    
+    queries = [f"query {i}" for i in range(5)] + ["bad query"]
+    results = pipeline.run_batch(queries, params={"Retriever": {"top_k": 1}}, batch_size=2, max_concurrency=3)
+    assert [result["query"] for result in results] == queries, "result order mismatch"
+    assert results[0]["answers"][0]["answer"] == "Answer to query 0", "answer mismatch"
+    assert len(results[0]["documents"]) == 1, "top_k not applied"
+    assert "LLM failure" in results[-1]["error"], "per-query error missing"
+    
+    single = doc_store.document_store.query_by_embedding(doc_store.get_retriever().embed_queries(["query 0"])[0],
+                                                         top_k=1)
+    assert results[0]["documents"][0].id == single[0].id, "batch retrieval differs from single retrieval"
+
+
+def test_async_pipeline(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that the async pipeline keeps many queries in flight without an API key.
+
+    :param doc_store: Document store instance
+    :param test_docs: Test documents
+    """
+    class CountingGenerator(StubGenerator):
+        """Stub generator recording the peak number of concurrent calls."""
+        
+        running = 0
+        peak = 0
+        
+        async def agenerate(self, query: str, documents: List[Document]) -> str:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            try:
+                return await super().agenerate(query, documents)
+            finally:
+                self.running -= 1
+    
+    doc_store.add_documents(test_docs)
+    generator = CountingGenerator(latency_seconds=0.2)
+    pipeline = AsyncQueryPipeline(retriever=doc_store.get_retriever(), generator=generator)
+    assert pipeline.prompt_node is None, "prompt node created for custom generator"
+    
+    queries = [f"query {i}" for i in range(10)]
+    results = asyncio.run(pipeline.arun_batch(queries, batch_size=4, max_concurrency=10))
+    
+    assert [result["query"] for result in results] == queries, "result order mismatch"
+    assert generator.peak > 1, "generator calls did not overlap"
+    
+    single = asyncio.run(pipeline.arun("query 0"))
+    assert single["answers"][0]["answer"] == results[0]["answers"][0]["answer"], "answer mismatch"
+    assert pipeline.run("query 0")["answers"][0]["answer"] == single["answers"][0]["answer"], \
+        "sync and async answers differ"
+    pipeline.close()
+
+
+def test_pipeline_stream(doc_store: DocumentStoreManager, test_docs: List[Document]) -> None:
+    """
+    Test that streaming yields the documents first, then the answer tokens, then timed results.
+
+    :param doc_store: Document store instance
+    :param test_docs: Test documents
+    """
+    doc_store.add_documents(test_docs)
+    generator = StubGenerator(latency_seconds=0.1, token_interval_seconds=0.01)
+    pipeline = QueryPipeline(retriever=doc_store.get_retriever(), generator=generator)
+    
+    events = list(pipeline.stream("test query"))
+    assert events[0]["event"] == "documents" and events[0]["documents"], "documents not streamed first"
+    assert events[-1]["event"] == "done", "final results missing"
+    
+    tokens = [event["token"] for event in events if event["event"] == "token"]
+    result = events[-1]["result"]
+    assert len(tokens) > 1, "answer not streamed token by token"
+    assert "".join(tokens) == result["answers"][0]["answer"] == pipeline.run("test query")["answers"][0]["answer"], \
+        "streamed answer mismatch"
+    
+    timings = result["timings"]
+    assert 0.1 <= timings["time_to_first_token"] < timings["total"], "time to first token mismatch"
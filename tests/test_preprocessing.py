@@ -4,7 +4,7 @@ from haystack.schema import Document
 from pathlib import Path
 from typing import List
 
-from src.pipeline.preprocessing import load_documents, preprocess_documents
+from src.pipeline.preprocessing import discover_files, load_and_preprocess_documents, load_documents, preprocess_documents
 
 
 def test_load_documents(test_dir: Path) -> None:
@@ -29,4 +29,31 @@ def test_preprocess_documents(test_docs: List[Document]) -> None:
     processed_docs = preprocess_documents(test_docs)
     assert len(processed_docs) >= len(test_docs), "processed document count mismatch"
     assert all(doc.content for doc in processed_docs), "content attributes missing"  # check presence of content field for each processed document
-    
\ No newline at end of file
+    
+
+
+def test_discover_files(test_dir: Path) -> None:
+    """
+    Test that only supported files are discovered, in sorted order.
+
+    :param test_dir: Directory containing test documents
+    """
+    (test_dir / "notes.md").write_text("Unsupported file type.")
+    file_paths = discover_files(str(test_dir))
+    assert [path.name for path in file_paths] == ["test1.txt", "test2.txt"], "file discovery mismatch"
+
+
+def test_load_and_preprocess_documents_parallel(test_dir: Path) -> None:
+    """
+    Test that parallel loading matches serial loading and isolates failing files.
+
+    :param test_dir: Directory containing test documents
+    """
+    (test_dir / "broken.pdf").write_bytes(b"not a pdf")
+    parallel_docs = load_and_preprocess_documents(str(test_dir), num_workers=2)
+    
+    assert [doc.meta["file_path"] for doc in parallel_docs] == ["test1.txt", "test2.txt"], "chunk order mismatch"
+    assert [doc.content for doc in parallel_docs] == ["This is a test document.", "This is another test document."], \
+        "chunk content mismatch"
+    serial_docs = load_and_preprocess_documents(str(test_dir), num_workers=1)
+    assert [doc.id for doc in serial_docs] == [doc.id for doc in parallel_docs], "failing file not skipped serially"
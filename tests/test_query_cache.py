@@ -0,0 +1,89 @@
+"""src.tests.test_query_cache.py -- Test query and answer cache functionality."""
+
+import time
+
+import numpy as np
+import pytest
+
+from haystack.schema import Document
+from typing import List
+
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.query_cache import QueryCache
+
+
+def test_answer_cache_similarity() -> None:
+    """
+    Test that answers are returned for similar queries with the same retrieved context only.
+    """
+    cache = QueryCache(similarity_threshold=0.9)
+    cache.put_answer(np.array([1.0, 0.0]), ["a", "b"], "test-model", {"results": ["answer"]})
+    
+    assert cache.get_answer(np.array([1.0, 0.1]), ["a", "b"], "test-model") == {"results": ["answer"]}, \
+        "similar query missed"
+    assert cache.get_answer(np.array([0.0, 1.0]), ["a", "b"], "test-model") is None, "dissimilar query hit"
+    assert cache.get_answer(np.array([1.0, 0.0]), ["a", "c"], "test-model") is None, "changed context hit"
+    assert cache.get_answer(np.array([1.0, 0.0]), ["a", "b"], "other-model") is None, "other model hit"
+    assert cache.stats["answer_hits"] == 1 and cache.stats["answer_misses"] == 3, "counter mismatch"
+
+
+def test_query_cache_eviction() -> None:
+    """
+    Test size-based, time-based and explicit eviction of cached queries.
+    """
+    cache = QueryCache(max_entries=2, ttl_seconds=None)
+    for i in range(3):
+        cache.put_query(("query", i), np.zeros(2), [str(i)], [1.0])
+    
+    assert cache.get_query(("query", 0)) is None, "least recently used entry not evicted"
+    assert cache.get_query(("query", 2))[1] == ["2"], "recent entry evicted"
+    
+    generation = cache.generation
+    cache.invalidate()
+    assert cache.get_query(("query", 2)) is None, "entry survived invalidation"
+    cache.put_query(("query", 3), np.zeros(2), ["3"], [1.0], generation=generation)
+    cache.put_answer(np.ones(2), ["3"], "model", {"results": ["stale"]}, generation=generation)
+    assert cache.get_query(("query", 3)) is None and cache.get_answer(np.ones(2), ["3"], "model") is None, \
+        "result computed before the invalidation cached"
+    assert cache.stats["stale_puts"] == 2, "stale puts not counted"
+    
+    cache = QueryCache(ttl_seconds=0.01)
+    cache.put_query(("query",), np.zeros(2), ["0"], [1.0])
+    time.sleep(0.02)
+    assert cache.get_query(("query",)) is None, "expired entry returned"
+
+
+def test_pipeline_cache(doc_store: DocumentStoreManager, test_docs: List[Document],
+                        monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Test that repeated queries skip the LLM and that adding documents invalidates the cache.
+    
+    :param doc_store: Document store instance
+    :param test_docs: Test documents
+    :param monkeypatch: Pytest monkeypatch fixture
+    """
+    calls = []
+    
+    def mock_run(query, documents):
+        calls.append(query)
+        return {"results": [f"Answer {len(calls)}"]}, "output_1"
+    
+    doc_store.add_documents(test_docs[:1])
+    cache = QueryCache()
+    doc_store.add_change_listener(cache.invalidate)
+    pipeline = QueryPipeline(retriever=doc_store.get_retriever(), query_cache=cache)
+    monkeypatch.setattr(pipeline.prompt_node, "run", mock_run)
+    
+    first = pipeline.run("test query")
+    second = pipeline.run("test query")
+    assert second["answers"][0]["answer"] == first["answers"][0]["answer"] == "Answer 1", "answer mismatch"
+    assert second["cache"] == {"query": True, "answer": True}, "repeated query not cached"
+    assert [doc.id for doc in second["documents"]] == [doc.id for doc in first["documents"]], \
+        "cached documents mismatch"
+    assert len(calls) == 1, "LLM called for cached answer"
+    
+    doc_store.add_documents(test_docs[1:])
+    third = pipeline.run("test query")
+    assert third["cache"] == {"query": False, "answer": False}, "cache not invalidated"
+    assert len(third["documents"]) == 2, "new document not retrieved"
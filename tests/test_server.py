@@ -0,0 +1,186 @@
+"""src.tests.test_server.py -- Test the query server and its client."""
+
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+import pytest
+
+import main
+from src.pipeline import document_store
+from src.pipeline.client import PipelineClient, ServerError, server_url
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.embedding_cache import CachedEmbeddingRetriever
+from src.pipeline.generators import StubGenerator
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.query_cache import QueryCache
+from src.pipeline.server import BadRequest, QueryService, create_server, is_loopback
+
+
+def make_service(tmp_path: Path) -> QueryService:
+    """
+    Create a query service over a document store in a temporary directory, ingesting directories under it.
+    
+    :param tmp_path: Temporary directory
+    :return: Query service answering with the stub generator
+    """
+    def create_doc_store_manager(retriever: Optional[CachedEmbeddingRetriever]) -> DocumentStoreManager:
+        return DocumentStoreManager(db_path=str(tmp_path / "store.db"), index_path=str(tmp_path / "store.faiss"),
+                                    embedding_cache_dir=str(tmp_path / "embedding_cache"), query_batch_wait_ms=1,
+                                    retriever=retriever)
+    
+    def create_pipeline(doc_store_manager: DocumentStoreManager) -> QueryPipeline:
+        query_cache = QueryCache()
+        doc_store_manager.add_change_listener(query_cache.invalidate)
+        return QueryPipeline(doc_store_manager.get_retriever(), generator=StubGenerator(), query_cache=query_cache,
+                             bm25_index=doc_store_manager.bm25_index, store_lock=doc_store_manager.lock)
+    
+    return QueryService(create_doc_store_manager, create_pipeline, ingest_root=str(tmp_path))
+
+
+def start_server(service: QueryService, **kwargs):
+    """
+    Serve a query service in a background thread.
+    
+    :param service: Query service
+    :param kwargs: Arguments of create_server
+    :return: Running server
+    """
+    server = create_server(service, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_query_server(tmp_path: Path, test_dir: Path) -> None:
+    """
+    Test ingestion, plain, streamed and batched queries, metrics and errors, e.g. of directories outside the ingest
+    root, over HTTP.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param test_dir: Test directory with files
+    """
+    server = start_server(make_service(tmp_path), port=0)
+    try:
+        client = PipelineClient(server_url(port=server.server_address[1]))
+        assert client.is_running(), "server not detected"
+        assert not PipelineClient(server_url(socket_path=str(tmp_path / "none.sock"))).is_running(), \
+            "missing server detected"
+        
+        assert client.ingest(str(test_dir))["new"] == 2, "documents not ingested"
+        assert client.health()["documents"] == 2, "ingested documents not counted"
+        
+        params = {"Retriever": {"top_k": 1}}
+        result = client.query("test document", params=params)
+        assert result["answer"].startswith("[stub"), "stub answer missing"
+        assert result["sources"][0]["file_path"].endswith(".txt"), "sources missing"
+        assert "faiss_search" in result["timings"], "stage timings missing"
+        
+        events = list(client.stream("test document", params=params))
+        assert [event["event"] for event in events][:2] == ["documents", "token"], "unexpected event order"
+        assert events[-1]["result"]["answer"] == "".join(event["token"] for event in events[1:-1]), \
+            "streamed tokens differ from answer"
+        
+        results = client.query_batch(["test document", "another test"], params=params)
+        assert [result["query"] for result in results] == ["test document", "another test"], "batch order lost"
+        assert results[0]["cache"]["query"], "repeated query not served from cache"
+        
+        assert "pipeline_stage_wall_seconds" in client.metrics(prometheus=True), "metrics not served"
+        with pytest.raises(ServerError) as error:
+            client.ingest(str(tmp_path / "missing"))
+        assert error.value.status == 400, "missing directory not rejected"
+        
+        outside = tmp_path.parent / f"{tmp_path.name}_outside"
+        outside.mkdir()
+        (outside / "secret.txt").write_text("Not meant to be indexed.")
+        (tmp_path / "link").symlink_to(outside)
+        for doc_dir in [outside, tmp_path / "link", tmp_path / ".." / outside.name]:
+            with pytest.raises(ServerError) as error:
+                client.ingest(str(doc_dir))
+            assert error.value.status == 400, f"directory {doc_dir} outside the ingest root not rejected"
+        assert client.health()["documents"] == 2, "directory outside the ingest root ingested"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_ingest_limits(tmp_path: Path, test_dir: Path, monkeypatch) -> None:
+    """
+    Test that the number of ingestion workers is capped and that services without an ingest root refuse ingestion.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param test_dir: Test directory with files
+    :param monkeypatch: Pytest fixture to record the arguments of the ingestion
+    """
+    calls = []
+    monkeypatch.setattr("src.pipeline.server.ingest_directory",
+                        lambda doc_dir, doc_store_manager, **kwargs: calls.append(kwargs))
+    service = make_service(tmp_path)
+    try:
+        service.ingest(str(test_dir), num_workers=10_000)
+        assert 1 <= calls[0]["num_workers"] <= (os.cpu_count() or 1), "number of workers not capped"
+        service.ingest_root = None
+        with pytest.raises(BadRequest):
+            service.ingest(str(test_dir))
+    finally:
+        service.close()
+    assert is_loopback("127.0.0.1") and is_loopback("::1") and not is_loopback("0.0.0.0"), \
+        "loopback interfaces not recognized"
+
+
+def test_client_imports() -> None:
+    """
+    Test that main.py, and with it runs handed to a query server, imports neither Haystack nor PyTorch.
+    """
+    code = "import sys, main; print(sorted({'haystack', 'torch', 'faiss'} & set(sys.modules)))"
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=str(Path(main.__file__).parent)).stdout.strip()
+    assert loaded == "[]", f"main.py loads {loaded}"
+    assert set(document_store.QUANTIZER_TYPES) == set(document_store.VECTOR_DTYPES), "vector dtype without quantizer"
+
+
+def test_concurrent_ingest_and_reload(tmp_path: Path) -> None:
+    """
+    Test that queries keep being answered over a Unix socket while documents are ingested and after a reload.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    doc_dir = tmp_path / "docs"
+    doc_dir.mkdir()
+    (doc_dir / "first.txt").write_text("The pump needs maintenance every month.")
+    service = make_service(tmp_path)
+    service.ingest(str(doc_dir))
+    
+    for i in range(20):
+        (doc_dir / f"part{i}.txt").write_text(f"Valve number {i} is part of circuit {i % 3}.")
+    
+    socket_path = str(tmp_path / "server.sock")
+    server = start_server(service, socket_path=socket_path)
+    try:
+        client = PipelineClient(server_url(socket_path=socket_path))
+        ingestion = threading.Thread(target=client.ingest, args=(str(doc_dir),), kwargs={"batch_size": 2})
+        ingestion.start()
+        answers = []
+        while ingestion.is_alive() or not answers:
+            answers.append(client.query("pump maintenance", params={"Retriever": {"top_k": 2}})["answer"])
+        ingestion.join()
+        
+        assert all(answer.startswith("[stub") for answer in answers), "query failed during ingestion"
+        assert client.health()["documents"] == 21, "documents lost during concurrent queries"
+        
+        previous = service.doc_store_manager
+        status = client.reload()
+        assert status["reloads"] == 1 and status["documents"] == 21, "store not reloaded"
+        result = client.query("valve number 7", params={"Retriever": {"top_k": 1}})
+        assert result["sources"][0]["file_path"].endswith("part7.txt"), "reloaded store not queried"
+        retriever = service.doc_store_manager.retriever
+        assert retriever.embedding_encoder is previous.retriever.embedding_encoder and \
+            retriever.embedding_cache is previous.embedding_cache, "embedding model loaded again"
+        assert previous.journal._file.closed, "previous document store not closed"
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+    assert not retriever.query_batcher._thread.is_alive(), "query batcher not stopped"
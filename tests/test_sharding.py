@@ -0,0 +1,130 @@
+"""src.tests.test_sharding.py -- Test sharded collections and their parallel search."""
+
+import threading
+from pathlib import Path
+
+import pytest
+
+from haystack.schema import Document
+
+from src.pipeline.document_store import DocumentStoreManager, query_by_embedding_batch
+from src.pipeline.generators import StubGenerator
+from src.pipeline.pipeline import QueryPipeline
+from src.pipeline.query_cache import QueryCache
+from src.pipeline import sharding
+from src.pipeline.sharding import CollectionManager, shard_of, shard_paths
+
+
+def test_collection_manager(tmp_path: Path) -> None:
+    """
+    Test that chunks are routed to shards, that the merged search equals the search of one index and that idle
+    shards are closed under the memory budget.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    docs = [Document(content=f"Pump {i} of station {i % 5} needs new seals after {i * 7} hours.") for i in range(20)]
+    manager = CollectionManager(root_dir=str(tmp_path / "collections"), embedding_cache_size=0, max_workers=4)
+    collection = manager.collection("tenant-a", num_shards=3)
+    assert collection.add_documents(docs) == {"new": 20, "skipped": 0, "reembedded": 0}, "stats mismatch"
+    assert collection.add_documents(docs[:5])["skipped"] == 5, "duplicates not skipped by their shard"
+    for shard in range(3):
+        with manager.use_shard("tenant-a", shard) as store:
+            stored_ids = {doc.id for doc in store.document_store.get_all_documents()}
+            assert stored_ids == {doc.id for doc in docs if shard_of(doc.id, 3) == shard}, "chunk in wrong shard"
+    manager.collection("tenant-b").add_documents(docs[:2])
+    assert manager.list_collections() == ["tenant-a", "tenant-b"], "collections not listed"
+    
+    single = DocumentStoreManager(db_path=str(tmp_path / "single.db"), index_path=str(tmp_path / "single.faiss"),
+                                  embedding_cache_size=0)
+    single.add_documents(docs)
+    query_embs = single.retriever.embed_queries(["station 3 seals", "pump 12 hours"])
+    expected = query_by_embedding_batch(single.document_store, query_embs, top_k=4)
+    results = manager.search(["tenant-a"], query_embs, top_k=4)
+    for retrieved, reference in zip(results, expected):
+        assert [doc.id for doc in retrieved] == [doc.id for doc in reference], "merged top-k mismatch"
+        assert all(doc.meta["collection"] == "tenant-a" and doc.meta["shard"] == shard_of(doc.id, 3)
+                   for doc in retrieved), "collection and shard not tagged"
+    both = manager.retrieve(["station 3 seals"], ["tenant-a", "tenant-b"], top_k=30)[0]
+    assert len(both) == 22, "collections not searched together"
+    
+    assert collection.delete_documents([docs[0].id, docs[1].id]) == 2, "chunks not deleted from their shards"
+    assert collection.get_document_count() == 18, "document count mismatch"
+    
+    assert manager.evict_idle() == 4, "idle shards not closed"
+    manager.memory_budget_bytes = 1
+    assert len(collection.get_documents_by_id([doc.id for doc in docs])) == 18, "closed shards not reopened"
+    assert manager.open_shards() == [], "shards not closed under the memory budget"
+    manager.close()
+    
+    reopened = CollectionManager(root_dir=str(tmp_path / "collections"), embedding_cache_size=0)
+    assert reopened.collection("tenant-a").num_shards == 3, "number of shards not stored"
+    with pytest.raises(ValueError):
+        reopened.collection("tenant-a", num_shards=2)
+    with pytest.raises(ValueError):
+        shard_paths(str(tmp_path), "../escape", 0)
+    assert len(reopened.search(["tenant-a"], query_embs, top_k=30)[1]) == 18, "reopened collection incomplete"
+    with pytest.raises(ValueError):
+        reopened.search(["tenant-typo"], query_embs, top_k=4)
+    assert reopened.list_collections() == ["tenant-a", "tenant-b"], "collection created by a search"
+    reopened.close()
+
+
+def test_shard_opening_unlocked(tmp_path: Path, monkeypatch) -> None:
+    """
+    Test that a shard being opened blocks neither searches of open shards nor other users of the same shard.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    :param monkeypatch: Pytest fixture to slow down the opening of a shard
+    """
+    manager = CollectionManager(root_dir=str(tmp_path / "collections"), embedding_cache_size=0, max_workers=4)
+    manager.collection("open").add_documents([Document(content="Pump seals of the open collection.")])
+    manager.collection("cold").add_documents([Document(content="Pump seals of the cold collection.")])
+    manager.evict_idle()
+    manager.retrieve(["pump seals"], ["open"])
+    
+    opening, release = threading.Event(), threading.Event()
+    
+    def open_slowly(*args, **kwargs) -> DocumentStoreManager:
+        opening.set()
+        assert release.wait(timeout=30), "opening not released"
+        return DocumentStoreManager(*args, **kwargs)
+    
+    monkeypatch.setattr(sharding, "DocumentStoreManager", open_slowly)
+    results = []
+    searches = [threading.Thread(target=lambda: results.append(manager.retrieve(["pump seals"], ["cold"])))
+                for _ in range(2)]
+    for search in searches:
+        search.start()
+    assert opening.wait(timeout=30), "cold shard not opened"
+    assert manager.retrieve(["pump seals"], ["open"])[0], "search of an open shard blocked by an opening shard"
+    release.set()
+    for search in searches:
+        search.join()
+    assert [len(result[0]) for result in results] == [1, 1], "waiting search not served by the opened shard"
+    assert manager.open_shards() == [("open", 0), ("cold", 0)], "shard opened twice"
+    manager.close()
+
+
+def test_collection_pipeline(tmp_path: Path) -> None:
+    """
+    Test that the query pipeline searches the selected collections only and serves cached results from them.
+    
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    manager = CollectionManager(root_dir=str(tmp_path / "collections"), embedding_cache_size=0)
+    manager.collection("manuals", num_shards=2).add_documents(
+        [Document(content=f"Manual page {i} explains the pump seals.") for i in range(6)])
+    manager.collection("tickets").add_documents([Document(content="Ticket about the pump seals.")])
+    
+    with pytest.raises(ValueError):
+        QueryPipeline(manager.retriever, generator=StubGenerator(), collection_manager=manager)
+    pipeline = QueryPipeline(manager.retriever, generator=StubGenerator(), collection_manager=manager,
+                             collections=["manuals"], query_cache=QueryCache())
+    params = {"Retriever": {"top_k": 10}}
+    documents = pipeline.retrieve(["pump seals"], params)[0]
+    assert len(documents) == 6 and {doc.meta["collection"] for doc in documents} == {"manuals"}, \
+        "collections not selected"
+    cached = pipeline.retrieve(["pump seals"], params)[0]
+    assert [doc.id for doc in cached] == [doc.id for doc in documents], "cached results not fetched from shards"
+    assert pipeline.run("pump seals", params)["answers"], "answer missing"
+    manager.close()
@@ -0,0 +1,88 @@
+"""src.tests.test_token_chunker.py -- Test chunking by the tokens of the embedding model."""
+
+import pickle
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from haystack.schema import Document
+
+from src.pipeline.chunking_evaluation import compare_chunkers
+from src.pipeline.context_builder import ContextBuilder
+from src.pipeline.document_store import DocumentStoreManager
+from src.pipeline.ingestion import ingest_directory
+from src.pipeline.preprocessing import load_and_preprocess_documents
+from src.pipeline.token_chunker import TokenChunker, clean_text
+
+
+def test_token_chunker(doc_store: DocumentStoreManager) -> None:
+    """
+    Test that chunks fit the token limit, end at sentence boundaries and overlap like PreProcessor chunks.
+    
+    :param doc_store: Document store instance providing the embedding model
+    """
+    sentences = [f"Pump {i} of station {i % 7} was inspected on day {i} and needs new seals." for i in range(40)]
+    text = "  " + " ".join(sentences[:20]) + "\n\n\n\n" + " ".join(sentences[20:]) + "  "
+    chunker = TokenChunker(doc_store.retriever.embedding_model, max_tokens=200, overlap_tokens=80)
+    table = Document(content=pd.DataFrame([["a", "b"]]), content_type="table")
+    chunks = chunker.process([Document(content=text, meta={"file_path": "pumps.txt"}), Document(content=" \n "),
+                              table])
+    
+    assert chunks[-1] is table and all(chunk.content_type == "text" for chunk in chunks[:-1]), "table not kept"
+    chunks = chunks[:-1]
+    special_tokens = chunker.tokenizer.num_special_tokens_to_add()
+    assert max(chunker.count_tokens([chunk.content for chunk in chunks])) <= 200 + special_tokens, "chunk too long"
+    assert all(chunk.content.endswith(".") for chunk in chunks), "chunk not ended at a sentence boundary"
+    assert [chunk.meta["_split_id"] for chunk in chunks] == list(range(len(chunks))), "split ids missing"
+    assert all(chunk.meta["file_path"] == "pumps.txt" for chunk in chunks), "meta fields not inherited"
+    
+    for previous, chunk in zip(chunks, chunks[1:]):
+        overlap = chunk.meta["_split_overlap"][0]
+        shared = chunk.content[overlap["range"][0]:overlap["range"][1]]
+        assert overlap["doc_id"] == previous.id and shared and previous.content.endswith(shared), \
+            "overlap not recorded"
+    for chunk in chunks:
+        chunk.score = 1.0
+    merged = ContextBuilder._merge_adjacent(chunks)
+    assert len(merged) == 1 and merged[0].content.split() == clean_text(text).split(), "chunks do not merge"
+    
+    restored = pickle.loads(pickle.dumps(chunker))
+    assert [chunk.id for chunk in restored.process([Document(content=text)])] == [chunk.id for chunk in chunks], \
+        "pickled chunker splits differently"
+    with pytest.raises(ValueError):
+        TokenChunker(doc_store.retriever.embedding_model, max_tokens=10_000)
+
+
+def test_token_chunker_ingestion(doc_store: DocumentStoreManager, test_dir: Path, tmp_path: Path) -> None:
+    """
+    Test that directories are ingested with the token chunker, also by worker processes.
+    
+    :param doc_store: Document store instance
+    :param test_dir: Directory with test files
+    :param tmp_path: Pytest fixture providing temporary directory
+    """
+    chunker = TokenChunker(doc_store.retriever.embedding_model)
+    chunks = load_and_preprocess_documents(str(test_dir), num_workers=2, chunker=chunker)
+    assert sorted(chunk.content for chunk in chunks) == ["This is a test document.",
+                                                         "This is another test document."], \
+        "files not chunked by worker processes"
+    
+    stats = ingest_directory(str(test_dir), doc_store, chunker=chunker, checkpoint_path=str(tmp_path / "checkpoint"))
+    assert stats["new"] == 2 and doc_store.document_store.get_document_count() == 2, "chunks not ingested"
+
+
+def test_compare_chunkers(doc_store: DocumentStoreManager) -> None:
+    """
+    Test that the evaluation reports the throughput and truncation rate of both chunkers.
+    
+    :param doc_store: Document store instance providing the embedding model
+    """
+    documents = [Document(content=" ".join(f"Valve {i}-{j} of circuit {j} was replaced." for j in range(300)))
+                 for i in range(3)]
+    results = compare_chunkers(documents, embedding_model=doc_store.retriever.embedding_model)
+    
+    assert [result["chunker"] for result in results] == ["preprocessor", "token"], "chunkers missing"
+    assert results[0]["speedup"] == 1.0 and all(result["chunks_per_second"] > 0 for result in results), \
+        "measurements missing"
+    assert results[0]["truncation_rate"] > 0 and results[1]["truncation_rate"] == 0, "truncation rate mismatch"